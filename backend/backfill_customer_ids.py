@@ -0,0 +1,23 @@
+"""
+Script to assign customer ids (KC-XXXXXXXX) to legacy users
+Run this once after deploying; login no longer backfills ids lazily
+"""
+import asyncio
+
+from server import backfill_customer_ids, client, ensure_indexes
+
+
+async def main():
+    try:
+        # The unique index must exist first so concurrent registrations can't collide
+        await ensure_indexes()
+        result = await backfill_customer_ids()
+        print(f"✅ Assigned {result['assigned']} customer ids ({result['conflicts_retried']} collisions retried)")
+    except Exception as e:
+        print(f"❌ Error backfilling customer ids: {e}")
+        raise
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,30 @@
+"""
+Script to compute materialized referral stats (referral_count, referral_earnings)
+Run this once after deploying; /referral/info no longer counts referred users per request
+"""
+import asyncio
+
+from server import backfill_referral_stats, client, dedupe_referral_payouts, ensure_indexes
+
+
+async def main():
+    try:
+        # Duplicate payouts from before the unique indexes would stop them being built
+        deduped = await dedupe_referral_payouts()
+        if deduped["moved"]:
+            print(f"⚠️ Moved {deduped['moved']} duplicate referral payouts to referral_payouts_duplicates "
+                  "(already paid out: review them)")
+        # Payout uniqueness and the referral_code index first, so new activity is tracked consistently
+        failed = await ensure_indexes()
+        if failed:
+            raise RuntimeError(f"Index creation failed: {', '.join(failed)}")
+        result = await backfill_referral_stats()
+        print(f"✅ Updated referral stats for {result['updated']} of {result['referrers']} referrers")
+    except Exception as e:
+        print(f"❌ Error backfilling referral stats: {e}")
+        raise
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
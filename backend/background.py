@@ -0,0 +1,96 @@
+import asyncio
+import inspect
+import logging
+import os
+from typing import Any, Callable, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger("background")
+
+BACKGROUND_JOBS = metrics.REGISTRY.register(metrics.Counter(
+    "background_jobs_total", "Background jobs by queue and outcome", ("queue", "outcome")))
+
+
+class BackgroundQueue:
+    """
+    Bounded in-process queue for fire-and-forget side effects (e.g. emails).
+
+    Sync callables run in a worker thread so blocking clients never hold the
+    event loop; coroutine functions are awaited. Failures are logged, not
+    retried. When the queue is full, submit() drops the job and returns False.
+    Jobs still queued at shutdown get `drain_timeout` seconds to finish.
+    """
+
+    def __init__(self, name: str, workers: int = 2, maxsize: int = 1000):
+        self.name = name
+        self.workers = workers
+        self.maxsize = maxsize
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def submit(self, label: str, fn: Callable[..., Any], *args: Any) -> bool:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+        try:
+            self._queue.put_nowait((label, fn, args))
+        except asyncio.QueueFull:
+            BACKGROUND_JOBS.inc(self.name, "dropped")
+            logger.error(f"Background queue {self.name} full; dropped {label}")
+            return False
+        return True
+
+    async def _run(self, job: Tuple[str, Callable[..., Any], tuple]) -> None:
+        label, fn, args = job
+        try:
+            if inspect.iscoroutinefunction(fn):
+                await fn(*args)
+            else:
+                await asyncio.to_thread(fn, *args)
+            BACKGROUND_JOBS.inc(self.name, "ok")
+        except Exception as e:
+            BACKGROUND_JOBS.inc(self.name, "error")
+            logger.error(f"Background job {label} failed: {e}")
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 5.0) -> None:
+        if self._queue is not None and self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Background queue {self.name}: {self.depth} jobs dropped at shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # A fresh queue binds to the next loop (tests start the app more than once)
+        self._queue = None
+
+
+QUEUE = BackgroundQueue("default", workers=int(os.environ.get("BACKGROUND_WORKERS", "2")))
+
+metrics.REGISTRY.register(metrics.Gauge(
+    "background_queue_depth", "Jobs waiting in the background queue", ("queue",),
+    callback=lambda: {(QUEUE.name,): QUEUE.depth}))
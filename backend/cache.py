@@ -0,0 +1,60 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class ReadThroughCache:
+    """
+    Per-process TTL cache in front of an async loader.
+
+    Concurrent misses for the same key share one load. invalidate() bumps a
+    generation, so a load that started before a write never repopulates the
+    cache with pre-write data. Workers do not share entries; the TTL bounds
+    how stale another worker can be after a write.
+    """
+
+    def __init__(self, loader: Callable[[Hashable], Awaitable[Any]], ttl: float, max_entries: int = 256):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._generation = 0
+
+    async def get(self, key: Hashable = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            value = await self.loader(key)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; don't leave "exception never retrieved" noise
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            if generation == self._generation:
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+            return value
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def invalidate(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+        self._inflight.clear()
@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+FAILURE_THRESHOLD = int(os.environ.get("OUTBOUND_BREAKER_FAILURES", "5"))
+RESET_TIMEOUT = float(os.environ.get("OUTBOUND_BREAKER_RESET_SECONDS", "30"))
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str):
+        super().__init__(f"{name} is unavailable (circuit open)")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker for one outbound dependency.
+
+    closed -> open after `failure_threshold` failures in a row; calls then
+    fail fast with CircuitOpenError. After `reset_timeout` one trial call is
+    let through (half-open): success closes the circuit, failure re-opens it.
+
+    Calls come from the event loop and from worker threads (queued emails),
+    so state changes take a lock; they happen once per outbound call, never
+    on the request hot path.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._state = CLOSED
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def before_call(self) -> None:
+        with self._lock:
+            state = self._current_state()
+            if state == OPEN or (state == HALF_OPEN and self._trial_in_flight):
+                raise CircuitOpenError(self.name)
+            if state == HALF_OPEN:
+                self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._state = CLOSED
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"state": self._current_state(), "consecutive_failures": self._failures}
@@ -0,0 +1,77 @@
+import math
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+
+import database
+import metrics
+from cache import ReadThroughCache
+
+# Shared state for the feature routers: database handle, password hashing,
+# the site settings cache and a few helpers every section uses.
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env', override=False)  # Don't override if already set
+
+# MongoDB connection
+mongo_url = os.environ.get('MONGO_URL')
+if not mongo_url:
+    raise ValueError("MONGO_URL environment variable is required")
+
+db_name = os.environ.get('DB_NAME', 'kayicom')
+# Pool sizing, timeouts and compression come from MONGO_* env vars (see database.py)
+client = database.create_client(mongo_url, event_listeners=[metrics.MONGO_LISTENER])
+db = database.DatabaseHandle(client[db_name])
+
+# Password hashing
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# ==================== READ CACHES ====================
+
+async def _load_site_settings(_key) -> Optional[Dict[str, Any]]:
+    return await db.settings.find_one({"id": "site_settings"}, {"_id": 0})
+
+# Site settings are read by most handlers; invalidated on settings writes
+_settings_cache = ReadThroughCache(_load_site_settings, ttl=30)
+
+async def _site_settings() -> Optional[Dict[str, Any]]:
+    """Cached settings document; a copy, so callers may modify it."""
+    settings = await _settings_cache.get()
+    return dict(settings) if settings else settings
+
+# ==================== HELPERS ====================
+
+def _as_utc(value: Any) -> Optional[datetime]:
+    """
+    Normalize a stored date to an aware UTC datetime.
+    Dates are stored as BSON datetimes; ISO strings are only accepted for
+    documents not yet converted by migrate_datetimes.py.
+    """
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _safe_float(val: Any, default: float) -> float:
+    """
+    Convert to float safely, falling back to default when missing/NaN/inf.
+    Prevents crashes when admin saves empty strings in crypto settings.
+    """
+    try:
+        f = float(val)
+        if math.isnan(f) or math.isinf(f):
+            return default
+        return f
+    except Exception:
+        return default
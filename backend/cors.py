@@ -0,0 +1,135 @@
+from typing import List, Optional, Sequence, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+Header = Tuple[bytes, bytes]
+
+_PREFLIGHT_METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+_PREFLIGHT_MAX_AGE = b"600"
+_ERROR_BODY = b'{"detail":"Internal Server Error"}'
+
+
+class CORSHeadersMiddleware:
+    """
+    Pure ASGI CORS layer: answers preflights and guarantees CORS headers on
+    every response, including handler errors.
+
+    - wildcard ("*"): Access-Control-Allow-Origin: * without credentials
+    - explicit origins: the request origin is echoed with credentials; unknown
+      or missing origins fall back to the first configured origin
+
+    Header tuples are built once per allowed origin, so the per-request cost
+    is one scan of the request headers and one of the response headers.
+    """
+
+    def __init__(self, app: ASGIApp, allow_origins: Sequence[str]) -> None:
+        self.app = app
+        origins = [o for o in allow_origins if o]
+        self.wildcard = not origins or "*" in origins
+
+        common: List[Header] = [
+            (b"access-control-allow-methods", b"*"),
+            (b"access-control-allow-headers", b"*"),
+            (b"access-control-expose-headers", b"*"),
+        ]
+        if self.wildcard:
+            self._fallback: List[Header] = [(b"access-control-allow-origin", b"*")] + common
+            self._by_origin = {}
+        else:
+            self._by_origin = {
+                o.encode("latin-1"): [
+                    (b"access-control-allow-origin", o.encode("latin-1")),
+                    (b"access-control-allow-credentials", b"true"),
+                ] + common
+                for o in origins
+            }
+            self._fallback = self._by_origin[origins[0].encode("latin-1")]
+
+    def _headers_for(self, origin: Optional[bytes]) -> List[Header]:
+        if origin is not None:
+            return self._by_origin.get(origin, self._fallback)
+        return self._fallback
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = None
+        request_method = None
+        request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        if scope["method"] == "OPTIONS" and origin is not None and request_method is not None:
+            await self._preflight(origin, request_headers, send)
+            return
+
+        cors_headers = self._headers_for(origin)
+        vary = not self.wildcard
+        response_started = False
+
+        async def send_with_cors(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+                headers = list(message.get("headers") or [])
+                has_origin = False
+                vary_index = None
+                for i, (name, _) in enumerate(headers):
+                    lname = name.lower()
+                    if lname == b"access-control-allow-origin":
+                        has_origin = True
+                    elif lname == b"vary":
+                        vary_index = i
+                if not has_origin:
+                    headers.extend(cors_headers)
+                if vary:
+                    if vary_index is None:
+                        headers.append((b"vary", b"Origin"))
+                    elif b"origin" not in headers[vary_index][1].lower():
+                        headers[vary_index] = (b"vary", headers[vary_index][1] + b", Origin")
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_cors)
+        except Exception:
+            # Unhandled errors: answer with a CORS-readable 500 so the browser
+            # surfaces the real status instead of an opaque CORS failure, then
+            # re-raise for the server error middleware to log.
+            if not response_started:
+                await send({
+                    "type": "http.response.start",
+                    "status": 500,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(_ERROR_BODY)).encode()),
+                    ] + cors_headers + ([(b"vary", b"Origin")] if vary else []),
+                })
+                await send({"type": "http.response.body", "body": _ERROR_BODY})
+            raise
+
+    async def _preflight(self, origin: bytes, request_headers: Optional[bytes], send: Send) -> None:
+        allowed = self.wildcard or origin in self._by_origin
+        headers: List[Header] = [
+            (b"access-control-allow-origin", b"*" if self.wildcard else (origin if allowed else self._fallback[0][1])),
+            (b"access-control-allow-methods", _PREFLIGHT_METHODS),
+            (b"access-control-max-age", _PREFLIGHT_MAX_AGE),
+            (b"content-type", b"text/plain; charset=utf-8"),
+        ]
+        if request_headers:
+            headers.append((b"access-control-allow-headers", request_headers))
+        if not self.wildcard:
+            headers.append((b"access-control-allow-credentials", b"true"))
+            headers.append((b"vary", b"Origin"))
+
+        body = b"OK" if allowed else b"Disallowed CORS origin"
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": 200 if allowed else 400, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -52,7 +52,7 @@ async def create_admin():
             "role": "admin",
             "referral_code": "ADMIN001",
             "referral_balance": 0.0,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
         
         await db.users.insert_one(admin_user)
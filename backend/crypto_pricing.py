@@ -0,0 +1,149 @@
+import os
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import jwt
+from fastapi import HTTPException
+
+import sessions
+from cache import ReadThroughCache
+from core import _safe_float, _settings_cache, db
+from models import CryptoConfig
+
+# Effective USDT buy/sell pricing, compiled from crypto_config and
+# site_settings.crypto_settings whenever either changes, so quotes and
+# buy/sell orders don't re-read both and re-resolve the fallbacks per call.
+
+QUOTE_TTL = int(os.environ.get("CRYPTO_QUOTE_TTL_SECONDS", "120"))
+_QUOTE_AUDIENCE = "crypto-quote"
+
+
+class ChainPricing:
+    """Resolved rates (USD per USDT), fees (%) and limits for one chain."""
+
+    __slots__ = ("buy_rate", "sell_rate", "buy_fee_percent", "sell_fee_percent",
+                 "min_buy_usd", "max_buy_usd", "min_sell_usdt", "max_sell_usdt")
+
+    def __init__(self, config: Dict[str, Any], crypto_settings: Dict[str, Any], chain: str):
+        # site_settings.crypto_settings wins, then the per-chain crypto_config value, then the generic one
+        self.buy_rate = _safe_float(
+            crypto_settings.get("buy_rate_usdt", config.get(f"buy_rate_{chain}", config.get("buy_rate_usdt", 1.02))), 1.02)
+        self.sell_rate = _safe_float(
+            crypto_settings.get("sell_rate_usdt", config.get(f"sell_rate_{chain}", config.get("sell_rate_usdt", 0.98))), 0.98)
+        self.buy_fee_percent = _safe_float(
+            crypto_settings.get("transaction_fee_percent", config.get("buy_fee_percent", config.get("transaction_fee_percent", 2.0))), 2.0)
+        self.sell_fee_percent = _safe_float(
+            crypto_settings.get("transaction_fee_percent", config.get("sell_fee_percent", config.get("transaction_fee_percent", 2.0))), 2.0)
+        self.min_buy_usd = _safe_float(
+            crypto_settings.get("min_transaction_usd", config.get("min_buy_usd", config.get("min_transaction_usd", 10.0))), 10.0)
+        self.max_buy_usd = _safe_float(config.get("max_buy_usd", 10000.0), 10000.0)
+        self.min_sell_usdt = _safe_float(config.get("min_sell_usdt", 10.0), 10.0)
+        self.max_sell_usdt = _safe_float(config.get("max_sell_usdt", 10000.0), 10000.0)
+
+
+class PricingTable:
+    """Everything the crypto endpoints derive from config + settings, built once per change."""
+
+    def __init__(self, config: Dict[str, Any], settings: Optional[Dict[str, Any]]):
+        self.config = config
+        self.settings = settings
+        self.crypto_settings = (settings or {}).get("crypto_settings") or {}
+        self._chains: Dict[str, ChainPricing] = {}
+        self.public_config = self._public_config()
+
+    def chain(self, chain: str) -> ChainPricing:
+        key = (chain or "").lower()
+        pricing = self._chains.get(key)
+        if pricing is None:
+            pricing = self._chains[key] = ChainPricing(self.config, self.crypto_settings, key)
+        return pricing
+
+    def wallet(self, chain: str) -> Optional[str]:
+        admin_wallets = self.crypto_settings.get("wallets") or {}
+        return admin_wallets.get(chain) or self.config.get(f"wallet_{chain.lower()}")
+
+    def _public_config(self) -> Dict[str, Any]:
+        # GET /crypto/config: the stored config plus the compatibility fields the CryptoPage reads
+        config = {k: v for k, v in self.config.items() if k != "_id"}
+        if self.crypto_settings:
+            config["crypto_settings"] = self.crypto_settings
+        generic = ChainPricing(self.config, self.crypto_settings, "bep20")
+        config["buy_rate_usdt"] = generic.buy_rate
+        config["sell_rate_usdt"] = generic.sell_rate
+        config["transaction_fee_percent"] = generic.buy_fee_percent
+        config["min_transaction_usd"] = generic.min_buy_usd
+        return config
+
+
+async def _load_crypto_config(_key) -> Dict[str, Any]:
+    config = await db.crypto_config.find_one({"id": "crypto_config"}, {"_id": 0})
+    if not config:
+        config = CryptoConfig().model_dump()
+        await db.crypto_config.insert_one(dict(config))
+    return config
+
+_crypto_config_cache = ReadThroughCache(_load_crypto_config, ttl=30)
+_table: Optional[PricingTable] = None
+
+
+async def pricing() -> PricingTable:
+    """The compiled table; rebuilt only when the cached config or settings object changed."""
+    global _table
+    config = await _crypto_config_cache.get()
+    # The cached object itself, not _site_settings()'s per-call copy, so identity means "unchanged"
+    settings = await _settings_cache.get()
+    table = _table
+    if table is None or table.config is not config or table.settings is not settings:
+        table = _table = PricingTable(config, settings)
+    return table
+
+
+def invalidate() -> None:
+    _crypto_config_cache.invalidate()
+
+
+# ==================== QUOTES ====================
+
+def quote(table: PricingTable, side: str, chain: str, amount: float) -> Dict[str, Any]:
+    """Price a buy (amount in USD) or sell (amount in USDT); 400 outside the limits."""
+    p = table.chain(chain)
+    if side == "buy":
+        if amount < p.min_buy_usd or amount > p.max_buy_usd:
+            raise HTTPException(status_code=400, detail=f"Amount must be between ${p.min_buy_usd} and ${p.max_buy_usd}")
+        fee = amount * (p.buy_fee_percent / 100)
+        return {
+            "side": "buy", "chain": chain, "exchange_rate": p.buy_rate, "fee_percent": p.buy_fee_percent,
+            "amount_usd": amount, "amount_crypto": amount / p.buy_rate, "fee": fee, "total_usd": amount + fee,
+        }
+    if side == "sell":
+        if amount < p.min_sell_usdt or amount > p.max_sell_usdt:
+            raise HTTPException(status_code=400, detail=f"Amount must be between {p.min_sell_usdt} and {p.max_sell_usdt} USDT")
+        amount_usd = amount * p.sell_rate
+        fee = amount_usd * (p.sell_fee_percent / 100)
+        return {
+            "side": "sell", "chain": chain, "exchange_rate": p.sell_rate, "fee_percent": p.sell_fee_percent,
+            "amount_usd": amount_usd, "amount_crypto": amount, "fee": fee, "total_usd": amount_usd - fee,
+        }
+    raise HTTPException(status_code=400, detail="side must be buy or sell")
+
+
+def sign(priced: Dict[str, Any]) -> Dict[str, Any]:
+    """Attach a short-lived signed token that buy/sell accept instead of re-pricing."""
+    now = int(time.time())
+    claims = {**priced, "aud": _QUOTE_AUDIENCE, "iat": now, "exp": now + QUOTE_TTL, "jti": uuid.uuid4().hex}
+    return {**priced, "quote_token": jwt.encode(claims, sessions.SECRET, algorithm="HS256"), "expires_in": QUOTE_TTL}
+
+
+def redeem(token: str, side: str, chain: str, amount: float) -> Dict[str, Any]:
+    """The quoted prices, if the token is valid and was issued for this exact side, chain and amount."""
+    try:
+        claims = jwt.decode(token, sessions.SECRET, algorithms=["HS256"], audience=_QUOTE_AUDIENCE)
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=400, detail="Quote expired, please request a new one")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=400, detail="Invalid quote")
+    quoted_amount = claims["amount_usd"] if side == "buy" else claims["amount_crypto"]
+    if claims.get("side") != side or str(claims.get("chain", "")).lower() != chain.lower() or abs(quoted_amount - amount) > 1e-9:
+        raise HTTPException(status_code=400, detail="Quote does not match this order")
+    return claims
@@ -0,0 +1,227 @@
+import importlib.util
+import os
+from collections import deque
+from typing import Any, Deque, Dict, List, Sequence, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import ReadPreference, monitoring
+from pymongo.write_concern import WriteConcern
+
+import metrics
+
+# Compressor -> module it needs; zlib ships with Python
+_COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": None}
+
+# A pool is reported saturated when this share of its connections is checked out
+SATURATION_THRESHOLD = float(os.environ.get("MONGO_POOL_SATURATION_THRESHOLD", "0.9"))
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def available_compressors(requested: Sequence[str]) -> List[str]:
+    """Keep the requested compressors whose Python package is installed, in order."""
+    out = []
+    for name in requested:
+        name = name.strip().lower()
+        if name not in _COMPRESSOR_MODULES or name in out:
+            continue
+        module = _COMPRESSOR_MODULES[name]
+        if module is None or importlib.util.find_spec(module) is not None:
+            out.append(name)
+    return out
+
+
+def client_options() -> Dict[str, Any]:
+    """Pool sizing, timeouts and wire compression from MONGO_* env vars."""
+    options: Dict[str, Any] = {
+        "maxPoolSize": _env_int("MONGO_MAX_POOL_SIZE", 100),
+        "minPoolSize": _env_int("MONGO_MIN_POOL_SIZE", 5),
+        "maxIdleTimeMS": _env_int("MONGO_MAX_IDLE_TIME_MS", 300_000),
+        "serverSelectionTimeoutMS": _env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5_000),
+        "connectTimeoutMS": _env_int("MONGO_CONNECT_TIMEOUT_MS", 10_000),
+        "waitQueueTimeoutMS": _env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10_000),
+    }
+    compressors = available_compressors(os.environ.get("MONGO_COMPRESSORS", "zstd,snappy,zlib").split(","))
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return options
+
+
+# ==================== READ / WRITE ROUTING ====================
+
+def analytics_reads(collection: AsyncIOMotorCollection) -> AsyncIOMotorCollection:
+    """Admin listings and dashboards: may be served by a secondary (slightly stale is fine)."""
+    return collection.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+
+_MAJORITY = WriteConcern("majority")
+
+
+def ledger_writes(collection: AsyncIOMotorCollection) -> AsyncIOMotorCollection:
+    """Balance changes and ledger entries: acknowledged only once a majority has them."""
+    return collection.with_options(write_concern=_MAJORITY)
+
+
+# ==================== RETRYABLE CREDITS ====================
+
+# Crediting a topup or referral payout is two writes: the balance, then the source
+# marked credited. The balance update also pushes the source's key onto the user's
+# applied_credits in the same atomic write, so a retry after a crash between the two
+# (the reconcilers) moves nothing; the key is pulled once the source is marked.
+
+async def apply_credit(users: AsyncIOMotorCollection, user_filter: Dict[str, Any],
+                       inc: Dict[str, float], key: str) -> bool:
+    """$inc the user's balances unless `key` is already applied; False when it was (or no user matched)."""
+    result = await ledger_writes(users).update_one(
+        {**user_filter, "applied_credits": {"$ne": key}},
+        {"$inc": inc, "$push": {"applied_credits": key}},
+    )
+    return result.modified_count == 1
+
+
+async def release_credit(users: AsyncIOMotorCollection, user_filter: Dict[str, Any], key: str) -> None:
+    """Forget `key` once its source is marked credited (nothing will retry it)."""
+    await users.update_one(user_filter, {"$pull": {"applied_credits": key}})
+
+
+# ==================== POOL MONITORING ====================
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """
+    Tracks open / checked-out / waiting connections per server.
+
+    Pool events fire on driver threads; like the command listener they only
+    append (address, field, delta) to a deque, applied on the loop thread
+    when stats are read.
+    """
+
+    _FIELDS = ("connections", "in_use", "waiting", "checkout_failures")
+
+    def __init__(self):
+        self._events: Deque[Tuple[Any, str, int]] = deque(maxlen=100_000)
+        self._pools: Dict[str, Dict[str, int]] = {}
+        self.max_pool_size = 0
+
+    def _push(self, event, field: str, delta: int):
+        self._events.append((event.address, field, delta))
+
+    def pool_created(self, event):
+        self._push(event, "connections", 0)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._push(event, "connections", 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._push(event, "connections", -1)
+
+    def connection_check_out_started(self, event):
+        self._push(event, "waiting", 1)
+
+    def connection_check_out_failed(self, event):
+        self._push(event, "waiting", -1)
+        self._push(event, "checkout_failures", 1)
+
+    def connection_checked_out(self, event):
+        self._push(event, "waiting", -1)
+        self._push(event, "in_use", 1)
+
+    def connection_checked_in(self, event):
+        self._push(event, "in_use", -1)
+
+    def _drain(self):
+        pop = self._events.popleft
+        while self._events:
+            address, field, delta = pop()
+            key = f"{address[0]}:{address[1]}" if isinstance(address, tuple) else str(address)
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._pools[key] = dict.fromkeys(self._FIELDS, 0)
+            pool[field] += delta
+            if field == "checkout_failures":
+                POOL_CHECKOUT_FAILURES.inc(key, amount=delta)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        self._drain()
+        out = {}
+        for address, pool in self._pools.items():
+            saturation = pool["in_use"] / self.max_pool_size if self.max_pool_size else 0.0
+            out[address] = {**pool, "max_pool_size": self.max_pool_size, "saturation": round(saturation, 3)}
+        return out
+
+    def _gauge(self, field: str):
+        return lambda: {(address, ): pool[field] for address, pool in self.stats().items()}
+
+
+POOL_LISTENER = PoolListener()
+
+metrics.REGISTRY.register(metrics.Gauge(
+    "mongodb_pool_connections", "Open connections per MongoDB server", ("address",),
+    callback=POOL_LISTENER._gauge("connections")))
+metrics.REGISTRY.register(metrics.Gauge(
+    "mongodb_pool_in_use", "Connections checked out per MongoDB server", ("address",),
+    callback=POOL_LISTENER._gauge("in_use")))
+metrics.REGISTRY.register(metrics.Gauge(
+    "mongodb_pool_waiting", "Operations waiting for a pooled connection", ("address",),
+    callback=POOL_LISTENER._gauge("waiting")))
+metrics.REGISTRY.register(metrics.Gauge(
+    "mongodb_pool_saturation", "Checked-out share of maxPoolSize", ("address",),
+    callback=POOL_LISTENER._gauge("saturation")))
+# Only ever grows: a counter, so rate() works; drained from the listener's buffer on scrape
+POOL_CHECKOUT_FAILURES = metrics.REGISTRY.register(metrics.Counter(
+    "mongodb_pool_checkout_failures_total", "Failed connection check-outs per MongoDB server", ("address",)))
+metrics.REGISTRY.add_collector(POOL_LISTENER._drain)
+
+
+def pool_health() -> Dict[str, Any]:
+    pools = POOL_LISTENER.stats()
+    saturated = [a for a, p in pools.items() if p["saturation"] >= SATURATION_THRESHOLD]
+    return {"status": "saturated" if saturated else "ok", "saturated": saturated, "pools": pools}
+
+
+def create_client(mongo_url: str, event_listeners: Sequence[Any] = ()) -> AsyncIOMotorClient:
+    options = client_options()
+    POOL_LISTENER.max_pool_size = options["maxPoolSize"]
+    # tz_aware: dates are stored as BSON datetimes and read back as aware UTC
+    return AsyncIOMotorClient(
+        mongo_url,
+        tz_aware=True,
+        event_listeners=[*event_listeners, POOL_LISTENER],
+        **options,
+    )
+
+
+class DatabaseHandle:
+    """
+    The app's database, as one object the feature routers import once.
+    Tests and benchmarks repoint it with use() (e.g. at memory_mongo) instead
+    of rebinding a module global in every router.
+    """
+
+    def __init__(self, target: Any):
+        self.target = target
+
+    def use(self, target: Any) -> None:
+        self.target = target
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.target, name)
+
+    def __getitem__(self, name: str) -> Any:
+        return self.target[name]
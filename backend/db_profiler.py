@@ -0,0 +1,159 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import metrics
+
+logger = logging.getLogger("db_profiler")
+
+# Development/staging only: records every Mongo command per request.
+ENABLED = os.environ.get("DB_PROFILING", "").strip().lower() in ("1", "true", "yes", "on")
+SLOW_REQUEST_MS = float(os.environ.get("DB_PROFILING_SLOW_MS", "200"))
+SAMPLE_RATE = float(os.environ.get("DB_PROFILING_SAMPLE_RATE", "1.0"))
+# The same query shape this many times in one request is reported as N+1
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("DB_PROFILING_N_PLUS_ONE", "3"))
+
+# Where each command keeps the collection's filter
+_FILTER_PATHS = {
+    "find": ("filter",),
+    "count": ("query",),
+    "distinct": ("query",),
+    "findAndModify": ("query",),
+    "update": ("updates", 0, "q"),
+    "delete": ("deletes", 0, "q"),
+}
+_IGNORED_COMMANDS = {"getMore", "endSessions", "hello", "isMaster", "ismaster", "ping", "saslStart", "saslContinue"}
+
+
+def _shape(value: Any) -> Any:
+    """Query structure with literal values replaced, so repeats compare equal."""
+    if isinstance(value, dict):
+        return {k: _shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_shape(v) for v in value[:1]]
+    return "?"
+
+
+def _command_filter(name: str, command: Dict[str, Any]) -> Any:
+    path = _FILTER_PATHS.get(name)
+    if path is None:
+        return None
+    node: Any = command
+    for key in path:
+        try:
+            node = node[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return node
+
+
+def query_shape(name: str, command: Dict[str, Any]) -> str:
+    """e.g. 'find users {"id": "?"}'; aggregations are keyed by their stage names."""
+    if name == "aggregate":
+        shape = [list(step) for step in command.get("pipeline") or []]
+    else:
+        shape = _shape(_command_filter(name, command))
+    return f"{name} {command.get(name)} {json.dumps(shape, sort_keys=True, default=str)}"
+
+
+def _describe(name: str, command: Dict[str, Any]) -> Optional[str]:
+    return None if name in _IGNORED_COMMANDS else query_shape(name, command)
+
+
+class RequestProfile:
+    """
+    One request's commands, recorded by metrics.MONGO_LISTENER into the shared
+    per-request CommandLog (no second listener): only shaped commands count.
+    """
+
+    __slots__ = ("started", "log")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.log = metrics.CommandLog(describe=_describe)
+
+    @property
+    def calls(self) -> List[Tuple[str, float, bool]]:
+        """(shape, seconds, ok) per command"""
+        return [(shape, seconds, ok) for _, seconds, ok, shape in self.log.calls if shape is not None]
+
+    @property
+    def db_seconds(self) -> float:
+        return sum(seconds for _, seconds, _ in self.calls)
+
+    def repeated_shapes(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> Dict[str, int]:
+        counts = Counter(shape for shape, _, _ in self.calls)
+        return {shape: n for shape, n in counts.items() if n >= threshold}
+
+
+_current: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar("db_profile", default=None)
+
+
+def current_profile() -> Optional[RequestProfile]:
+    return _current.get()
+
+
+class DBProfilerMiddleware:
+    """
+    Adds X-DB-Calls / X-DB-Time (ms) to every response and logs slow or N+1
+    requests (sampled) with their full query list.
+    """
+
+    def __init__(self, app: ASGIApp, slow_ms: float = SLOW_REQUEST_MS, sample_rate: float = SAMPLE_RATE) -> None:
+        self.app = app
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile()
+        token = _current.set(profile)
+        commands_token = metrics.track_commands(profile.log)
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers") or [])
+                headers.append((b"x-db-calls", str(len(profile.calls)).encode()))
+                headers.append((b"x-db-time", f"{profile.db_seconds * 1000:.1f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            metrics.untrack_commands(commands_token)
+            _current.reset(token)
+            self._report(scope, profile)
+
+    def _report(self, scope: Scope, profile: RequestProfile) -> None:
+        elapsed_ms = (time.perf_counter() - profile.started) * 1000
+        repeated = profile.repeated_shapes()
+        if elapsed_ms < self.slow_ms and not repeated:
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        route = scope.get("route")
+        logger.warning(json.dumps({
+            "event": "n_plus_one" if repeated else "slow_request",
+            "method": scope.get("method"),
+            "path": scope.get("path"),
+            "route": getattr(route, "path", None),
+            "elapsed_ms": round(elapsed_ms, 1),
+            "db_calls": len(profile.calls),
+            "db_ms": round(profile.db_seconds * 1000, 1),
+            "repeated": repeated,
+            "queries": [
+                {"shape": shape, "ms": round(seconds * 1000, 2), "ok": ok}
+                for shape, seconds, ok in profile.calls
+            ],
+        }))
@@ -0,0 +1,426 @@
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from pymongo import ReturnDocument
+
+import metrics
+from core import _as_utc, db
+
+logger = logging.getLogger("events")
+
+# ==================== CHANGE FEED ====================
+
+# Write paths call changed(topic, id) after they touch a document the admin
+# consoles show. A flusher task batches those notes, reads the current
+# projected documents (one find per topic per batch) and appends them to the
+# `events` collection under a global sequence number. Every worker tails that
+# collection while it has subscribers, so a change made in any worker reaches
+# every stream. The sequence number is the resume token (SSE `id:`).
+#
+# Mongo change streams would need a replica set; this works on any deployment.
+
+# How long events stay resumable; older Last-Event-IDs get a "reset"
+RETENTION_SECONDS = int(os.environ.get("EVENTS_RETENTION_SECONDS", str(24 * 3600)))
+# How often a worker with subscribers looks for events written by other workers
+POLL_SECONDS = float(os.environ.get("EVENTS_POLL_SECONDS", "1"))
+# A missing sequence number (allocated, not yet inserted) is waited for this long before it is skipped
+GAP_GRACE_SECONDS = float(os.environ.get("EVENTS_GAP_GRACE_SECONDS", "5"))
+# Events a slow subscriber may fall behind by before it is told to reset
+SUBSCRIBER_BUFFER = int(os.environ.get("EVENTS_SUBSCRIBER_BUFFER", "1000"))
+# Flusher batching: at most this many changes per write
+FLUSH_BATCH = 500
+MAX_PENDING = 10000
+
+# topic -> fields carried by its events (what the admin consoles and order pages render)
+TOPICS: Dict[str, Tuple[str, ...]] = {
+    "orders": (
+        "id", "user_email", "items.product_name", "items.quantity", "items.price", "items.player_id", "items.credentials",
+        "total_amount", "payment_method", "payment_status", "order_status", "payment_proof_url", "transaction_id",
+        "delivery_info", "refunded_at", "created_at", "plisio_invoice_id", "plisio_invoice_url", "subscription_end_date",
+    ),
+    "minutes_transfers": (
+        "id", "user_email", "country", "phone_number", "amount", "fee_amount", "total_amount", "payment_method",
+        "payment_status", "transfer_status", "payment_proof_url", "transaction_id", "plisio_invoice_url", "created_at",
+    ),
+    "wallet_topups": (
+        "id", "user_email", "amount", "payment_method", "payment_status", "payment_proof_url", "transaction_id",
+        "plisio_invoice_url", "credited", "created_at",
+    ),
+    "withdrawals": (
+        "id", "user_email", "amount", "method", "wallet_address", "paypal_email", "moncash_phone", "moncash_name",
+        "status", "admin_notes", "created_at",
+    ),
+    "crypto_transactions": (
+        "id", "user_email", "transaction_type", "chain", "amount_crypto", "amount_usd", "fee", "total_usd",
+        "payment_method", "wallet_address", "transaction_id", "payment_proof", "receiving_info", "status",
+        "admin_notes", "tx_hash", "created_at",
+    ),
+}
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return _as_utc(value).isoformat()
+    return str(value)
+
+
+class Event:
+    __slots__ = ("seq", "topic", "id", "user_id", "doc")
+
+    def __init__(self, seq: int, topic: str, id: str, user_id: Optional[str], doc: Dict[str, Any]):
+        self.seq = seq
+        self.topic = topic
+        self.id = id
+        self.user_id = user_id
+        self.doc = doc
+
+    @classmethod
+    def from_stored(cls, stored: Dict[str, Any]) -> "Event":
+        return cls(stored["seq"], stored["topic"], stored["id"], stored.get("user_id"), stored.get("doc") or {})
+
+    def data(self) -> str:
+        return json.dumps({"seq": self.seq, "topic": self.topic, "id": self.id, "doc": self.doc},
+                          default=_json_default, separators=(",", ":"))
+
+    def sse(self) -> str:
+        return f"id: {self.seq}\nevent: {self.topic}\ndata: {self.data()}\n\n"
+
+
+class Subscription:
+    """
+    One stream's (or long-poll's) view of the feed: the stored events it
+    missed, then a bounded buffer of live events matching its filter.
+    """
+
+    __slots__ = ("topics", "user_id", "backlog", "queue", "floor", "overflowed", "expired")
+
+    def __init__(self, topics: Optional[Set[str]], user_id: Optional[str]):
+        self.topics = topics
+        self.user_id = user_id
+        self.backlog: Deque[Event] = deque()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_BUFFER)
+        self.floor = 0
+        self.overflowed = False
+        self.expired = False
+
+    def matches(self, event: Event) -> bool:
+        return self.topics is None or event.topic in self.topics
+
+    def offer(self, event: Event) -> None:
+        if self.overflowed or not self.matches(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too far behind to catch up from memory; the stream tells the client to reload
+            self.overflowed = True
+
+    @property
+    def lost(self) -> bool:
+        """True once the client must reload its state and subscribe afresh."""
+        return self.expired or (self.overflowed and not self.backlog and self.queue.empty())
+
+    async def next(self, timeout: float) -> Optional[Event]:
+        """The next event, or None when lost; asyncio.TimeoutError if nothing arrives in time."""
+        while True:
+            if self.backlog:
+                return self.backlog.popleft()
+            if self.lost:
+                return None
+            event = await asyncio.wait_for(self.queue.get(), timeout)
+            # Another worker's tail may be ahead of ours: skip what the client already has
+            if event.seq > self.floor:
+                return event
+
+    def drain(self, limit: int) -> List[Event]:
+        """Whatever is available right now, without waiting."""
+        ready: List[Event] = []
+        while len(ready) < limit and self.backlog:
+            ready.append(self.backlog.popleft())
+        while len(ready) < limit and not self.queue.empty():
+            event = self.queue.get_nowait()
+            if event.seq > self.floor:
+                ready.append(event)
+        return ready
+
+
+class TooManyStreams(Exception):
+    """open() with a per-user limit that the user's open subscriptions already reach."""
+
+
+class EventBus:
+    """
+    changed() is synchronous and cheap, so write paths never wait on the feed.
+    open() returns a Subscription that hands out the stored events after the
+    caller's resume token, then live ones.
+    """
+
+    def __init__(self, get_events: Callable[[], Any], get_counters: Callable[[], Any],
+                 get_collection: Callable[[str], Any]):
+        self.get_events = get_events
+        self.get_counters = get_counters
+        self.get_collection = get_collection
+        self._pending: Dict[Tuple[str, str], None] = {}
+        self._wake_flusher: Optional[asyncio.Event] = None
+        self._wake_poller: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._poller: Optional[asyncio.Task] = None
+        self._cursor: Optional[int] = None
+        # Admin streams see every event; customer streams are indexed by user
+        self._subscribers: Set[Subscription] = set()
+        self._by_user: Dict[str, Set[Subscription]] = {}
+        # Per-user opens not registered yet, already counted against their limit
+        self._opening: Dict[str, int] = {}
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers) + sum(len(subs) for subs in self._by_user.values())
+
+    def streams(self, user_id: str) -> int:
+        return len(self._by_user.get(user_id, ())) + self._opening.get(user_id, 0)
+
+    # ---------- publishing ----------
+
+    def changed(self, topic: str, *ids: str) -> None:
+        """Note that these documents changed; their current state is published shortly."""
+        if topic not in TOPICS:
+            raise ValueError(f"Unknown event topic {topic}")
+        for doc_id in ids:
+            if len(self._pending) >= MAX_PENDING:
+                metrics.CHANGE_EVENTS.inc(topic, "dropped")
+                continue
+            # Several changes to one document before the next flush publish its state once
+            self._pending[(topic, doc_id)] = None
+        if self._wake_flusher is not None:
+            self._wake_flusher.set()
+
+    async def flush(self) -> int:
+        """Publish everything noted so far; returns the number of events written."""
+        written = 0
+        while self._pending:
+            batch = list(self._pending)[:FLUSH_BATCH]
+            for key in batch:
+                self._pending.pop(key, None)
+            try:
+                written += await self._publish(batch)
+            except BaseException:
+                # Put the batch back for the next flush, or the consoles keep stale rows with no reset
+                self._requeue(batch)
+                raise
+        return written
+
+    def _requeue(self, batch: List[Tuple[str, str]]) -> None:
+        for key in batch:
+            if key in self._pending:
+                continue
+            if len(self._pending) >= MAX_PENDING:
+                metrics.CHANGE_EVENTS.inc(key[0], "dropped")
+                continue
+            self._pending[key] = None
+
+    async def _publish(self, batch: List[Tuple[str, str]]) -> int:
+        by_topic: Dict[str, List[str]] = {}
+        for topic, doc_id in batch:
+            by_topic.setdefault(topic, []).append(doc_id)
+
+        found: List[Tuple[str, Dict[str, Any]]] = []
+        for topic, ids in by_topic.items():
+            projection = {"_id": 0, "user_id": 1, **{f: 1 for f in TOPICS[topic]}}
+            docs = await self.get_collection(topic).find({"id": {"$in": ids}}, projection).to_list(len(ids))
+            found.extend((topic, doc) for doc in docs)
+        if not found:
+            return 0
+
+        # Reserve len(found) sequence numbers in one write
+        counter = await self.get_counters().find_one_and_update(
+            {"_id": "events"}, {"$inc": {"seq": len(found)}}, upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        first = counter["seq"] - len(found) + 1
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=RETENTION_SECONDS)
+        docs = []
+        for offset, (topic, doc) in enumerate(found):
+            user_id = doc.pop("user_id", None)
+            docs.append({"seq": first + offset, "topic": topic, "id": doc["id"], "user_id": user_id,
+                         "doc": doc, "ts": now, "expires_at": expires_at})
+            metrics.CHANGE_EVENTS.inc(topic, "published")
+        await self.get_events().insert_many(docs, ordered=False)
+        if self._wake_poller is not None:
+            self._wake_poller.set()
+        return len(docs)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await self._wake_flusher.wait()
+            self._wake_flusher.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Change feed flush failed: {e}")
+                await asyncio.sleep(1.0)
+
+    # ---------- tailing ----------
+
+    async def _latest_seq(self) -> int:
+        last = await self.get_events().find({}, {"_id": 0, "seq": 1}).sort("seq", -1).limit(1).to_list(1)
+        return last[0]["seq"] if last else 0
+
+    async def _oldest_seq(self) -> Optional[int]:
+        first = await self.get_events().find({}, {"_id": 0, "seq": 1}).sort("seq", 1).limit(1).to_list(1)
+        return first[0]["seq"] if first else None
+
+    async def poll_once(self) -> int:
+        """Hand new events to local subscribers, in sequence order; returns how many were delivered."""
+        stored = await self.get_events().find({"seq": {"$gt": self._cursor}}, {"_id": 0}).sort("seq", 1).to_list(FLUSH_BATCH)
+        delivered = 0
+        for doc in stored:
+            if doc["seq"] != self._cursor + 1:
+                # A sequence number was reserved but not inserted yet: wait for it, up to the grace period
+                if datetime.now(timezone.utc) - _as_utc(doc["ts"]) < timedelta(seconds=GAP_GRACE_SECONDS):
+                    break
+            event = Event.from_stored(doc)
+            self._cursor = event.seq
+            for sub in self._subscribers:
+                sub.offer(event)
+            for sub in self._by_user.get(event.user_id, ()):
+                sub.offer(event)
+            metrics.CHANGE_EVENTS.inc(event.topic, "delivered")
+            delivered += 1
+        return delivered
+
+    async def _poll_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake_poller.wait(), timeout=POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake_poller.clear()
+            if not self.subscribers:
+                continue
+            try:
+                while await self.poll_once() >= FLUSH_BATCH:
+                    pass
+            except Exception as e:
+                logger.error(f"Change feed poll failed: {e}")
+
+    def _ensure_poller(self) -> None:
+        if self._poller is None:
+            self._wake_poller = asyncio.Event()
+            self._cursor = 0
+            self._poller = asyncio.create_task(self._poll_loop())
+
+    async def open(self, after: Optional[int] = None, topics: Optional[Set[str]] = None,
+                   user_id: Optional[str] = None, limit: Optional[int] = None) -> Subscription:
+        """
+        Subscribe to events after the resume token `after` (None: from now
+        on), optionally only `topics` and only one user's documents. The
+        subscription is lost at once when the token is no longer retained.
+        With `limit`, raises TooManyStreams when the user already holds that
+        many. Pair with close().
+        """
+        self._ensure_poller()
+        if user_id is not None:
+            # Checked and reserved before the first await, so concurrent opens can't all pass
+            if limit is not None and self.streams(user_id) >= limit:
+                raise TooManyStreams(user_id)
+            self._opening[user_id] = self._opening.get(user_id, 0) + 1
+        try:
+            if not self.subscribers:
+                # The poller idles without subscribers; nobody needs what it skipped
+                latest = await self._latest_seq()
+                if not self.subscribers:
+                    self._cursor = max(self._cursor, latest)
+        finally:
+            if user_id is not None:
+                left = self._opening.pop(user_id) - 1
+                if left:
+                    self._opening[user_id] = left
+        sub = Subscription(topics, user_id)
+        # Registered before the replay: everything past the cursor arrives through the buffer
+        if user_id is None:
+            self._subscribers.add(sub)
+        else:
+            self._by_user.setdefault(user_id, set()).add(sub)
+        cursor = sub.floor = self._cursor
+        try:
+            if after is not None and after < cursor:
+                oldest = await self._oldest_seq()
+                if oldest is None or oldest > after + 1:
+                    sub.expired = True
+                    return sub
+                query: Dict[str, Any] = {"seq": {"$gt": after, "$lte": cursor}}
+                if topics is not None:
+                    query["topic"] = {"$in": sorted(topics)}
+                if user_id is not None:
+                    query["user_id"] = user_id
+                stored = await self.get_events().find(query, {"_id": 0}).sort("seq", 1).to_list(SUBSCRIBER_BUFFER + 1)
+                if len(stored) > SUBSCRIBER_BUFFER:
+                    sub.expired = True
+                    return sub
+                sub.backlog.extend(Event.from_stored(doc) for doc in stored)
+            elif after is not None and after > cursor:
+                if after > await self._latest_seq():
+                    # A token from another feed (e.g. the database was reset)
+                    sub.expired = True
+                sub.floor = after
+        except BaseException:
+            self.close(sub)
+            raise
+        return sub
+
+    def close(self, sub: Subscription) -> None:
+        self._subscribers.discard(sub)
+        if sub.user_id is not None:
+            subs = self._by_user.get(sub.user_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._by_user[sub.user_id]
+
+    # ---------- lifecycle ----------
+
+    def start(self) -> None:
+        if self._flusher is not None:
+            return
+        self._wake_flusher = asyncio.Event()
+        if self._pending:
+            self._wake_flusher.set()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        tasks = [t for t in (self._flusher, self._poller) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Change feed flush at shutdown failed: {e}")
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget tasks, subscribers and unflushed changes (tests start the app more than once, each on a new loop)."""
+        self._pending = {}
+        self._flusher = self._poller = None
+        self._wake_flusher = self._wake_poller = None
+        self._cursor = None
+        self._subscribers = set()
+        self._opening = {}
+        self._by_user = {}
+
+
+BUS = EventBus(lambda: db.events, lambda: db.counters, lambda name: db[name])
+
+
+def changed(topic: str, *ids: str) -> None:
+    BUS.changed(topic, *ids)
+
+
+metrics.REGISTRY.register(metrics.Gauge(
+    "change_feed_subscribers", "Open change feed streams in this worker",
+    callback=lambda: {(): BUS.subscribers}))
@@ -0,0 +1,64 @@
+import os
+from typing import Any, Callable, Dict, Iterable, List, Type
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from pydantic_core import PydanticUndefined
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+# Opt-in: list endpoints return trusted rows without response_model revalidation.
+# Read once at import; handlers look up fast_json.ENABLED on each call, so tests can patch it.
+ENABLED = os.environ.get("FAST_JSON_RESPONSES", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+class FastJSONResponse(JSONResponse):
+    """orjson-backed JSON response. Encodes datetimes natively, same 'Z' form as Pydantic."""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS)
+        return super().render(jsonable_encoder(content))
+
+
+class TrustedModelView:
+    """
+    Precomputed read path for documents that already match a response model.
+
+    The Mongo projection only returns the model's fields, and missing fields are
+    filled from the model's defaults (static ones with a dict merge, default_factory
+    ones per row) - so the rows have the model's shape, same keys as the validated
+    path, without being validated and re-serialized by Pydantic.
+    """
+
+    def __init__(self, model: Type[BaseModel]):
+        self.model = model
+        self.projection: Dict[str, int] = {name: 1 for name in model.model_fields}
+        self.projection["_id"] = 0
+        self.defaults: Dict[str, Any] = {
+            name: field.default
+            for name, field in model.model_fields.items()
+            if field.default is not PydanticUndefined and field.default_factory is None
+        }
+        self.factories: Dict[str, Callable[[], Any]] = {
+            name: field.default_factory
+            for name, field in model.model_fields.items()
+            if field.default_factory is not None
+        }
+
+    def rows(self, docs: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        defaults, factories = self.defaults, self.factories
+        rows = [{**defaults, **doc} for doc in docs]
+        if factories:
+            for row in rows:
+                for name, factory in factories.items():
+                    if name not in row:
+                        row[name] = factory()
+        return rows
+
+    def response(self, docs: Iterable[Dict[str, Any]]) -> FastJSONResponse:
+        return FastJSONResponse(self.rows(docs))
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+
+import metrics
+from circuit_breaker import CircuitBreaker
+
+if TYPE_CHECKING:
+    import aiohttp
+    import requests
+
+# Shared outbound pools (Plisio, Resend), created on first use so requests reuse
+# warm keep-alive/TLS connections instead of a new session each call.
+# aiohttp and requests are imported then too: together they are a large share
+# of cold import time, and most workers never call out before the first payment.
+_async_session: Optional["aiohttp.ClientSession"] = None
+_sync_session: Optional["requests.Session"] = None
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+_sync_session_lock = threading.Lock()
+
+
+def _new_sync_session() -> "requests.Session":
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _new_async_session() -> "aiohttp.ClientSession":
+    import aiohttp
+
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=50, ttl_dns_cache=300, keepalive_timeout=30),
+        timeout=aiohttp.ClientTimeout(total=30),
+    )
+
+
+async def close_pools() -> None:
+    global _async_session, _async_loop, _sync_session
+    if _async_session is not None:
+        await _async_session.close()
+        _async_session, _async_loop = None, None
+    if _sync_session is not None:
+        _sync_session.close()
+        _sync_session = None
+
+
+def sync_session() -> "requests.Session":
+    """Shared requests session, created on first use."""
+    global _sync_session
+    if _sync_session is None:
+        # Resend calls run on background-queue threads; only one may build the pool
+        with _sync_session_lock:
+            if _sync_session is None:
+                _sync_session = _new_sync_session()
+    return _sync_session
+
+
+@asynccontextmanager
+async def aiohttp_session() -> AsyncIterator["aiohttp.ClientSession"]:
+    """
+    The shared aiohttp session, created on first use and bound to that loop.
+    Callers on another loop (scripts, tests) get a short-lived session instead.
+    """
+    global _async_session, _async_loop
+    loop = asyncio.get_running_loop()
+    if _async_session is None or _async_session.closed:
+        _async_session, _async_loop = _new_async_session(), loop
+    if _async_loop is loop:
+        yield _async_session
+        return
+    async with _new_async_session() as session:
+        yield session
+
+
+# One breaker per outbound dependency; state is reported by /health/ready
+BREAKERS = {
+    "plisio": CircuitBreaker("plisio"),
+    "resend": CircuitBreaker("resend"),
+}
+
+
+class outbound:
+    """
+    Circuit breaker + latency metrics around one outbound call; `with` or `async with`.
+    Raises CircuitOpenError without calling out while the service's circuit is open.
+    """
+
+    __slots__ = ("_breaker", "_timer")
+
+    def __init__(self, service: str, operation: str):
+        self._breaker = BREAKERS[service]
+        self._timer = metrics.outbound(service, operation)
+
+    def __enter__(self):
+        self._breaker.before_call()
+        self._timer.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._timer.__exit__(exc_type, exc, tb)
+        if exc_type is None:
+            self._breaker.record_success()
+        else:
+            self._breaker.record_failure()
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
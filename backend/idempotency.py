@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, FrozenSet, List, Optional
+from urllib.parse import parse_qs
+
+from pymongo.errors import DuplicateKeyError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import metrics
+import sessions
+
+logger = logging.getLogger("idempotency")
+
+# How long a stored response is replayed for the same Idempotency-Key
+TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# A first request that hasn't finished after this long is presumed dead; a retry may take over
+LOCK_SECONDS = float(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", "60"))
+# How long a concurrent duplicate waits for the first one's response before getting 409
+WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", "30"))
+
+# POST endpoints that move money or create Plisio invoices
+PATHS: FrozenSet[str] = frozenset({
+    "/api/orders",
+    "/api/wallet/topups",
+    "/api/minutes/transfers",
+    "/api/mobile-topup/requests",
+    "/api/crypto/buy",
+    "/api/crypto/sell",
+    "/api/withdrawals/request",
+})
+
+# Responses worth replaying: the handler ran to a decision. 5xx (and 409/429,
+# which say "try again") release the key so a retry executes again.
+_NOT_STORED = frozenset({409, 429})
+_KEY_HEADER = b"idempotency-key"
+_MAX_KEY_LENGTH = 255
+
+
+def _json_response(status: int, detail: str) -> List[Message]:
+    body = ('{"detail":"%s"}' % detail).encode()
+    return [
+        {"type": "http.response.start", "status": status,
+         "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]},
+        {"type": "http.response.body", "body": body},
+    ]
+
+
+class IdempotencyMiddleware:
+    """
+    Replays the stored response when a POST to one of PATHS repeats its
+    Idempotency-Key, without running the handler again.
+
+    One document per (caller, path, key) in `idempotency_keys`:
+    {_id, fingerprint, state: "in_flight" | "done", locked_until, status,
+    headers, body, expires_at}. Inserting it is the lock: a concurrent
+    duplicate collides on _id and waits (on an in-process event when the
+    first request is in this worker, polling otherwise) for the result.
+    The same key with a different body is rejected with 422.
+    """
+
+    def __init__(self, app: ASGIApp, get_collection: Callable[[], Any], paths: FrozenSet[str] = PATHS) -> None:
+        self.app = app
+        self.get_collection = get_collection
+        self.paths = paths
+        self._local: Dict[str, asyncio.Event] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        key = next((v for k, v in scope["headers"] if k == _KEY_HEADER), None)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > _MAX_KEY_LENGTH:
+            await self._send(send, _json_response(400, "Invalid Idempotency-Key"))
+            return
+
+        body = await self._read_body(receive)
+        doc_id = hashlib.sha256(b"\n".join([self._caller(scope).encode(), scope["path"].encode(), key])).hexdigest()
+        fingerprint = hashlib.sha256(scope.get("query_string", b"") + b"\n" + body).hexdigest()
+
+        coll = self.get_collection()
+        stored = await self._acquire(coll, doc_id, fingerprint)
+        if stored is not None:
+            if stored.get("fingerprint") != fingerprint:
+                metrics.IDEMPOTENCY_REQUESTS.inc(scope["path"], "mismatch")
+                await self._send(send, _json_response(422, "Idempotency-Key was already used with a different request"))
+            elif stored.get("state") != "done":
+                metrics.IDEMPOTENCY_REQUESTS.inc(scope["path"], "conflict")
+                await self._send(send, _json_response(409, "A request with this Idempotency-Key is still in progress"))
+            else:
+                metrics.IDEMPOTENCY_REQUESTS.inc(scope["path"], "replayed")
+                await self._replay(send, stored)
+            return
+
+        metrics.IDEMPOTENCY_REQUESTS.inc(scope["path"], "executed")
+        event = self._local[doc_id] = asyncio.Event()
+        try:
+            await self._execute(scope, body, send, coll, doc_id)
+        finally:
+            self._local.pop(doc_id, None)
+            event.set()
+
+    # ---------- key lifecycle ----------
+
+    async def _acquire(self, coll, doc_id: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """None when this request owns the key and must execute; otherwise the stored document."""
+        deadline = asyncio.get_running_loop().time() + WAIT_SECONDS
+        delay = 0.05
+        while True:
+            now = datetime.now(timezone.utc)
+            lock = {
+                "fingerprint": fingerprint,
+                "state": "in_flight",
+                "locked_until": now + timedelta(seconds=LOCK_SECONDS),
+                "expires_at": now + timedelta(seconds=TTL_SECONDS),
+            }
+            try:
+                await coll.insert_one({"_id": doc_id, **lock})
+                return None
+            except DuplicateKeyError:
+                pass
+
+            doc = await coll.find_one({"_id": doc_id})
+            if doc is None:
+                continue  # expired or released in between: try the insert again
+            if doc.get("state") == "done" or doc.get("fingerprint") != fingerprint:
+                return doc
+            if doc["locked_until"].replace(tzinfo=timezone.utc) <= now:
+                # The first request died mid-way: take its lock over
+                res = await coll.update_one({"_id": doc_id, "state": "in_flight", "locked_until": doc["locked_until"]}, {"$set": lock})
+                if res.matched_count:
+                    return None
+                continue
+
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return doc
+            event = self._local.get(doc_id)
+            if event is not None:
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, 1.0)
+
+    async def _execute(self, scope: Scope, body: bytes, send: Send, coll, doc_id: str) -> None:
+        sent_body = False
+
+        async def receive() -> Message:
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return {"type": "http.disconnect"}
+
+        start: Dict[str, Any] = {}
+        chunks: List[bytes] = []
+
+        async def capture(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        except BaseException:
+            await self._release(coll, doc_id)
+            raise
+
+        status = start.get("status", 500)
+        if status >= 500 or status in _NOT_STORED:
+            await self._release(coll, doc_id)
+            return
+        headers = [[k.decode("latin-1"), v.decode("latin-1")] for k, v in start.get("headers", [])
+                   if k.lower() not in (b"content-length", b"set-cookie")]
+        try:
+            await coll.update_one(
+                {"_id": doc_id},
+                {"$set": {"state": "done", "status": status, "headers": headers, "body": b"".join(chunks)},
+                 "$unset": {"locked_until": ""}},
+            )
+        except Exception as e:
+            # The client already has its response; a retry would execute again
+            logger.error(f"Could not store idempotent response: {e}")
+
+    async def _release(self, coll, doc_id: str) -> None:
+        try:
+            await coll.delete_one({"_id": doc_id, "state": "in_flight"})
+        except Exception as e:
+            logger.error(f"Could not release Idempotency-Key lock: {e}")
+
+    # ---------- helpers ----------
+
+    @staticmethod
+    def _caller(scope: Scope) -> str:
+        # Keys are per caller, so two users can't collide on (or read) each other's responses
+        authorization = next((v for k, v in scope["headers"] if k == b"authorization"), b"").decode("latin-1")
+        user_id = sessions.subject(authorization)
+        if user_id:
+            return f"user:{user_id}"
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        return f"param:{(query.get('user_id') or [''])[0]}"
+
+    @staticmethod
+    async def _read_body(receive: Receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        return b"".join(chunks)
+
+    @staticmethod
+    async def _replay(send: Send, stored: Dict[str, Any]) -> None:
+        body = bytes(stored.get("body") or b"")
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in stored.get("headers") or []]
+        headers.append((b"content-length", str(len(body)).encode()))
+        headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": stored["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def _send(send: Send, messages: List[Message]) -> None:
+        for message in messages:
+            await send(message)
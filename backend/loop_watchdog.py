@@ -0,0 +1,107 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import List, Optional
+
+import metrics
+
+logger = logging.getLogger("loop_watchdog")
+
+# Blocking the loop longer than this is reported; 0 disables the watchdog.
+THRESHOLD_MS = float(os.environ.get("LOOP_WATCHDOG_MS", "250"))
+_MAX_FRAMES = 40
+
+
+class LoopWatchdog:
+    """
+    Detects synchronous work that holds the event loop.
+
+    A heartbeat task on the loop stamps a monotonic time every interval. A
+    daemon thread checks the stamp; when it is older than the threshold the
+    loop is stuck, so the thread grabs the loop thread's current stack (the
+    blocking call and the coroutine that made it) and logs it once per stall.
+    The stall's duration is recorded in metrics by the heartbeat when the
+    loop comes back, so metric updates stay on the loop thread.
+    """
+
+    def __init__(self, threshold_ms: float = THRESHOLD_MS):
+        self.threshold = threshold_ms / 1000
+        self.interval = self.threshold / 4
+        self._beat = 0.0
+        self._reported_beat = 0.0
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    async def _heartbeat(self):
+        while True:
+            before = time.monotonic()
+            self._beat = before
+            await asyncio.sleep(self.interval)
+            blocked = time.monotonic() - before - self.interval
+            if blocked >= self.threshold:
+                metrics.LOOP_STALLS.inc()
+                metrics.LOOP_STALL_DURATION.observe(blocked)
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat
+            if blocked < self.threshold or beat == self._reported_beat:
+                continue
+            self._reported_beat = beat
+            self._report(blocked)
+
+    def _loop_stack(self) -> List[str]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return []
+        return [
+            f"{f.filename}:{f.lineno} in {f.name}" + (f": {f.line}" if f.line else "")
+            for f in traceback.extract_stack(frame)[-_MAX_FRAMES:]
+        ]
+
+    def _report(self, blocked: float):
+        logger.warning(json.dumps({
+            "event": "loop_stall",
+            "blocked_ms": round(blocked * 1000, 1),
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "stack": self._loop_stack(),
+        }))
+
+    def start(self):
+        """Call from the event loop (startup hook)."""
+        if not self.enabled or (self._task is not None and not self._task.done()):
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+
+WATCHDOG = LoopWatchdog()
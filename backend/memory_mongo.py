@@ -0,0 +1,2101 @@
+import asyncio
+import bisect
+import functools
+import itertools
+import logging
+import math
+import re
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Deque, Dict, Iterable, List, Mapping, MutableMapping, Optional, Sequence, Tuple
+
+from bson import Decimal128, ObjectId, Regex
+from bson.errors import InvalidDocument
+from pymongo import DeleteMany, DeleteOne, IndexModel, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, InvalidOperation, OperationFailure
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+logger = logging.getLogger("memory_mongo")
+
+# In-memory stand-in for the Motor API the backend uses, for offline tests and
+# benchmarks. Documents are stored BSON-normalised (naive UTC datetimes with
+# millisecond precision, unencodable values rejected); indexes are sorted
+# key lists, so lookups by an indexed field cost O(log n) and unindexed
+# queries scan, like the real thing. Every command is reported to
+# pymongo-style CommandListeners (metrics, db_profiler, CommandCounter).
+#
+# Not emulated: transactions, sessions, change streams, positional ($, $[])
+# updates, update pipelines. Using them raises NotImplementedError rather
+# than silently diverging from MongoDB.
+
+_MISSING = object()
+
+
+# ==================== BSON VALUES ====================
+
+def _encode(value: Any) -> Any:
+    """Copy a value the way it would be stored: BSON types only, datetimes as naive UTC ms."""
+    if value is None or isinstance(value, (bool, str, ObjectId, bytes, Regex, Decimal128, re.Pattern)):
+        return value
+    if isinstance(value, int):
+        if not -(2 ** 63) <= value < 2 ** 63:
+            raise OverflowError("MongoDB can only handle up to 8-byte ints")
+        return value
+    if isinstance(value, float):
+        return value
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    if isinstance(value, Mapping):
+        out = {}
+        for k, v in value.items():
+            if not isinstance(k, str):
+                raise InvalidDocument(f"documents must have only string keys, key was {k!r}")
+            out[k] = _encode(v)
+        return out
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    raise InvalidDocument(f"cannot encode object: {value!r}, of type: {type(value)!r}")
+
+
+def _decode(value: Any, tz_aware: bool) -> Any:
+    """Fresh copy of a stored value, as the driver would hand it back."""
+    if isinstance(value, dict):
+        return {k: _decode(v, tz_aware) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v, tz_aware) for v in value]
+    if tz_aware and isinstance(value, datetime):
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _copy(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+def _sort_key(value: Any) -> tuple:
+    """BSON comparison order: null < numbers < strings < objects < arrays < binary < ObjectId < bool < dates."""
+    if value is None or value is _MISSING:
+        return (1,)
+    if isinstance(value, bool):
+        return (8, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, Decimal128):
+        return (2, float(value.to_decimal()))
+    if isinstance(value, str):
+        return (3, value)
+    if isinstance(value, dict):
+        return (4, tuple((k, _sort_key(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return (5, tuple(_sort_key(v) for v in value))
+    if isinstance(value, bytes):
+        return (6, value)
+    if isinstance(value, ObjectId):
+        return (7, value.binary)
+    if isinstance(value, datetime):
+        return (9, value)
+    return (12, repr(value))
+
+
+_TYPE_ALIASES = {
+    1: "double", 2: "string", 3: "object", 4: "array", 5: "binData", 7: "objectId",
+    8: "bool", 9: "date", 10: "null", 11: "regex", 16: "int", 18: "long", 19: "decimal",
+}
+
+
+def _type_names(value: Any) -> Tuple[str, ...]:
+    if value is None:
+        return ("null",)
+    if isinstance(value, bool):
+        return ("bool",)
+    if isinstance(value, int):
+        return ("int", "long", "number") if -(2 ** 31) <= value < 2 ** 31 else ("long", "number")
+    if isinstance(value, float):
+        return ("double", "number")
+    if isinstance(value, Decimal128):
+        return ("decimal", "number")
+    if isinstance(value, str):
+        return ("string",)
+    if isinstance(value, dict):
+        return ("object",)
+    if isinstance(value, list):
+        return ("array",)
+    if isinstance(value, bytes):
+        return ("binData",)
+    if isinstance(value, ObjectId):
+        return ("objectId",)
+    if isinstance(value, datetime):
+        return ("date",)
+    if isinstance(value, (re.Pattern, Regex)):
+        return ("regex",)
+    return ()
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# ==================== PATHS ====================
+
+def _lookup(value: Any, parts: Sequence[str]) -> List[Any]:
+    """Values at a dotted path; arrays on the way fan out like MongoDB's query paths."""
+    for i, part in enumerate(parts):
+        if isinstance(value, dict):
+            if part not in value:
+                return [_MISSING]
+            value = value[part]
+        elif isinstance(value, list):
+            out = []
+            if part.isdigit() and int(part) < len(value):
+                out.extend(_lookup(value[int(part)], parts[i + 1:]))
+            for element in value:
+                if isinstance(element, dict):
+                    out.extend(v for v in _lookup(element, parts[i:]) if v is not _MISSING)
+            return out or [_MISSING]
+        else:
+            return [_MISSING]
+    return [value]
+
+
+def _expand(values: Iterable[Any]) -> Iterable[Any]:
+    # A query on an array field matches the array itself or any element
+    for value in values:
+        yield value
+        if isinstance(value, list):
+            yield from value
+
+
+def _get(doc: Any, parts: Sequence[str]) -> Any:
+    for part in parts:
+        if isinstance(doc, dict):
+            doc = doc.get(part, _MISSING)
+        elif isinstance(doc, list) and part.isdigit() and int(part) < len(doc):
+            doc = doc[int(part)]
+        else:
+            return _MISSING
+        if doc is _MISSING:
+            return _MISSING
+    return doc
+
+
+def _parent(doc: dict, parts: Sequence[str], create: bool) -> Any:
+    container: Any = doc
+    for i, part in enumerate(parts[:-1]):
+        if isinstance(container, list) and part.isdigit():
+            index = int(part)
+            if index >= len(container):
+                if not create:
+                    return None
+                container.extend([None] * (index + 1 - len(container)))
+            nxt = container[index]
+            if nxt is None and create:
+                nxt = container[index] = {}
+        elif isinstance(container, dict):
+            nxt = container.get(part)
+            if nxt is None:
+                if not create:
+                    return None
+                nxt = container[part] = {}
+        else:
+            return None
+        if not isinstance(nxt, (dict, list)):
+            if create:
+                raise OperationFailure(
+                    f"Cannot create field '{parts[i + 1]}' in element {{{part}: {nxt!r}}}", code=28)
+            return None
+        container = nxt
+    return container
+
+
+def _set_path(doc: dict, parts: Sequence[str], value: Any) -> None:
+    for part in parts:
+        if part == "$" or part.startswith("$["):
+            raise NotImplementedError("positional updates are not supported by the in-memory backend")
+    container = _parent(doc, parts, create=True)
+    key = parts[-1]
+    if isinstance(container, list):
+        index = int(key)
+        if index >= len(container):
+            container.extend([None] * (index + 1 - len(container)))
+        container[index] = value
+    else:
+        container[key] = value
+
+
+def _unset_path(doc: dict, parts: Sequence[str]) -> Any:
+    container = _parent(doc, parts, create=False)
+    key = parts[-1]
+    if isinstance(container, dict):
+        return container.pop(key, _MISSING)
+    if isinstance(container, list) and key.isdigit() and int(key) < len(container):
+        old, container[int(key)] = container[int(key)], None
+        return old
+    return _MISSING
+
+
+# ==================== QUERIES ====================
+
+_REGEX_FLAGS = {"i": re.IGNORECASE, "m": re.MULTILINE, "s": re.DOTALL, "x": re.VERBOSE}
+
+
+@functools.lru_cache(maxsize=512)
+def _compile(pattern: str, options: str) -> re.Pattern:
+    flags = 0
+    for option in options or "":
+        flags |= _REGEX_FLAGS.get(option, 0)
+    try:
+        return re.compile(pattern, flags)
+    except re.error as e:
+        raise OperationFailure(f"Regular expression is invalid: {e}", code=51091)
+
+
+def _regex(pattern: Any, options: str = "") -> re.Pattern:
+    if isinstance(pattern, re.Pattern):
+        return _compile(pattern.pattern, options) if options else pattern
+    if isinstance(pattern, Regex):
+        return pattern.try_compile()
+    return _compile(str(pattern), options)
+
+
+def _regex_any(values: List[Any], pattern: Any, options: str = "") -> bool:
+    compiled = _regex(pattern, options)
+    return any(isinstance(v, str) and compiled.search(v) is not None for v in _expand(values))
+
+
+def _eq_any(values: List[Any], expected: Any) -> bool:
+    if isinstance(expected, (re.Pattern, Regex)):
+        return _regex_any(values, expected)
+    key = _sort_key(expected)
+    return any(_sort_key(v) == key for v in _expand(values))
+
+
+def _is_operator_doc(cond: Any) -> bool:
+    return isinstance(cond, dict) and bool(cond) and all(k.startswith("$") for k in cond)
+
+
+def _compare(values: List[Any], arg: Any, accept: Callable[[tuple, tuple], bool]) -> bool:
+    # Comparisons only match within the same BSON type bracket
+    target = _sort_key(arg)
+    for value in _expand(values):
+        key = _sort_key(value)
+        if key[0] == target[0] and accept(key, target):
+            return True
+    return False
+
+
+def _operator(values: List[Any], op: str, arg: Any, cond: Mapping[str, Any]) -> bool:
+    if op == "$eq":
+        return _eq_any(values, arg)
+    if op == "$ne":
+        return not _eq_any(values, arg)
+    if op == "$gt":
+        return _compare(values, arg, lambda a, b: a > b)
+    if op == "$gte":
+        return _compare(values, arg, lambda a, b: a >= b)
+    if op == "$lt":
+        return _compare(values, arg, lambda a, b: a < b)
+    if op == "$lte":
+        return _compare(values, arg, lambda a, b: a <= b)
+    if op in ("$in", "$nin"):
+        if not isinstance(arg, list):
+            raise OperationFailure(f"{op} needs an array", code=2)
+        found = any(_eq_any(values, candidate) for candidate in arg)
+        return found if op == "$in" else not found
+    if op == "$exists":
+        return any(v is not _MISSING for v in values) == bool(arg)
+    if op == "$regex":
+        return _regex_any(values, arg, cond.get("$options", ""))
+    if op == "$options":
+        return True
+    if op == "$not":
+        if isinstance(arg, (re.Pattern, Regex)):
+            return not _regex_any(values, arg)
+        return not _match_condition(values, arg)
+    if op == "$size":
+        return any(isinstance(v, list) and len(v) == arg for v in values)
+    if op == "$all":
+        return bool(arg) and all(_eq_any(values, candidate) for candidate in arg)
+    if op == "$elemMatch":
+        for value in values:
+            if not isinstance(value, list):
+                continue
+            for element in value:
+                if _is_operator_doc(arg):
+                    if _match_condition([element], arg):
+                        return True
+                elif isinstance(element, dict) and _matches(element, arg):
+                    return True
+        return False
+    if op == "$type":
+        wanted = {_TYPE_ALIASES.get(t, t) for t in (arg if isinstance(arg, list) else [arg])}
+        return any(v is not _MISSING and wanted.intersection(_type_names(v)) for v in _expand(values))
+    if op == "$mod":
+        divisor, remainder = arg
+        return any(_is_number(v) and int(v) % divisor == remainder for v in _expand(values))
+    raise OperationFailure(f"unknown operator: {op}", code=2)
+
+
+def _match_condition(values: List[Any], cond: Any) -> bool:
+    if _is_operator_doc(cond):
+        return all(_operator(values, op, arg, cond) for op, arg in cond.items())
+    return _eq_any(values, cond)
+
+
+def _matches(doc: Mapping[str, Any], query: Optional[Mapping[str, Any]]) -> bool:
+    if not query:
+        return True
+    for key, cond in query.items():
+        if key == "$and":
+            ok = all(_matches(doc, sub) for sub in cond)
+        elif key == "$or":
+            ok = any(_matches(doc, sub) for sub in cond)
+        elif key == "$nor":
+            ok = not any(_matches(doc, sub) for sub in cond)
+        elif key == "$expr":
+            ok = _truthy(_evaluate(cond, doc))
+        elif key == "$comment":
+            ok = True
+        elif key.startswith("$"):
+            raise OperationFailure(f"unknown top level operator: {key}", code=2)
+        else:
+            ok = _match_condition(_lookup(doc, key.split(".")), cond)
+        if not ok:
+            return False
+    return True
+
+
+# ==================== PROJECTION / SORT ====================
+
+def _path_tree(paths: Iterable[str]) -> Dict[str, Any]:
+    tree: Dict[str, Any] = {}
+    for path in paths:
+        node = tree
+        parts = path.split(".")
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if node is True:
+                break
+        else:
+            node[parts[-1]] = True
+    return tree
+
+
+def _include(doc: Mapping[str, Any], tree: Mapping[str, Any]) -> Dict[str, Any]:
+    out = {}
+    for key, value in doc.items():
+        sub = tree.get(key)
+        if sub is None:
+            continue
+        if sub is True:
+            out[key] = value
+        elif isinstance(value, dict):
+            out[key] = _include(value, sub)
+        elif isinstance(value, list):
+            out[key] = [_include(v, sub) for v in value if isinstance(v, dict)]
+    return out
+
+
+def _exclude(doc: Mapping[str, Any], tree: Mapping[str, Any]) -> Dict[str, Any]:
+    out = {}
+    for key, value in doc.items():
+        sub = tree.get(key)
+        if sub is True:
+            continue
+        if sub is None:
+            out[key] = value
+        elif isinstance(value, dict):
+            out[key] = _exclude(value, sub)
+        elif isinstance(value, list):
+            out[key] = [_exclude(v, sub) if isinstance(v, dict) else v for v in value]
+        else:
+            out[key] = value
+    return out
+
+
+def _normalize_projection(projection: Any) -> Optional[Dict[str, Any]]:
+    if projection is None:
+        return None
+    if isinstance(projection, (list, tuple)):
+        return {field: 1 for field in projection}
+    return dict(projection)
+
+
+def _project(doc: Mapping[str, Any], projection: Optional[Mapping[str, Any]]) -> Dict[str, Any]:
+    if not projection:
+        return dict(doc)
+    keep_id = bool(projection.get("_id", 1))
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    for field, flag in fields.items():
+        if isinstance(flag, dict):
+            raise NotImplementedError(f"projection operator on {field!r} is not supported by the in-memory backend")
+    included = [k for k, v in fields.items() if v]
+    excluded = [k for k, v in fields.items() if not v]
+    if included and excluded:
+        raise OperationFailure(f"Cannot do exclusion on field {excluded[0]} in inclusion projection", code=31254)
+    if included:
+        tree = _path_tree(included + (["_id"] if keep_id else []))
+        return _include(doc, tree)
+    tree = _path_tree(excluded + ([] if keep_id else ["_id"]))
+    return _exclude(doc, tree)
+
+
+def _normalize_sort(key_or_list: Any, direction: Any = None) -> List[Tuple[str, int]]:
+    if key_or_list is None:
+        return []
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    if isinstance(key_or_list, Mapping):
+        return list(key_or_list.items())
+    return [(k, d) for k, d in key_or_list]
+
+
+def _sort_value(doc: Mapping[str, Any], parts: Sequence[str], direction: int) -> tuple:
+    keys = []
+    for value in _lookup(doc, parts):
+        if isinstance(value, list) and value:
+            keys.extend(_sort_key(v) for v in value)
+        else:
+            keys.append(_sort_key(value))
+    return min(keys) if direction > 0 else max(keys)
+
+
+def _sort_docs(docs: List[Any], spec: List[Tuple[str, int]], get: Callable[[Any], Mapping[str, Any]] = lambda d: d) -> None:
+    # Stable sorts from the least significant key up
+    for field, direction in reversed(spec):
+        parts = field.split(".")
+        docs.sort(key=lambda d: _sort_value(get(d), parts, direction), reverse=direction < 0)
+
+
+# ==================== UPDATES ====================
+
+def _inc(doc: dict, parts: List[str], amount: Any, path: str) -> None:
+    if not _is_number(amount):
+        raise OperationFailure(f"Cannot increment with non-numeric argument: {{{path}: {amount!r}}}", code=14)
+    current = _get(doc, parts)
+    if current is _MISSING:
+        _set_path(doc, parts, amount)
+    elif not _is_number(current):
+        raise OperationFailure(f"Cannot apply $inc to a value of non-numeric type. {{{path}: {current!r}}}", code=14)
+    else:
+        _set_path(doc, parts, current + amount)
+
+
+def _mul(doc: dict, parts: List[str], factor: Any, path: str) -> None:
+    if not _is_number(factor):
+        raise OperationFailure(f"Cannot multiply with non-numeric argument: {{{path}: {factor!r}}}", code=14)
+    current = _get(doc, parts)
+    if current is _MISSING:
+        _set_path(doc, parts, 0 * factor)
+    elif not _is_number(current):
+        raise OperationFailure(f"Cannot apply $mul to a value of non-numeric type. {{{path}: {current!r}}}", code=14)
+    else:
+        _set_path(doc, parts, current * factor)
+
+
+def _array_at(doc: dict, parts: List[str], path: str, create: bool) -> Optional[list]:
+    current = _get(doc, parts)
+    if current is _MISSING:
+        if not create:
+            return None
+        current = []
+        _set_path(doc, parts, current)
+    if not isinstance(current, list):
+        raise OperationFailure(f"The field '{path}' must be an array but is of type {_type_names(current)[:1]}", code=2)
+    return current
+
+
+def _push(doc: dict, parts: List[str], value: Any, path: str) -> None:
+    array = _array_at(doc, parts, path, create=True)
+    if isinstance(value, dict) and "$each" in value:
+        items = list(value["$each"])
+        position = value.get("$position")
+        if position is None:
+            array.extend(items)
+        else:
+            array[position:position] = items
+        if "$sort" in value:
+            spec = value["$sort"]
+            if isinstance(spec, dict):
+                _sort_docs(array, list(spec.items()))
+            else:
+                array.sort(key=_sort_key, reverse=spec < 0)
+        if "$slice" in value:
+            n = value["$slice"]
+            array[:] = array[:n] if n >= 0 else array[n:]
+    else:
+        array.append(value)
+
+
+def _add_to_set(doc: dict, parts: List[str], value: Any, path: str) -> None:
+    array = _array_at(doc, parts, path, create=True)
+    items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+    for item in items:
+        if not any(_sort_key(existing) == _sort_key(item) for existing in array):
+            array.append(item)
+
+
+def _pull(doc: dict, parts: List[str], cond: Any, path: str) -> None:
+    array = _array_at(doc, parts, path, create=False)
+    if array is None:
+        return
+    if _is_operator_doc(cond):
+        keep = [v for v in array if not _match_condition([v], cond)]
+    elif isinstance(cond, dict):
+        keep = [v for v in array if not (isinstance(v, dict) and _matches(v, cond))]
+    else:
+        keep = [v for v in array if _sort_key(v) != _sort_key(cond)]
+    array[:] = keep
+
+
+def _pull_all(doc: dict, parts: List[str], values: Any, path: str) -> None:
+    array = _array_at(doc, parts, path, create=False)
+    if array is not None:
+        drop = {_sort_key(v) for v in values}
+        array[:] = [v for v in array if _sort_key(v) not in drop]
+
+
+def _pop(doc: dict, parts: List[str], end: Any, path: str) -> None:
+    array = _array_at(doc, parts, path, create=False)
+    if array:
+        array.pop(0 if end < 0 else -1)
+
+
+def _min_max(keep_smaller: bool):
+    def apply(doc: dict, parts: List[str], value: Any, path: str) -> None:
+        current = _get(doc, parts)
+        if current is _MISSING or (_sort_key(value) < _sort_key(current)) == keep_smaller and _sort_key(value) != _sort_key(current):
+            _set_path(doc, parts, value)
+    return apply
+
+
+def _current_date(doc: dict, parts: List[str], spec: Any, path: str) -> None:
+    if isinstance(spec, dict) and spec.get("$type") == "timestamp":
+        raise NotImplementedError("$currentDate timestamps are not supported by the in-memory backend")
+    _set_path(doc, parts, _encode(datetime.now(timezone.utc)))
+
+
+def _rename(doc: dict, parts: List[str], target: str, path: str) -> None:
+    value = _unset_path(doc, parts)
+    if value is not _MISSING:
+        _set_path(doc, target.split("."), value)
+
+
+_UPDATE_OPERATORS: Dict[str, Callable[[dict, List[str], Any, str], None]] = {
+    "$set": lambda doc, parts, value, _path: _set_path(doc, parts, value),
+    "$setOnInsert": lambda doc, parts, value, _path: _set_path(doc, parts, value),
+    "$unset": lambda doc, parts, _value, _path: _unset_path(doc, parts),
+    "$inc": _inc,
+    "$mul": _mul,
+    "$min": _min_max(keep_smaller=True),
+    "$max": _min_max(keep_smaller=False),
+    "$push": _push,
+    "$addToSet": _add_to_set,
+    "$pull": _pull,
+    "$pullAll": _pull_all,
+    "$pop": _pop,
+    "$rename": _rename,
+    "$currentDate": _current_date,
+}
+
+
+def _validate_update(update: Any) -> None:
+    if isinstance(update, list):
+        raise NotImplementedError("update pipelines are not supported by the in-memory backend")
+    if not isinstance(update, Mapping) or not update:
+        raise ValueError("update cannot be empty")
+    if not next(iter(update)).startswith("$"):
+        raise ValueError("update only works with $ operators")
+
+
+def _apply_update(doc: dict, update: Mapping[str, Any], inserting: bool) -> None:
+    for op, fields in update.items():
+        handler = _UPDATE_OPERATORS.get(op)
+        if handler is None:
+            raise OperationFailure(f"Unknown modifier: {op}. Expected a valid update modifier", code=9)
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for path, value in fields.items():
+            handler(doc, path.split("."), _copy(value), path)
+
+
+def _upsert_seed(query: Mapping[str, Any]) -> dict:
+    """Equality fields of a filter become the base of an upserted document."""
+    doc: dict = {}
+    for key, cond in query.items():
+        if key == "$and":
+            for sub in cond:
+                for k, v in _upsert_seed(sub).items():
+                    doc[k] = v
+        elif key.startswith("$"):
+            continue
+        elif _is_operator_doc(cond):
+            if "$eq" in cond:
+                _set_path(doc, key.split("."), _copy(cond["$eq"]))
+        elif not isinstance(cond, (re.Pattern, Regex)):
+            _set_path(doc, key.split("."), _copy(cond))
+    return doc
+
+
+# ==================== AGGREGATION EXPRESSIONS ====================
+
+def _truthy(value: Any) -> bool:
+    return value is not None and value is not _MISSING and value is not False and not (_is_number(value) and value == 0)
+
+
+def _field_path(doc: Any, parts: Sequence[str]) -> Any:
+    for i, part in enumerate(parts):
+        if isinstance(doc, dict):
+            doc = doc.get(part, _MISSING)
+            if doc is _MISSING:
+                return _MISSING
+        elif isinstance(doc, list):
+            values = [_field_path(v, parts[i:]) for v in doc if isinstance(v, dict)]
+            return [v for v in values if v is not _MISSING]
+        else:
+            return _MISSING
+    return doc
+
+
+def _numbers(values: Iterable[Any]) -> List[Any]:
+    return [v for v in values if _is_number(v)]
+
+
+def _arith(op: str, args: List[Any]) -> Any:
+    if any(a is None or a is _MISSING for a in args):
+        return None
+    if op == "$add":
+        dates = [a for a in args if isinstance(a, datetime)]
+        total = sum(a for a in args if not isinstance(a, datetime))
+        return dates[0] + timedelta(milliseconds=total) if dates else total
+    if op == "$subtract":
+        a, b = args
+        if isinstance(a, datetime) and isinstance(b, datetime):
+            return int((a - b).total_seconds() * 1000)
+        if isinstance(a, datetime):
+            return a - timedelta(milliseconds=b)
+        return a - b
+    if op == "$multiply":
+        return functools.reduce(lambda x, y: x * y, args, 1)
+    if op == "$divide":
+        if args[1] == 0:
+            raise OperationFailure("can't $divide by zero", code=2)
+        return args[0] / args[1]
+    if op == "$mod":
+        return math.fmod(args[0], args[1]) if isinstance(args[0], float) or isinstance(args[1], float) else args[0] % args[1]
+    raise OperationFailure(f"Unrecognized expression '{op}'", code=168)
+
+
+def _args(arg: Any, doc: Any) -> List[Any]:
+    return [_evaluate(a, doc) for a in arg] if isinstance(arg, list) else [_evaluate(arg, doc)]
+
+
+def _evaluate(expr: Any, doc: Any) -> Any:
+    if isinstance(expr, str) and expr.startswith("$$"):
+        name, _, rest = expr[2:].partition(".")
+        if name == "ROOT" or name == "CURRENT":
+            return _field_path(doc, rest.split(".")) if rest else doc
+        if name == "NOW":
+            return _encode(datetime.now(timezone.utc))
+        raise NotImplementedError(f"aggregation variable $${name} is not supported by the in-memory backend")
+    if isinstance(expr, str) and expr.startswith("$"):
+        return _field_path(doc, expr[1:].split("."))
+    if isinstance(expr, list):
+        return [_evaluate(e, doc) for e in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if len(expr) != 1 or not next(iter(expr)).startswith("$"):
+        out = {}
+        for key, sub in expr.items():
+            value = _evaluate(sub, doc)
+            if value is not _MISSING:
+                out[key] = value
+        return out
+
+    op, arg = next(iter(expr.items()))
+    if op == "$literal":
+        return arg
+    if op in ("$add", "$subtract", "$multiply", "$divide", "$mod"):
+        return _arith(op, _args(arg, doc))
+    if op in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$cmp"):
+        a, b = (_sort_key(v) for v in _args(arg, doc))
+        return {
+            "$eq": a == b, "$ne": a != b, "$gt": a > b, "$gte": a >= b, "$lt": a < b, "$lte": a <= b,
+            "$cmp": (a > b) - (a < b),
+        }[op]
+    if op == "$and":
+        return all(_truthy(v) for v in _args(arg, doc))
+    if op == "$or":
+        return any(_truthy(v) for v in _args(arg, doc))
+    if op == "$not":
+        return not _truthy(_args(arg, doc)[0])
+    if op == "$cond":
+        if isinstance(arg, dict):
+            test, then, otherwise = arg["if"], arg["then"], arg["else"]
+        else:
+            test, then, otherwise = arg
+        return _evaluate(then if _truthy(_evaluate(test, doc)) else otherwise, doc)
+    if op == "$ifNull":
+        values = _args(arg, doc)
+        for value in values[:-1]:
+            if value is not None and value is not _MISSING:
+                return value
+        return values[-1]
+    if op in ("$sum", "$avg", "$min", "$max"):
+        values = _args(arg, doc)
+        if len(values) == 1 and isinstance(values[0], list):
+            values = values[0]
+        if op == "$sum":
+            return sum(_numbers(values))
+        if op == "$avg":
+            nums = _numbers(values)
+            return sum(nums) / len(nums) if nums else None
+        present = [v for v in values if v is not None and v is not _MISSING]
+        if not present:
+            return None
+        return (min if op == "$min" else max)(present, key=_sort_key)
+    if op in ("$abs", "$floor", "$ceil"):
+        value = _args(arg, doc)[0]
+        if value is None or value is _MISSING:
+            return None
+        return {"$abs": abs, "$floor": math.floor, "$ceil": math.ceil}[op](value)
+    if op == "$round":
+        values = _args(arg, doc)
+        if values[0] is None or values[0] is _MISSING:
+            return None
+        return round(values[0], values[1] if len(values) > 1 else 0)
+    if op == "$size":
+        value = _args(arg, doc)[0]
+        if not isinstance(value, list):
+            raise OperationFailure("The argument to $size must be an array", code=17124)
+        return len(value)
+    if op == "$in":
+        needle, haystack = _args(arg, doc)
+        return any(_sort_key(needle) == _sort_key(v) for v in haystack or [])
+    if op == "$arrayElemAt":
+        array, index = _args(arg, doc)
+        try:
+            return array[index]
+        except (IndexError, TypeError):
+            return _MISSING
+    if op == "$concat":
+        values = _args(arg, doc)
+        if any(v is None or v is _MISSING for v in values):
+            return None
+        return "".join(values)
+    if op in ("$toLower", "$toUpper", "$toString"):
+        value = _args(arg, doc)[0]
+        if value is None or value is _MISSING:
+            return "" if op != "$toString" else None
+        text = value.isoformat() if isinstance(value, datetime) else str(value)
+        return {"$toLower": text.lower(), "$toUpper": text.upper(), "$toString": text}[op]
+    if op in ("$toInt", "$toLong", "$toDouble"):
+        value = _args(arg, doc)[0]
+        if value is None or value is _MISSING:
+            return None
+        return float(value) if op == "$toDouble" else int(value)
+    if op in ("$first", "$last"):
+        value = _args(arg, doc)[0]
+        if isinstance(value, list):
+            return (value[0] if op == "$first" else value[-1]) if value else _MISSING
+        return value
+    raise NotImplementedError(f"aggregation operator {op} is not supported by the in-memory backend")
+
+
+def _group(spec: Mapping[str, Any], docs: Iterable[Mapping[str, Any]]) -> List[Dict[str, Any]]:
+    groups: Dict[tuple, Dict[str, Any]] = {}
+    state: Dict[tuple, Dict[str, List[Any]]] = {}
+    for doc in docs:
+        group_id = _evaluate(spec["_id"], doc)
+        if group_id is _MISSING:
+            group_id = None
+        key = _sort_key(group_id)
+        if key not in groups:
+            groups[key] = {"_id": group_id}
+            state[key] = {field: [] for field in spec if field != "_id"}
+        for field, acc in spec.items():
+            if field == "_id":
+                continue
+            (op, arg), = acc.items()
+            state[key][field].append(_MISSING if op == "$count" else _evaluate(arg, doc))
+
+    out = []
+    for key, group in groups.items():
+        for field, acc in spec.items():
+            if field == "_id":
+                continue
+            op = next(iter(acc))
+            values = state[key][field]
+            present = [v for v in values if v is not _MISSING]
+            if op == "$sum":
+                group[field] = sum(_numbers(present))
+            elif op == "$count":
+                group[field] = len(values)
+            elif op == "$avg":
+                nums = _numbers(present)
+                group[field] = sum(nums) / len(nums) if nums else None
+            elif op in ("$min", "$max"):
+                present = [v for v in present if v is not None]
+                group[field] = (min if op == "$min" else max)(present, key=_sort_key) if present else None
+            elif op == "$first":
+                group[field] = values[0] if values and values[0] is not _MISSING else None
+            elif op == "$last":
+                group[field] = values[-1] if values and values[-1] is not _MISSING else None
+            elif op == "$push":
+                group[field] = present
+            elif op == "$addToSet":
+                seen: Dict[tuple, Any] = {}
+                for v in present:
+                    seen.setdefault(_sort_key(v), v)
+                group[field] = list(seen.values())
+            else:
+                raise NotImplementedError(f"accumulator {op} is not supported by the in-memory backend")
+        out.append(group)
+    return out
+
+
+# ==================== INDEXES ====================
+
+class _Index:
+    """A sorted list of (key tuple, rowid): equality and range scans by bisect."""
+
+    def __init__(self, name: str, keys: List[Tuple[str, Any]], unique: bool = False, sparse: bool = False,
+                 partial: Optional[Mapping[str, Any]] = None, ttl: Optional[float] = None):
+        self.name = name
+        self.keys = keys
+        self.fields = [field for field, _ in keys]
+        self._parts = [field.split(".") for field in self.fields]
+        self.unique = unique
+        self.sparse = sparse
+        self.partial = partial
+        self.ttl = ttl
+        self.entries: List[Tuple[tuple, int]] = []
+
+    def info(self) -> Dict[str, Any]:
+        info: Dict[str, Any] = {"v": 2, "key": list(self.keys)}
+        if self.unique:
+            info["unique"] = True
+        if self.sparse:
+            info["sparse"] = True
+        if self.partial is not None:
+            info["partialFilterExpression"] = self.partial
+        if self.ttl is not None:
+            info["expireAfterSeconds"] = self.ttl
+        return info
+
+    def same_options(self, other: "_Index") -> bool:
+        return (self.keys, self.unique, self.sparse, self.partial, self.ttl) == (
+            other.keys, other.unique, other.sparse, other.partial, other.ttl)
+
+    def keys_for(self, doc: Mapping[str, Any]) -> List[tuple]:
+        if self.partial is not None and not _matches(doc, self.partial):
+            return []
+        per_field = []
+        present = False
+        for parts in self._parts:
+            values = []
+            for value in _lookup(doc, parts):
+                if value is not _MISSING:
+                    present = True
+                if isinstance(value, list) and value:
+                    values.extend(_sort_key(v) for v in value)  # multikey
+                else:
+                    values.append(_sort_key(value))
+            per_field.append(list(dict.fromkeys(values)))
+        if self.sparse and not present:
+            return []
+        return list(dict.fromkeys(itertools.product(*per_field)))
+
+    def holder(self, key: tuple) -> Optional[int]:
+        i = bisect.bisect_left(self.entries, (key,))
+        if i < len(self.entries) and self.entries[i][0] == key:
+            return self.entries[i][1]
+        return None
+
+    def conflict(self, key: tuple, rowid: int) -> bool:
+        i = bisect.bisect_left(self.entries, (key,))
+        while i < len(self.entries) and self.entries[i][0] == key:
+            if self.entries[i][1] != rowid:
+                return True
+            i += 1
+        return False
+
+    def add(self, keys: List[tuple], rowid: int) -> None:
+        for key in keys:
+            bisect.insort(self.entries, (key, rowid))
+
+    def remove(self, keys: List[tuple], rowid: int) -> None:
+        for key in keys:
+            i = bisect.bisect_left(self.entries, (key, rowid))
+            if i < len(self.entries) and self.entries[i] == (key, rowid):
+                del self.entries[i]
+
+    def scan(self, prefixes: List[tuple], bounds: Optional[Tuple[Any, ...]]) -> Tuple[List[int], int]:
+        """Rowids whose keys start with one of `prefixes` (then fall within `bounds`), and keys examined."""
+        rowids: Dict[int, None] = {}
+        examined = 0
+        for prefix in prefixes:
+            n = len(prefix)
+            start: tuple = prefix
+            low = high = None
+            if bounds is not None:
+                low, low_inclusive, high, high_inclusive, bracket = bounds
+                start = prefix + ((low,) if low is not None else ((bracket,),))
+            i = bisect.bisect_left(self.entries, (start,))
+            while i < len(self.entries):
+                key, rowid = self.entries[i]
+                i += 1
+                if key[:n] != prefix:
+                    break
+                examined += 1
+                if bounds is not None:
+                    value = key[n]
+                    if value[0] != bracket:
+                        if value[0] > bracket:
+                            break
+                        continue
+                    if low is not None and not low_inclusive and value == low:
+                        continue
+                    if high is not None and (value > high or (value == high and not high_inclusive)):
+                        break
+                rowids[rowid] = None
+        return list(rowids), examined
+
+
+def _index_name(keys: List[Tuple[str, Any]]) -> str:
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+def _normalize_keys(keys: Any) -> List[Tuple[str, Any]]:
+    if isinstance(keys, str):
+        return [(keys, 1)]
+    if isinstance(keys, Mapping):
+        return list(keys.items())
+    return [(key, 1) if isinstance(key, str) else (key[0], key[1]) for key in keys]
+
+
+def _equality_keys(cond: Any) -> Optional[List[tuple]]:
+    if isinstance(cond, (re.Pattern, Regex, list)):
+        return None
+    if _is_operator_doc(cond):
+        if "$eq" in cond:
+            return _equality_keys(cond["$eq"])
+        if "$in" in cond and isinstance(cond["$in"], list):
+            if any(isinstance(v, (re.Pattern, Regex, list)) for v in cond["$in"]):
+                return None
+            return sorted({_sort_key(v) for v in cond["$in"]})
+        return None
+    return [_sort_key(cond)]
+
+
+def _range_bounds(cond: Any) -> Optional[Tuple[Any, ...]]:
+    if not _is_operator_doc(cond):
+        return None
+    low = high = None
+    low_inclusive = high_inclusive = True
+    bracket = None
+    for op, arg in cond.items():
+        if op not in ("$gt", "$gte", "$lt", "$lte"):
+            continue
+        key = _sort_key(arg)
+        if bracket is not None and key[0] != bracket:
+            return None
+        bracket = key[0]
+        if op in ("$gt", "$gte"):
+            low, low_inclusive = key, op == "$gte"
+        else:
+            high, high_inclusive = key, op == "$lte"
+    if bracket is None:
+        return None
+    return low, low_inclusive, high, high_inclusive, bracket
+
+
+def _implies(query: Mapping[str, Any], partial: Mapping[str, Any]) -> bool:
+    """Whether every document matching `query` is covered by a partial index's filter."""
+    for field, cond in partial.items():
+        if field.startswith("$"):
+            return False
+        given = query.get(field, _MISSING)
+        if given is _MISSING:
+            return False
+        if given == cond:
+            continue
+        if _is_operator_doc(given):
+            values = given.get("$in") if set(given) == {"$in"} else ([given["$eq"]] if set(given) == {"$eq"} else None)
+        else:
+            values = None if isinstance(given, (re.Pattern, Regex)) else [given]
+        if values is None or not all(_match_condition([v], cond) for v in values):
+            return False
+    return True
+
+
+class _Plan:
+    __slots__ = ("index", "prefixes", "bounds")
+
+    def __init__(self, index: _Index, prefixes: List[tuple], bounds: Optional[Tuple[Any, ...]]):
+        self.index = index
+        self.prefixes = prefixes
+        self.bounds = bounds
+
+
+# ==================== COLLECTIONS ====================
+
+class _Store:
+    """Documents and indexes of one collection, shared by its with_options() views."""
+
+    def __init__(self):
+        self.docs: Dict[int, dict] = {}
+        self.next_rowid = 0
+        self.indexes: Dict[str, _Index] = {"_id_": _Index("_id_", [("_id", 1)], unique=True)}
+
+
+class _CursorBase:
+    def __init__(self, collection: "MemoryCollection"):
+        self.collection = collection
+        self._buffer: Optional[Deque[Dict[str, Any]]] = None
+        self._closed = False
+
+    async def _fetch(self) -> Deque[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def _ensure(self) -> Deque[Dict[str, Any]]:
+        if self._buffer is None:
+            self._buffer = deque(await self._fetch())
+        return self._buffer
+
+    @property
+    def alive(self) -> bool:
+        return not self._closed and (self._buffer is None or bool(self._buffer))
+
+    async def to_list(self, length: Optional[int]) -> List[Dict[str, Any]]:
+        if length is not None:
+            if not isinstance(length, int):
+                raise TypeError(f"length must be an int, not {length!r}")
+            if length < 0:
+                raise ValueError("length must be non-negative")
+        if self._closed:
+            return []
+        buffer = await self._ensure()
+        n = len(buffer) if length is None else min(length, len(buffer))
+        return [buffer.popleft() for _ in range(n)]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        buffer = await self._ensure()
+        if self._closed or not buffer:
+            raise StopAsyncIteration
+        return buffer.popleft()
+
+    async def next(self) -> Dict[str, Any]:
+        return await self.__anext__()
+
+    async def close(self) -> None:
+        self._closed = True
+
+    def batch_size(self, _n: int):
+        return self
+
+
+class MemoryCursor(_CursorBase):
+    """find() cursor: chain sort/skip/limit before the first fetch, as with Motor."""
+
+    def __init__(self, collection: "MemoryCollection", filter: Optional[Mapping[str, Any]] = None,
+                 projection: Any = None, skip: int = 0, limit: int = 0, sort: Any = None, hint: Any = None, **_options: Any):
+        super().__init__(collection)
+        self._filter = dict(filter or {})
+        self._projection = _normalize_projection(projection)
+        self._skip = skip
+        self._limit = limit
+        self._sort = _normalize_sort(sort)
+        self._hint = hint
+
+    def _check_unstarted(self) -> None:
+        if self._buffer is not None:
+            raise InvalidOperation("cannot set options after executing query")
+
+    def sort(self, key_or_list: Any, direction: Any = None) -> "MemoryCursor":
+        self._check_unstarted()
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int) -> "MemoryCursor":
+        if not isinstance(skip, int):
+            raise TypeError("skip must be an integer")
+        if skip < 0:
+            raise ValueError("skip must be >= 0")
+        self._check_unstarted()
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int) -> "MemoryCursor":
+        if not isinstance(limit, int):
+            raise TypeError("limit must be an integer")
+        self._check_unstarted()
+        self._limit = limit
+        return self
+
+    def hint(self, index: Any) -> "MemoryCursor":
+        self._check_unstarted()
+        self._hint = index
+        return self
+
+    def max_time_ms(self, _ms: Optional[int]) -> "MemoryCursor":
+        return self
+
+    def collation(self, _collation: Any) -> "MemoryCursor":
+        raise NotImplementedError("collations are not supported by the in-memory backend")
+
+    def clone(self) -> "MemoryCursor":
+        return MemoryCursor(self.collection, self._filter, self._projection, self._skip, self._limit, self._sort, self._hint)
+
+    def _command(self) -> Dict[str, Any]:
+        command: Dict[str, Any] = {"find": self.collection.name, "filter": self._filter}
+        if self._projection:
+            command["projection"] = self._projection
+        if self._sort:
+            command["sort"] = dict(self._sort)
+        if self._skip:
+            command["skip"] = self._skip
+        if self._limit:
+            command["limit"] = abs(self._limit)
+        if self._hint is not None:
+            command["hint"] = self._hint
+        return command
+
+    async def _fetch(self) -> List[Dict[str, Any]]:
+        return await self.collection._command(self._command(), lambda: self.collection._find(
+            self._filter, self._projection, self._sort, self._skip, abs(self._limit), self._hint))
+
+    async def explain(self) -> Dict[str, Any]:
+        """Winning plan and execution stats, in the shape of MongoDB's explain output."""
+        _, stats = self.collection._find(self._filter, self._projection, self._sort, self._skip, abs(self._limit), self._hint)
+        stage = {"stage": "IXSCAN", "indexName": stats["index"]} if stats["index"] else {"stage": "COLLSCAN"}
+        return {
+            "queryPlanner": {"namespace": self.collection.full_name, "winningPlan": stage},
+            "executionStats": {
+                "nReturned": stats["nReturned"],
+                "totalKeysExamined": stats["keysExamined"],
+                "totalDocsExamined": stats["docsExamined"],
+            },
+        }
+
+
+class MemoryCommandCursor(_CursorBase):
+    """aggregate() / list_indexes() cursor."""
+
+    def __init__(self, collection: "MemoryCollection", command: Dict[str, Any], execute: Callable[[], Any]):
+        super().__init__(collection)
+        self._command_doc = command
+        self._execute = execute
+
+    async def _fetch(self) -> List[Dict[str, Any]]:
+        return await self.collection._command(self._command_doc, self._execute)
+
+
+class MemoryCollection:
+    """
+    Motor-compatible collection over an in-memory _Store.
+
+    preload()/documents are synchronous helpers for fixtures and assertions;
+    everything else mirrors AsyncIOMotorCollection and reports a command.
+    """
+
+    def __init__(self, database: "MemoryDatabase", name: str, store: _Store, options: Optional[Dict[str, Any]] = None):
+        self.database = database
+        self.name = name
+        self._store = store
+        self._options = options or {}
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.database.name}.{self.name}"
+
+    def __repr__(self) -> str:
+        return f"MemoryCollection({self.full_name!r})"
+
+    def with_options(self, **options: Any) -> "MemoryCollection":
+        return MemoryCollection(self.database, self.name, self._store, {**self._options, **{k: v for k, v in options.items() if v is not None}})
+
+    @property
+    def write_concern(self) -> Any:
+        return self._options.get("write_concern")
+
+    @property
+    def read_preference(self) -> Any:
+        return self._options.get("read_preference")
+
+    # ---------- fixtures ----------
+
+    def preload(self, documents: Iterable[Mapping[str, Any]]) -> None:
+        """Insert documents synchronously without recording commands (test and benchmark setup)."""
+        for document in documents:
+            doc = _encode(document)
+            doc.setdefault("_id", ObjectId())
+            self._insert(doc)
+
+    @property
+    def documents(self) -> List[Dict[str, Any]]:
+        """Copies of the stored documents in natural (insertion) order."""
+        return [_decode(doc, self.database.client.tz_aware) for doc in self._store.docs.values()]
+
+    # ---------- plumbing ----------
+
+    async def _command(self, command: Dict[str, Any], execute: Callable[[], Any]) -> Any:
+        name = next(iter(command))
+        if name in CommandCounter.WRITES and self.write_concern is not None and not self.write_concern.is_server_default:
+            command["writeConcern"] = self.write_concern.document
+        if self.read_preference is not None and self.read_preference.mode:
+            command["$readPreference"] = self.read_preference.document
+        return await self.database._command(command, execute, self._expire)
+
+    def _expire(self) -> None:
+        # TTL indexes: documents are removed on the next command rather than by a 60s monitor
+        for index in self._store.indexes.values():
+            if index.ttl is None:
+                continue
+            cutoff = _sort_key(_encode(datetime.now(timezone.utc) - timedelta(seconds=index.ttl)))
+            expired = []
+            for key, rowid in index.entries:
+                value = key[0]
+                if value[0] < 9:
+                    continue
+                if value[0] > 9 or value >= cutoff:
+                    break
+                expired.append(rowid)
+            for rowid in dict.fromkeys(expired):
+                if rowid in self._store.docs:
+                    self._remove(rowid)
+
+    def _key_error(self, index: _Index, doc: Mapping[str, Any]) -> Dict[str, Any]:
+        key_value = {field: _decode(next(iter(_lookup(doc, field.split("."))), None), self.database.client.tz_aware)
+                     for field in index.fields}
+        key_value = {k: (None if v is _MISSING else v) for k, v in key_value.items()}
+        shown = ", ".join(f"{k}: {v!r}" for k, v in key_value.items())
+        return {
+            "code": 11000,
+            "errmsg": f"E11000 duplicate key error collection: {self.full_name} index: {index.name} dup key: {{ {shown} }}",
+            "keyPattern": dict(index.keys),
+            "keyValue": key_value,
+        }
+
+    def _check_unique(self, doc: Mapping[str, Any], rowid: int) -> Dict[_Index, List[tuple]]:
+        keys = {}
+        for index in self._store.indexes.values():
+            index_keys = index.keys_for(doc)
+            if index.unique:
+                for key in index_keys:
+                    if index.conflict(key, rowid):
+                        details = self._key_error(index, doc)
+                        raise DuplicateKeyError(details["errmsg"], 11000, details)
+            keys[index] = index_keys
+        return keys
+
+    def _insert(self, doc: dict) -> None:
+        rowid = self._store.next_rowid
+        keys = self._check_unique(doc, rowid)
+        self._store.next_rowid += 1
+        self._store.docs[rowid] = doc
+        for index, index_keys in keys.items():
+            index.add(index_keys, rowid)
+
+    def _replace(self, rowid: int, old: dict, new: dict) -> None:
+        if _sort_key(new.get("_id")) != _sort_key(old.get("_id")):
+            raise OperationFailure("Performing an update on the path '_id' would modify the immutable field '_id'", code=66)
+        keys = self._check_unique(new, rowid)
+        for index, index_keys in keys.items():
+            old_keys = index.keys_for(old)
+            if old_keys != index_keys:
+                index.remove(old_keys, rowid)
+                index.add(index_keys, rowid)
+        self._store.docs[rowid] = new
+
+    def _remove(self, rowid: int) -> None:
+        doc = self._store.docs.pop(rowid)
+        for index in self._store.indexes.values():
+            index.remove(index.keys_for(doc), rowid)
+
+    def _plan(self, query: Mapping[str, Any], hint: Any = None) -> Optional[_Plan]:
+        equalities: Dict[str, List[tuple]] = {}
+        ranges: Dict[str, Tuple[Any, ...]] = {}
+        for field, cond in query.items():
+            if field.startswith("$"):
+                continue
+            keys = _equality_keys(cond)
+            if keys is not None:
+                equalities[field] = keys
+            else:
+                bounds = _range_bounds(cond)
+                if bounds is not None:
+                    ranges[field] = bounds
+
+        candidates = list(self._store.indexes.values())
+        if hint is not None:
+            name = hint if isinstance(hint, str) else _index_name(_normalize_keys(hint))
+            if name not in self._store.indexes:
+                raise OperationFailure("error processing query: planner returned error :: caused by :: hint provided does not correspond to an existing index", code=2)
+            candidates = [self._store.indexes[name]]
+
+        best = None
+        for index in candidates:
+            if index.partial is not None and not _implies(query, index.partial):
+                continue
+            if index.sparse and not all(f in equalities and (1,) not in equalities[f] for f in index.fields[:1]):
+                continue
+            n = 0
+            for field in index.fields:
+                if field not in equalities:
+                    break
+                n += 1
+            ranged = n < len(index.fields) and index.fields[n] in ranges
+            if not n and not ranged:
+                continue
+            score = (n + (0.5 if ranged else 0), index.unique and n == len(index.fields), -len(index.fields))
+            if best is None or score > best[0]:
+                best = (score, index, n, ranged)
+        if best is None:
+            return None
+        _, index, n, ranged = best
+        prefixes = list(itertools.product(*(equalities[f] for f in index.fields[:n])))
+        return _Plan(index, prefixes, ranges[index.fields[n]] if ranged else None)
+
+    def _select(self, query: Optional[Mapping[str, Any]], hint: Any = None) -> Tuple[List[Tuple[int, dict]], Dict[str, Any]]:
+        query = _encode(query or {})
+        plan = self._plan(query, hint)
+        if plan is None:
+            rowids: Iterable[int] = list(self._store.docs)
+            keys_examined = 0
+        else:
+            rowids, keys_examined = plan.index.scan(plan.prefixes, plan.bounds)
+        docs = self._store.docs
+        rows = []
+        examined = 0
+        for rowid in rowids:
+            doc = docs.get(rowid)
+            if doc is None:
+                continue
+            examined += 1
+            if _matches(doc, query):
+                rows.append((rowid, doc))
+        stats = {"index": plan.index.name if plan else None, "keysExamined": keys_examined, "docsExamined": examined}
+        return rows, stats
+
+    def _find(self, query, projection, sort, skip, limit, hint=None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        rows, stats = self._select(query, hint)
+        if sort:
+            _sort_docs(rows, sort, get=lambda row: row[1])
+        rows = rows[skip:]
+        if limit:
+            rows = rows[:limit]
+        tz_aware = self.database.client.tz_aware
+        docs = [_decode(_project(doc, projection), tz_aware) for _, doc in rows]
+        stats["nReturned"] = len(docs)
+        return docs, stats
+
+    def _update(self, query, update, upsert: bool, multi: bool, sort=None, replacement: bool = False) -> Dict[str, Any]:
+        rows, stats = self._select(query)
+        if sort:
+            _sort_docs(rows, _normalize_sort(sort), get=lambda row: row[1])
+        if not multi:
+            rows = rows[:1]
+        update = _encode(update)
+        modified = 0
+        for rowid, doc in rows:
+            if replacement:
+                new = {"_id": doc["_id"], **{k: v for k, v in update.items() if k != "_id"}}
+                if "_id" in update and _sort_key(update["_id"]) != _sort_key(doc["_id"]):
+                    new["_id"] = update["_id"]
+            else:
+                new = _copy(doc)
+                _apply_update(new, update, inserting=False)
+            if new != doc:
+                self._replace(rowid, doc, new)
+                modified += 1
+        raw: Dict[str, Any] = {"n": len(rows), "nModified": modified, "ok": 1.0, "plan": stats}
+        if not rows and upsert:
+            new = _upsert_seed(_encode(query or {}))
+            if replacement:
+                new = {**({"_id": new["_id"]} if "_id" in new else {}), **update}
+            else:
+                _apply_update(new, update, inserting=True)
+            new.setdefault("_id", ObjectId())
+            self._insert(new)
+            raw.update(n=1, upserted=new["_id"])
+        return raw
+
+    def _delete(self, query, multi: bool) -> Dict[str, Any]:
+        rows, stats = self._select(query)
+        if not multi:
+            rows = rows[:1]
+        for rowid, _ in rows:
+            self._remove(rowid)
+        return {"n": len(rows), "ok": 1.0, "plan": stats}
+
+    # ---------- reads ----------
+
+    def find(self, *args: Any, **kwargs: Any) -> MemoryCursor:
+        return MemoryCursor(self, *args, **kwargs)
+
+    async def find_one(self, filter: Any = None, *args: Any, **kwargs: Any) -> Optional[Dict[str, Any]]:
+        if filter is not None and not isinstance(filter, Mapping):
+            filter = {"_id": filter}
+        docs = await self.find(filter, *args, **kwargs).limit(1).to_list(1)
+        return docs[0] if docs else None
+
+    async def count_documents(self, filter: Mapping[str, Any], skip: int = 0, limit: int = 0, hint: Any = None, **_kwargs: Any) -> int:
+        pipeline: List[Dict[str, Any]] = [{"$match": filter}]
+        if skip:
+            pipeline.append({"$skip": skip})
+        if limit:
+            pipeline.append({"$limit": limit})
+        pipeline.append({"$group": {"_id": 1, "n": {"$sum": 1}}})
+
+        def execute():
+            rows, stats = self._select(filter, hint)
+            n = len(rows[skip:limit + skip if limit else None])
+            return n, stats
+
+        return await self._command({"aggregate": self.name, "pipeline": pipeline, "cursor": {}}, execute)
+
+    async def estimated_document_count(self, **_kwargs: Any) -> int:
+        return await self._command({"count": self.name}, lambda: len(self._store.docs))
+
+    async def distinct(self, key: str, filter: Optional[Mapping[str, Any]] = None, **_kwargs: Any) -> List[Any]:
+        def execute():
+            rows, stats = self._select(filter)
+            seen: Dict[tuple, Any] = {}
+            for _, doc in rows:
+                for value in _lookup(doc, key.split(".")):
+                    for v in (value if isinstance(value, list) else [value]):
+                        if v is not _MISSING:
+                            seen.setdefault(_sort_key(v), v)
+            return _decode(list(seen.values()), self.database.client.tz_aware), stats
+
+        return await self._command({"distinct": self.name, "key": key, "query": filter or {}}, execute)
+
+    def aggregate(self, pipeline: List[Mapping[str, Any]], **_kwargs: Any) -> MemoryCommandCursor:
+        def execute():
+            return self._aggregate(pipeline)
+        return MemoryCommandCursor(self, {"aggregate": self.name, "pipeline": pipeline, "cursor": {}}, execute)
+
+    def _aggregate(self, pipeline: List[Mapping[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        stages = list(pipeline)
+        stats: Dict[str, Any] = {"index": None, "keysExamined": 0, "docsExamined": 0}
+        if stages and "$match" in stages[0]:
+            rows, stats = self._select(stages.pop(0)["$match"])
+        else:
+            rows, _ = self._select({})
+            stats["docsExamined"] = len(rows)
+        docs = self._run_stages([doc for _, doc in rows], stages)
+        return _decode(docs, self.database.client.tz_aware), stats
+
+    def _run_stages(self, docs: List[Any], stages: Iterable[Mapping[str, Any]]) -> List[Any]:
+        for stage in stages:
+            (name, spec), = stage.items()
+            if name == "$match":
+                query = _encode(spec)
+                docs = [d for d in docs if _matches(d, query)]
+            elif name == "$group":
+                docs = _group(spec, docs)
+            elif name == "$facet":
+                docs = [{key: self._run_stages(list(docs), sub) for key, sub in spec.items()}]
+            elif name == "$sort":
+                docs = list(docs)
+                _sort_docs(docs, list(spec.items()))
+            elif name == "$skip":
+                docs = docs[spec:]
+            elif name == "$limit":
+                docs = docs[:spec]
+            elif name == "$count":
+                docs = [{spec: len(docs)}] if docs else []
+            elif name == "$project":
+                docs = [self._project_stage(d, spec) for d in docs]
+            elif name in ("$addFields", "$set"):
+                out = []
+                for d in docs:
+                    new = _copy(d)
+                    for field, expr in spec.items():
+                        value = _evaluate(expr, d)
+                        if value is not _MISSING:
+                            _set_path(new, field.split("."), value)
+                    out.append(new)
+                docs = out
+            elif name == "$unset":
+                fields = [spec] if isinstance(spec, str) else spec
+                docs = [_exclude(d, _path_tree(fields)) for d in docs]
+            elif name == "$unwind":
+                docs = self._unwind(docs, spec)
+            elif name in ("$replaceRoot", "$replaceWith"):
+                expr = spec["newRoot"] if name == "$replaceRoot" else spec
+                docs = [_evaluate(expr, d) for d in docs]
+            elif name == "$sortByCount":
+                docs = _group({"_id": spec, "count": {"$sum": 1}}, docs)
+                docs.sort(key=lambda d: d["count"], reverse=True)
+            elif name == "$lookup":
+                docs = self._lookup_stage(docs, spec)
+            else:
+                raise OperationFailure(f"Unrecognized pipeline stage name: '{name}'", code=40324)
+        return docs
+
+    def _project_stage(self, doc: Mapping[str, Any], spec: Mapping[str, Any]) -> Dict[str, Any]:
+        computed = {k: v for k, v in spec.items() if not isinstance(v, (bool, int))}
+        flags = {k: v for k, v in spec.items() if k not in computed}
+        if not computed:
+            return _project(doc, flags)
+        # Computed fields put $project in inclusion mode
+        included = [k for k, v in flags.items() if v and k != "_id"]
+        out = _include(doc, _path_tree(included + (["_id"] if flags.get("_id", 1) else [])))
+        for field, expr in computed.items():
+            value = _evaluate(expr, doc)
+            if value is not _MISSING:
+                _set_path(out, field.split("."), value)
+        return out
+
+    @staticmethod
+    def _unwind(docs: List[Any], spec: Any) -> List[Any]:
+        path = spec if isinstance(spec, str) else spec["path"]
+        preserve = isinstance(spec, dict) and spec.get("preserveNullAndEmptyArrays", False)
+        parts = path[1:].split(".")
+        out = []
+        for doc in docs:
+            value = _get(doc, parts)
+            if isinstance(value, list) and value:
+                for element in value:
+                    new = _copy(doc)
+                    _set_path(new, parts, element)
+                    out.append(new)
+            elif isinstance(value, list) or value is None or value is _MISSING:
+                if preserve:
+                    new = _copy(doc)
+                    if isinstance(value, list):
+                        _unset_path(new, parts)
+                    out.append(new)
+            else:
+                out.append(doc)
+        return out
+
+    def _lookup_stage(self, docs: List[Any], spec: Mapping[str, Any]) -> List[Any]:
+        if "pipeline" in spec:
+            raise NotImplementedError("$lookup pipelines are not supported by the in-memory backend")
+        foreign = self.database[spec["from"]]
+        out = []
+        for doc in docs:
+            local = _lookup(doc, spec["localField"].split("."))
+            values = [v for v in _expand(local) if not isinstance(v, list)]
+            query = {spec["foreignField"]: {"$in": [None if v is _MISSING else v for v in values]}}
+            rows, _ = foreign._select(query)
+            new = _copy(doc)
+            new[spec["as"]] = [_copy(d) for _, d in rows]
+            out.append(new)
+        return out
+
+    # ---------- writes ----------
+
+    async def insert_one(self, document: MutableMapping[str, Any], **_kwargs: Any) -> InsertOneResult:
+        if not isinstance(document, MutableMapping):
+            raise TypeError("document must be an instance of dict, bson.son.SON, or any other type that inherits from collections.MutableMapping")
+        if "_id" not in document:
+            document["_id"] = ObjectId()  # the driver adds _id to the caller's dict
+        doc = _encode(document)
+
+        def execute():
+            self._insert(doc)
+            return InsertOneResult(document["_id"], True)
+
+        return await self._command({"insert": self.name, "documents": [doc], "ordered": True}, execute)
+
+    async def insert_many(self, documents: Iterable[MutableMapping[str, Any]], ordered: bool = True, **_kwargs: Any) -> InsertManyResult:
+        documents = list(documents)
+        if not documents:
+            raise TypeError("documents must be a non-empty list")
+        for document in documents:
+            if "_id" not in document:
+                document["_id"] = ObjectId()
+        encoded = [_encode(d) for d in documents]
+
+        def execute():
+            errors = []
+            inserted = 0
+            for i, doc in enumerate(encoded):
+                try:
+                    self._insert(doc)
+                    inserted += 1
+                except DuplicateKeyError as e:
+                    errors.append({"index": i, **e.details, "op": doc})
+                    if ordered:
+                        break
+            if errors:
+                raise BulkWriteError(self._bulk_details(nInserted=inserted, writeErrors=errors))
+            return InsertManyResult([d["_id"] for d in documents], True)
+
+        return await self._command({"insert": self.name, "documents": encoded, "ordered": ordered}, execute)
+
+    @staticmethod
+    def _bulk_details(**counts: Any) -> Dict[str, Any]:
+        details = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+                   "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        details.update(counts)
+        return details
+
+    async def update_one(self, filter: Mapping[str, Any], update: Mapping[str, Any], upsert: bool = False, **_kwargs: Any) -> UpdateResult:
+        _validate_update(update)
+        return await self._write_update(filter, update, upsert, multi=False)
+
+    async def update_many(self, filter: Mapping[str, Any], update: Mapping[str, Any], upsert: bool = False, **_kwargs: Any) -> UpdateResult:
+        _validate_update(update)
+        return await self._write_update(filter, update, upsert, multi=True)
+
+    async def replace_one(self, filter: Mapping[str, Any], replacement: Mapping[str, Any], upsert: bool = False, **_kwargs: Any) -> UpdateResult:
+        if any(k.startswith("$") for k in replacement):
+            raise ValueError("replacement can not include $ operators")
+        return await self._write_update(filter, replacement, upsert, multi=False, replacement=True)
+
+    async def _write_update(self, filter, update, upsert, multi, replacement=False) -> UpdateResult:
+        command = {"update": self.name, "updates": [{"q": filter, "u": update, "upsert": upsert, "multi": multi}], "ordered": True}
+
+        def execute():
+            raw = self._update(filter, update, upsert, multi, replacement=replacement)
+            return UpdateResult(raw, True), raw["plan"]
+
+        return await self._command(command, execute)
+
+    async def delete_one(self, filter: Mapping[str, Any], **_kwargs: Any) -> DeleteResult:
+        return await self._write_delete(filter, multi=False)
+
+    async def delete_many(self, filter: Mapping[str, Any], **_kwargs: Any) -> DeleteResult:
+        return await self._write_delete(filter, multi=True)
+
+    async def _write_delete(self, filter, multi) -> DeleteResult:
+        command = {"delete": self.name, "deletes": [{"q": filter, "limit": 0 if multi else 1}], "ordered": True}
+
+        def execute():
+            raw = self._delete(filter, multi)
+            return DeleteResult(raw, True), raw["plan"]
+
+        return await self._command(command, execute)
+
+    async def _find_and_modify(self, filter, projection, sort, upsert, return_new, update=None, replacement=None, remove=False):
+        command: Dict[str, Any] = {"findAndModify": self.name, "query": filter}
+        if sort:
+            command["sort"] = dict(_normalize_sort(sort))
+        if remove:
+            command["remove"] = True
+        else:
+            command.update(update=update if update is not None else replacement, new=return_new, upsert=upsert)
+        projection = _normalize_projection(projection)
+
+        def execute():
+            rows, stats = self._select(filter)
+            if sort:
+                _sort_docs(rows, _normalize_sort(sort), get=lambda row: row[1])
+            tz_aware = self.database.client.tz_aware
+            if rows:
+                rowid, doc = rows[0]
+                if remove:
+                    self._remove(rowid)
+                    return _decode(_project(doc, projection), tz_aware), stats
+                if update is not None:
+                    new = _copy(doc)
+                    _apply_update(new, _encode(update), inserting=False)
+                else:
+                    new = {"_id": doc["_id"], **_encode(replacement)}
+                if new != doc:
+                    self._replace(rowid, doc, new)
+                return _decode(_project(new if return_new else doc, projection), tz_aware), stats
+            if not upsert or remove:
+                return None, stats
+            new = _upsert_seed(_encode(filter))
+            if update is not None:
+                _apply_update(new, _encode(update), inserting=True)
+            else:
+                new = {**({"_id": new["_id"]} if "_id" in new else {}), **_encode(replacement)}
+            new.setdefault("_id", ObjectId())
+            self._insert(new)
+            return (_decode(_project(new, projection), tz_aware) if return_new else None), stats
+
+        return await self._command(command, execute)
+
+    async def find_one_and_update(self, filter: Mapping[str, Any], update: Mapping[str, Any], projection: Any = None,
+                                  sort: Any = None, upsert: bool = False,
+                                  return_document: bool = ReturnDocument.BEFORE, **_kwargs: Any) -> Optional[Dict[str, Any]]:
+        _validate_update(update)
+        return await self._find_and_modify(filter, projection, sort, upsert, bool(return_document), update=update)
+
+    async def find_one_and_replace(self, filter: Mapping[str, Any], replacement: Mapping[str, Any], projection: Any = None,
+                                   sort: Any = None, upsert: bool = False,
+                                   return_document: bool = ReturnDocument.BEFORE, **_kwargs: Any) -> Optional[Dict[str, Any]]:
+        return await self._find_and_modify(filter, projection, sort, upsert, bool(return_document), replacement=replacement)
+
+    async def find_one_and_delete(self, filter: Mapping[str, Any], projection: Any = None, sort: Any = None,
+                                  **_kwargs: Any) -> Optional[Dict[str, Any]]:
+        return await self._find_and_modify(filter, projection, sort, False, False, remove=True)
+
+    async def bulk_write(self, requests: Sequence[Any], ordered: bool = True, **_kwargs: Any) -> BulkWriteResult:
+        requests = list(requests)
+        if not requests:
+            raise InvalidOperation("No operations to execute")
+        for request in requests:
+            if isinstance(request, (UpdateOne, UpdateMany)):
+                _validate_update(request._doc)
+            elif isinstance(request, InsertOne) and "_id" not in request._doc:
+                request._doc["_id"] = ObjectId()
+        totals = self._bulk_details()
+        # The driver sends each run of same-type operations as one command
+        for kind, group in itertools.groupby(enumerate(requests), key=lambda item: _bulk_kind(item[1])):
+            group = list(group)
+            command = {kind: self.name, "ordered": ordered, _BULK_FIELDS[kind]: [_bulk_spec(op) for _, op in group]}
+            stop = await self._command(command, functools.partial(self._bulk_group, group, ordered, totals))
+            if stop:
+                break
+        if totals["writeErrors"]:
+            raise BulkWriteError(totals)
+        return BulkWriteResult(totals, True)
+
+    def _bulk_group(self, group: List[Tuple[int, Any]], ordered: bool, totals: Dict[str, Any]) -> bool:
+        for index, op in group:
+            try:
+                if isinstance(op, InsertOne):
+                    self._insert(_encode(op._doc))
+                    totals["nInserted"] += 1
+                elif isinstance(op, (DeleteOne, DeleteMany)):
+                    totals["nRemoved"] += self._delete(op._filter, multi=isinstance(op, DeleteMany))["n"]
+                else:
+                    raw = self._update(op._filter, op._doc, bool(op._upsert), multi=isinstance(op, UpdateMany),
+                                       replacement=isinstance(op, ReplaceOne))
+                    if "upserted" in raw:
+                        totals["nUpserted"] += 1
+                        totals["upserted"].append({"index": index, "_id": raw["upserted"]})
+                    else:
+                        totals["nMatched"] += raw["n"]
+                        totals["nModified"] += raw["nModified"]
+            except DuplicateKeyError as e:
+                totals["writeErrors"].append({"index": index, **e.details, "op": _bulk_spec(op)})
+                if ordered:
+                    return True
+        return False
+
+    # ---------- indexes ----------
+
+    async def create_index(self, keys: Any, **kwargs: Any) -> str:
+        keys = _normalize_keys(keys)
+        index = _Index(
+            kwargs.get("name") or _index_name(keys),
+            keys,
+            unique=bool(kwargs.get("unique", False)),
+            sparse=bool(kwargs.get("sparse", False)),
+            partial=_encode(kwargs["partialFilterExpression"]) if kwargs.get("partialFilterExpression") else None,
+            ttl=kwargs.get("expireAfterSeconds"),
+        )
+        command = {"createIndexes": self.name, "indexes": [{"name": index.name, "key": dict(keys), **{
+            k: v for k, v in kwargs.items() if k not in ("name", "background")}}]}
+        return await self._command(command, lambda: self._build_index(index))
+
+    async def create_indexes(self, indexes: Sequence[IndexModel], **_kwargs: Any) -> List[str]:
+        names = []
+        for model in indexes:
+            document = dict(model.document)
+            keys = list(document.pop("key").items())
+            names.append(await self.create_index(keys, **document))
+        return names
+
+    def _build_index(self, index: _Index) -> str:
+        existing = self._store.indexes.get(index.name)
+        if existing is not None:
+            if existing.same_options(index):
+                return index.name
+            raise OperationFailure(f"An existing index has the same name as the requested index: {index.name}", code=86)
+        for other in self._store.indexes.values():
+            if other.keys == index.keys and other.partial == index.partial:
+                if other.same_options(index):
+                    return other.name
+                raise OperationFailure(f"Index already exists with a different name: {other.name}", code=85)
+        for rowid, doc in self._store.docs.items():
+            keys = index.keys_for(doc)
+            if index.unique:
+                for key in keys:
+                    if index.conflict(key, rowid):
+                        details = self._key_error(index, doc)
+                        raise DuplicateKeyError(details["errmsg"], 11000, details)
+            index.add(keys, rowid)
+        self._store.indexes[index.name] = index
+        return index.name
+
+    async def drop_index(self, index_or_name: Any, **_kwargs: Any) -> None:
+        name = index_or_name if isinstance(index_or_name, str) else _index_name(_normalize_keys(index_or_name))
+
+        def execute():
+            if name == "_id_":
+                raise OperationFailure("cannot drop _id index", code=72)
+            if self._store.indexes.pop(name, None) is None:
+                raise OperationFailure(f"index not found with name [{name}]", code=27)
+
+        await self._command({"dropIndexes": self.name, "index": name}, execute)
+
+    async def drop_indexes(self, **_kwargs: Any) -> None:
+        def execute():
+            for name in [n for n in self._store.indexes if n != "_id_"]:
+                del self._store.indexes[name]
+
+        await self._command({"dropIndexes": self.name, "index": "*"}, execute)
+
+    async def index_information(self, **_kwargs: Any) -> Dict[str, Dict[str, Any]]:
+        return await self._command({"listIndexes": self.name},
+                                   lambda: {name: index.info() for name, index in self._store.indexes.items()})
+
+    def list_indexes(self, **_kwargs: Any) -> MemoryCommandCursor:
+        return MemoryCommandCursor(self, {"listIndexes": self.name}, lambda: [
+            {"name": name, **{k: (dict(v) if k == "key" else v) for k, v in index.info().items()}}
+            for name, index in self._store.indexes.items()])
+
+    async def drop(self, **_kwargs: Any) -> None:
+        await self.database.drop_collection(self.name)
+
+
+def _bulk_kind(op: Any) -> str:
+    if isinstance(op, InsertOne):
+        return "insert"
+    if isinstance(op, (DeleteOne, DeleteMany)):
+        return "delete"
+    if isinstance(op, (UpdateOne, UpdateMany, ReplaceOne)):
+        return "update"
+    raise TypeError(f"{op!r} is not a valid request")
+
+
+_BULK_FIELDS = {"insert": "documents", "update": "updates", "delete": "deletes"}
+
+
+def _bulk_spec(op: Any) -> Dict[str, Any]:
+    if isinstance(op, InsertOne):
+        return op._doc
+    if isinstance(op, (DeleteOne, DeleteMany)):
+        return {"q": op._filter, "limit": 0 if isinstance(op, DeleteMany) else 1}
+    return {"q": op._filter, "u": op._doc, "upsert": bool(op._upsert), "multi": isinstance(op, UpdateMany)}
+
+
+# ==================== DATABASE / CLIENT ====================
+
+class MemoryDatabase:
+    def __init__(self, client: "MemoryClient", name: str):
+        self.client = client
+        self.name = name
+        self._stores: Dict[str, _Store] = {}
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __repr__(self) -> str:
+        return f"MemoryDatabase({self.name!r})"
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.get_collection(name)
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        return self.get_collection(name)
+
+    def get_collection(self, name: str, **options: Any) -> MemoryCollection:
+        store = self._stores.setdefault(name, _Store())
+        options = {k: v for k, v in options.items() if v is not None}
+        if options:
+            return MemoryCollection(self, name, store, options)
+        # One default view per collection, so tests can patch its methods
+        collection = self._collections.get(name)
+        if collection is None or collection._store is not store:
+            collection = self._collections[name] = MemoryCollection(self, name, store)
+        return collection
+
+    @property
+    def counter(self) -> "CommandCounter":
+        return self.client.counter
+
+    async def _command(self, command: Dict[str, Any], execute: Callable[[], Any], before: Optional[Callable[[], None]] = None) -> Any:
+        # Each command is a round trip: yield to the loop so concurrent requests interleave
+        await asyncio.sleep(0)
+        return self.client._execute(self.name, command, execute, before)
+
+    async def command(self, command: Any, value: Any = 1, **kwargs: Any) -> Dict[str, Any]:
+        name = command if isinstance(command, str) else next(iter(command))
+        doc = {name: value, **kwargs} if isinstance(command, str) else dict(command)
+
+        def execute():
+            if name in ("ping", "hello", "isMaster", "ismaster"):
+                return {"ok": 1.0} if name == "ping" else {"ok": 1.0, "isWritablePrimary": True, "ismaster": True}
+            if name == "buildInfo":
+                return {"ok": 1.0, "version": "7.0.0-memory"}
+            if name == "dbStats":
+                return {"ok": 1.0, "db": self.name, "collections": len(self._stores),
+                        "objects": sum(len(s.docs) for s in self._stores.values())}
+            raise OperationFailure(f"no such command: '{name}'", code=59)
+
+        return await self._command(doc, execute)
+
+    async def list_collection_names(self, **_kwargs: Any) -> List[str]:
+        return await self._command({"listCollections": 1, "nameOnly": True}, lambda: [n for n, s in self._stores.items()])
+
+    async def create_collection(self, name: str, **_kwargs: Any) -> MemoryCollection:
+        def execute():
+            if name in self._stores:
+                raise OperationFailure(f"Collection {self.name}.{name} already exists.", code=48)
+            self._stores[name] = _Store()
+
+        await self._command({"create": name}, execute)
+        return self.get_collection(name)
+
+    async def drop_collection(self, name_or_collection: Any, **_kwargs: Any) -> None:
+        name = name_or_collection if isinstance(name_or_collection, str) else name_or_collection.name
+        await self._command({"drop": name}, lambda: self._stores.pop(name, None) and None)
+
+
+class MemoryClient:
+    """
+    Drop-in for AsyncIOMotorClient in tests and in-process benchmarks.
+
+    `event_listeners` take the same pymongo CommandListeners as the real
+    client; `counter` always records every command (see CommandCounter).
+    """
+
+    def __init__(self, tz_aware: bool = True, event_listeners: Optional[Sequence[Any]] = None, **_options: Any):
+        self.tz_aware = tz_aware
+        self.counter = CommandCounter()
+        self._listeners = [self.counter] + [l for l in (event_listeners or []) if isinstance(l, monitoring.CommandListener)]
+        self._databases: Dict[str, MemoryDatabase] = {}
+        self._request_ids = itertools.count(1)
+        self.address = ("memory", 27017)
+
+    def __getattr__(self, name: str) -> MemoryDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.get_database(name)
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        return self.get_database(name)
+
+    def get_database(self, name: str, **_options: Any) -> MemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(self, name)
+        return self._databases[name]
+
+    async def list_database_names(self, **_kwargs: Any) -> List[str]:
+        return list(self._databases)
+
+    async def drop_database(self, name_or_database: Any, **_kwargs: Any) -> None:
+        name = name_or_database if isinstance(name_or_database, str) else name_or_database.name
+        self._databases.pop(name, None)
+
+    async def server_info(self) -> Dict[str, Any]:
+        return await self.admin.command("buildInfo")
+
+    def close(self) -> None:
+        pass
+
+    def _publish(self, method: str, event: Any) -> None:
+        for listener in self._listeners:
+            try:
+                getattr(listener, method)(event)
+            except Exception as e:
+                logger.error(f"Command listener {listener!r} failed: {e}")
+
+    def _execute(self, database: str, command: Dict[str, Any], execute: Callable[[], Any], before: Optional[Callable[[], None]]) -> Any:
+        request_id = next(self._request_ids)
+        name = next(iter(command))
+        self._publish("started", monitoring.CommandStartedEvent(command, database, request_id, self.address, request_id))
+        start = time.perf_counter()
+        try:
+            if before is not None:
+                before()
+            result = execute()
+        except Exception as e:
+            failure = {"ok": 0.0, "errmsg": str(e), "code": getattr(e, "code", None)}
+            self._publish("failed", monitoring.CommandFailedEvent(
+                timedelta(seconds=time.perf_counter() - start), failure, name, request_id, self.address, request_id))
+            raise
+        plan = None
+        if isinstance(result, tuple) and len(result) == 2 and (isinstance(result[1], dict) and "docsExamined" in result[1]):
+            result, plan = result
+        reply = {"ok": 1.0}
+        if plan is not None:
+            reply["plan"] = plan
+        self._publish("succeeded", monitoring.CommandSucceededEvent(
+            timedelta(seconds=time.perf_counter() - start), reply, name, request_id, self.address, request_id))
+        return result
+
+
+# ==================== COMMAND COUNTER ====================
+
+class RecordedCommand:
+    __slots__ = ("name", "database", "collection", "command", "duration_micros", "plan", "failed")
+
+    def __init__(self, name: str, database: str, command: Mapping[str, Any]):
+        self.name = name
+        self.database = database
+        target = command.get(name)
+        self.collection = target if isinstance(target, str) else None
+        self.command = command
+        self.duration_micros: Optional[int] = None
+        self.plan: Optional[Dict[str, Any]] = None
+        self.failed = False
+
+    def __repr__(self) -> str:
+        return f"<{self.name} {self.collection}>"
+
+
+class CommandCounter(monitoring.CommandListener):
+    """
+    Records every command a client runs, for assertions like "checkout issues
+    at most N queries". Also works as an event listener on a real client.
+    `plan` (index used, keys/docs examined) is only filled in by MemoryClient.
+    """
+
+    READS = frozenset({"find", "aggregate", "count", "distinct"})
+    WRITES = frozenset({"insert", "update", "delete", "findAndModify"})
+
+    def __init__(self):
+        self.commands: List[RecordedCommand] = []
+        self._pending: Dict[Tuple[Any, int], RecordedCommand] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        record = RecordedCommand(event.command_name, event.database_name, event.command)
+        self.commands.append(record)
+        self._pending[(event.connection_id, event.request_id)] = record
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        record = self._pending.pop((event.connection_id, event.request_id), None)
+        if record is not None:
+            record.duration_micros = event.duration_micros
+            reply = event.reply or {}
+            record.plan = reply.get("plan")
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        record = self._pending.pop((event.connection_id, event.request_id), None)
+        if record is not None:
+            record.duration_micros = event.duration_micros
+            record.failed = True
+
+    def reset(self) -> None:
+        self.commands.clear()
+        self._pending.clear()
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def filter(self, name: Any = None, collection: Optional[str] = None) -> List[RecordedCommand]:
+        names = {name} if isinstance(name, str) else (set(name) if name else None)
+        return [c for c in self.commands
+                if (names is None or c.name in names) and (collection is None or c.collection == collection)]
+
+    def count(self, name: Any = None, collection: Optional[str] = None) -> int:
+        return len(self.filter(name, collection))
+
+    @property
+    def reads(self) -> int:
+        return self.count(self.READS)
+
+    @property
+    def writes(self) -> int:
+        return self.count(self.WRITES)
@@ -0,0 +1,456 @@
+import asyncio
+import contextvars
+import math
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+QUANTILES = (0.5, 0.95, 0.99)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback: Optional[Callable[[], Dict[Labels, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    def value(self, *labels: str) -> float:
+        if self._callback is not None:
+            return self._callback().get(labels, 0.0)
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        values = self._callback() if self._callback is not None else self._values
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    """
+    Fixed-bucket histogram. Also renders a <name>_quantiles summary with
+    p50/p95/p99 estimated from the buckets (same interpolation as PromQL's
+    histogram_quantile), so slow routes are visible without a query layer.
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = LATENCY_BUCKETS, quantiles: bool = False):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.quantiles = quantiles
+        # labels -> [bucket counts..., +Inf count], sum
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self._counts.get(labels)
+        if counts is None:
+            counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+            self._sums[labels] = 0.0
+        i = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            i += 1
+        counts[i] += 1
+        self._sums[labels] += value
+
+    def count(self, *labels: str) -> int:
+        return sum(self._counts.get(labels, ()))
+
+    def quantile(self, q: float, *labels: str) -> float:
+        counts = self._counts.get(labels)
+        if not counts:
+            return math.nan
+        total = sum(counts)
+        rank = q * total
+        cumulative = 0
+        lower = 0.0
+        for i, bound in enumerate(self.buckets):
+            if cumulative + counts[i] >= rank:
+                if counts[i] == 0:
+                    return bound
+                return lower + (bound - lower) * (rank - cumulative) / counts[i]
+            cumulative += counts[i]
+            lower = bound
+        # Falls in +Inf bucket: report the highest finite bound
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = []
+        for labels, counts in self._counts.items():
+            cumulative = 0
+            for bound, c in zip(self.buckets + (math.inf,), counts):
+                cumulative += c
+                le = 'le="' + _fmt_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, labels)} {_fmt_value(self._sums[labels])}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+    def render_quantiles(self) -> List[str]:
+        name = f"{self.name}_quantiles"
+        lines = [f"# HELP {name} {self.documentation} (p50/p95/p99 estimated from buckets)", f"# TYPE {name} summary"]
+        for labels in self._counts:
+            for q in QUANTILES:
+                qlabel = f'quantile="{q}"'
+                lines.append(f"{name}{_fmt_labels(self.labelnames, labels, qlabel)} {_fmt_value(self.quantile(q, *labels))}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, fn: Callable[[], None]) -> None:
+        """fn runs before each scrape (e.g. to drain cross-thread buffers)."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            collect()
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+            if isinstance(metric, Histogram) and metric.quantiles:
+                lines.extend(metric.render_quantiles())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status")))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route"), quantiles=True))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled", ("route",)))
+
+MONGO_COMMANDS = REGISTRY.register(Counter(
+    "mongodb_commands_total", "MongoDB commands by name and outcome", ("command", "outcome")))
+MONGO_LATENCY = REGISTRY.register(Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ("command",), quantiles=True))
+MONGO_PER_REQUEST = REGISTRY.register(Histogram(
+    "mongodb_commands_per_request", "MongoDB commands issued per HTTP request", ("route",), buckets=COUNT_BUCKETS))
+MONGO_TIME_PER_REQUEST = REGISTRY.register(Histogram(
+    "mongodb_time_per_request_seconds", "Total MongoDB time per HTTP request", ("route",)))
+
+OUTBOUND_REQUESTS = REGISTRY.register(Counter(
+    "outbound_requests_total", "Outbound API calls by service, operation and outcome", ("service", "operation", "outcome")))
+OUTBOUND_LATENCY = REGISTRY.register(Histogram(
+    "outbound_request_duration_seconds", "Outbound API call latency", ("service", "operation"), quantiles=True))
+
+RATE_LIMIT_DECISIONS = REGISTRY.register(Counter(
+    "rate_limit_decisions_total", "Rate limiter decisions by rule (allowed, throttled, store_error)", ("rule", "decision")))
+
+IDEMPOTENCY_REQUESTS = REGISTRY.register(Counter(
+    "idempotency_requests_total", "Requests carrying an Idempotency-Key by outcome (executed, replayed, conflict, mismatch)", ("route", "outcome")))
+
+CHANGE_EVENTS = REGISTRY.register(Counter(
+    "change_events_total", "Change feed events by topic and stage (published, dropped, delivered)", ("topic", "stage")))
+
+LOOP_LAG = REGISTRY.register(Gauge(
+    "event_loop_lag_seconds", "Most recent event loop scheduling lag"))
+LOOP_LAG_HISTOGRAM = REGISTRY.register(Histogram(
+    "event_loop_lag_distribution_seconds", "Event loop scheduling lag", quantiles=True,
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)))
+LOOP_STALLS = REGISTRY.register(Counter(
+    "event_loop_stalls_total", "Times the event loop was blocked past the watchdog threshold"))
+LOOP_STALL_DURATION = REGISTRY.register(Histogram(
+    "event_loop_stall_duration_seconds", "How long the event loop stayed blocked",
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)))
+
+
+# ==================== MONGO COMMANDS ====================
+
+# The listener runs on Motor's executor threads. It only appends to deques
+# (atomic in CPython); the loop thread drains them after each request and on
+# scrape, so metric updates never take a lock.
+# (command, seconds, ok)
+_mongo_events: Deque[Tuple[str, float, bool]] = deque(maxlen=100_000)
+
+
+class CommandLog:
+    """
+    Mongo commands issued by one request: (command, seconds, ok, shape).
+    With a `describe` callable (the DB profiler's) each command also gets a
+    query shape, computed when it starts; describe returns None to skip one.
+    """
+
+    __slots__ = ("calls", "describe", "pending")
+
+    def __init__(self, describe: Optional[Callable[[str, Dict[str, Any]], Optional[str]]] = None):
+        # list.append is atomic, so no lock across driver threads
+        self.calls: List[Tuple[str, float, bool, Optional[str]]] = []
+        self.describe = describe
+        # (connection, driver request_id) -> shape, between started and succeeded/failed
+        self.pending: Dict[Tuple[Any, int], str] = {}
+
+
+# The one per-request tracker: MetricsRoute and the DB profiler share it.
+# Motor copies the context into its executor.
+_request_commands: contextvars.ContextVar[Optional[CommandLog]] = contextvars.ContextVar(
+    "request_mongo_commands", default=None)
+
+
+def current_commands() -> Optional[CommandLog]:
+    return _request_commands.get()
+
+
+def track_commands(log: CommandLog) -> contextvars.Token:
+    """Attribute commands issued in this context to `log`; pass the token to untrack_commands."""
+    return _request_commands.set(log)
+
+
+def untrack_commands(token: contextvars.Token) -> None:
+    _request_commands.reset(token)
+
+
+def drain_mongo_events() -> None:
+    pop = _mongo_events.popleft
+    while _mongo_events:
+        command, seconds, ok = pop()
+        MONGO_COMMANDS.inc(command, "success" if ok else "failure")
+        MONGO_LATENCY.observe(seconds, command)
+
+
+REGISTRY.add_collector(drain_mongo_events)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Records command counts/durations globally and for the current request."""
+
+    def started(self, event):
+        log = _request_commands.get()
+        if log is None or log.describe is None:
+            return
+        shape = log.describe(event.command_name, event.command)
+        if shape is not None:
+            log.pending[(event.connection_id, event.request_id)] = shape
+
+    def _record(self, event, ok: bool):
+        seconds = event.duration_micros / 1_000_000
+        _mongo_events.append((event.command_name, seconds, ok))
+        log = _request_commands.get()
+        if log is not None:
+            shape = log.pending.pop((event.connection_id, event.request_id), None) if log.pending else None
+            log.calls.append((event.command_name, seconds, ok, shape))
+
+    def succeeded(self, event):
+        self._record(event, True)
+
+    def failed(self, event):
+        self._record(event, False)
+
+
+MONGO_LISTENER = MongoCommandListener()
+
+
+# ==================== HTTP ROUTES ====================
+
+class MetricsRoute(APIRoute):
+    """
+    APIRoute that records latency, status and in-flight count under the route
+    template (e.g. /api/orders/{order_id}), so label cardinality stays bounded.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        route = self.path_format
+
+        async def timed_handler(request):
+            method = request.method
+            HTTP_IN_FLIGHT.inc(route)
+            # Reuse the profiler's log when it wraps this request; count only this handler's commands
+            log = _request_commands.get()
+            token = None
+            if log is None:
+                log = CommandLog()
+                token = _request_commands.set(log)
+            first = len(log.calls)
+            status = 500
+            start = time.perf_counter()
+            try:
+                response = await handler(request)
+                status = response.status_code
+                return response
+            except HTTPException as e:
+                status = e.status_code
+                raise
+            except RequestValidationError:
+                status = 422
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                if token is not None:
+                    _request_commands.reset(token)
+                commands = log.calls[first:]
+                HTTP_IN_FLIGHT.dec(route)
+                HTTP_REQUESTS.inc(method, route, str(status))
+                HTTP_LATENCY.observe(elapsed, method, route)
+                MONGO_PER_REQUEST.observe(len(commands), route)
+                MONGO_TIME_PER_REQUEST.observe(sum(c[1] for c in commands), route)
+                drain_mongo_events()
+
+        return timed_handler
+
+
+# ==================== OUTBOUND CALLS ====================
+
+# (service, operation, seconds, ok); outbound calls may run on worker threads
+_outbound_events: Deque[Tuple[str, str, float, bool]] = deque(maxlen=100_000)
+
+
+def drain_outbound_events() -> None:
+    pop = _outbound_events.popleft
+    while _outbound_events:
+        service, operation, seconds, ok = pop()
+        OUTBOUND_LATENCY.observe(seconds, service, operation)
+        OUTBOUND_REQUESTS.inc(service, operation, "ok" if ok else "error")
+
+
+REGISTRY.add_collector(drain_outbound_events)
+
+
+class outbound:
+    """
+    Time an outbound API call; usable with `with` (blocking clients) or `async with`.
+
+        async with metrics.outbound("plisio", "create_invoice"):
+            ...
+    """
+
+    __slots__ = ("service", "operation", "_start")
+
+    def __init__(self, service: str, operation: str):
+        self.service = service
+        self.operation = operation
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _outbound_events.append((self.service, self.operation, time.perf_counter() - self._start, exc_type is None))
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+# ==================== EVENT LOOP LAG ====================
+
+class LoopLagMonitor:
+    """Sleeps for a fixed interval and records how late the loop wakes it up."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            LOOP_LAG.set(lag)
+            LOOP_LAG_HISTOGRAM.observe(lag)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+LOOP_LAG_MONITOR = LoopLagMonitor()
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,115 @@
+"""
+Script to convert ISO-string dates to native BSON datetimes
+Run this once after deploying the datetime storage change; it is safe to re-run
+"""
+import asyncio
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env', override=False)
+
+# collection -> date fields written by the API routers (dotted paths for nested fields)
+DATETIME_FIELDS: Dict[str, List[str]] = {
+    "users": ["created_at", "blocked_at"],
+    "products": ["created_at"],
+    "coupons": ["created_at", "expires_at"],
+    "orders": [
+        "created_at", "updated_at", "refunded_at",
+        "subscription_start_date", "subscription_end_date", "delivery_info.delivered_at",
+    ],
+    "wallet_transactions": ["created_at"],
+    "credits_transactions": ["created_at"],
+    "referral_payouts": ["created_at"],
+    "wallet_topups": ["created_at", "updated_at"],
+    "minutes_transfers": ["created_at", "updated_at"],
+    "crypto_transactions": ["created_at", "updated_at"],
+    "withdrawals": ["created_at", "updated_at"],
+    "subscription_notifications": ["sent_at"],
+    "settings": ["updated_at"],
+    "crypto_config": ["updated_at"],
+    "games": ["created_at", "updated_at"],
+}
+
+
+def _parse(value: str) -> Optional[datetime]:
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def _get_path(doc: Dict[str, Any], path: str) -> Any:
+    for part in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+async def migrate_collection(collection, fields: List[str], batch_size: int = 500) -> Dict[str, int]:
+    """Stream documents that still hold string dates and rewrite them in bulk batches."""
+    query = {"$or": [{f: {"$type": "string"}} for f in fields]}
+    projection = {f: 1 for f in fields}
+    converted = 0
+    unparseable = 0
+    ops: List[UpdateOne] = []
+
+    async for doc in collection.find(query, projection).batch_size(batch_size):
+        updates = {}
+        for field in fields:
+            raw = _get_path(doc, field)
+            if not isinstance(raw, str):
+                continue
+            parsed = _parse(raw)
+            if parsed is None:
+                unparseable += 1
+                continue
+            updates[field] = parsed
+        if updates:
+            # Match on the original string so a concurrent write of a real datetime wins
+            ops.append(UpdateOne({"_id": doc["_id"], **{f: _get_path(doc, f) for f in updates}}, {"$set": updates}))
+        if len(ops) >= batch_size:
+            converted += (await collection.bulk_write(ops, ordered=False)).modified_count
+            ops = []
+
+    if ops:
+        converted += (await collection.bulk_write(ops, ordered=False)).modified_count
+    return {"converted": converted, "unparseable": unparseable}
+
+
+async def migrate_all(database, batch_size: int = 500) -> Dict[str, Dict[str, int]]:
+    results = {}
+    for name, fields in DATETIME_FIELDS.items():
+        results[name] = await migrate_collection(database[name], fields, batch_size=batch_size)
+    return results
+
+
+async def main():
+    mongo_url = os.environ.get('MONGO_URL')
+    if not mongo_url:
+        print("❌ Error: MONGO_URL environment variable not set")
+        exit(1)
+
+    client = AsyncIOMotorClient(mongo_url, tz_aware=True)
+    try:
+        results = await migrate_all(client[os.environ.get('DB_NAME', 'kayicom')])
+        for name, res in results.items():
+            print(f"✅ {name}: {res['converted']} documents converted, {res['unparseable']} unparseable values left as-is")
+    except Exception as e:
+        print(f"❌ Error migrating dates: {e}")
+        raise
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
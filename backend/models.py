@@ -0,0 +1,383 @@
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
+
+
+# ==================== MODELS ====================
+
+# User Models
+class UserBase(BaseModel):
+    email: EmailStr
+    full_name: str
+
+class UserCreate(UserBase):
+    password: str
+
+class User(UserBase):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    customer_id: str = Field(default_factory=lambda: "")
+    role: str = "customer"  # customer or admin
+    referral_code: str = Field(default_factory=lambda: str(uuid.uuid4())[:8].upper())
+    referred_by: Optional[str] = None  # referral_code of referrer
+    referral_balance: float = 0.0  # Balance from referrals
+    wallet_balance: float = 0.0  # Store credit / refunds
+    credits_balance: int = 0  # Loyalty credits (100 credits = $1)
+    is_blocked: bool = False
+    blocked_at: Optional[datetime] = None
+    blocked_reason: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class LoginRequest(BaseModel):
+    email: EmailStr
+    password: str
+
+# Product Models
+class Product(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    description: str
+    category: str  # giftcard, topup, subscription, service, crypto
+    price: float
+    currency: str = "USD"
+    image_url: Optional[str] = None
+    stock_available: bool = True
+    delivery_type: str = "automatic"  # automatic or manual
+    subscription_duration_months: Optional[int] = None  # For subscriptions: 2, 6, 12, 24 months
+    subscription_auto_check: bool = False  # Auto-check if subscription is still valid
+    variant_name: Optional[str] = None  # For variants like "100 Diamonds", "500 UC", etc
+    parent_product_id: Optional[str] = None  # Link to parent product for variants
+    requires_player_id: bool = False  # For topup products that need player ID
+    player_id_label: Optional[str] = None  # Custom label: UID, Character ID, etc
+    requires_credentials: bool = False  # For subscription/services that need login credentials
+    credential_fields: Optional[List[str]] = None  # e.g. ["email","password"]
+    region: Optional[str] = None  # For gift cards: US, EU, ASIA, etc.
+    giftcard_category: Optional[str] = None  # For gift cards: Shopping, Gaming, Entertainment, etc.
+    is_subscription: bool = False  # Track if this triggers referral payout
+    metadata: Optional[Dict[str, Any]] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class ProductCreate(BaseModel):
+    name: str
+    description: str
+    category: str
+    price: float
+    currency: str = "USD"
+    image_url: Optional[str] = None
+    stock_available: bool = True
+    delivery_type: str = "automatic"
+    subscription_duration_months: Optional[int] = None
+    subscription_auto_check: bool = False
+    variant_name: Optional[str] = None
+    parent_product_id: Optional[str] = None
+    requires_player_id: bool = False
+    player_id_label: Optional[str] = None
+    requires_credentials: bool = False
+    credential_fields: Optional[List[str]] = None
+    region: Optional[str] = None
+    giftcard_category: Optional[str] = None
+    is_subscription: bool = False
+    metadata: Optional[Dict[str, Any]] = None
+
+class ProductUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    category: Optional[str] = None
+    price: Optional[float] = None
+    currency: Optional[str] = None
+    image_url: Optional[str] = None
+    stock_available: Optional[bool] = None
+    delivery_type: Optional[str] = None
+    subscription_duration_months: Optional[int] = None
+    subscription_auto_check: Optional[bool] = None
+    variant_name: Optional[str] = None
+    parent_product_id: Optional[str] = None
+    requires_player_id: Optional[bool] = None
+    player_id_label: Optional[str] = None
+    requires_credentials: Optional[bool] = None
+    credential_fields: Optional[List[str]] = None
+    region: Optional[str] = None
+    giftcard_category: Optional[str] = None
+    is_subscription: Optional[bool] = None
+    metadata: Optional[Dict[str, Any]] = None
+
+# Order Models
+class OrderItem(BaseModel):
+    product_id: str
+    product_name: str
+    quantity: int
+    price: float
+    player_id: Optional[str] = None  # For topup products
+    credentials: Optional[Dict[str, str]] = None  # For subscription/services (email/password, etc)
+
+class Order(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    user_email: str
+    items: List[OrderItem]
+    total_amount: float
+    subtotal_amount: Optional[float] = None
+    discount_amount: Optional[float] = None
+    coupon_code: Optional[str] = None
+    coupon_usage_recorded: Optional[bool] = None
+    credits_awarded: Optional[int] = None
+    credits_recorded: Optional[bool] = None
+    currency: str = "USD"
+    payment_method: str  # wallet, crypto_plisio, paypal, skrill, moncash, binance_pay, zelle, cashapp
+    payment_status: str = "pending"  # pending, paid, failed, cancelled
+    order_status: str = "pending"  # pending, processing, completed, cancelled
+    payment_proof_url: Optional[str] = None
+    transaction_id: Optional[str] = None
+    plisio_invoice_id: Optional[str] = None
+    plisio_invoice_url: Optional[str] = None
+    delivery_info: Optional[Dict[str, Any]] = None
+    refunded_at: Optional[datetime] = None
+    refunded_amount: Optional[float] = None
+    subscription_start_date: Optional[datetime] = None
+    subscription_end_date: Optional[datetime] = None  # For subscription orders
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class OrderCreate(BaseModel):
+    items: List[OrderItem]
+    payment_method: str
+    coupon_code: Optional[str] = None
+
+
+# ==================== COUPON MODELS ====================
+
+class Coupon(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    code: str
+    discount_type: str  # percent or fixed
+    discount_value: float
+    active: bool = True
+    min_order_amount: float = 0.0
+    usage_limit: Optional[int] = None
+    used_count: int = 0
+    expires_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class CouponCreate(BaseModel):
+    code: str
+    discount_type: str  # percent or fixed
+    discount_value: float
+    active: bool = True
+    min_order_amount: float = 0.0
+    usage_limit: Optional[int] = None
+    expires_at: Optional[datetime] = None
+
+class CouponUpdate(BaseModel):
+    discount_type: Optional[str] = None
+    discount_value: Optional[float] = None
+    active: Optional[bool] = None
+    min_order_amount: Optional[float] = None
+    usage_limit: Optional[int] = None
+    expires_at: Optional[datetime] = None
+
+# Payment Models
+class ManualPaymentProof(BaseModel):
+    order_id: str
+    transaction_id: str
+    payment_proof_url: str
+
+# Settings Models
+class SiteSettings(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = "site_settings"
+    site_name: str = "KayiCom"
+    logo_url: Optional[str] = None
+    primary_color: str = "#3b82f6"
+    secondary_color: str = "#8b5cf6"
+    support_email: str = "support@kayicom.com"
+    plisio_api_key: Optional[str] = None
+    mtcgame_api_key: Optional[str] = None
+    gosplit_api_key: Optional[str] = None
+    z2u_api_key: Optional[str] = None
+    resend_api_key: Optional[str] = None
+    resend_from_email: Optional[str] = None  # e.g. "KayiCom <no-reply@yourdomain.com>"
+    announcement_enabled: Optional[bool] = False
+    announcement_message: Optional[str] = None
+    trustpilot_enabled: Optional[bool] = False
+    trustpilot_business_id: Optional[str] = None
+    product_categories: Optional[List[str]] = ["giftcard", "topup", "subscription", "service"]
+    # Payment Gateway Settings
+    payment_gateways: Optional[dict] = {
+        "paypal": {"enabled": True, "email": "", "instructions": ""},
+        "airtm": {"enabled": True, "email": "", "instructions": ""},
+        "skrill": {"enabled": True, "email": "", "instructions": ""},
+        "moncash": {"enabled": True, "email": "", "instructions": ""},
+        "binance_pay": {"enabled": True, "email": "", "instructions": ""},
+        "zelle": {"enabled": True, "email": "", "instructions": ""},
+        "cashapp": {"enabled": True, "email": "", "instructions": ""},
+        # Legacy key kept for backwards compatibility
+        "crypto_usdt": {"enabled": True, "wallet": "", "instructions": ""}
+    }
+    # Crypto Exchange Settings
+    crypto_settings: Optional[dict] = {
+        "buy_rate_usdt": 1.0,
+        "sell_rate_usdt": 0.98,
+        "transaction_fee_percent": 2.0,
+        "min_transaction_usd": 10.0,
+        "wallets": {
+            "BEP20": "",
+            "TRC20": "",
+            "MATIC": ""
+        }
+    }
+    # Minutes Transfer (international mobile minutes / airtime)
+    minutes_transfer_enabled: Optional[bool] = False
+    minutes_transfer_fee_type: Optional[str] = "percent"  # percent or fixed
+    minutes_transfer_fee_value: Optional[float] = 0.0  # percent (0-100) or fixed USD
+    minutes_transfer_min_amount: Optional[float] = 1.0
+    minutes_transfer_max_amount: Optional[float] = 500.0
+    # Tiers: [{"up_to": 50, "fee_type": "fixed", "fee_value": 1.5}, {"up_to": None, "fee_type": "percent", "fee_value": 3}]
+    minutes_transfer_fee_tiers: Optional[List[Dict[str, Any]]] = None
+    # Per country (case-insensitive name): any of fee_type, fee_value, fee_tiers, min_amount, max_amount
+    minutes_transfer_country_fees: Optional[Dict[str, Dict[str, Any]]] = None
+    minutes_transfer_instructions: Optional[str] = None
+    # Social links (follow buttons)
+    social_links: Optional[dict] = {
+        "facebook": "",
+        "instagram": "",
+        "tiktok": "",
+        "youtube": "",
+        "twitter": "",
+        "telegram": "",
+        "whatsapp": "",
+    }
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class SettingsUpdate(BaseModel):
+    site_name: Optional[str] = None
+    logo_url: Optional[str] = None
+    primary_color: Optional[str] = None
+    secondary_color: Optional[str] = None
+    support_email: Optional[str] = None
+    plisio_api_key: Optional[str] = None
+    mtcgame_api_key: Optional[str] = None
+    gosplit_api_key: Optional[str] = None
+    z2u_api_key: Optional[str] = None
+    resend_api_key: Optional[str] = None
+    resend_from_email: Optional[str] = None
+    announcement_enabled: Optional[bool] = None
+    announcement_message: Optional[str] = None
+    trustpilot_enabled: Optional[bool] = None
+    trustpilot_business_id: Optional[str] = None
+    product_categories: Optional[List[str]] = None
+    payment_gateways: Optional[dict] = None
+    crypto_settings: Optional[dict] = None
+    minutes_transfer_enabled: Optional[bool] = None
+    minutes_transfer_fee_type: Optional[str] = None
+    minutes_transfer_fee_value: Optional[float] = None
+    minutes_transfer_min_amount: Optional[float] = None
+    minutes_transfer_max_amount: Optional[float] = None
+    minutes_transfer_fee_tiers: Optional[List[Dict[str, Any]]] = None
+    minutes_transfer_country_fees: Optional[Dict[str, Dict[str, Any]]] = None
+    minutes_transfer_instructions: Optional[str] = None
+    social_links: Optional[dict] = None
+
+# Bulk Email Model
+class BulkEmailRequest(BaseModel):
+    subject: str
+    message: str
+    recipient_type: str  # all, customers, specific_emails
+    specific_emails: Optional[List[EmailStr]] = None
+
+
+# Withdrawal Models
+class Withdrawal(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    user_email: str
+    amount: float
+    method: str  # usdt_bep20, btc, paypal
+    wallet_address: Optional[str] = None  # For crypto
+    paypal_email: Optional[str] = None  # For PayPal
+    status: str = "pending"  # pending, approved, rejected, completed
+    admin_notes: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class WithdrawalRequest(BaseModel):
+    amount: float
+    method: str
+    wallet_address: Optional[str] = None
+    paypal_email: Optional[str] = None
+    moncash_phone: Optional[str] = None
+    moncash_name: Optional[str] = None
+
+# Crypto Transaction Models
+class CryptoTransaction(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    user_email: str
+    transaction_type: str  # buy or sell
+    crypto_type: str = "USDT"
+    chain: str  # BEP20, TRC20, MATIC
+    amount_crypto: float
+    amount_usd: float
+    exchange_rate: float
+    fee: float
+    total_usd: float  # amount_usd + fee for buy, amount_usd - fee for sell
+    payment_method: Optional[str] = None  # For buy: paypal, moncash, btc, usdt
+    wallet_address: Optional[str] = None
+    transaction_hash: Optional[str] = None
+    status: str = "pending"  # pending, processing, completed, failed
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class CryptoBuyRequest(BaseModel):
+    chain: str
+    amount_usd: float
+    payment_method: str
+    wallet_address: str
+    transaction_id: Optional[str] = None
+    payment_proof: Optional[str] = None
+    quote_token: Optional[str] = None  # from /crypto/quote: locks the quoted rate and fee
+
+class CryptoSellRequest(BaseModel):
+    chain: str
+    amount_crypto: float
+    payment_method: str  # paypal, moncash, usdt, btc
+    receiving_info: str  # Email or wallet address for receiving payment
+    transaction_id: Optional[str] = None
+    payment_proof: Optional[str] = None
+    quote_token: Optional[str] = None
+
+# Crypto Config Model
+class CryptoConfig(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = "crypto_config"
+    # Exchange rates (USD per 1 USDT)
+    buy_rate_bep20: float = 1.02
+    sell_rate_bep20: float = 0.98
+    buy_rate_trc20: float = 1.02
+    sell_rate_trc20: float = 0.98
+    buy_rate_matic: float = 1.02
+    sell_rate_matic: float = 0.98
+    # Fees
+    buy_fee_percent: float = 2.0
+    sell_fee_percent: float = 2.0
+    # Limits
+    min_buy_usd: float = 10.0
+    max_buy_usd: float = 10000.0
+    min_sell_usdt: float = 10.0
+    max_sell_usdt: float = 10000.0
+    # Confirmations required
+    bep20_confirmations: int = 15
+    trc20_confirmations: int = 20
+    matic_confirmations: int = 10
+    # Wallets
+    wallet_bep20: Optional[str] = None
+    wallet_trc20: Optional[str] = None
+    wallet_matic: Optional[str] = None
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -0,0 +1,205 @@
+import logging
+import os
+import re
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+import events
+import http_clients
+from core import _as_utc, _site_settings, db
+
+
+# ==================== EMAIL HELPERS ====================
+
+def _frontend_base_url() -> str:
+    return os.environ.get("FRONTEND_URL", "http://localhost:3000").rstrip("/")
+
+
+def _format_dt(dt: datetime) -> str:
+    try:
+        return dt.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+    except Exception:
+        return str(dt)
+
+
+def _send_resend_email(settings: dict, to_email: str, subject: str, html: str):
+    """Send one email via Resend. Raises HTTPException on misconfig."""
+    if not settings or not settings.get("resend_api_key"):
+        raise HTTPException(status_code=400, detail="Resend API key not configured")
+
+    resend_from = settings.get("resend_from_email") or settings.get("support_email")
+    if not resend_from:
+        raise HTTPException(status_code=400, detail="Resend from email not configured")
+
+    headers = {
+        "Authorization": f"Bearer {settings['resend_api_key']}",
+        "Content-Type": "application/json",
+    }
+    with http_clients.outbound("resend", "send_email"):
+        resp = http_clients.sync_session().post(
+            "https://api.resend.com/emails",
+            headers=headers,
+            json={"from": resend_from, "to": [to_email], "subject": subject, "html": html},
+            timeout=20,
+        )
+    if not (200 <= resp.status_code < 300):
+        raise HTTPException(status_code=500, detail=f"Resend send failed: {resp.status_code}: {resp.text[:300]}")
+
+
+# ==================== SUBSCRIPTION HELPERS ====================
+
+def _parse_subscription_duration(product: dict) -> timedelta:
+    """
+    Return subscription duration as timedelta.
+    Preference:
+    - product.subscription_duration_months if present
+    - parse product.variant_name like "1 Month", "3 Months", "12 Months", "7 Days", "1 Year"
+    - fallback 30 days
+    """
+    months = product.get("subscription_duration_months")
+    if months:
+        try:
+            return timedelta(days=int(months) * 30)
+        except Exception:
+            pass
+
+    variant = (product.get("variant_name") or "").strip().lower()
+    if variant:
+        # Support English + Haitian Creole + French-ish keywords
+        # - day/jou
+        # - month/mwa/mois
+        # - year/ane/an/ans/years
+        m = re.search(r"(\d+)\s*(day|days|jou|month|months|mwa|mois|year|years|ane|an|ans)", variant)
+        if m:
+            n = int(m.group(1))
+            unit = m.group(2)
+            if unit in ["day", "days", "jou"]:
+                return timedelta(days=n)
+            if unit in ["month", "months", "mwa", "mois"]:
+                return timedelta(days=n * 30)
+            if unit in ["year", "years", "ane", "an", "ans"]:
+                return timedelta(days=n * 365)
+
+    return timedelta(days=30)
+
+async def _set_subscription_dates_if_needed(order_id: str) -> Optional[Dict[str, Any]]:
+    """If order contains subscription products, set subscription_start_date/end_date."""
+    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    if not order:
+        return None
+
+    # Idempotent: don't overwrite if already set
+    if order.get("subscription_end_date"):
+        return order
+
+    # Only if paid+completed
+    if order.get("payment_status") != "paid" or order.get("order_status") != "completed":
+        return None
+
+    max_end: Optional[datetime] = None
+    start = datetime.now(timezone.utc)
+
+    for item in order.get("items", []):
+        product = await db.products.find_one({"id": item.get("product_id")}, {"_id": 0})
+        if product and product.get("is_subscription"):
+            duration = _parse_subscription_duration(product)
+            end = start + duration
+            if (max_end is None) or (end > max_end):
+                max_end = end
+
+    if not max_end:
+        return None
+
+    await db.orders.update_one(
+        {"id": order_id},
+        {"$set": {
+            "subscription_start_date": start,
+            "subscription_end_date": max_end,
+            "updated_at": datetime.now(timezone.utc)
+        }}
+    )
+    events.changed("orders", order_id)
+    updated = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    return updated
+
+async def _maybe_send_subscription_emails(order: dict):
+    """Send reminder emails (5 days before + at expiry) once per order."""
+    if not order:
+        return
+    if order.get("payment_status") != "paid" or order.get("order_status") != "completed":
+        return
+    end = _as_utc(order.get("subscription_end_date"))
+    if not end:
+        return
+
+    settings = await _site_settings() or {}
+    user_email = order.get("user_email")
+    if not user_email:
+        return
+
+    now = datetime.now(timezone.utc)
+    reminder_at = end - timedelta(days=5)
+
+    # Ensure notification collection exists
+    # doc: {order_id, type, sent_at}
+    async def already_sent(kind: str) -> bool:
+        return bool(await db.subscription_notifications.find_one({"order_id": order["id"], "type": kind}))
+
+    def mark_sent(kind: str):
+        return db.subscription_notifications.insert_one({
+            "id": str(uuid.uuid4()),
+            "order_id": order["id"],
+            "type": kind,
+            "sent_at": datetime.now(timezone.utc)
+        })
+
+    renew_link = f"{_frontend_base_url()}/products/subscription"
+
+    # 5-day reminder
+    if now >= reminder_at and now < end and not await already_sent("reminder_5d"):
+        subject = "Subscription renewal reminder"
+        html = (
+            f"<div style='font-family:Arial,sans-serif'>"
+            f"<h2>Reminder: your subscription is ending soon</h2>"
+            f"<p>Your subscription will end on <b>{_format_dt(end)}</b>.</p>"
+            f"<p>Renew here: <a href='{renew_link}'>{renew_link}</a></p>"
+            f"</div>"
+        )
+        _send_resend_email(settings, user_email, subject, html)
+        await mark_sent("reminder_5d")
+
+    # Expired notice
+    if now >= end and not await already_sent("expired"):
+        subject = "Subscription expired"
+        html = (
+            f"<div style='font-family:Arial,sans-serif'>"
+            f"<h2>Your subscription has expired</h2>"
+            f"<p>It ended on <b>{_format_dt(end)}</b>.</p>"
+            f"<p>Renew here: <a href='{renew_link}'>{renew_link}</a></p>"
+            f"</div>"
+        )
+        _send_resend_email(settings, user_email, subject, html)
+        await mark_sent("expired")
+
+
+async def _run_subscription_notifications() -> Dict[str, Any]:
+    now = datetime.now(timezone.utc)
+    # Find orders with subscription_end_date set
+    orders = await db.orders.find(
+        {"subscription_end_date": {"$ne": None}, "payment_status": "paid", "order_status": "completed"},
+        {"_id": 0}
+    ).to_list(5000)
+
+    processed = 0
+    for order in orders:
+        try:
+            # Ensure dates exist (and parseable)
+            await _maybe_send_subscription_emails(order)
+            processed += 1
+        except Exception as e:
+            logging.error(f"Subscription notification error for {order.get('id')}: {e}")
+
+    return {"processed": processed, "timestamp": now.isoformat()}
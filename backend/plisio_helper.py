@@ -1,7 +1,8 @@
-import aiohttp
 import os
 from typing import Dict, Optional
 
+import http_clients
+
 PLISIO_API_URL = "https://plisio.net/api/v1"
 
 class PlisioHelper:
@@ -47,7 +48,7 @@ class PlisioHelper:
         if email:
             params["email"] = email
         
-        async with aiohttp.ClientSession() as session:
+        async with http_clients.aiohttp_session() as session, http_clients.outbound("plisio", "create_invoice"):
             async with session.get(url, params=params) as response:
                 print(f"Plisio API Response Status: {response.status}")
                 print(f"Plisio API Response Headers: {response.headers}")
@@ -103,7 +104,7 @@ class PlisioHelper:
             "api_key": self.api_key
         }
         
-        async with aiohttp.ClientSession() as session:
+        async with http_clients.aiohttp_session() as session, http_clients.outbound("plisio", "invoice_status"):
             async with session.get(url, params=params) as response:
                 data = await response.json()
                 
@@ -139,7 +140,7 @@ class PlisioHelper:
             "api_key": self.api_key
         }
         
-        async with aiohttp.ClientSession() as session:
+        async with http_clients.aiohttp_session() as session, http_clients.outbound("plisio", "balance"):
             async with session.get(url, params=params) as response:
                 data = await response.json()
                 
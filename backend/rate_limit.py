@@ -0,0 +1,220 @@
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from pymongo.errors import DuplicateKeyError
+
+import metrics
+import sessions
+from core import db
+
+logger = logging.getLogger("rate_limit")
+
+# Token buckets for the endpoints where one call is expensive (bcrypt, regex
+# scans, outbound Plisio calls). A rule holds `capacity` tokens and refills
+# them over `period` seconds; a request takes one or gets 429 + Retry-After.
+#
+# Rules are set with RATE_LIMIT_<NAME>="<requests>/<seconds>" ("0" disables one)
+# and the whole limiter with RATE_LIMIT_ENABLED=0.
+
+ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+# memory = per worker; mongo = one bucket per key shared by every worker
+STORE = os.environ.get("RATE_LIMIT_STORE", "memory").strip().lower()
+# Upper bound on buckets the memory store keeps (least recently used are dropped)
+MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "50000"))
+
+DEFAULT_RULES = {
+    "login": "20/60",            # per client IP
+    "login_account": "10/300",   # per email: slows password guessing spread over many IPs
+    "coupon_validate": "30/60",
+    "minutes_quote": "60/60",
+    "product_search": "60/60",   # only /api/products?q=...
+    "plisio_status": "12/60",
+}
+
+
+class Rule:
+    __slots__ = ("name", "capacity", "period")
+
+    def __init__(self, name: str, capacity: int, period: float):
+        self.name = name
+        self.capacity = capacity
+        self.period = period
+
+    @property
+    def interval(self) -> float:
+        """Seconds to earn back one token."""
+        return self.period / self.capacity
+
+    @classmethod
+    def parse(cls, name: str, spec: str) -> Optional["Rule"]:
+        spec = (spec or "").strip()
+        if spec in ("", "0", "off"):
+            return None
+        count, _, period = spec.partition("/")
+        capacity = int(count)
+        if capacity <= 0:
+            return None
+        return cls(name, capacity, float(period or 60))
+
+
+def _load_rules() -> Dict[str, Optional[Rule]]:
+    return {
+        name: Rule.parse(name, os.environ.get(f"RATE_LIMIT_{name.upper()}", default))
+        for name, default in DEFAULT_RULES.items()
+    }
+
+
+# ==================== STORES ====================
+
+# A store answers take(rule, key) with 0.0 when a token was taken, otherwise
+# the seconds until the next one. Anything that can do that atomically per key
+# (a Redis script, say) can replace these.
+
+class MemoryStore:
+    """Per-process buckets: {key: (tokens, updated_at)}. Everything runs on the loop thread."""
+
+    def __init__(self, max_keys: int = MAX_KEYS, clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, rule: Rule, key: str) -> float:
+        now = self.clock()
+        bucket_key = f"{rule.name}:{key}"
+        tokens, updated = self._buckets.pop(bucket_key, (float(rule.capacity), now))
+        tokens = min(float(rule.capacity), tokens + (now - updated) / rule.interval)
+        if tokens >= 1.0:
+            tokens -= 1.0
+            retry_after = 0.0
+        else:
+            retry_after = (1.0 - tokens) * rule.interval
+        self._buckets[bucket_key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    def reset(self) -> None:
+        self._buckets.clear()
+
+
+class MongoStore:
+    """
+    Buckets shared by all workers in `rate_limits`: {_id: "rule:key", tat, expires_at}.
+
+    Stored as GCRA, the token bucket written as one "theoretical arrival time"
+    (tat): a request is allowed while tat <= now + (capacity - 1) * interval,
+    and pushes tat forward by one interval. That makes each decision a single
+    conditional update, without update pipelines; a TTL index removes idle keys.
+    """
+
+    def __init__(self, get_collection: Callable[[], Any], clock: Callable[[], float] = time.time):
+        self.get_collection = get_collection
+        self.clock = clock
+
+    async def take(self, rule: Rule, key: str) -> float:
+        coll = self.get_collection()
+        now = self.clock()
+        doc_id = f"{rule.name}:{key}"
+        burst = (rule.capacity - 1) * rule.interval
+        expires_at = datetime.fromtimestamp(now + rule.period, timezone.utc)
+
+        # Full (or new) bucket: restart from now
+        try:
+            res = await coll.update_one(
+                {"_id": doc_id, "tat": {"$lte": now}},
+                {"$set": {"tat": now + rule.interval, "expires_at": expires_at}},
+                upsert=True,
+            )
+            if res.matched_count or res.upserted_id is not None:
+                return 0.0
+        except DuplicateKeyError:
+            pass  # bucket exists and is partly drained
+
+        # Partly drained: take a token if one is left
+        res = await coll.update_one(
+            {"_id": doc_id, "tat": {"$gt": now, "$lte": now + burst}},
+            {"$inc": {"tat": rule.interval}, "$set": {"expires_at": expires_at + timedelta(seconds=burst)}},
+        )
+        if res.matched_count:
+            return 0.0
+
+        doc = await coll.find_one({"_id": doc_id}, {"tat": 1})
+        if not doc:
+            return 0.0  # expired in between
+        return max(0.001, float(doc["tat"]) - burst - now)
+
+    def reset(self) -> None:
+        pass
+
+
+class RateLimiter:
+    def __init__(self, store: Any, rules: Dict[str, Optional[Rule]], enabled: bool = ENABLED):
+        self.store = store
+        self.rules = rules
+        self.enabled = enabled
+
+    async def check(self, rule_name: str, key: str) -> None:
+        """Take a token for key under rule_name, or raise 429 with Retry-After."""
+        rule = self.rules.get(rule_name)
+        if not self.enabled or rule is None:
+            return
+        try:
+            retry_after = await self.store.take(rule, key)
+        except Exception as e:
+            # A limiter outage must not take login and checkout down with it
+            logger.warning(f"Rate limit store failed for {rule_name}, allowing request: {e}")
+            metrics.RATE_LIMIT_DECISIONS.inc(rule_name, "store_error")
+            return
+        if retry_after <= 0:
+            metrics.RATE_LIMIT_DECISIONS.inc(rule_name, "allowed")
+            return
+        metrics.RATE_LIMIT_DECISIONS.inc(rule_name, "throttled")
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, please slow down",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    def reset(self) -> None:
+        self.store.reset()
+
+
+def _create_store() -> Any:
+    if STORE == "mongo":
+        return MongoStore(lambda: db.rate_limits)
+    if STORE != "memory":
+        logger.warning(f"Unknown RATE_LIMIT_STORE={STORE!r}, using memory")
+    return MemoryStore()
+
+
+LIMITER = RateLimiter(_create_store(), _load_rules())
+
+
+# ==================== DEPENDENCIES ====================
+
+def client_ip(request: Request) -> str:
+    # serve.py runs uvicorn with proxy_headers, so this is already the X-Forwarded-For client
+    return request.client.host if request.client else "unknown"
+
+
+def caller_key(request: Request) -> str:
+    """The token's user when the caller sent one, otherwise the client IP."""
+    user_id = sessions.subject(request.headers.get("authorization"))
+    return f"user:{user_id}" if user_id else f"ip:{client_ip(request)}"
+
+
+def limit(rule_name: str, key: Callable[[Request], str] = caller_key, when: Optional[Callable[[Request], bool]] = None):
+    """Route dependency: `dependencies=[Depends(rate_limit.limit("coupon_validate"))]`."""
+
+    async def dependency(request: Request) -> None:
+        if when is not None and not when(request):
+            return
+        await LIMITER.check(rule_name, key(request))
+
+    return dependency
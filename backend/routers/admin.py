@@ -0,0 +1,350 @@
+import asyncio
+import base64
+import mimetypes
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, File, HTTPException, UploadFile
+from pydantic import BaseModel
+
+import http_clients
+import metrics
+import sessions
+from core import _settings_cache, _site_settings, db
+from database import analytics_reads
+from models import BulkEmailRequest, SettingsUpdate, SiteSettings
+from notifications import _run_subscription_notifications
+
+router = APIRouter(route_class=metrics.MetricsRoute)
+
+# ==================== SETTINGS ENDPOINTS ====================
+
+@router.get("/settings", response_model=SiteSettings)
+async def get_settings():
+    settings = await _site_settings()
+    if not settings:
+        # Create default settings
+        default_settings = SiteSettings()
+        doc = default_settings.model_dump()
+        await db.settings.insert_one(doc)
+        _settings_cache.invalidate()
+        return default_settings
+
+    # Never expose secret keys to clients
+    for secret_field in ["plisio_api_key", "mtcgame_api_key", "gosplit_api_key", "z2u_api_key", "resend_api_key"]:
+        if secret_field in settings:
+            settings[secret_field] = None
+    return settings
+
+@router.put("/settings", response_model=SiteSettings)
+async def update_settings(updates: SettingsUpdate):
+    update_data = {k: v for k, v in updates.model_dump().items() if v is not None}
+    update_data['updated_at'] = datetime.now(timezone.utc)
+    
+    await db.settings.update_one(
+        {"id": "site_settings"},
+        {"$set": update_data},
+        upsert=True
+    )
+    _settings_cache.invalidate()
+    
+    settings = await _site_settings()
+    return settings
+
+
+# ==================== ADMIN: CUSTOMERS ====================
+
+@router.get("/admin/customers")
+async def admin_list_customers(q: Optional[str] = None, limit: int = 50, skip: int = 0):
+    """
+    Admin: list customer users with optional search.
+    Search matches email/full_name/customer_id (case-insensitive).
+    (No auth implemented in this project.)
+    """
+    limit = max(1, min(int(limit), 500))
+    skip = max(0, int(skip))
+    query: Dict[str, Any] = {"role": "customer"}
+    if q and q.strip():
+        s = q.strip()
+        query["$or"] = [
+            {"email": {"$regex": s, "$options": "i"}},
+            {"full_name": {"$regex": s, "$options": "i"}},
+            {"customer_id": {"$regex": s, "$options": "i"}},
+        ]
+    users = await analytics_reads(db.users).find(query, {"_id": 0, "password": 0, "password_hash": 0}).sort("created_at", -1).skip(skip).to_list(limit)
+    return users
+
+
+@router.get("/admin/customers/{user_id}")
+async def admin_get_customer(user_id: str):
+    user = await db.users.find_one({"id": user_id, "role": "customer"}, {"_id": 0, "password": 0, "password_hash": 0})
+    if not user:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    return user
+
+
+# Per-section (collection, limit, projection) for the customer overview.
+# Only the fields the admin console renders are fetched.
+_CUSTOMER_OVERVIEW_SECTIONS: Dict[str, tuple] = {
+    "orders": ("orders", 50, {
+        "_id": 0, "id": 1, "total_amount": 1, "payment_method": 1, "payment_status": 1,
+        "order_status": 1, "coupon_code": 1, "refunded_amount": 1, "created_at": 1,
+    }),
+    "wallet_transactions": ("wallet_transactions", 50, {
+        "_id": 0, "id": 1, "order_id": 1, "type": 1, "amount": 1, "reason": 1, "created_at": 1,
+    }),
+    "credits_transactions": ("credits_transactions", 50, {
+        "_id": 0, "id": 1, "order_id": 1, "type": 1, "credits": 1, "usd_equivalent": 1, "reason": 1, "created_at": 1,
+    }),
+    "wallet_topups": ("wallet_topups", 20, {
+        "_id": 0, "id": 1, "amount": 1, "payment_method": 1, "payment_status": 1, "credited": 1, "created_at": 1,
+    }),
+    "withdrawals": ("withdrawals", 20, {
+        "_id": 0, "id": 1, "amount": 1, "method": 1, "status": 1, "created_at": 1,
+    }),
+    "crypto_transactions": ("crypto_transactions", 20, {
+        "_id": 0, "id": 1, "transaction_type": 1, "chain": 1, "amount_crypto": 1, "amount_usd": 1,
+        "total_usd": 1, "status": 1, "created_at": 1,
+    }),
+    "minutes_transfers": ("minutes_transfers", 20, {
+        "_id": 0, "id": 1, "country": 1, "phone_number": 1, "amount": 1, "total_amount": 1,
+        "payment_status": 1, "transfer_status": 1, "created_at": 1,
+    }),
+}
+
+
+def _facet_total(facet_result: List[Dict[str, Any]], key: str) -> Dict[str, Any]:
+    """Read a {total, count} group out of a $facet result (empty when nothing matched)."""
+    rows = (facet_result[0] if facet_result else {}).get(key) or []
+    row = rows[0] if rows else {}
+    return {"total": round(float(row.get("total") or 0.0), 2), "count": int(row.get("count") or 0)}
+
+
+async def _customer_order_totals(user_id: str) -> Dict[str, Any]:
+    pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$facet": {
+            "spend": [
+                {"$match": {"payment_status": "paid"}},
+                {"$group": {"_id": None, "total": {"$sum": "$total_amount"}, "count": {"$sum": 1}}},
+            ],
+            "refunds": [
+                {"$match": {"refunded_amount": {"$gt": 0}}},
+                {"$group": {"_id": None, "total": {"$sum": "$refunded_amount"}, "count": {"$sum": 1}}},
+            ],
+            "all": [
+                {"$group": {"_id": None, "total": {"$sum": "$total_amount"}, "count": {"$sum": 1}}},
+            ],
+        }},
+    ]
+    result = await analytics_reads(db.orders).aggregate(pipeline).to_list(1)
+    return {
+        "lifetime_spend": _facet_total(result, "spend"),
+        "refunds": _facet_total(result, "refunds"),
+        "orders": _facet_total(result, "all"),
+    }
+
+
+async def _customer_topup_totals(user_id: str) -> Dict[str, Any]:
+    pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$facet": {
+            "paid": [
+                {"$match": {"payment_status": "paid"}},
+                {"$group": {"_id": None, "total": {"$sum": "$amount"}, "count": {"$sum": 1}}},
+            ],
+            "pending": [
+                {"$match": {"payment_status": {"$in": ["pending", "pending_verification"]}}},
+                {"$group": {"_id": None, "total": {"$sum": "$amount"}, "count": {"$sum": 1}}},
+            ],
+        }},
+    ]
+    result = await analytics_reads(db.wallet_topups).aggregate(pipeline).to_list(1)
+    return {
+        "topups": _facet_total(result, "paid"),
+        "pending_topups": _facet_total(result, "pending"),
+    }
+
+
+@router.get("/admin/customers/{user_id}/overview")
+async def admin_customer_overview(user_id: str):
+    """
+    Admin: one-call customer 360 view.
+    Profile, recent activity per section and aggregated totals are fetched concurrently.
+    """
+    async def recent(collection: str, limit: int, projection: Dict[str, int]):
+        return await analytics_reads(db[collection]).find({"user_id": user_id}, projection).sort("created_at", -1).to_list(limit)
+
+    section_names = list(_CUSTOMER_OVERVIEW_SECTIONS.keys())
+    results = await asyncio.gather(
+        db.users.find_one({"id": user_id, "role": "customer"}, {"_id": 0, "password": 0, "password_hash": 0}),
+        _customer_order_totals(user_id),
+        _customer_topup_totals(user_id),
+        *(recent(*_CUSTOMER_OVERVIEW_SECTIONS[name]) for name in section_names),
+    )
+    user, order_totals, topup_totals = results[0], results[1], results[2]
+    if not user:
+        raise HTTPException(status_code=404, detail="Customer not found")
+
+    return {
+        "customer": user,
+        "totals": {**order_totals, **topup_totals},
+        **dict(zip(section_names, results[3:])),
+    }
+
+
+class AdminBlockCustomerRequest(BaseModel):
+    reason: Optional[str] = None
+
+
+@router.post("/admin/customers/{user_id}/block")
+async def admin_block_customer(user_id: str, body: AdminBlockCustomerRequest):
+    user = await db.users.find_one({"id": user_id, "role": "customer"}, {"_id": 0})
+    if not user:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    await db.users.update_one(
+        {"id": user_id},
+        {"$set": {"is_blocked": True, "blocked_at": datetime.now(timezone.utc), "blocked_reason": body.reason}}
+    )
+    await sessions.set_blocked(user_id, True)
+    updated = await db.users.find_one({"id": user_id, "role": "customer"}, {"_id": 0, "password": 0, "password_hash": 0})
+    return updated or {"message": "Blocked"}
+
+
+@router.post("/admin/customers/{user_id}/unblock")
+async def admin_unblock_customer(user_id: str):
+    user = await db.users.find_one({"id": user_id, "role": "customer"}, {"_id": 0})
+    if not user:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    await db.users.update_one(
+        {"id": user_id},
+        {"$set": {"is_blocked": False, "blocked_at": None, "blocked_reason": None}}
+    )
+    await sessions.set_blocked(user_id, False)
+    updated = await db.users.find_one({"id": user_id, "role": "customer"}, {"_id": 0, "password": 0, "password_hash": 0})
+    return updated or {"message": "Unblocked"}
+
+
+# ==================== BULK EMAIL ENDPOINTS ====================
+
+@router.post("/emails/bulk-send")
+async def send_bulk_email(email_data: BulkEmailRequest):
+    settings = await _site_settings()
+    if not settings or not settings.get('resend_api_key'):
+        raise HTTPException(status_code=400, detail="Resend API key not configured")
+
+    resend_from = settings.get("resend_from_email") or settings.get("support_email")
+    if not resend_from:
+        raise HTTPException(status_code=400, detail="Resend from email not configured")
+    
+    # Get recipients based on type
+    recipients = []
+    if email_data.recipient_type == "all":
+        users = await db.users.find({}, {"email": 1, "_id": 0}).to_list(10000)
+        recipients = [user['email'] for user in users]
+    elif email_data.recipient_type == "customers":
+        users = await db.users.find({"role": "customer"}, {"email": 1, "_id": 0}).to_list(10000)
+        recipients = [user['email'] for user in users]
+    elif email_data.recipient_type == "specific_emails" and email_data.specific_emails:
+        recipients = email_data.specific_emails
+    
+    if not recipients:
+        raise HTTPException(status_code=400, detail="No recipients found")
+    
+    # Send emails via Resend API (send individually to avoid leaking recipient list)
+    resend_api_key = settings["resend_api_key"]
+    headers = {
+        "Authorization": f"Bearer {resend_api_key}",
+        "Content-Type": "application/json",
+    }
+
+    sent_count = 0
+    failed: List[Dict[str, Any]] = []
+    for recipient in recipients:
+        try:
+            with http_clients.outbound("resend", "send_bulk_email"):
+                resp = http_clients.sync_session().post(
+                    "https://api.resend.com/emails",
+                    headers=headers,
+                    json={
+                        "from": resend_from,
+                        "to": [recipient],
+                        "subject": email_data.subject,
+                        "html": f"<div style='font-family:Arial,sans-serif;white-space:pre-wrap'>{email_data.message}</div>",
+                    },
+                    timeout=20,
+                )
+            if 200 <= resp.status_code < 300:
+                sent_count += 1
+            else:
+                failed.append({"email": recipient, "status": resp.status_code, "error": resp.text[:300]})
+        except Exception as e:
+            failed.append({"email": recipient, "status": None, "error": str(e)[:300]})
+
+    return {
+        "message": f"Bulk email sent to {sent_count} recipients",
+        "sent_count": sent_count,
+        "failed_count": len(failed),
+        "failed": failed[:20],
+        "recipients_preview": recipients[:10] if len(recipients) > 10 else recipients
+    }
+
+
+# ==================== SUBSCRIPTION NOTIFICATIONS ====================
+
+@router.post("/subscriptions/run-notifications")
+async def run_subscription_notifications():
+    """
+    Run subscription reminder checks for all paid+completed subscription orders.
+    Safe to call from a cron job; the scheduler also runs it hourly.
+    """
+    return await _run_subscription_notifications()
+
+
+# ==================== STATS ENDPOINTS ====================
+
+@router.get("/stats/dashboard")
+async def get_dashboard_stats():
+    orders = analytics_reads(db.orders)
+    total_orders = await orders.count_documents({})
+    total_products = await analytics_reads(db.products).count_documents({})
+    total_customers = await analytics_reads(db.users).count_documents({"role": "customer"})
+    
+    # Revenue calculation
+    pipeline = [
+        {"$match": {"payment_status": "paid"}},
+        {"$group": {"_id": None, "total": {"$sum": "$total_amount"}}}
+    ]
+    revenue_result = await orders.aggregate(pipeline).to_list(1)
+    total_revenue = revenue_result[0]['total'] if revenue_result else 0
+    
+    # Pending payments
+    pending_payments = await orders.count_documents({"payment_status": "pending_verification"})
+    
+    return {
+        "total_orders": total_orders,
+        "total_products": total_products,
+        "total_customers": total_customers,
+        "total_revenue": total_revenue,
+        "pending_payments": pending_payments
+    }
+
+
+# File Upload Endpoint
+@router.post("/upload/image")
+async def upload_image(file: UploadFile = File(...)):
+    """Upload image and return base64 data URL"""
+    try:
+        # Read file content
+        contents = await file.read()
+        
+        # Get mime type
+        mime_type = file.content_type or mimetypes.guess_type(file.filename)[0] or 'image/jpeg'
+        
+        # Convert to base64
+        base64_data = base64.b64encode(contents).decode('utf-8')
+        data_url = f"data:{mime_type};base64,{base64_data}"
+        
+        return {"url": data_url, "filename": file.filename}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
@@ -0,0 +1,186 @@
+import logging
+import secrets
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import metrics
+import rate_limit
+import sessions
+from core import db, pwd_context
+from models import LoginRequest, User, UserCreate
+from routers.referrals import register_referral, unregister_referral
+
+router = APIRouter(route_class=metrics.MetricsRoute)
+
+# ==================== CUSTOMER IDS ====================
+
+# Unique partial index on users.customer_id (see ensure_indexes) makes the
+# database the arbiter of uniqueness: ids are allocated by inserting and
+# retrying on a duplicate key, never by probing with find_one first.
+_CUSTOMER_ID_ATTEMPTS = 8
+_LEGACY_CUSTOMER_ID_FILTER = {"customer_id": {"$in": [None, ""]}}
+
+
+def _new_customer_id() -> str:
+    """Return a short, human-friendly customer id like KC-12345678."""
+    return f"KC-{secrets.randbelow(90_000_000) + 10_000_000}"
+
+
+def _is_customer_id_conflict(err: Dict[str, Any]) -> bool:
+    details = err.get("keyPattern") or err.get("keyValue") or {}
+    if details:
+        return "customer_id" in details
+    return "customer_id" in str(err.get("errmsg", ""))
+
+
+async def _insert_user_with_customer_id(doc: Dict[str, Any]) -> str:
+    """Insert a new user document, allocating its customer_id on the way in."""
+    for _ in range(_CUSTOMER_ID_ATTEMPTS):
+        doc["customer_id"] = _new_customer_id()
+        try:
+            await db.users.insert_one(doc)
+            return doc["customer_id"]
+        except DuplicateKeyError as e:
+            if not _is_customer_id_conflict(e.details or {}):
+                raise
+            doc.pop("_id", None)
+    raise HTTPException(status_code=503, detail="Could not allocate customer id, please retry")
+
+
+async def backfill_customer_ids(batch_size: int = 500) -> Dict[str, int]:
+    """
+    One-shot job: assign customer_ids to legacy users that have none.
+    Works in batches with conditional bulk updates, so it is safe to re-run
+    and safe to run while the app is serving traffic.
+    """
+    assigned = 0
+    conflicts = 0
+    while True:
+        batch = await db.users.find(_LEGACY_CUSTOMER_ID_FILTER, {"_id": 0, "id": 1}).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        pending = [u["id"] for u in batch if u.get("id")]
+        progressed = False
+        for _ in range(_CUSTOMER_ID_ATTEMPTS):
+            if not pending:
+                break
+            ops = [
+                UpdateOne({"id": uid, **_LEGACY_CUSTOMER_ID_FILTER}, {"$set": {"customer_id": _new_customer_id()}})
+                for uid in pending
+            ]
+            try:
+                result = await db.users.bulk_write(ops, ordered=False)
+                assigned += result.modified_count
+                progressed = progressed or result.modified_count > 0
+                pending = []
+            except BulkWriteError as e:
+                details = e.details or {}
+                assigned += int(details.get("nModified", 0))
+                progressed = progressed or int(details.get("nModified", 0)) > 0
+                retry = [
+                    pending[err["index"]] for err in details.get("writeErrors", [])
+                    if err.get("code") == 11000 and _is_customer_id_conflict(err)
+                ]
+                if len(retry) != len(details.get("writeErrors", [])):
+                    raise
+                conflicts += len(retry)
+                pending = retry
+        if not progressed:
+            break
+    return {"assigned": assigned, "conflicts_retried": conflicts}
+
+
+# ==================== AUTH ENDPOINTS ====================
+
+@router.post("/auth/register", response_model=User)
+async def register(user_data: UserCreate):
+    # Check if user exists
+    existing = await db.users.find_one({"email": user_data.email})
+    if existing:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    
+    # Hash password
+    hashed_password = pwd_context.hash(user_data.password)
+    
+    # Create user
+    user = User(
+        email=user_data.email,
+        full_name=user_data.full_name,
+        role="customer"
+    )
+    
+    doc = user.model_dump()
+    doc['password'] = hashed_password
+    
+    user.customer_id = await _insert_user_with_customer_id(doc)
+    return user
+
+@router.post("/auth/login", dependencies=[Depends(rate_limit.limit("login"))])
+async def login(credentials: LoginRequest):
+    await rate_limit.LIMITER.check("login_account", credentials.email.strip().lower())
+    user = await db.users.find_one({"email": credentials.email})
+    if not user:
+        logging.error(f"Login failed: user not found for {credentials.email}")
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    if user.get("is_blocked"):
+        raise HTTPException(status_code=403, detail="Account is blocked. Contact support.")
+    
+    # Support both 'password' and 'password_hash' field names
+    password_field = 'password_hash' if 'password_hash' in user else 'password'
+    logging.info(f"Login attempt for {credentials.email}, using field: {password_field}")
+    
+    if not pwd_context.verify(credentials.password, user[password_field]):
+        logging.error(f"Login failed: incorrect password for {credentials.email}")
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    logging.info(f"Login successful for {credentials.email}")
+
+    return {
+        "user_id": user['id'],
+        "id": user['id'],
+        "customer_id": user.get("customer_id"),
+        "email": user['email'],
+        "username": user.get('username', user.get('full_name', 'User')),
+        "role": user['role'],
+        "is_blocked": bool(user.get("is_blocked", False)),
+        "access_token": sessions.issue(user),
+        "token_type": "bearer",
+        "expires_in": sessions.TOKEN_TTL,
+    }
+
+
+@router.post("/auth/register-with-referral")
+async def register_with_referral(user_data: UserCreate, referral_code: Optional[str] = None):
+    """Register user with optional referral code"""
+    existing = await db.users.find_one({"email": user_data.email})
+    if existing:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    
+    hashed_password = pwd_context.hash(user_data.password)
+    
+    user = User(
+        email=user_data.email,
+        full_name=user_data.full_name,
+        role="customer"
+    )
+    
+    doc = user.model_dump()
+    doc['password'] = hashed_password
+    doc['referral_balance'] = 0.0
+    
+    # Set referrer if valid code provided; counting the referral is the validity check
+    referred_by = await register_referral(referral_code)
+    if referred_by:
+        doc['referred_by'] = referred_by
+
+    try:
+        user.customer_id = await _insert_user_with_customer_id(doc)
+    except Exception:
+        if referred_by:
+            await unregister_referral(referred_by)
+        raise
+    return user
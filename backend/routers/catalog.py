@@ -0,0 +1,291 @@
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+
+import fast_json
+import metrics
+import rate_limit
+from cache import ReadThroughCache
+from core import _as_utc, db
+from fast_json import TrustedModelView
+from models import Coupon, CouponCreate, CouponUpdate, Product, ProductCreate, ProductUpdate
+
+router = APIRouter(route_class=metrics.MetricsRoute)
+
+# ==================== PRODUCT ENDPOINTS ====================
+
+# Trusted read paths for list endpoints (used when FAST_JSON_RESPONSES is on)
+_PRODUCT_VIEW = TrustedModelView(Product)
+_COUPON_VIEW = TrustedModelView(Coupon)
+
+async def _load_catalog(key) -> List[Dict[str, Any]]:
+    fast, filters = key
+    projection = _PRODUCT_VIEW.projection if fast else {"_id": 0}
+    return await db.products.find(dict(filters), projection).to_list(1000)
+
+# Filter-only catalog listings (category / parent); invalidated on product writes
+_catalog_cache = ReadThroughCache(_load_catalog, ttl=60)
+
+async def _find_products(query: Dict[str, Any], fast: bool) -> List[Dict[str, Any]]:
+    """Catalog listing. Text search ($or) goes to Mongo; everything else is served from the cache."""
+    if "$or" in query:
+        projection = _PRODUCT_VIEW.projection if fast else {"_id": 0}
+        return await db.products.find(query, projection).to_list(1000)
+    return await _catalog_cache.get((fast, tuple(sorted(query.items()))))
+
+
+def _is_search(request) -> bool:
+    # Plain listings come from the catalog cache; only ?q= runs regex scans
+    return bool(request.query_params.get("q", "").strip())
+
+
+@router.get("/products", response_model=List[Product], dependencies=[Depends(rate_limit.limit("product_search", when=_is_search))])
+async def get_products(
+    category: Optional[str] = None,
+    parent_product_id: Optional[str] = None,
+    q: Optional[str] = None,
+):
+    """
+    Return all products with optional category/parent filters and text search.
+    Also normalizes fields to ensure frontend compatibility.
+    """
+    try:
+        query: Dict[str, Any] = {}
+        if category:
+            query["category"] = category
+        if parent_product_id:
+            query["parent_product_id"] = parent_product_id
+        if q:
+            q = q.strip()
+            if q:
+                query["$or"] = [
+                    {"name": {"$regex": q, "$options": "i"}},
+                    {"description": {"$regex": q, "$options": "i"}},
+                    {"variant_name": {"$regex": q, "$options": "i"}},
+                    {"giftcard_category": {"$regex": q, "$options": "i"}},
+                ]
+
+        if fast_json.ENABLED:
+            products = await _find_products(query, fast=True)
+            return _PRODUCT_VIEW.response(products)
+
+        products = await _find_products(query, fast=False)
+
+        validated_products: List[Dict[str, Any]] = []
+        for product in products:
+            try:
+                validated_product = {
+                    "id": product.get("id", ""),
+                    "name": product.get("name", ""),
+                    "description": product.get("description", ""),
+                    "category": product.get("category", ""),
+                    "price": float(product.get("price", 0) or 0),
+                    "currency": product.get("currency", "USD"),
+                    "image_url": product.get("image_url"),
+                    "stock_available": product.get("stock_available", True),
+                    "delivery_type": product.get("delivery_type", "automatic"),
+                    "subscription_duration_months": product.get("subscription_duration_months"),
+                    "subscription_auto_check": product.get("subscription_auto_check", False),
+                    "variant_name": product.get("variant_name"),
+                    "parent_product_id": product.get("parent_product_id"),
+                    "requires_player_id": product.get("requires_player_id", False),
+                    "player_id_label": product.get("player_id_label"),
+                    "requires_credentials": product.get("requires_credentials", False),
+                    "credential_fields": product.get("credential_fields"),
+                    "region": product.get("region"),
+                    "giftcard_category": product.get("giftcard_category"),
+                    "is_subscription": product.get("is_subscription", False),
+                    "metadata": product.get("metadata", {}),
+                    "created_at": product.get("created_at") or datetime.now(timezone.utc),
+                }
+
+                validated_products.append(validated_product)
+            except Exception as e:
+                logging.error(f"Error validating product {product.get('id')}: {e}")
+                continue
+
+        return validated_products
+    except Exception as e:
+        logging.error(f"Error in get_products: {e}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+@router.get("/products/{product_id}", response_model=Product)
+async def get_product(product_id: str):
+    product = await db.products.find_one({"id": product_id}, {"_id": 0})
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return product
+
+@router.post("/products", response_model=Product)
+async def create_product(product_data: ProductCreate):
+    product = Product(**product_data.model_dump())
+    doc = product.model_dump()
+    
+    await db.products.insert_one(doc)
+    _catalog_cache.invalidate()
+    return product
+
+@router.put("/products/{product_id}", response_model=Product)
+async def update_product(product_id: str, updates: ProductUpdate):
+    existing = await db.products.find_one({"id": product_id})
+    if not existing:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    update_data = {k: v for k, v in updates.model_dump().items() if v is not None}
+    
+    if update_data:
+        await db.products.update_one({"id": product_id}, {"$set": update_data})
+        _catalog_cache.invalidate()
+    
+    updated = await db.products.find_one({"id": product_id}, {"_id": 0})
+    return updated
+
+@router.delete("/products/{product_id}")
+async def delete_product(product_id: str):
+    result = await db.products.delete_one({"id": product_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Product not found")
+    _catalog_cache.invalidate()
+    return {"message": "Product deleted successfully"}
+
+
+# ==================== COUPON ENDPOINTS ====================
+
+def _normalize_coupon_code(code: str) -> str:
+    return (code or "").strip().upper()
+
+async def _get_valid_coupon(code: str, order_amount: float) -> Optional[dict]:
+    """Return coupon doc if valid for given amount, else None."""
+    normalized = _normalize_coupon_code(code)
+    if not normalized:
+        return None
+
+    coupon = await db.coupons.find_one({"code": normalized}, {"_id": 0})
+    if not coupon:
+        return None
+    if not coupon.get("active", True):
+        return None
+    expires_at = _as_utc(coupon.get("expires_at"))
+    if expires_at and expires_at < datetime.now(timezone.utc):
+        return None
+    if float(order_amount) < float(coupon.get("min_order_amount", 0.0)):
+        return None
+    usage_limit = coupon.get("usage_limit")
+    if usage_limit is not None and int(coupon.get("used_count", 0)) >= int(usage_limit):
+        return None
+    return coupon
+
+def _calculate_discount(coupon: dict, subtotal: float) -> float:
+    discount_type = coupon.get("discount_type")
+    value = float(coupon.get("discount_value", 0.0))
+    if value <= 0:
+        return 0.0
+    if discount_type == "percent":
+        return max(0.0, min(subtotal, subtotal * (value / 100.0)))
+    if discount_type == "fixed":
+        return max(0.0, min(subtotal, value))
+    return 0.0
+
+async def _record_coupon_usage_if_needed(order_id: str):
+    """Increment coupon usage once per paid order."""
+    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    if not order:
+        return
+    code = _normalize_coupon_code(order.get("coupon_code"))
+    if not code:
+        return
+    if order.get("coupon_usage_recorded"):
+        return
+    if order.get("payment_status") != "paid":
+        return
+
+    coupon = await db.coupons.find_one({"code": code}, {"_id": 0})
+    if not coupon:
+        # Still mark recorded to avoid retry loops
+        await db.orders.update_one({"id": order_id}, {"$set": {"coupon_usage_recorded": True}})
+        return
+
+    usage_limit = coupon.get("usage_limit")
+    if usage_limit is not None and int(coupon.get("used_count", 0)) >= int(usage_limit):
+        # Coupon exhausted; keep order as-is but mark recorded to avoid retry loops
+        await db.orders.update_one({"id": order_id}, {"$set": {"coupon_usage_recorded": True}})
+        return
+
+    await db.coupons.update_one({"code": code}, {"$inc": {"used_count": 1}})
+    await db.orders.update_one({"id": order_id}, {"$set": {"coupon_usage_recorded": True}})
+
+
+@router.get("/coupons/validate", dependencies=[Depends(rate_limit.limit("coupon_validate"))])
+async def validate_coupon(code: str, amount: float):
+    coupon = await _get_valid_coupon(code, amount)
+    if not coupon:
+        raise HTTPException(status_code=400, detail="Invalid coupon")
+    discount = _calculate_discount(coupon, float(amount))
+    return {
+        "code": coupon["code"],
+        "discount_amount": discount,
+        "total_after_discount": float(amount) - discount
+    }
+
+@router.get("/coupons", response_model=List[Coupon])
+async def list_coupons():
+    if fast_json.ENABLED:
+        coupons = await db.coupons.find({}, _COUPON_VIEW.projection).sort("created_at", -1).to_list(500)
+        return _COUPON_VIEW.response(coupons)
+
+    coupons = await db.coupons.find({}, {"_id": 0}).sort("created_at", -1).to_list(500)
+    return coupons
+
+@router.post("/coupons", response_model=Coupon)
+async def create_coupon(data: CouponCreate):
+    code = _normalize_coupon_code(data.code)
+    if not code:
+        raise HTTPException(status_code=400, detail="Coupon code required")
+    if data.discount_type not in ["percent", "fixed"]:
+        raise HTTPException(status_code=400, detail="Invalid discount_type")
+    if data.discount_value <= 0:
+        raise HTTPException(status_code=400, detail="discount_value must be > 0")
+
+    existing = await db.coupons.find_one({"code": code})
+    if existing:
+        raise HTTPException(status_code=400, detail="Coupon code already exists")
+
+    coupon = Coupon(
+        code=code,
+        discount_type=data.discount_type,
+        discount_value=float(data.discount_value),
+        active=bool(data.active),
+        min_order_amount=float(data.min_order_amount or 0.0),
+        usage_limit=data.usage_limit,
+        expires_at=_as_utc(data.expires_at),
+    )
+    await db.coupons.insert_one(coupon.model_dump())
+    return coupon
+
+@router.put("/coupons/{coupon_id}", response_model=Coupon)
+async def update_coupon(coupon_id: str, updates: CouponUpdate):
+    existing = await db.coupons.find_one({"id": coupon_id}, {"_id": 0})
+    if not existing:
+        raise HTTPException(status_code=404, detail="Coupon not found")
+
+    update_data = {k: v for k, v in updates.model_dump().items() if v is not None}
+    if "discount_type" in update_data and update_data["discount_type"] not in ["percent", "fixed"]:
+        raise HTTPException(status_code=400, detail="Invalid discount_type")
+    if "discount_value" in update_data and float(update_data["discount_value"]) <= 0:
+        raise HTTPException(status_code=400, detail="discount_value must be > 0")
+
+    if "expires_at" in update_data:
+        update_data["expires_at"] = _as_utc(update_data["expires_at"])
+
+    await db.coupons.update_one({"id": coupon_id}, {"$set": update_data})
+    updated = await db.coupons.find_one({"id": coupon_id}, {"_id": 0})
+    return updated
+
+@router.delete("/coupons/{coupon_id}")
+async def delete_coupon(coupon_id: str):
+    res = await db.coupons.delete_one({"id": coupon_id})
+    if res.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Coupon not found")
+    return {"message": "Coupon deleted"}
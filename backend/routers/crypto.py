@@ -0,0 +1,254 @@
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+
+import crypto_pricing
+import events
+import metrics
+from core import _site_settings, db
+from models import CryptoBuyRequest, CryptoSellRequest
+
+router = APIRouter(route_class=metrics.MetricsRoute)
+
+# ==================== CRYPTO ENDPOINTS ====================
+
+@router.get("/crypto/config")
+async def get_crypto_config():
+    """Get crypto exchange rates and config"""
+    table = await crypto_pricing.pricing()
+    return dict(table.public_config)
+
+@router.get("/crypto/quote")
+async def get_crypto_quote(side: str, chain: str, amount: float):
+    """Price a buy (amount in USD) or sell (amount in USDT) and sign it for the order that follows"""
+    table = await crypto_pricing.pricing()
+    return crypto_pricing.sign(crypto_pricing.quote(table, side.lower(), chain, amount))
+
+@router.put("/crypto/config")
+async def update_crypto_config(updates: Dict[str, Any]):
+    """Admin: Update crypto config"""
+    updates['updated_at'] = datetime.now(timezone.utc)
+    
+    await db.crypto_config.update_one(
+        {"id": "crypto_config"},
+        {"$set": updates},
+        upsert=True
+    )
+    crypto_pricing.invalidate()
+    
+    return {"message": "Crypto config updated"}
+
+@router.post("/crypto/buy")
+async def buy_crypto(request: CryptoBuyRequest, user_id: str = None, user_email: str = None):
+    """User buys USDT - Generate Plisio invoice automatically"""
+    # Extract user info from request if not provided
+    if not user_id:
+        user_id = "guest"
+    if not user_email:
+        user_email = "guest@kayicom.com"
+    # For BUY USDT, customer pays with FIAT (PayPal, AirTM, Skrill)
+    # No need for Plisio - just show admin payment info
+    settings = await _site_settings()
+
+    # A signed quote from /crypto/quote carries the price; otherwise price from the compiled table
+    if request.quote_token:
+        priced = crypto_pricing.redeem(request.quote_token, "buy", request.chain, request.amount_usd)
+    else:
+        priced = crypto_pricing.quote(await crypto_pricing.pricing(), "buy", request.chain, request.amount_usd)
+    exchange_rate, amount_crypto = priced["exchange_rate"], priced["amount_crypto"]
+    fee, total_usd = priced["fee"], priced["total_usd"]
+    
+    # Create transaction
+    transaction = {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "user_email": user_email,
+        "transaction_type": "buy",
+        "crypto_type": "USDT",
+        "chain": request.chain,
+        "amount_crypto": amount_crypto,
+        "amount_usd": request.amount_usd,
+        "exchange_rate": exchange_rate,
+        "fee": fee,
+        "total_usd": total_usd,
+        "payment_method": request.payment_method,
+        "wallet_address": request.wallet_address,
+        "transaction_id": request.transaction_id,
+        "payment_proof": request.payment_proof,
+        "status": "pending",
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
+    }
+    
+    await db.crypto_transactions.insert_one(transaction)
+    events.changed("crypto_transactions", transaction["id"])
+    
+    # Get admin payment information based on selected method
+    payment_info = {}
+    if settings and settings.get('payment_gateways'):
+        gateway = settings['payment_gateways'].get(request.payment_method, {})
+        if gateway.get('enabled'):
+            payment_info = {
+                'method': request.payment_method,
+                'email': gateway.get('email', ''),
+                'instructions': gateway.get('instructions', '')
+            }
+    
+    return {
+        "message": "Buy crypto order created. Please send payment and submit proof.",
+        "transaction_id": transaction['id'],
+        "amount_crypto": amount_crypto,
+        "total_usd": total_usd,
+        "payment_info": payment_info
+    }
+
+@router.post("/crypto/sell")
+async def sell_crypto(request: CryptoSellRequest, user_id: str, user_email: str):
+    """User sells USDT"""
+    settings = await _site_settings()
+    table = await crypto_pricing.pricing()
+
+    if request.quote_token:
+        priced = crypto_pricing.redeem(request.quote_token, "sell", request.chain, request.amount_crypto)
+    else:
+        priced = crypto_pricing.quote(table, "sell", request.chain, request.amount_crypto)
+    exchange_rate, amount_usd = priced["exchange_rate"], priced["amount_usd"]
+    fee, total_usd = priced["fee"], priced["total_usd"]
+    
+    transaction_id = str(uuid.uuid4())
+    
+    # Create Plisio invoice for receiving USDT from customer
+    plisio_invoice = None
+    
+    if settings and settings.get('plisio_api_key'):
+        try:
+            from plisio_helper import PlisioHelper
+            plisio_helper = PlisioHelper(settings['plisio_api_key'])
+            
+            # Plisio uses just 'USDT' and handles chain automatically
+            plisio_currency = 'USDT'
+            
+            plisio_result = await plisio_helper.create_invoice(
+                amount=request.amount_crypto,
+                currency=plisio_currency,
+                order_name="Sell USDT Order",
+                order_number=transaction_id,
+                email=user_email
+            )
+            
+            if plisio_result.get('success'):
+                plisio_invoice = plisio_result
+            else:
+                print(f"Plisio invoice creation failed: {plisio_result.get('error')}")
+        except Exception as e:
+            print(f"Plisio integration error: {str(e)}")
+            # Continue without Plisio integration
+    
+    # Create transaction
+    transaction = {
+        "id": transaction_id,
+        "user_id": user_id,
+        "user_email": user_email,
+        "transaction_type": "sell",
+        "crypto_type": "USDT",
+        "chain": request.chain,
+        "amount_crypto": request.amount_crypto,
+        "amount_usd": amount_usd,
+        "exchange_rate": exchange_rate,
+        "fee": fee,
+        "total_usd": total_usd,
+        "payment_method": request.payment_method,
+        "metadata": {"receiving_info": request.receiving_info},
+        "receiving_info": request.receiving_info,
+        "transaction_id": request.transaction_id,
+        "payment_proof": request.payment_proof,
+        "plisio_invoice_id": plisio_invoice.get('txn_id') if plisio_invoice else None,
+        "status": "pending",
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
+    }
+    
+    await db.crypto_transactions.insert_one(transaction)
+    events.changed("crypto_transactions", transaction["id"])
+    
+    response = {
+        "message": "Crypto sell order created. Send USDT to the address below",
+        "transaction_id": transaction['id'],
+        "total_usd_to_receive": total_usd,
+        "amount_crypto": request.amount_crypto
+    }
+    
+    # Add Plisio details if available
+    if plisio_invoice:
+        response['plisio'] = {
+            "wallet_address": plisio_invoice.get("wallet_address"),
+            "invoice_url": plisio_invoice.get("invoice_url"),
+            "qr_code": plisio_invoice.get("qr_code"),
+            "amount_crypto": plisio_invoice.get("amount_crypto"),
+            "message": "Send USDT to this unique address. Payment will be automatically detected."
+        }
+    else:
+        # Fallback to admin wallet if Plisio not available
+        response['wallet_address'] = table.wallet(request.chain)
+        response['message'] = "Send USDT to admin wallet. You'll need to provide transaction ID."
+    
+    return response
+
+@router.get("/crypto/transactions/user/{user_id}")
+async def get_user_crypto_transactions(user_id: str):
+    """Get user's crypto transactions"""
+    transactions = await db.crypto_transactions.find(
+        {"user_id": user_id},
+        {"_id": 0}
+    ).sort("created_at", -1).to_list(100)
+    
+    return transactions
+
+@router.get("/crypto/transactions/all")
+async def get_all_crypto_transactions():
+    """Admin: Get all crypto transactions"""
+    transactions = await db.crypto_transactions.find(
+        {},
+        {"_id": 0}
+    ).sort("created_at", -1).to_list(1000)
+    
+    return transactions
+
+class CryptoStatusUpdate(BaseModel):
+    status: str
+    admin_notes: Optional[str] = None
+    tx_hash: Optional[str] = None
+
+@router.put("/crypto/transactions/{transaction_id}/status")
+async def update_crypto_transaction_status(
+    transaction_id: str,
+    update_data: CryptoStatusUpdate
+):
+    """Admin: Update crypto transaction status"""
+    if update_data.status not in ['processing', 'completed', 'rejected', 'failed']:
+        raise HTTPException(status_code=400, detail="Invalid status")
+    
+    updates = {
+        "status": update_data.status,
+        "updated_at": datetime.now(timezone.utc)
+    }
+    
+    if update_data.admin_notes:
+        updates['admin_notes'] = update_data.admin_notes
+    
+    if update_data.tx_hash:
+        updates['tx_hash'] = update_data.tx_hash
+    
+    result = await db.crypto_transactions.update_one(
+        {"id": transaction_id},
+        {"$set": updates}
+    )
+    
+    if result.modified_count == 0:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    events.changed("crypto_transactions", transaction_id)
+    
+    return {"message": "Transaction status updated"}
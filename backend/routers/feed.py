@@ -0,0 +1,162 @@
+import asyncio
+import os
+from typing import AsyncIterator, FrozenSet, Optional, Set
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+import events
+import metrics
+import sessions
+
+router = APIRouter(route_class=metrics.MetricsRoute)
+
+# ==================== CHANGE FEED STREAMS ====================
+
+# Streams end after this long; EventSource reconnects with Last-Event-ID and
+# resumes, so a long-lived connection never pins a worker through a deploy
+STREAM_SECONDS = float(os.environ.get("EVENTS_STREAM_SECONDS", "300"))
+# Comment lines keep proxies from closing an idle stream
+HEARTBEAT_SECONDS = float(os.environ.get("EVENTS_HEARTBEAT_SECONDS", "15"))
+# Open streams and long-polls one customer may hold in one worker
+MAX_STREAMS_PER_USER = int(os.environ.get("EVENTS_MAX_STREAMS_PER_USER", "4"))
+# Long-poll: how long a request waits for an event, and the most it may ask for
+POLL_TIMEOUT = 25.0
+MAX_POLL_TIMEOUT = 55.0
+MAX_POLL_EVENTS = 100
+_RETRY_MS = 3000
+
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# What customers may follow: state changes of their own orders and topups
+CUSTOMER_TOPICS = frozenset({"orders", "wallet_topups", "minutes_transfers"})
+
+
+def _resume_token(last_event_id: Optional[str], after: Optional[str]) -> Optional[int]:
+    token = last_event_id or after
+    if token is None or token == "":
+        return None
+    try:
+        return int(token)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid resume token")
+
+
+def _topics(topics: Optional[str], allowed: Optional[FrozenSet[str]] = None) -> Optional[Set[str]]:
+    """The requested topics; None (every topic) for an admin stream without a filter."""
+    choices = allowed or frozenset(events.TOPICS)
+    if not topics:
+        return None if allowed is None else set(allowed)
+    wanted = {t.strip() for t in topics.split(",") if t.strip()}
+    if wanted - choices:
+        raise HTTPException(status_code=400, detail=f"Unknown topics. Use any of: {', '.join(sorted(choices))}")
+    return wanted
+
+
+async def _sse(request: Request, sub: events.Subscription) -> AsyncIterator[str]:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STREAM_SECONDS
+    try:
+        yield f"retry: {_RETRY_MS}\n\n"
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0 or await request.is_disconnected():
+                return
+            try:
+                event = await sub.next(timeout=min(HEARTBEAT_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if event is None:
+                # Resume point no longer retained (or we fell behind): reload, then reconnect without an id
+                yield "event: reset\ndata: {}\n\n"
+                return
+            yield event.sse()
+    finally:
+        events.BUS.close(sub)
+
+
+def _stream(request: Request, sub: events.Subscription) -> StreamingResponse:
+    # Subscribed before the response, so the slot counts at once; the background close
+    # covers a client gone before the first byte, when the body never runs (close is idempotent)
+    return StreamingResponse(_sse(request, sub), media_type="text/event-stream", headers=_SSE_HEADERS,
+                             background=BackgroundTask(events.BUS.close, sub))
+
+
+@router.get("/admin/events")
+async def admin_events(request: Request, topics: Optional[str] = None, after: Optional[str] = None,
+                       last_event_id: Optional[str] = Header(None)):
+    """
+    Admin: Server-Sent Events with the current console view of every order,
+    wallet topup, minutes transfer, withdrawal and crypto transaction that
+    changes. Each event's `id` is a resume token (sent back as Last-Event-ID
+    by EventSource, or as `after`); a `reset` event means the token expired
+    and the console should reload its lists.
+    """
+    sub = await events.BUS.open(after=_resume_token(last_event_id, after), topics=_topics(topics))
+    return _stream(request, sub)
+
+
+# ==================== CUSTOMER CHANNEL ====================
+
+async def _subscriber(
+    token: Optional[str] = None,
+    user_id: Optional[str] = None,
+    authorization: Optional[str] = Header(None),
+) -> sessions.Session:
+    # EventSource can't set headers: the session token may come as ?token=
+    if token and not authorization:
+        authorization = f"Bearer {token}"
+    return await sessions.customer(user_id=user_id, user_email=None, authorization=authorization)
+
+
+async def _open_customer(session: sessions.Session, after: Optional[int], topics: Optional[str]) -> events.Subscription:
+    topics = _topics(topics, CUSTOMER_TOPICS)
+    try:
+        return await events.BUS.open(after=after, topics=topics, user_id=session.user_id, limit=MAX_STREAMS_PER_USER)
+    except events.TooManyStreams:
+        raise HTTPException(status_code=429, detail="Too many open update channels",
+                            headers={"Retry-After": str(_RETRY_MS // 1000)})
+
+
+@router.get("/events")
+async def customer_events(request: Request, topics: Optional[str] = None, after: Optional[str] = None,
+                          last_event_id: Optional[str] = Header(None),
+                          session: sessions.Session = Depends(_subscriber)):
+    """
+    Server-Sent Events for the caller's own orders, wallet topups and
+    minutes transfers: each event carries the document's current state.
+    Resumes from Last-Event-ID like /admin/events; clients that can't hold
+    a stream use /events/poll.
+    """
+    sub = await _open_customer(session, _resume_token(last_event_id, after), topics)
+    return _stream(request, sub)
+
+
+@router.get("/events/poll")
+async def customer_events_poll(topics: Optional[str] = None, after: Optional[str] = None, timeout: float = POLL_TIMEOUT,
+                               session: sessions.Session = Depends(_subscriber)):
+    """
+    Long-poll fallback for /events: answers as soon as the caller has events
+    after `after` (or after `timeout` seconds with none). Pass `next` back as
+    `after`; `reset: true` means reload, then poll without `after`.
+    """
+    sub = await _open_customer(session, _resume_token(None, after), topics)
+    try:
+        found = []
+        try:
+            first = await sub.next(timeout=max(0.0, min(timeout, MAX_POLL_TIMEOUT)))
+            if first is not None:
+                found = [first] + sub.drain(MAX_POLL_EVENTS - 1)
+        except asyncio.TimeoutError:
+            pass
+        if sub.lost and not found:
+            return {"events": [], "next": None, "reset": True}
+        return {
+            "events": [{"seq": e.seq, "topic": e.topic, "id": e.id, "doc": e.doc} for e in found],
+            "next": found[-1].seq if found else sub.floor,
+            "reset": False,
+        }
+    finally:
+        events.BUS.close(sub)
@@ -0,0 +1,354 @@
+import logging
+import math
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+import events
+import metrics
+import rate_limit
+import sessions
+from core import _safe_float, _settings_cache, _site_settings, db
+from database import ledger_writes
+from routers.wallet import _debit_wallet
+
+router = APIRouter(route_class=metrics.MetricsRoute)
+
+# ==================== MINUTES TRANSFER (INTERNATIONAL) ====================
+
+class MinutesQuoteResponse(BaseModel):
+    amount: float
+    fee_amount: float
+    total_amount: float
+    currency: str = "USD"
+
+
+class MinutesTransferCreate(BaseModel):
+    country: str
+    phone_number: str
+    amount: float  # USD amount customer wants to send
+    payment_method: str  # wallet, crypto_plisio, or manual gateways
+
+
+class MinutesTransferProof(BaseModel):
+    transfer_id: str
+    transaction_id: str
+    payment_proof_url: str
+
+
+class MinutesTransferStatusUpdate(BaseModel):
+    payment_status: Optional[str] = None  # pending, pending_verification, paid, failed, rejected, processing
+    transfer_status: Optional[str] = None  # pending, processing, completed, cancelled
+
+
+class MinutesQuoteBatchRequest(BaseModel):
+    amounts: List[float]
+    country: Optional[str] = None
+
+
+MAX_BATCH_QUOTES = 100
+
+
+class _FeeRule:
+    """Flat percent/fixed fee, or tiers picked by the first `up_to` the amount fits under."""
+
+    __slots__ = ("tiers",)
+
+    def __init__(self, fee_type: Any, fee_value: Any, tiers: Optional[List[Dict[str, Any]]] = None):
+        compiled = []
+        for tier in tiers or []:
+            up_to = tier.get("up_to")
+            compiled.append((
+                math.inf if up_to in (None, "") else _safe_float(up_to, math.inf),
+                tier.get("fee_type") or fee_type,
+                tier.get("fee_value", fee_value),
+            ))
+        compiled.sort(key=lambda t: t[0])
+        if not compiled or compiled[-1][0] != math.inf:
+            compiled.append((math.inf, fee_type, fee_value))
+        self.tiers = [(up_to, t if t in ("percent", "fixed") else "percent", max(0.0, _safe_float(v, 0.0)))
+                      for up_to, t, v in compiled]
+
+    def fee(self, amount: float) -> float:
+        for up_to, fee_type, fee_value in self.tiers:
+            if amount <= up_to + 1e-9:
+                return amount * fee_value / 100.0 if fee_type == "percent" else fee_value
+        return 0.0
+
+
+class MinutesFeeSchedule:
+    """
+    Fees and limits compiled from site settings; quotes are pure arithmetic.
+    Rebuilt by _fee_schedule() whenever the cached settings document changes.
+    """
+
+    def __init__(self, settings: Optional[Dict[str, Any]]):
+        self.settings = settings
+        settings = settings or {}
+        fee_type = settings.get("minutes_transfer_fee_type") or "percent"
+        fee_value = settings.get("minutes_transfer_fee_value") or 0.0
+        self.default = (
+            _FeeRule(fee_type, fee_value, settings.get("minutes_transfer_fee_tiers")),
+            _safe_float(settings.get("minutes_transfer_min_amount"), 1.0),
+            _safe_float(settings.get("minutes_transfer_max_amount"), 500.0),
+        )
+        self.countries: Dict[str, Any] = {}
+        for country, spec in (settings.get("minutes_transfer_country_fees") or {}).items():
+            if not isinstance(spec, dict):
+                continue
+            self.countries[country.strip().lower()] = (
+                _FeeRule(spec.get("fee_type") or fee_type, spec.get("fee_value", fee_value),
+                         spec.get("fee_tiers", settings.get("minutes_transfer_fee_tiers"))),
+                _safe_float(spec.get("min_amount"), self.default[1]),
+                _safe_float(spec.get("max_amount"), self.default[2]),
+            )
+
+    def quote(self, amount: float, country: Optional[str] = None) -> Dict[str, Any]:
+        """Priced amount, or HTTPException(400) when it is outside the country's limits."""
+        rule, min_amt, max_amt = self.countries.get((country or "").strip().lower(), self.default)
+        if amount <= 0:
+            raise HTTPException(status_code=400, detail="Amount must be > 0")
+        if amount + 1e-9 < min_amt or amount - 1e-9 > max_amt:
+            raise HTTPException(status_code=400, detail=f"Amount must be between ${min_amt} and ${max_amt}")
+        fee_amount = round(float(rule.fee(amount)), 2)
+        return {"amount": round(amount, 2), "fee_amount": fee_amount, "total_amount": round(amount + fee_amount, 2), "currency": "USD"}
+
+
+_schedule: Optional[MinutesFeeSchedule] = None
+
+
+async def _fee_schedule() -> MinutesFeeSchedule:
+    global _schedule
+    # The cached object itself, not _site_settings()'s per-call copy, so identity means "unchanged"
+    settings = await _settings_cache.get()
+    schedule = _schedule
+    if schedule is None or schedule.settings is not settings:
+        schedule = _schedule = MinutesFeeSchedule(settings)
+    return schedule
+
+
+@router.get("/minutes/quote", response_model=MinutesQuoteResponse, dependencies=[Depends(rate_limit.limit("minutes_quote"))])
+@router.get("/mobile-topup/quote", response_model=MinutesQuoteResponse, dependencies=[Depends(rate_limit.limit("minutes_quote"))])
+async def minutes_quote(amount: float, country: Optional[str] = None):
+    """Get quote for minutes transfer. Country is optional for quote calculation."""
+    # Allow quotes even if feature is disabled (users can see pricing)
+    # Only block actual transfers if disabled
+    schedule = await _fee_schedule()
+    return schedule.quote(float(amount), country)
+
+
+@router.post("/minutes/quotes", dependencies=[Depends(rate_limit.limit("minutes_quote"))])
+@router.post("/mobile-topup/quotes", dependencies=[Depends(rate_limit.limit("minutes_quote"))])
+async def minutes_quote_batch(body: MinutesQuoteBatchRequest):
+    """Price several amounts at once (e.g. preset buttons); invalid ones carry an error instead."""
+    if len(body.amounts) > MAX_BATCH_QUOTES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUOTES} amounts per request")
+    schedule = await _fee_schedule()
+    quotes = []
+    for amount in body.amounts:
+        try:
+            quotes.append(schedule.quote(float(amount), body.country))
+        except HTTPException as e:
+            quotes.append({"amount": amount, "error": e.detail})
+    return {"country": body.country, "quotes": quotes}
+
+
+@router.post("/minutes/transfers")
+@router.post("/mobile-topup/requests")
+async def create_minutes_transfer(payload: MinutesTransferCreate, session: sessions.Session = Depends(sessions.customer)):
+    user_id, user_email = session.user_id, session.email
+    settings = await _site_settings() or {}
+    if not settings.get("minutes_transfer_enabled"):
+        raise HTTPException(status_code=400, detail="Minutes transfer is disabled")
+
+    country = (payload.country or "").strip()
+    phone = (payload.phone_number or "").strip()
+    if not country:
+        raise HTTPException(status_code=400, detail="Country is required")
+    if not phone:
+        raise HTTPException(status_code=400, detail="Phone number is required")
+    
+    # Basic phone validation - must have at least 5 characters
+    if len(phone) < 5:
+        raise HTTPException(status_code=400, detail="Phone number is too short")
+
+    amt = float(payload.amount)
+    fee = (await _fee_schedule()).quote(amt, country)
+    transfer_id = str(uuid.uuid4())
+    doc = {
+        "id": transfer_id,
+        "user_id": user_id,
+        "user_email": user_email,
+        "country": country,
+        "phone_number": phone,
+        "amount": fee["amount"],
+        "fee_amount": fee["fee_amount"],
+        "total_amount": fee["total_amount"],
+        "payment_method": payload.payment_method,
+        "payment_status": "pending",
+        "transfer_status": "pending",
+        "transaction_id": None,
+        "payment_proof_url": None,
+        "plisio_invoice_id": None,
+        "plisio_invoice_url": None,
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc),
+    }
+
+    # Payment validation
+    if payload.payment_method == "wallet":
+        if not await _debit_wallet(user_id, float(doc["total_amount"])):
+            raise HTTPException(status_code=400, detail="Insufficient wallet balance")
+        await ledger_writes(db.wallet_transactions).insert_one({
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "user_email": user_email,
+            "order_id": None,
+            "type": "minutes_transfer",
+            "amount": -float(doc["total_amount"]),
+            "reason": f"Minutes transfer {transfer_id}",
+            "created_at": datetime.now(timezone.utc)
+        })
+        doc["payment_status"] = "paid"
+        doc["transfer_status"] = "processing"
+
+    elif payload.payment_method == "crypto_plisio":
+        if not settings.get("plisio_api_key"):
+            raise HTTPException(status_code=400, detail="Plisio not configured")
+        try:
+            from plisio_helper import PlisioHelper
+            plisio = PlisioHelper(settings["plisio_api_key"])
+            invoice_response = await plisio.create_invoice(
+                amount=float(doc["total_amount"]),
+                currency="USDT",
+                order_name=f"Minutes Transfer {transfer_id}",
+                order_number=transfer_id,
+                email=user_email,
+            )
+            if invoice_response.get("success"):
+                doc["plisio_invoice_id"] = invoice_response.get("invoice_id")
+                doc["plisio_invoice_url"] = invoice_response.get("invoice_url")
+        except Exception as e:
+            logging.error(f"Plisio minutes transfer error: {e}")
+    else:
+        gateways = settings.get("payment_gateways") or {}
+        gateway = gateways.get(payload.payment_method) or {}
+        if not gateway.get("enabled"):
+            raise HTTPException(status_code=400, detail="Payment method not enabled")
+
+    await db.minutes_transfers.insert_one(doc)
+    events.changed("minutes_transfers", doc["id"])
+
+    payment_info = {}
+    if payload.payment_method not in ["wallet", "crypto_plisio"]:
+        gateways = settings.get("payment_gateways") or {}
+        gateway = gateways.get(payload.payment_method) or {}
+        if gateway.get("enabled"):
+            payment_info = {
+                "method": payload.payment_method,
+                "email": gateway.get("email", ""),
+                "instructions": gateway.get("instructions", ""),
+            }
+    if settings.get("minutes_transfer_instructions"):
+        payment_info["service_instructions"] = settings.get("minutes_transfer_instructions")
+
+    # Ensure all values are JSON-serializable
+    try:
+        # Convert doc to a clean dict (remove any MongoDB-specific fields)
+        clean_doc = {
+            "id": doc.get("id"),
+            "user_id": doc.get("user_id"),
+            "user_email": doc.get("user_email"),
+            "country": doc.get("country"),
+            "phone_number": doc.get("phone_number"),
+            "amount": float(doc.get("amount", 0)),
+            "fee_amount": float(doc.get("fee_amount", 0)),
+            "total_amount": float(doc.get("total_amount", 0)),
+            "payment_method": doc.get("payment_method"),
+            "payment_status": doc.get("payment_status"),
+            "transfer_status": doc.get("transfer_status"),
+            "transaction_id": doc.get("transaction_id"),
+            "payment_proof_url": doc.get("payment_proof_url"),
+            "plisio_invoice_id": doc.get("plisio_invoice_id"),
+            "plisio_invoice_url": doc.get("plisio_invoice_url"),
+            "created_at": doc.get("created_at"),
+            "updated_at": doc.get("updated_at"),
+        }
+        return JSONResponse(jsonable_encoder({
+            "transfer": clean_doc,
+            "payment_info": payment_info
+        }))
+    except Exception as e:
+        logging.error(f"Error serializing minutes transfer response: {e}")
+        # Return minimal response if serialization fails
+        return JSONResponse({
+            "transfer": {
+                "id": transfer_id,
+                "user_id": user_id,
+                "payment_status": doc.get("payment_status", "pending"),
+                "transfer_status": doc.get("transfer_status", "pending")
+            },
+            "payment_info": payment_info
+        })
+
+
+@router.get("/minutes/transfers/user/{user_id}")
+@router.get("/mobile-topup/requests/user/{user_id}")
+async def get_user_minutes_transfers(user_id: str):
+    transfers = await db.minutes_transfers.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(200)
+    return transfers
+
+
+@router.get("/minutes/transfers/all")
+@router.get("/mobile-topup/requests/all")
+async def get_all_minutes_transfers():
+    transfers = await db.minutes_transfers.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    return transfers
+
+
+@router.post("/minutes/transfers/proof")
+@router.post("/mobile-topup/requests/proof")
+async def submit_minutes_transfer_proof(proof: MinutesTransferProof):
+    res = await db.minutes_transfers.update_one(
+        {"id": proof.transfer_id},
+        {"$set": {
+            "transaction_id": proof.transaction_id,
+            "payment_proof_url": proof.payment_proof_url,
+            "payment_status": "pending_verification",
+            "updated_at": datetime.now(timezone.utc)
+        }}
+    )
+    if res.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Transfer not found")
+    events.changed("minutes_transfers", proof.transfer_id)
+    return {"message": "Payment proof submitted"}
+
+
+@router.put("/minutes/transfers/{transfer_id}/status")
+@router.put("/mobile-topup/requests/{transfer_id}/status")
+async def update_minutes_transfer_status(transfer_id: str, updates: MinutesTransferStatusUpdate):
+    update_data = {}
+    if updates.payment_status is not None:
+        if updates.payment_status not in ["pending", "pending_verification", "paid", "failed", "rejected", "processing", "cancelled"]:
+            raise HTTPException(status_code=400, detail="Invalid payment_status")
+        update_data["payment_status"] = updates.payment_status
+    if updates.transfer_status is not None:
+        if updates.transfer_status not in ["pending", "processing", "completed", "cancelled"]:
+            raise HTTPException(status_code=400, detail="Invalid transfer_status")
+        update_data["transfer_status"] = updates.transfer_status
+
+    if not update_data:
+        raise HTTPException(status_code=400, detail="No updates provided")
+
+    update_data["updated_at"] = datetime.now(timezone.utc)
+    res = await db.minutes_transfers.update_one({"id": transfer_id}, {"$set": update_data})
+    if res.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Transfer not found")
+    events.changed("minutes_transfers", transfer_id)
+    updated = await db.minutes_transfers.find_one({"id": transfer_id}, {"_id": 0})
+    return updated or {"message": "Updated"}
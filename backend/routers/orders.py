@@ -0,0 +1,486 @@
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+
+import background
+import events
+import fast_json
+import http_clients
+import metrics
+import rate_limit
+import sessions
+from core import _as_utc, _site_settings, db
+from database import ledger_writes
+from fast_json import TrustedModelView
+from models import ManualPaymentProof, Order, OrderCreate, OrderItem
+from notifications import _format_dt, _maybe_send_subscription_emails, _send_resend_email, _set_subscription_dates_if_needed
+from routers.catalog import _calculate_discount, _get_valid_coupon, _normalize_coupon_code, _record_coupon_usage_if_needed
+from routers.referrals import check_and_credit_referral
+from routers.wallet import WalletAdjustment, _credit_topup, _debit_wallet
+
+router = APIRouter(route_class=metrics.MetricsRoute)
+
+# Trusted read path for the order list (used when FAST_JSON_RESPONSES is on)
+_ORDER_VIEW = TrustedModelView(Order)
+
+# ==================== LOYALTY CREDITS ====================
+
+async def _record_loyalty_credits_if_needed(order_id: str):
+    """
+    Award loyalty credits once per successful order.
+    Rule: each successful (paid + completed) order gives 5 credits,
+    only if total_amount >= $10.
+    """
+    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    if not order:
+        return
+
+    # Only award when fully successful
+    if order.get("payment_status") != "paid":
+        return
+    if order.get("order_status") != "completed":
+        return
+
+    # Minimum order amount
+    try:
+        total_amount = float(order.get("total_amount") or 0.0)
+    except Exception:
+        total_amount = 0.0
+    if total_amount + 1e-9 < 10.0:
+        # Mark as recorded to avoid repeatedly re-checking for old small orders
+        await db.orders.update_one(
+            {"id": order_id},
+            {"$set": {"credits_recorded": True, "credits_awarded": 0, "updated_at": datetime.now(timezone.utc)}}
+        )
+        return
+
+    if order.get("credits_recorded"):
+        return
+
+    credits = 5
+    await ledger_writes(db.users).update_one({"id": order["user_id"]}, {"$inc": {"credits_balance": int(credits)}})
+    await db.orders.update_one(
+        {"id": order_id},
+        {"$set": {"credits_recorded": True, "credits_awarded": int(credits), "updated_at": datetime.now(timezone.utc)}}
+    )
+    await ledger_writes(db.credits_transactions).insert_one({
+        "id": str(uuid.uuid4()),
+        "user_id": order["user_id"],
+        "user_email": order.get("user_email"),
+        "order_id": order_id,
+        "type": "earn",
+        "credits": int(credits),
+        "usd_equivalent": round(float(credits) / 100.0, 2),
+        "reason": "Order success reward",
+        "created_at": datetime.now(timezone.utc)
+    })
+
+
+# ==================== ORDER ENDPOINTS ====================
+
+@router.post("/orders", response_model=Order)
+async def create_order(order_data: OrderCreate, session: sessions.Session = Depends(sessions.customer)):
+    user_id, user_email = session.user_id, session.email
+
+    # Validate items & calculate total using authoritative product pricing/settings
+    validated_items: List[OrderItem] = []
+    subtotal = 0.0
+    # One round trip for the whole cart instead of a lookup per item
+    product_ids = list(dict.fromkeys(item.product_id for item in order_data.items))
+    products = {
+        p["id"]: p
+        for p in await db.products.find({"id": {"$in": product_ids}}, {"_id": 0}).to_list(len(product_ids))
+    }
+    for item in order_data.items:
+        product = products.get(item.product_id)
+        if not product:
+            raise HTTPException(status_code=400, detail=f"Invalid product_id: {item.product_id}")
+
+        quantity = int(item.quantity)
+        if quantity <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be at least 1")
+
+        # Required fields validation
+        if product.get("requires_player_id") and not (item.player_id and str(item.player_id).strip()):
+            label = product.get("player_id_label") or "Player ID"
+            raise HTTPException(status_code=400, detail=f"{label} is required for {product.get('name')}")
+
+        if product.get("requires_credentials"):
+            creds = item.credentials or {}
+            required_fields = product.get("credential_fields") or ["email", "password"]
+            missing = [f for f in required_fields if not (creds.get(f) and str(creds.get(f)).strip())]
+            if missing:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Missing credentials fields for {product.get('name')}: {', '.join(missing)}"
+                )
+
+        price = float(product.get("price", item.price))
+        subtotal += price * quantity
+
+        validated_items.append(
+            OrderItem(
+                product_id=product["id"],
+                product_name=product.get("name", item.product_name),
+                quantity=quantity,
+                price=price,
+                player_id=item.player_id,
+                credentials=item.credentials,
+            )
+        )
+    
+    # Apply coupon (if any)
+    coupon_code = _normalize_coupon_code(order_data.coupon_code) if order_data.coupon_code else None
+    discount_amount = 0.0
+    if coupon_code:
+        coupon = await _get_valid_coupon(coupon_code, subtotal)
+        if not coupon:
+            raise HTTPException(status_code=400, detail="Invalid coupon")
+        discount_amount = _calculate_discount(coupon, subtotal)
+
+    total = max(0.0, float(subtotal) - float(discount_amount))
+
+    order = Order(
+        user_id=user_id,
+        user_email=user_email,
+        items=validated_items,
+        subtotal_amount=subtotal,
+        discount_amount=discount_amount if discount_amount > 0 else None,
+        coupon_code=coupon_code,
+        coupon_usage_recorded=False if coupon_code else None,
+        total_amount=total,
+        payment_method=order_data.payment_method
+    )
+
+    # Wallet payment: instantly mark paid and deduct balance
+    if order_data.payment_method == "wallet":
+        if not await _debit_wallet(user_id, total):
+            raise HTTPException(status_code=400, detail="Insufficient wallet balance")
+
+        await ledger_writes(db.wallet_transactions).insert_one({
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "user_email": user_email,
+            "order_id": order.id,
+            "type": "purchase",
+            "amount": -float(total),
+            "reason": "Order payment (wallet)",
+            "created_at": datetime.now(timezone.utc)
+        })
+        order.payment_status = "paid"
+        order.order_status = "processing"
+    
+    # If crypto payment, create Plisio invoice
+    if order_data.payment_method == "crypto_plisio":
+        settings = await _site_settings()
+        if settings and settings.get('plisio_api_key'):
+            try:
+                from plisio_helper import PlisioHelper
+                plisio = PlisioHelper(settings['plisio_api_key'])
+                
+                # Create Plisio invoice for USDT payment
+                invoice_response = await plisio.create_invoice(
+                    amount=total,
+                    currency="USDT",
+                    order_name=f"Order {order.id}",
+                    order_number=order.id,
+                    email=user_email
+                )
+                
+                if invoice_response.get("success"):
+                    order.plisio_invoice_id = invoice_response.get("invoice_id")
+                    order.plisio_invoice_url = invoice_response.get("invoice_url")
+            except Exception as e:
+                logging.error(f"Plisio error: {e}")
+    
+    doc = order.model_dump()
+    
+    await db.orders.insert_one(doc)
+    events.changed("orders", order.id)
+    return order
+
+@router.get("/orders", response_model=List[Order])
+async def get_orders(user_id: Optional[str] = None):
+    query = {}
+    if user_id:
+        query['user_id'] = user_id
+    
+    if fast_json.ENABLED:
+        orders = await db.orders.find(query, _ORDER_VIEW.projection).sort("created_at", -1).to_list(1000)
+        return _ORDER_VIEW.response(orders)
+
+    orders = await db.orders.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    return orders
+
+@router.get("/orders/{order_id}", response_model=Order)
+async def get_order(order_id: str):
+    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return order
+
+@router.put("/orders/{order_id}/status")
+async def update_order_status(order_id: str, payment_status: Optional[str] = None, order_status: Optional[str] = None):
+    updates = {"updated_at": datetime.now(timezone.utc)}
+    if payment_status:
+        updates['payment_status'] = payment_status
+    if order_status:
+        updates['order_status'] = order_status
+    
+    result = await db.orders.update_one({"id": order_id}, {"$set": updates})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Order not found")
+    events.changed("orders", order_id)
+
+    # Record coupon usage once payment is marked as paid
+    if payment_status == "paid":
+        await _record_coupon_usage_if_needed(order_id)
+
+    # If order is completed, trigger referral payout check (idempotent)
+    if order_status == "completed":
+        order = await db.orders.find_one({"id": order_id})
+        if order:
+            # Set subscription dates (if applicable) and run emails
+            updated = await _set_subscription_dates_if_needed(order_id)
+            try:
+                await _maybe_send_subscription_emails(updated or order)
+            except Exception as e:
+                logging.error(f"Subscription email check error: {e}")
+            await check_and_credit_referral(order)
+            await _record_loyalty_credits_if_needed(order_id)
+    
+    return {"message": "Order updated successfully"}
+
+# Delivery Management Model
+class DeliveryInfo(BaseModel):
+    delivery_details: str  # Credentials, codes, or instructions
+
+@router.put("/orders/{order_id}/delivery")
+async def update_order_delivery(order_id: str, delivery_info: DeliveryInfo):
+    """Update order with delivery information and mark as completed"""
+    updates = {
+        "delivery_info": {"details": delivery_info.delivery_details, "delivered_at": datetime.now(timezone.utc)},
+        "order_status": "completed",
+        "payment_status": "paid",
+        "updated_at": datetime.now(timezone.utc)
+    }
+    
+    result = await db.orders.update_one({"id": order_id}, {"$set": updates})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Order not found")
+    events.changed("orders", order_id)
+
+    # Set subscription dates if this order is a subscription
+    order = await _set_subscription_dates_if_needed(order_id)
+    if not order:
+        order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+
+    # Award loyalty credits once order is completed+paid
+    await _record_loyalty_credits_if_needed(order_id)
+
+    # Send delivery email (includes expiry if subscription)
+    try:
+        settings = await _site_settings() or {}
+        if order and order.get("user_email"):
+            end = _as_utc(order.get("subscription_end_date"))
+            end_str = _format_dt(end) if end else ""
+            extra = f"<p><b>Subscription ends:</b> {end_str}</p>" if end_str else ""
+            html = (
+                f"<div style='font-family:Arial,sans-serif'>"
+                f"<h2>Your order has been delivered</h2>"
+                f"<p><b>Order:</b> {order_id}</p>"
+                f"<p><b>Delivery details:</b></p>"
+                f"<pre style='background:#111827;color:#D1D5DB;padding:12px;border-radius:8px;white-space:pre-wrap'>{delivery_info.delivery_details}</pre>"
+                f"{extra}"
+                f"</div>"
+            )
+            # Queued: the Resend call is blocking and must not hold the event loop
+            background.QUEUE.submit("delivery_email", _send_resend_email, settings, order["user_email"], "Your delivery is ready", html)
+    except Exception as e:
+        logging.error(f"Delivery email error: {e}")
+
+    # Schedule/trigger reminder checks immediately
+    if order:
+        try:
+            await _maybe_send_subscription_emails(order)
+        except Exception as e:
+            logging.error(f"Subscription email check error: {e}")
+
+    return {"message": "Order delivered successfully"}
+
+
+# ==================== PAYMENT ENDPOINTS ====================
+
+@router.post("/payments/manual-proof")
+async def upload_payment_proof(proof_data: ManualPaymentProof):
+    # Update order with payment proof
+    result = await db.orders.update_one(
+        {"id": proof_data.order_id},
+        {"$set": {
+            "payment_proof_url": proof_data.payment_proof_url,
+            "transaction_id": proof_data.transaction_id,
+            "payment_status": "pending_verification",
+            "updated_at": datetime.now(timezone.utc)
+        }}
+    )
+    
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Order not found")
+    events.changed("orders", proof_data.order_id)
+    
+    return {"message": "Payment proof uploaded successfully"}
+
+@router.post("/payments/plisio-callback")
+async def plisio_callback(data: Dict[str, Any]):
+    # Handle Plisio webhook
+    order_id = data.get('order_number')
+    status = data.get('status')
+    
+    if status == 'completed':
+        # First try normal orders
+        order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+        if order:
+            await db.orders.update_one(
+                {"id": order_id},
+                {"$set": {
+                    "payment_status": "paid",
+                    "order_status": "processing",
+                    "updated_at": datetime.now(timezone.utc)
+                }}
+            )
+            events.changed("orders", order_id)
+            await _record_coupon_usage_if_needed(order_id)
+        else:
+            # Then try wallet topups
+            topup = await db.wallet_topups.find_one({"id": order_id}, {"_id": 0})
+            if topup:
+                await db.wallet_topups.update_one(
+                    {"id": order_id},
+                    {"$set": {
+                        "payment_status": "paid",
+                        "updated_at": datetime.now(timezone.utc)
+                    }}
+                )
+                if not topup.get("credited"):
+                    await _credit_topup(topup, f"Wallet topup {order_id} (Plisio)")
+                events.changed("wallet_topups", order_id)
+            else:
+                # Then try minutes transfers
+                transfer = await db.minutes_transfers.find_one({"id": order_id}, {"_id": 0})
+                if transfer:
+                    await db.minutes_transfers.update_one(
+                        {"id": order_id},
+                        {"$set": {
+                            "payment_status": "paid",
+                            "transfer_status": "processing",
+                            "updated_at": datetime.now(timezone.utc)
+                        }}
+                    )
+                    events.changed("minutes_transfers", order_id)
+    
+    return {"status": "ok"}
+
+@router.get("/payments/plisio-status/{invoice_id}", dependencies=[Depends(rate_limit.limit("plisio_status"))])
+async def check_plisio_status(invoice_id: str):
+    settings = await _site_settings()
+    if not settings or not settings.get('plisio_api_key'):
+        raise HTTPException(status_code=400, detail="Plisio not configured")
+    
+    try:
+        with http_clients.outbound("plisio", "operation_status"):
+            response = http_clients.sync_session().get(
+                f"https://api.plisio.net/api/v1/operations/{invoice_id}",
+                params={"api_key": settings['plisio_api_key']}
+            )
+        return response.json()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ==================== REFUND / COMPLETE ====================
+
+@router.post("/orders/{order_id}/refund")
+async def refund_order_to_wallet(order_id: str, adjustment: WalletAdjustment):
+    """
+    Refund an order to the user's wallet (store credit).
+    This is intended for admin use (no auth implemented in this project).
+    """
+    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    if order.get("refunded_at"):
+        raise HTTPException(status_code=400, detail="Order already refunded")
+
+    if float(adjustment.amount) <= 0:
+        raise HTTPException(status_code=400, detail="Refund amount must be > 0")
+
+    user_id = order.get("user_id")
+    user_email = order.get("user_email")
+
+    # Credit wallet
+    await ledger_writes(db.users).update_one({"id": user_id}, {"$inc": {"wallet_balance": float(adjustment.amount)}})
+    await ledger_writes(db.wallet_transactions).insert_one({
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "user_email": user_email,
+        "order_id": order_id,
+        "type": "refund",
+        "amount": float(adjustment.amount),
+        "reason": adjustment.reason or "Order refund",
+        "created_at": datetime.now(timezone.utc)
+    })
+
+    # Update order
+    await db.orders.update_one(
+        {"id": order_id},
+        {"$set": {
+            "order_status": "cancelled",
+            "payment_status": "cancelled",
+            "refunded_amount": float(adjustment.amount),
+            "refunded_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
+        }}
+    )
+    events.changed("orders", order_id)
+
+    return {"message": "Refunded to wallet", "user_id": user_id, "amount": float(adjustment.amount)}
+
+# Modify order status endpoint to trigger referral check
+@router.put("/orders/{order_id}/complete")
+async def complete_order_with_referral_check(order_id: str):
+    """Complete order and check for referral payout"""
+    order = await db.orders.find_one({"id": order_id})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    # Update order status
+    await db.orders.update_one(
+        {"id": order_id},
+        {"$set": {
+            "order_status": "completed",
+            "payment_status": "paid",
+            "updated_at": datetime.now(timezone.utc)
+        }}
+    )
+    events.changed("orders", order_id)
+
+    await _record_coupon_usage_if_needed(order_id)
+    await _set_subscription_dates_if_needed(order_id)
+    updated = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    try:
+        await _maybe_send_subscription_emails(updated or order)
+    except Exception as e:
+        logging.error(f"Subscription email check error: {e}")
+    
+    # Check and credit referral
+    await check_and_credit_referral(order)
+
+    # Award loyalty credits for successful order
+    await _record_loyalty_credits_if_needed(order_id)
+    
+    return {"message": "Order completed"}
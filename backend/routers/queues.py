@@ -0,0 +1,136 @@
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException
+
+import events
+import metrics
+from core import _as_utc, db
+
+router = APIRouter(route_class=metrics.MetricsRoute)
+
+# ==================== ADMIN WORK QUEUES ====================
+
+# Each console asks for one queue (a fixed status filter) instead of the last
+# 1000 full documents. Every queue has its own partial index, (status fields,
+# created_at, id), holding only the documents in it, so listing and counting
+# touch queued documents only, however large the collection grows. Filters
+# are plain equalities so they work as partialFilterExpression.
+
+
+class _Kind:
+    __slots__ = ("collection", "queues", "projection")
+
+    def __init__(self, collection: str, queues: Dict[str, Dict[str, Any]], fields: Tuple[str, ...]):
+        self.collection = collection
+        self.queues = queues
+        self.projection = {"_id": 0, **{f: 1 for f in fields}}
+
+
+_KINDS: Dict[str, _Kind] = {
+    "orders": _Kind(
+        "orders",
+        {
+            "pending_verification": {"payment_status": "pending_verification"},
+            "processing": {"order_status": "processing"},
+            "awaiting_delivery": {"payment_status": "paid", "order_status": "processing"},
+        },
+        # What AdminOrders.jsx renders; the change feed carries the same fields
+        events.TOPICS["orders"],
+    ),
+    "minutes-transfers": _Kind(
+        "minutes_transfers",
+        {
+            "pending_verification": {"payment_status": "pending_verification"},
+            "processing": {"transfer_status": "processing"},
+        },
+        events.TOPICS["minutes_transfers"],
+    ),
+    "wallet-topups": _Kind(
+        "wallet_topups",
+        {"pending_verification": {"payment_status": "pending_verification"}},
+        events.TOPICS["wallet_topups"],
+    ),
+    "withdrawals": _Kind(
+        "withdrawals",
+        {"pending": {"status": "pending"}, "approved": {"status": "approved"}},
+        events.TOPICS["withdrawals"],
+    ),
+}
+
+DEFAULT_PAGE = 50
+MAX_PAGE = 200
+
+
+def _index_name(kind: _Kind, queue: str) -> str:
+    return f"queue_{kind.collection}_{queue}"
+
+
+def queue_indexes() -> Iterator[Tuple[str, List[Tuple[str, int]], str, Dict[str, Any]]]:
+    """(collection, keys, index name, partial filter) for every queue; created by ensure_indexes."""
+    for kind in _KINDS.values():
+        for queue, query in kind.queues.items():
+            keys = [(field, 1) for field in query] + [("created_at", 1), ("id", 1)]
+            yield kind.collection, keys, _index_name(kind, queue), query
+
+
+def _lookup(kind_name: str, queue: Optional[str] = None) -> _Kind:
+    kind = _KINDS.get(kind_name)
+    if kind is None:
+        raise HTTPException(status_code=404, detail=f"Unknown queue kind. Use one of: {', '.join(_KINDS)}")
+    if queue is not None and queue not in kind.queues:
+        raise HTTPException(status_code=404, detail=f"Unknown queue. Use one of: {', '.join(kind.queues)}")
+    return kind
+
+
+async def _counts(kind: _Kind) -> Dict[str, int]:
+    coll = db[kind.collection]
+    return {
+        queue: await coll.count_documents(query)
+        for queue, query in kind.queues.items()
+    }
+
+
+def _parse_cursor(after: str) -> Tuple[datetime, str]:
+    created_at, _, last_id = after.partition("|")
+    parsed = _as_utc(created_at)
+    if parsed is None or not last_id:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return parsed, last_id
+
+
+@router.get("/admin/queues")
+async def get_queue_counts():
+    """Admin: how many items wait in each work queue"""
+    return {name: await _counts(kind) for name, kind in _KINDS.items()}
+
+
+@router.get("/admin/queues/{kind_name}/{queue}")
+async def get_queue(kind_name: str, queue: str, limit: int = DEFAULT_PAGE, after: Optional[str] = None):
+    """
+    Admin: one page of a work queue, oldest first, with only the fields the
+    console shows. Pass back `next` as `after` for the following page.
+    """
+    kind = _lookup(kind_name, queue)
+    limit = max(1, min(limit, MAX_PAGE))
+    query: Dict[str, Any] = dict(kind.queues[queue])
+    if after:
+        created_at, last_id = _parse_cursor(after)
+        query["$or"] = [{"created_at": {"$gt": created_at}}, {"created_at": created_at, "id": {"$gt": last_id}}]
+
+    coll = db[kind.collection]
+    items: List[Dict[str, Any]] = await coll.find(query, kind.projection).sort(
+        [("created_at", 1), ("id", 1)]
+    ).limit(limit).to_list(limit)
+
+    next_cursor = None
+    if len(items) == limit:
+        last = items[-1]
+        next_cursor = f"{_as_utc(last['created_at']).isoformat()}|{last['id']}"
+    return {
+        "kind": kind_name,
+        "queue": queue,
+        "count": await coll.count_documents(kind.queues[queue]),
+        "items": items,
+        "next": next_cursor,
+    }
@@ -0,0 +1,259 @@
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+import metrics
+from cache import ReadThroughCache
+from core import db
+from database import apply_credit, ledger_writes, release_credit
+
+router = APIRouter(route_class=metrics.MetricsRoute)
+
+# ==================== REFERRAL STATS ====================
+
+# Each referrer carries materialized stats on its user document:
+#   referral_count    - users registered with its code ($inc at registration)
+#   referral_earnings - total referral payouts ($inc at payout)
+# so nothing counts referred users per request. backfill_referral_stats()
+# computes them once for data from before they existed.
+
+REFERRAL_PAYOUT = 1.0
+LEADERBOARD_MAX = 50
+# Payouts still uncredited this long after being recorded are finished by the
+# reconciler; also how long a crediting lease lasts
+_PAYOUT_RECONCILE_AFTER = timedelta(minutes=10)
+# Unique referral_payouts indexes (see ensure_indexes), by the field each keeps unique
+PAYOUT_UNIQUE_INDEXES = {"referral_payout_user": "referred_user_id", "referral_payout_order": "order_id"}
+
+
+async def register_referral(referral_code: Optional[str]) -> Optional[str]:
+    """Count a new referral for the code's owner; returns the code if it belongs to someone."""
+    if not referral_code:
+        return None
+    res = await db.users.update_one({"referral_code": referral_code}, {"$inc": {"referral_count": 1}})
+    return referral_code if res.matched_count else None
+
+
+async def unregister_referral(referral_code: str) -> None:
+    """Undo register_referral when the new user could not be created after all."""
+    await db.users.update_one({"referral_code": referral_code}, {"$inc": {"referral_count": -1}})
+
+
+async def check_and_credit_referral(order: dict):
+    """Check if order qualifies for referral payout and credit referrer"""
+    # Only for paid + completed orders
+    if order.get("payment_status") != "paid" or order.get("order_status") != "completed":
+        return
+
+    # Check if user was referred
+    user = await db.users.find_one({"id": order['user_id']}, {"_id": 0, "referred_by": 1})
+    if not user or not user.get('referred_by'):
+        return
+
+    # Check if order contains subscription
+    product_ids = list({item.get('product_id') for item in order.get('items', []) if item.get('product_id')})
+    if not product_ids or not await db.products.find_one({"id": {"$in": product_ids}, "is_subscription": True}, {"_id": 0, "id": 1}):
+        return
+
+    # Only the first PAID+COMPLETED subscription order of a referred user pays out, once.
+    # Unique indexes on order_id and referred_user_id make the insert the check; until
+    # they exist (duplicates in old data block them) an explicit probe stands in.
+    if not await _payout_indexes.get():
+        if await db.referral_payouts.find_one(
+            {"$or": [{"referred_user_id": order['user_id']}, {"order_id": order['id']}]}, {"_id": 0, "id": 1}
+        ):
+            return
+    payout = {
+        "id": str(uuid.uuid4()),
+        "referrer_code": user['referred_by'],
+        "referred_user_id": order['user_id'],
+        "order_id": order['id'],
+        "amount": REFERRAL_PAYOUT,
+        "credited": False,
+        "created_at": datetime.now(timezone.utc)
+    }
+    try:
+        await ledger_writes(db.referral_payouts).insert_one(payout)
+    except DuplicateKeyError:
+        return
+    await _credit_payout(payout)
+
+
+async def _load_payout_indexes(_key) -> bool:
+    names = await db.referral_payouts.index_information()
+    return all(name in names for name in PAYOUT_UNIQUE_INDEXES)
+
+# Rechecked every few minutes, so workers notice once backfill_referral_stats.py builds them
+_payout_indexes = ReadThroughCache(_load_payout_indexes, ttl=300)
+
+
+async def _credit_payout(payout: Dict[str, Any]) -> bool:
+    """
+    Credit a recorded payout to its referrer, at most once. `crediting_at`
+    is a lease: only its holder moves the balance, and a lease left by a
+    crashed process lapses, so the reconciler finishes the payout. Applying
+    the credit is idempotent (see apply_credit), so finishing after a crash
+    between the balance and the `credited` flag doesn't pay twice.
+    """
+    now = datetime.now(timezone.utc)
+    claim = await db.referral_payouts.update_one(
+        {"id": payout["id"], "credited": False,
+         "$or": [{"crediting_at": None}, {"crediting_at": {"$lt": now - _PAYOUT_RECONCILE_AFTER}}]},
+        {"$set": {"crediting_at": now}},
+    )
+    if claim.modified_count != 1:
+        return False
+    referrer = {"referral_code": payout["referrer_code"]}
+    key = f"referral_payout:{payout['id']}"
+    await apply_credit(db.users, referrer,
+                       {"referral_balance": payout["amount"], "referral_earnings": payout["amount"]}, key)
+    await ledger_writes(db.referral_payouts).update_one(
+        {"id": payout["id"]},
+        {"$set": {"credited": True, "credited_at": datetime.now(timezone.utc)}, "$unset": {"crediting_at": ""}},
+    )
+    await release_credit(db.users, referrer, key)
+    return True
+
+
+# A payout is normally credited right after it is recorded; this finishes ones
+# where the process died before `credited` was set, whether or not the balance
+# had moved yet. Payouts from before `credited` existed were paid at insert and
+# have no flag, so they are never picked up.
+async def _reconcile_referral_payouts() -> Dict[str, Any]:
+    cutoff = datetime.now(timezone.utc) - _PAYOUT_RECONCILE_AFTER
+    stuck = await db.referral_payouts.find(
+        {"credited": False, "created_at": {"$lt": cutoff}},
+        {"_id": 0, "id": 1, "referrer_code": 1, "amount": 1},
+    ).to_list(500)
+
+    credited = 0
+    for payout in stuck:
+        if await _credit_payout(payout):
+            credited += 1
+    return {"checked": len(stuck), "credited": credited}
+
+
+# ==================== PAYOUT DEDUPLICATION ====================
+
+# referral_payouts from before its unique indexes may hold more than one payout
+# per referred user or order, and then the indexes can't be built. The extra
+# ones (all but the earliest) move to referral_payouts_duplicates for review;
+# they were already paid, so no balance changes.
+
+
+
+async def _duplicate_payout_ids(key: str) -> List[str]:
+    rows = await db.referral_payouts.aggregate([
+        {"$sort": {"created_at": 1}},
+        {"$group": {"_id": f"${key}", "ids": {"$push": "$id"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+    ]).to_list(None)
+    return [pid for row in rows for pid in row["ids"][1:]]
+
+
+async def dedupe_referral_payouts() -> Dict[str, int]:
+    """Move duplicate payouts aside so the unique payout indexes can be built. Safe to re-run."""
+    moved = 0
+    for key in PAYOUT_UNIQUE_INDEXES.values():
+        ids = await _duplicate_payout_ids(key)
+        if not ids:
+            continue
+        docs = await db.referral_payouts.find({"id": {"$in": ids}}, {"_id": 0}).to_list(None)
+        await ledger_writes(db.referral_payouts_duplicates).insert_many(
+            [{**d, "duplicate_of": key, "moved_at": datetime.now(timezone.utc)} for d in docs]
+        )
+        await ledger_writes(db.referral_payouts).delete_many({"id": {"$in": ids}})
+        moved += len(docs)
+    _payout_indexes.invalidate()
+    return {"moved": moved}
+
+
+async def backfill_referral_stats(batch_size: int = 500) -> Dict[str, int]:
+    """
+    One-shot job: (re)compute referral_count and referral_earnings for every
+    referrer from users.referred_by and referral_payouts. Safe to re-run.
+    Run it once before relying on the materialized stats.
+    """
+    counts = {
+        row["_id"]: row["n"]
+        for row in await db.users.aggregate([
+            {"$match": {"referred_by": {"$gt": ""}}},
+            {"$group": {"_id": "$referred_by", "n": {"$sum": 1}}},
+        ]).to_list(None)
+    }
+    earnings = {
+        row["_id"]: row["total"]
+        for row in await db.referral_payouts.aggregate([
+            {"$group": {"_id": "$referrer_code", "total": {"$sum": "$amount"}}},
+        ]).to_list(None)
+    }
+    codes = sorted(set(counts) | set(earnings))
+    ops = [
+        UpdateOne({"referral_code": code}, {"$set": {
+            "referral_count": counts.get(code, 0),
+            "referral_earnings": float(earnings.get(code, 0.0)),
+        }})
+        for code in codes
+    ]
+    updated = 0
+    for start in range(0, len(ops), batch_size):
+        updated += (await db.users.bulk_write(ops[start:start + batch_size], ordered=False)).matched_count
+    return {"referrers": len(codes), "updated": updated}
+
+
+# ==================== REFERRAL ENDPOINTS ====================
+
+@router.get("/referral/info")
+async def get_referral_info(user_id: str):
+    """Get user's referral code and balance"""
+    user = await db.users.find_one(
+        {"id": user_id},
+        {"_id": 0, "referral_code": 1, "referral_balance": 1, "held_balance": 1, "referral_count": 1, "referral_earnings": 1},
+    )
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return {
+        "referral_code": user.get('referral_code'),
+        "referral_balance": user.get('referral_balance', 0.0),
+        "held_balance": user.get('held_balance', 0.0),
+        "total_referrals": user.get('referral_count', 0),
+        "total_earnings": user.get('referral_earnings', 0.0),
+        "referral_link": f"{os.environ.get('FRONTEND_URL', 'http://localhost:3000')}/register?ref={user.get('referral_code')}"
+    }
+
+
+def _display_name(user: Dict[str, Any]) -> str:
+    # Public list: first name and last initial only
+    parts = (user.get("full_name") or user.get("username") or "Customer").split()
+    return parts[0] if len(parts) == 1 else f"{parts[0]} {parts[-1][0]}."
+
+
+async def _load_leaderboard(_key) -> List[Dict[str, Any]]:
+    top = await db.users.find(
+        {"referral_count": {"$gt": 0}},
+        {"_id": 0, "full_name": 1, "username": 1, "referral_count": 1, "referral_earnings": 1},
+    ).sort([("referral_count", -1), ("referral_earnings", -1)]).limit(LEADERBOARD_MAX).to_list(LEADERBOARD_MAX)
+    return [
+        {
+            "rank": rank,
+            "name": _display_name(user),
+            "referrals": user.get("referral_count", 0),
+            "earnings": float(user.get("referral_earnings", 0.0)),
+        }
+        for rank, user in enumerate(top, start=1)
+    ]
+
+_leaderboard_cache = ReadThroughCache(_load_leaderboard, ttl=60)
+
+
+@router.get("/referral/leaderboard")
+async def get_referral_leaderboard(limit: int = 10):
+    """Top referrers by referral count, from the materialized stats"""
+    board = await _leaderboard_cache.get()
+    return board[:max(1, min(limit, LEADERBOARD_MAX))]
@@ -0,0 +1,207 @@
+import copy
+import os
+import traceback
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+
+import metrics
+from core import db, pwd_context
+from routers.catalog import _catalog_cache
+
+router = APIRouter(route_class=metrics.MetricsRoute)
+
+# ==================== TEMPORARY INTERNAL SEEDING ENDPOINT ====================
+# ⚠️  SECURITY WARNING: Remove this endpoint after initial setup!
+# This endpoint is for one-time database seeding in Railway deployment
+
+class SeedRequest(BaseModel):
+    secret: str
+
+class SeedResponse(BaseModel):
+    success: bool
+    message: str
+    results: Dict[str, Any]
+
+async def create_admin_internal() -> Dict[str, Any]:
+    """Create admin user if doesn't exist, or update old admin email to new one"""
+    try:
+        new_email = "kayicom509@gmail.com"
+        old_email = "info.kayicom.com@gmx.fr"
+
+        # 1. Check if the new email already exists
+        existing_new = await db.users.find_one({"email": new_email})
+        if existing_new:
+            return {"status": "skipped", "message": "Admin user with new email already exists", "user_id": str(existing_new.get("_id"))}
+
+        # 2. Check if the old email exists to update it
+        existing_old = await db.users.find_one({"email": old_email})
+        if existing_old:
+            await db.users.update_one({"email": old_email}, {"$set": {"email": new_email}})
+            return {"status": "updated", "message": f"Updated admin email from {old_email} to {new_email}", "user_id": str(existing_old.get("_id"))}
+
+        # Create admin user
+        hashed_password = pwd_context.hash("admin123")
+
+        admin_user = {
+            "id": "admin-001",
+            "email": "kayicom509@gmail.com",
+            "full_name": "Admin User",
+            "password": hashed_password,
+            "role": "admin",
+            "referral_code": "ADMIN001",
+            "referral_balance": 0.0,
+            "created_at": datetime.now(timezone.utc)
+        }
+
+        result = await db.users.insert_one(admin_user)
+        return {"status": "created", "message": "Admin user created successfully", "user_id": str(result.inserted_id)}
+
+    except Exception as e:
+        return {"status": "error", "message": f"Failed to create admin: {str(e)}", "error": traceback.format_exc()}
+
+async def seed_demo_products_internal() -> Dict[str, Any]:
+    """Seed demo products if not already seeded"""
+    try:
+        # Check if products already exist
+        existing_count = await db.products.count_documents({})
+        if existing_count > 0:
+            return {"status": "skipped", "message": f"Products already exist ({existing_count} products found)"}
+
+        import seed_data  # fixtures load on first seed, not at worker startup
+
+        total_added = 0
+
+        for product_group in copy.deepcopy(seed_data.DEMO_PRODUCTS):
+            variants = product_group.pop("variants", [])
+
+            if variants:
+                # Create parent product
+                parent_id = str(uuid.uuid4())
+                parent_product = {
+                    **product_group,
+                    "id": parent_id,
+                    "created_at": datetime.now(timezone.utc)
+                }
+                await db.products.insert_one(parent_product)
+
+                # Create variant products
+                for variant in variants:
+                    variant_product = {
+                        **product_group,
+                        "id": str(uuid.uuid4()),
+                        "parent_product_id": parent_id,
+                        "variant_name": variant.get("value") or variant.get("duration"),
+                        "price": variant["price"],
+                        "region": variant.get("region"),
+                        "subscription_duration_months": None,  # Will be set if duration
+                        "created_at": datetime.now(timezone.utc)
+                    }
+
+                    # Handle duration for subscriptions
+                    if "duration" in variant:
+                        duration_map = {
+                            "1 Month": 1,
+                            "3 Months": 3,
+                            "6 Months": 6,
+                            "12 Months": 12,
+                            "24 Months": 24
+                        }
+                        variant_product["subscription_duration_months"] = duration_map.get(variant["duration"])
+
+                    await db.products.insert_one(variant_product)
+                    total_added += 1
+            else:
+                # Single product without variants
+                single_product = {
+                    **product_group,
+                    "id": str(uuid.uuid4()),
+                    "created_at": datetime.now(timezone.utc)
+                }
+                await db.products.insert_one(single_product)
+                total_added += 1
+
+        _catalog_cache.invalidate()
+        return {"status": "created", "message": f"Successfully seeded {total_added} demo products"}
+
+    except Exception as e:
+        return {"status": "error", "message": f"Failed to seed products: {str(e)}", "error": traceback.format_exc()}
+
+async def seed_games_internal() -> Dict[str, Any]:
+    """Seed game configurations if not already seeded"""
+    try:
+        # Check if games already exist
+        existing_count = await db.games.count_documents({})
+        if existing_count > 0:
+            return {"status": "skipped", "message": f"Game configurations already exist ({existing_count} games found)"}
+
+        import seed_data
+
+        added_games = []
+        for game_config in seed_data.GAMES_CONFIG:
+            game_doc = {
+                **game_config,
+                "id": str(uuid.uuid4()),
+                "created_at": datetime.now(timezone.utc),
+                "updated_at": datetime.now(timezone.utc)
+            }
+            await db.games.insert_one(game_doc)
+            added_games.append(game_config["name"])
+
+        return {"status": "created", "message": f"Successfully seeded {len(added_games)} game configurations", "games": added_games}
+
+    except Exception as e:
+        return {"status": "error", "message": f"Failed to seed games: {str(e)}", "error": traceback.format_exc()}
+
+@router.post("/__internal/seed", response_model=SeedResponse)
+async def seed_database(request: SeedRequest):
+    """
+    TEMPORARY INTERNAL ENDPOINT - Remove after use!
+    Seeds the database with admin user, demo products, and game configurations.
+    Protected by SEED_SECRET environment variable.
+    """
+    # Check seed secret
+    expected_secret = os.environ.get("SEED_SECRET")
+    if not expected_secret:
+        raise HTTPException(status_code=500, detail="SEED_SECRET environment variable not configured")
+
+    if request.secret != expected_secret:
+        raise HTTPException(status_code=403, detail="Invalid seed secret")
+
+    try:
+        results = {}
+
+        # Run seeding operations
+        results["admin_user"] = await create_admin_internal()
+        results["demo_products"] = await seed_demo_products_internal()
+        results["game_configs"] = await seed_games_internal()
+
+        # Check final state
+        final_admin = await db.users.count_documents({"email": "kayicom509@gmail.com"})
+        final_products = await db.products.count_documents({})
+        final_games = await db.games.count_documents({})
+
+        results["summary"] = {
+            "admin_users": final_admin,
+            "products": final_products,
+            "games": final_games,
+            "total_items": final_admin + final_products + final_games
+        }
+
+        return SeedResponse(
+            success=True,
+            message="Database seeding completed successfully",
+            results=results
+        )
+
+    except Exception as e:
+        return SeedResponse(
+            success=False,
+            message=f"Database seeding failed: {str(e)}",
+            results={"error": traceback.format_exc()}
+        )
+
+# ==================== END TEMPORARY SEEDING ENDPOINT ====================
@@ -0,0 +1,679 @@
+import csv
+import io
+import logging
+import re
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+from pymongo import UpdateOne
+
+import events
+import metrics
+import sessions
+from core import _site_settings, db
+from database import apply_credit, ledger_writes, release_credit
+from models import WithdrawalRequest
+
+router = APIRouter(route_class=metrics.MetricsRoute)
+
+# ==================== TOPUP CREDIT ====================
+
+# Topups still uncredited this long after their last update are finished by the
+# reconciler; also how long a crediting lease lasts
+_TOPUP_RECONCILE_AFTER = timedelta(minutes=10)
+
+async def _credit_topup(topup: Dict[str, Any], reason: str) -> bool:
+    """
+    Credit a paid topup to its user's wallet, at most once. `crediting_at`
+    is a lease: only its holder (admin status, Plisio callback or reconciler)
+    moves the balance, and a lease left by a crashed process lapses, so the
+    reconciler finishes the topup. Applying the credit and its ledger row are
+    idempotent, so finishing after a crash before `credited` doesn't pay twice.
+    """
+    now = datetime.now(timezone.utc)
+    claim = await db.wallet_topups.update_one(
+        {"id": topup["id"], "credited": {"$ne": True},
+         "$or": [{"crediting_at": None}, {"crediting_at": {"$lt": now - _TOPUP_RECONCILE_AFTER}}]},
+        {"$set": {"crediting_at": now}},
+    )
+    if claim.modified_count != 1:
+        return False
+    user = {"id": topup["user_id"]}
+    key = f"topup:{topup['id']}"
+    await apply_credit(db.users, user, {"wallet_balance": float(topup["amount"])}, key)
+    await ledger_writes(db.wallet_transactions).update_one(
+        {"topup_id": topup["id"], "type": "topup"},
+        {"$setOnInsert": {
+            "id": str(uuid.uuid4()),
+            "user_id": topup["user_id"],
+            "user_email": topup.get("user_email"),
+            "order_id": None,
+            "amount": float(topup["amount"]),
+            "reason": reason,
+            "created_at": datetime.now(timezone.utc)
+        }},
+        upsert=True,
+    )
+    await ledger_writes(db.wallet_topups).update_one(
+        {"id": topup["id"]},
+        {"$set": {"credited": True, "credited_at": datetime.now(timezone.utc)}, "$unset": {"crediting_at": ""}},
+    )
+    await release_credit(db.users, user, key)
+    events.changed("wallet_topups", topup["id"])
+    return True
+
+
+# ==================== TOPUP RECONCILER ====================
+
+# A topup is normally credited right after it is marked paid; this finishes ones
+# where the process died before `credited` was set, whether or not the balance
+# had moved yet. Only topups idle for a while are touched.
+async def _reconcile_paid_topups() -> Dict[str, Any]:
+    cutoff = datetime.now(timezone.utc) - _TOPUP_RECONCILE_AFTER
+    stuck = await db.wallet_topups.find(
+        {"payment_status": "paid", "credited": {"$ne": True}, "updated_at": {"$lt": cutoff}},
+        {"_id": 0, "id": 1, "user_id": 1, "user_email": 1, "amount": 1},
+    ).to_list(500)
+
+    credited = 0
+    for topup in stuck:
+        if await _credit_topup(topup, f"Wallet topup {topup['id']} (reconciled)"):
+            credited += 1
+    return {"checked": len(stuck), "credited": credited}
+
+
+# ==================== WITHDRAWAL ENDPOINTS ====================
+
+@router.post("/withdrawals/request")
+async def request_withdrawal(withdrawal: WithdrawalRequest, session: sessions.Session = Depends(sessions.customer)):
+    """User requests withdrawal"""
+    user_id, user_email = session.user_id, session.email
+    # Check minimum
+    if withdrawal.amount < 5.0:
+        raise HTTPException(status_code=400, detail="Minimum withdrawal is $5")
+    
+    # Validate method-specific fields
+    if withdrawal.method in ['usdt_bep20', 'btc'] and not withdrawal.wallet_address:
+        raise HTTPException(status_code=400, detail="Wallet address required")
+    if withdrawal.method == 'paypal' and not withdrawal.paypal_email:
+        raise HTTPException(status_code=400, detail="PayPal email required")
+    if withdrawal.method == 'moncash' and (not withdrawal.moncash_phone or not withdrawal.moncash_name):
+        raise HTTPException(status_code=400, detail="MonCash phone and name required")
+    
+    # Create withdrawal request
+    withdrawal_doc = {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "user_email": user_email,
+        "amount": withdrawal.amount,
+        "method": withdrawal.method,
+        "wallet_address": withdrawal.wallet_address,
+        "paypal_email": withdrawal.paypal_email,
+        "moncash_phone": withdrawal.moncash_phone if withdrawal.method == 'moncash' else None,
+        "moncash_name": withdrawal.moncash_name if withdrawal.method == 'moncash' else None,
+        "status": "pending",
+        "held": True,
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
+    }
+    
+    # Move the amount to held_balance; the balance check is part of the write,
+    # so concurrent requests can't both spend the same balance
+    hold = await ledger_writes(db.users).update_one(
+        {"id": user_id, "referral_balance": {"$gte": withdrawal.amount}},
+        {"$inc": {"referral_balance": -withdrawal.amount, "held_balance": withdrawal.amount}}
+    )
+    if hold.matched_count == 0:
+        raise HTTPException(status_code=400, detail="Insufficient balance")
+
+    try:
+        await db.withdrawals.insert_one(withdrawal_doc)
+    except Exception:
+        await ledger_writes(db.users).update_one(
+            {"id": user_id},
+            {"$inc": {"referral_balance": withdrawal.amount, "held_balance": -withdrawal.amount}}
+        )
+        raise
+    events.changed("withdrawals", withdrawal_doc["id"])
+    
+    return {"message": "Withdrawal request submitted", "withdrawal_id": withdrawal_doc['id']}
+
+@router.get("/withdrawals/user/{user_id}")
+async def get_user_withdrawals(user_id: str):
+    """Get user's withdrawal history"""
+    withdrawals = await db.withdrawals.find(
+        {"user_id": user_id},
+        {"_id": 0}
+    ).sort("created_at", -1).to_list(100)
+    
+    return withdrawals
+
+@router.get("/withdrawals/all")
+async def get_all_withdrawals():
+    """Admin: Get all withdrawal requests"""
+    withdrawals = await db.withdrawals.find(
+        {},
+        {"_id": 0}
+    ).sort("created_at", -1).to_list(1000)
+    
+    return withdrawals
+
+# Status a withdrawal may move to, from which statuses. Held funds leave
+# held_balance on completion and go back to referral_balance on rejection.
+_WITHDRAWAL_TRANSITIONS = {
+    "approved": ("pending",),
+    "completed": ("pending", "approved"),
+    "rejected": ("pending", "approved"),
+}
+
+
+async def _transition_withdrawals(ids: List[str], status: str, admin_notes: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Move many withdrawals to `status` at once. One update_many claims every
+    withdrawal still in an allowed source status (tagged with a batch id, so
+    a concurrent batch can't process the same one), then one bulk_write
+    settles the balances per user.
+    """
+    if status not in _WITHDRAWAL_TRANSITIONS:
+        raise HTTPException(status_code=400, detail="Invalid status")
+    batch_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    claimed_from = await db.withdrawals.find(
+        {"id": {"$in": ids}, "status": {"$in": list(_WITHDRAWAL_TRANSITIONS[status])}},
+        {"_id": 0, "id": 1, "status": 1},
+    ).to_list(None)
+    previous = {w["id"]: w["status"] for w in claimed_from}
+
+    updates: Dict[str, Any] = {"status": status, "batch_id": batch_id, "updated_at": now}
+    if admin_notes:
+        updates["admin_notes"] = admin_notes
+    await db.withdrawals.update_many(
+        {"id": {"$in": list(previous)}, "status": {"$in": list(_WITHDRAWAL_TRANSITIONS[status])}},
+        {"$set": updates},
+    )
+    claimed = await db.withdrawals.find(
+        {"batch_id": batch_id}, {"_id": 0, "id": 1, "user_id": 1, "amount": 1, "held": 1}
+    ).to_list(None)
+
+    # Net balance change per user
+    deltas: Dict[str, Dict[str, float]] = {}
+    for w in claimed:
+        amount = float(w["amount"])
+        inc = deltas.setdefault(w["user_id"], {})
+        if w.get("held"):
+            if status in ("completed", "rejected"):
+                inc["held_balance"] = inc.get("held_balance", 0.0) - amount
+            if status == "rejected":
+                inc["referral_balance"] = inc.get("referral_balance", 0.0) + amount
+        elif status == "rejected" and previous.get(w["id"]) == "pending":
+            # Requested before holds existed: the amount was deducted outright
+            inc["referral_balance"] = inc.get("referral_balance", 0.0) + amount
+    ops = [UpdateOne({"id": user_id}, {"$inc": inc}) for user_id, inc in deltas.items() if inc]
+    if ops:
+        await ledger_writes(db.users).bulk_write(ops, ordered=False)
+
+    claimed_ids = {w["id"] for w in claimed}
+    events.changed("withdrawals", *claimed_ids)
+    return {"status": status, "updated": sorted(claimed_ids), "skipped": [i for i in ids if i not in claimed_ids]}
+
+
+class WithdrawalBatchUpdate(BaseModel):
+    ids: List[str]
+    status: str
+    admin_notes: Optional[str] = None
+
+
+@router.put("/withdrawals/{withdrawal_id}/status")
+async def update_withdrawal_status(withdrawal_id: str, status: str, admin_notes: Optional[str] = None):
+    """Admin: Update withdrawal status"""
+    result = await _transition_withdrawals([withdrawal_id], status, admin_notes)
+    if not result["updated"]:
+        current = await db.withdrawals.find_one({"id": withdrawal_id}, {"_id": 0, "status": 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="Withdrawal not found")
+        if current["status"] != status:
+            raise HTTPException(status_code=409, detail=f"Cannot change a {current['status']} withdrawal to {status}")
+    
+    return {"message": f"Withdrawal {status}"}
+
+
+MAX_WITHDRAWAL_BATCH = 500
+
+
+@router.post("/withdrawals/batch-status")
+async def batch_update_withdrawal_status(body: WithdrawalBatchUpdate):
+    """Admin: approve, complete or reject many withdrawals; ones not in a matching status are skipped"""
+    if len(body.ids) > MAX_WITHDRAWAL_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_WITHDRAWAL_BATCH} withdrawals per batch")
+    return await _transition_withdrawals(list(dict.fromkeys(body.ids)), body.status, body.admin_notes)
+
+
+# Payout file columns per method family: (header, withdrawal field or callable)
+_PAYOUT_EXPORTS = {
+    "paypal": (("paypal_email", "amount", "currency", "withdrawal_id", "note"),
+               lambda w: (w.get("paypal_email"), w["amount"], "USD", w["id"], f"Withdrawal {w['id']}")),
+    "moncash": (("moncash_phone", "moncash_name", "amount_usd", "withdrawal_id"),
+                lambda w: (w.get("moncash_phone"), w.get("moncash_name"), w["amount"], w["id"])),
+    "usdt": (("wallet_address", "network", "amount_usdt", "withdrawal_id"),
+             lambda w: (w.get("wallet_address"), w["method"].split("_", 1)[-1].upper(), w["amount"], w["id"])),
+}
+
+
+@router.get("/withdrawals/export")
+async def export_withdrawal_payouts(method: str, status: str = "approved"):
+    """Admin: payout CSV for one method (paypal, moncash, usdt) to upload to the provider"""
+    export = _PAYOUT_EXPORTS.get(method.lower())
+    if not export:
+        raise HTTPException(status_code=400, detail=f"method must be one of: {', '.join(_PAYOUT_EXPORTS)}")
+    header, row = export
+    method_filter: Any = {"$regex": "^usdt"} if method.lower() == "usdt" else method.lower()
+    withdrawals = await db.withdrawals.find(
+        {"method": method_filter, "status": status}, {"_id": 0}
+    ).sort("created_at", 1).to_list(None)
+
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(header)
+    for w in withdrawals:
+        writer.writerow(row(w))
+    filename = f"withdrawals-{method.lower()}-{status}-{datetime.now(timezone.utc):%Y%m%d}.csv"
+    return Response(
+        out.getvalue(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+# ==================== WALLET (STORE CREDIT) ENDPOINTS ====================
+
+class WalletAdjustment(BaseModel):
+    amount: float
+    reason: Optional[str] = None
+
+class WalletTopupCreate(BaseModel):
+    amount: float
+    payment_method: str  # crypto_plisio or manual gateways
+
+class WalletTopupProof(BaseModel):
+    topup_id: str
+    transaction_id: str
+    payment_proof_url: str
+
+class AdminWalletAdjustRequest(BaseModel):
+    identifier: str  # user_id or customer_id or email
+    amount: float
+    reason: Optional[str] = None
+    action: str = "credit"  # credit or debit
+
+
+class CreditsConvertRequest(BaseModel):
+    credits: int  # must be multiple of 100
+    reason: Optional[str] = None
+
+
+class AdminCreditsAdjustRequest(BaseModel):
+    identifier: str  # user_id or customer_id or email
+    credits: int
+    reason: Optional[str] = None
+    action: str = "credit"  # credit or debit
+
+async def _debit_wallet(user_id: str, amount: float) -> bool:
+    """Take amount off the wallet only if it covers it: one conditional write, no read."""
+    query: Dict[str, Any] = {"id": user_id}
+    if amount > 0:
+        query["wallet_balance"] = {"$gte": float(amount) - 1e-9}
+    result = await ledger_writes(db.users).update_one(query, {"$inc": {"wallet_balance": -float(amount)}})
+    return result.matched_count == 1
+
+@router.get("/wallet/balance")
+async def get_wallet_balance(session: sessions.Session = Depends(sessions.customer)):
+    user = session.doc or await db.users.find_one({"id": session.user_id}, {"_id": 0, "wallet_balance": 1})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"user_id": session.user_id, "wallet_balance": float(user.get("wallet_balance", 0.0))}
+
+@router.get("/wallet/transactions")
+async def get_wallet_transactions(user_id: str):
+    txs = await db.wallet_transactions.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(200)
+    return txs
+
+@router.post("/wallet/admin-adjust")
+async def admin_adjust_wallet(req: AdminWalletAdjustRequest):
+    """
+    Admin: credit/debit a user's wallet balance by user_id, customer_id, or email.
+    (No auth implemented in this project.)
+    """
+    ident = (req.identifier or "").strip()
+    if not ident:
+        raise HTTPException(status_code=400, detail="Identifier required")
+    amt = float(req.amount)
+    if amt <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be > 0")
+    if req.action not in ["credit", "debit"]:
+        raise HTTPException(status_code=400, detail="Invalid action")
+
+    # Case-insensitive regex for customer_id and email
+    ident_regex = {"$regex": f"^{re.escape(ident)}$", "$options": "i"}
+    # Try exact match first for id (it should be case-sensitive), then case-insensitive for customer_id and email
+    user = await db.users.find_one(
+        {"$or": [
+            {"id": ident},  # user_id should be exact match
+            {"customer_id": ident_regex},  # Case-insensitive match for customer_id
+            {"email": ident_regex},  # Case-insensitive match for email
+        ]},
+        {"_id": 0}
+    )
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    delta = amt if req.action == "credit" else -amt
+    # If debit, prevent negative balance
+    current_balance = float(user.get("wallet_balance", 0.0))
+    if delta < 0 and current_balance + 1e-9 < abs(delta):
+        raise HTTPException(status_code=400, detail="Insufficient wallet balance")
+
+    # Update wallet balance using $inc (atomic operation)
+    update_result = await ledger_writes(db.users).update_one(
+        {"id": user["id"]}, 
+        {"$inc": {"wallet_balance": float(delta)}}
+    )
+    
+    if update_result.matched_count == 0:
+        raise HTTPException(status_code=500, detail="Failed to update wallet: user not found in update operation")
+    
+    # modified_count can be 0 if the field didn't exist and was created, or in rare edge cases
+    # We'll verify by fetching the user after update
+    
+    # Insert transaction record
+    await ledger_writes(db.wallet_transactions).insert_one({
+        "id": str(uuid.uuid4()),
+        "user_id": user["id"],
+        "user_email": user.get("email"),
+        "order_id": None,
+        "type": "admin_adjust",
+        "amount": float(delta),
+        "reason": req.reason or f"Admin wallet {req.action}",
+        "created_at": datetime.now(timezone.utc)
+    })
+    
+    logging.info(f"Admin wallet adjust: user_id={user['id']}, identifier={ident}, action={req.action}, amount={amt}, delta={delta}, old_balance={current_balance}")
+
+    # Fetch updated user to return new balance and verify the update
+    updated = await db.users.find_one({"id": user["id"]}, {"_id": 0})
+    if not updated:
+        raise HTTPException(status_code=500, detail="Failed to retrieve updated user")
+    
+    new_balance = float(updated.get("wallet_balance", 0.0))
+    expected_balance = current_balance + delta
+    
+    # Verify the balance was updated correctly (allow small floating point differences)
+    if abs(new_balance - expected_balance) > 0.01:
+        logging.error(f"Wallet balance mismatch! user_id={user['id']}, expected={expected_balance}, actual={new_balance}")
+        # Still return the actual balance, but log the issue
+    
+    logging.info(f"Admin wallet adjust: user_id={user['id']}, identifier={ident}, action={req.action}, amount={amt}, delta={delta}, old_balance={current_balance}, new_balance={new_balance}")
+    
+    return JSONResponse({
+        "user_id": user["id"], 
+        "customer_id": user.get("customer_id"), 
+        "wallet_balance": new_balance
+    })
+
+
+@router.get("/credits/balance")
+async def get_credits_balance(user_id: str):
+    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"user_id": user_id, "credits_balance": int(user.get("credits_balance", 0)), "rate": "100_credits = 1_USD"}
+
+
+@router.get("/credits/transactions")
+async def get_credits_transactions(user_id: str):
+    txs = await db.credits_transactions.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(200)
+    return txs
+
+
+@router.post("/credits/admin-adjust")
+async def admin_adjust_credits(req: AdminCreditsAdjustRequest):
+    """
+    Admin: credit/debit a user's credits by user_id, customer_id, or email.
+    (No auth implemented in this project.)
+    """
+    ident = (req.identifier or "").strip()
+    if not ident:
+        raise HTTPException(status_code=400, detail="Identifier required")
+    credits = int(req.credits)
+    if credits <= 0:
+        raise HTTPException(status_code=400, detail="Credits must be > 0")
+    if req.action not in ["credit", "debit"]:
+        raise HTTPException(status_code=400, detail="Invalid action")
+
+    user = await db.users.find_one(
+        {"$or": [{"id": ident}, {"customer_id": ident}, {"email": ident}]},
+        {"_id": 0}
+    )
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    delta = credits if req.action == "credit" else -credits
+    current = int(user.get("credits_balance", 0))
+    if delta < 0 and current < abs(delta):
+        raise HTTPException(status_code=400, detail="Insufficient credits")
+
+    await ledger_writes(db.users).update_one({"id": user["id"]}, {"$inc": {"credits_balance": int(delta)}})
+    await ledger_writes(db.credits_transactions).insert_one({
+        "id": str(uuid.uuid4()),
+        "user_id": user["id"],
+        "user_email": user.get("email"),
+        "order_id": None,
+        "type": "admin_adjust",
+        "credits": int(delta),
+        "usd_equivalent": round(float(delta) / 100.0, 2),
+        "reason": req.reason or f"Admin credits {req.action}",
+        "created_at": datetime.now(timezone.utc)
+    })
+
+    updated = await db.users.find_one({"id": user["id"]}, {"_id": 0})
+    return {"user_id": user["id"], "customer_id": user.get("customer_id"), "credits_balance": int(updated.get("credits_balance", 0))}
+
+
+@router.post("/credits/convert")
+async def convert_credits_to_wallet(req: CreditsConvertRequest, user_id: str, user_email: str):
+    credits = int(req.credits)
+    if credits <= 0:
+        raise HTTPException(status_code=400, detail="Credits must be > 0")
+    if credits % 100 != 0:
+        raise HTTPException(status_code=400, detail="Credits must be a multiple of 100")
+
+    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    current = int(user.get("credits_balance", 0))
+    if current < credits:
+        raise HTTPException(status_code=400, detail="Insufficient credits")
+
+    usd = round(float(credits) / 100.0, 2)
+    await ledger_writes(db.users).update_one({"id": user_id}, {"$inc": {"credits_balance": -credits, "wallet_balance": float(usd)}})
+
+    await ledger_writes(db.wallet_transactions).insert_one({
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "user_email": user_email,
+        "order_id": None,
+        "type": "credits_convert",
+        "amount": float(usd),
+        "reason": req.reason or f"Converted {credits} credits to wallet",
+        "created_at": datetime.now(timezone.utc)
+    })
+    await ledger_writes(db.credits_transactions).insert_one({
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "user_email": user_email,
+        "order_id": None,
+        "type": "convert",
+        "credits": -credits,
+        "usd_equivalent": float(usd),
+        "reason": req.reason or "Convert credits to wallet",
+        "created_at": datetime.now(timezone.utc)
+    })
+
+    updated = await db.users.find_one({"id": user_id}, {"_id": 0})
+    return {"user_id": user_id, "credits_converted": credits, "usd_added": float(usd), "wallet_balance": float(updated.get("wallet_balance", 0.0)), "credits_balance": int(updated.get("credits_balance", 0))}
+
+@router.post("/wallet/topups")
+async def create_wallet_topup(topup: WalletTopupCreate, session: sessions.Session = Depends(sessions.customer)):
+    user_id, user_email = session.user_id, session.email
+    if float(topup.amount) <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be > 0")
+
+    settings = await _site_settings() or {}
+
+    topup_id = str(uuid.uuid4())
+    doc = {
+        "id": topup_id,
+        "user_id": user_id,
+        "user_email": user_email,
+        "amount": float(topup.amount),
+        "payment_method": topup.payment_method,
+        "payment_status": "pending",
+        "transaction_id": None,
+        "payment_proof_url": None,
+        "plisio_invoice_id": None,
+        "plisio_invoice_url": None,
+        "credited": False,
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc),
+    }
+
+    # If crypto payment, create Plisio invoice
+    if topup.payment_method == "crypto_plisio" and settings.get("plisio_api_key"):
+        try:
+            from plisio_helper import PlisioHelper
+            plisio = PlisioHelper(settings["plisio_api_key"])
+            invoice_response = await plisio.create_invoice(
+                amount=float(topup.amount),
+                currency="USDT",
+                order_name=f"Wallet Topup {topup_id}",
+                order_number=topup_id,
+                email=user_email,
+            )
+            if invoice_response.get("success"):
+                doc["plisio_invoice_id"] = invoice_response.get("invoice_id")
+                doc["plisio_invoice_url"] = invoice_response.get("invoice_url")
+        except Exception as e:
+            logging.error(f"Plisio topup error: {e}")
+
+    await db.wallet_topups.insert_one(doc)
+    events.changed("wallet_topups", topup_id)
+
+    # Attach payment instructions for manual methods (optional)
+    payment_info = {}
+    gateways = settings.get("payment_gateways") or {}
+    gateway = gateways.get(topup.payment_method) or {}
+    if gateway.get("enabled"):
+        payment_info = {
+            "method": topup.payment_method,
+            "email": gateway.get("email", ""),
+            "instructions": gateway.get("instructions", "")
+        }
+
+    # Ensure all values are JSON-serializable and return with JSONResponse for proper CORS headers
+    try:
+        clean_doc = {
+            "id": doc.get("id"),
+            "user_id": doc.get("user_id"),
+            "user_email": doc.get("user_email"),
+            "amount": doc.get("amount"),
+            "payment_method": doc.get("payment_method"),
+            "payment_status": doc.get("payment_status"),
+            "transaction_id": doc.get("transaction_id"),
+            "payment_proof_url": doc.get("payment_proof_url"),
+            "plisio_invoice_id": doc.get("plisio_invoice_id"),
+            "plisio_invoice_url": doc.get("plisio_invoice_url"),
+            "credited": doc.get("credited"),
+            "created_at": doc.get("created_at"),
+            "updated_at": doc.get("updated_at"),
+        }
+        return JSONResponse(jsonable_encoder({
+            "topup": clean_doc,
+            "payment_info": payment_info
+        }))
+    except Exception as e:
+        logging.error(f"Error serializing wallet topup response: {e}")
+        # Return minimal response if serialization fails
+        return JSONResponse({
+            "topup": {
+                "id": topup_id,
+                "user_id": user_id,
+                "amount": float(topup.amount),
+                "payment_status": doc.get("payment_status", "pending")
+            },
+            "payment_info": payment_info
+        })
+
+@router.get("/wallet/topups/user/{user_id}")
+async def get_user_wallet_topups(user_id: str):
+    topups = await db.wallet_topups.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(200)
+    return topups
+
+@router.get("/wallet/topups/all")
+async def get_all_wallet_topups():
+    topups = await db.wallet_topups.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    return topups
+
+@router.post("/wallet/topups/proof")
+async def submit_wallet_topup_proof(proof: WalletTopupProof):
+    """Submit payment proof for a wallet topup"""
+    update_data = {
+        "transaction_id": proof.transaction_id,
+        "payment_proof_url": proof.payment_proof_url,
+        "payment_status": "pending_verification",
+        "updated_at": datetime.now(timezone.utc)
+    }
+    res = await db.wallet_topups.update_one(
+        {"id": proof.topup_id},
+        {"$set": update_data}
+    )
+    if res.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Topup not found")
+    events.changed("wallet_topups", proof.topup_id)
+    
+    # Return the updated topup document for confirmation
+    updated = await db.wallet_topups.find_one({"id": proof.topup_id}, {"_id": 0})
+    if not updated:
+        raise HTTPException(status_code=404, detail="Topup not found after update")
+    
+    logging.info(f"Payment proof submitted for topup {proof.topup_id}, URL length: {len(proof.payment_proof_url) if proof.payment_proof_url else 0}")
+    
+    return {
+        "message": "Topup proof submitted",
+        "topup": updated
+    }
+
+@router.put("/wallet/topups/{topup_id}/status")
+async def update_wallet_topup_status(topup_id: str, payment_status: str):
+    if payment_status not in ["paid", "failed", "rejected", "processing"]:
+        raise HTTPException(status_code=400, detail="Invalid status")
+
+    topup = await db.wallet_topups.find_one({"id": topup_id}, {"_id": 0})
+    if not topup:
+        raise HTTPException(status_code=404, detail="Topup not found")
+
+    await db.wallet_topups.update_one(
+        {"id": topup_id},
+        {"$set": {"payment_status": payment_status, "updated_at": datetime.now(timezone.utc)}}
+    )
+
+    # Credit wallet once when marked paid
+    if payment_status == "paid" and not topup.get("credited"):
+        await _credit_topup(topup, f"Wallet topup {topup_id}")
+
+    events.changed("wallet_topups", topup_id)
+    return {"message": "Topup updated"}
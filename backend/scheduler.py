@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger("scheduler")
+
+LEASE_SECONDS = float(os.environ.get("SCHEDULER_LEASE_SECONDS", "30"))
+# SCHEDULER_ENABLED=0 keeps this process out of the election (e.g. one-off shells)
+ENABLED = os.environ.get("SCHEDULER_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+class MongoLease:
+    """
+    Leader election over one document in `leases`: {_id: name, holder, expires_at}.
+
+    The holder renews before expiry; anyone may take an expired lease. The
+    filter only matches when we hold it or it has expired, so a live lease
+    held by another worker makes the upsert collide on _id (DuplicateKeyError)
+    and we stay a follower.
+    """
+
+    def __init__(self, get_collection: Callable[[], Any], name: str, ttl: float = LEASE_SECONDS):
+        self.get_collection = get_collection
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    async def acquire(self) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            doc = await self.get_collection().find_one_and_update(
+                {"_id": self.name, "$or": [{"holder": self.holder}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"holder": self.holder, "expires_at": now + timedelta(seconds=self.ttl)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            return False
+        return bool(doc) and doc.get("holder") == self.holder
+
+    async def release(self) -> None:
+        await self.get_collection().delete_one({"_id": self.name, "holder": self.holder})
+
+
+class _Job:
+    __slots__ = ("name", "interval", "fn", "next_run", "task")
+
+    def __init__(self, name: str, interval: float, fn: Callable[[], Awaitable[Any]]):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.next_run = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+
+class Scheduler:
+    """
+    Periodic jobs that run in exactly one worker: the current lease holder.
+
+    Every worker runs the loop; it renews (or tries to take) the lease each
+    tick and only the holder starts due jobs. Jobs run as tasks so a long run
+    doesn't stop lease renewal; if leadership is lost they are cancelled.
+    """
+
+    def __init__(self, lease: MongoLease, tick: Optional[float] = None):
+        self.lease = lease
+        self.tick = tick if tick is not None else lease.ttl / 3
+        self.jobs: List[_Job] = []
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+
+    def every(self, seconds: float, name: str, fn: Callable[[], Awaitable[Any]]) -> None:
+        self.jobs.append(_Job(name, seconds, fn))
+
+    async def _run_job(self, job: _Job) -> None:
+        start = time.monotonic()
+        try:
+            result = await job.fn()
+            logger.info(f"Scheduled job {job.name} finished in {time.monotonic() - start:.1f}s: {result}")
+        except Exception as e:
+            logger.error(f"Scheduled job {job.name} failed: {e}")
+
+    def _cancel_jobs(self) -> None:
+        for job in self.jobs:
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+
+    async def run_once(self) -> None:
+        try:
+            leader = await self.lease.acquire()
+        except Exception as e:
+            logger.error(f"Scheduler lease check failed: {e}")
+            leader = False
+        if leader != self.is_leader:
+            logger.info(f"Scheduler {'acquired' if leader else 'lost'} lease {self.lease.name} ({self.lease.holder})")
+            self.is_leader = leader
+            if not leader:
+                self._cancel_jobs()
+        if not leader:
+            return
+        now = time.monotonic()
+        for job in self.jobs:
+            if now >= job.next_run and (job.task is None or job.task.done()):
+                job.next_run = now + job.interval
+                job.task = asyncio.create_task(self._run_job(job))
+
+    async def _loop(self) -> None:
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.tick)
+
+    def start(self) -> None:
+        if ENABLED and self.jobs and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._cancel_jobs()
+        await asyncio.gather(*(j.task for j in self.jobs if j.task is not None), return_exceptions=True)
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                # Hand over immediately instead of waiting for the lease to expire
+                await self.lease.release()
+            except Exception as e:
+                logger.error(f"Scheduler lease release failed: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        return {"leader": self.is_leader, "holder": self.lease.holder, "jobs": [j.name for j in self.jobs]}
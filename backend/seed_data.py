@@ -0,0 +1,116 @@
+# Fixtures for the internal seeding endpoint (routers/seeding.py); imported
+# only when a seed actually runs so workers don't build them at startup.
+
+DEMO_PRODUCTS = [
+    # Gift Cards
+    {
+        "name": "Amazon Gift Card",
+        "description": "Amazon gift card with instant delivery. Valid in selected regions.",
+        "category": "giftcard",
+        "image_url": "https://images.unsplash.com/photo-1523474253046-8cd2748b5fd2?w=400",
+        "delivery_type": "manual",
+        "requires_player_id": False,
+        "variants": [
+            {"region": "US", "value": "$25", "price": 25.00},
+            {"region": "US", "value": "$50", "price": 50.00},
+            {"region": "US", "value": "$100", "price": 100.00},
+        ]
+    },
+    {
+        "name": "iTunes Gift Card",
+        "description": "Apple iTunes gift card for App Store, Apple Music, and more.",
+        "category": "giftcard",
+        "image_url": "https://images.unsplash.com/photo-1563013544-824ae1b704d3?w=400",
+        "delivery_type": "manual",
+        "requires_player_id": False,
+        "variants": [
+            {"region": "US", "value": "$25", "price": 25.00},
+            {"region": "US", "value": "$50", "price": 50.00},
+        ]
+    },
+    # Game Top-ups
+    {
+        "name": "Free Fire Diamonds",
+        "description": "Top up your Free Fire account with diamonds instantly.",
+        "category": "topup",
+        "image_url": "https://images.unsplash.com/photo-1556438064-2d7646166914?w=400",
+        "delivery_type": "automatic",
+        "requires_player_id": True,
+        "player_id_label": "Free Fire Player ID",
+        "variants": [
+            {"value": "100 Diamonds", "price": 5.00},
+            {"value": "310 Diamonds", "price": 15.00},
+            {"value": "520 Diamonds", "price": 25.00},
+            {"value": "1080 Diamonds", "price": 50.00},
+        ]
+    },
+    # Subscriptions
+    {
+        "name": "Premium Subscription",
+        "description": "1 month premium access with all features unlocked.",
+        "category": "subscription",
+        "image_url": "https://images.unsplash.com/photo-1556742049-0cfed4f6a45d?w=400",
+        "delivery_type": "automatic",
+        "requires_player_id": False,
+        "is_subscription": True,
+        "variants": [
+            {"duration": "1 Month", "price": 9.99},
+            {"duration": "3 Months", "price": 24.99},
+            {"duration": "6 Months", "price": 44.99},
+        ]
+    },
+]
+
+GAMES_CONFIG = [
+    {
+        "name": "Free Fire",
+        "game_id": "freefire",
+        "description": "Garena Free Fire battle royale game",
+        "image_url": "https://images.unsplash.com/photo-1556438064-2d7646166914?w=400",
+        "regions": ["Global"],
+        "currencies": ["Diamonds"],
+        "is_active": True,
+        "api_supported": True,
+        "player_id_format": "Player ID",
+        "denominations": [
+            {"amount": 100, "price": 5.00, "currency": "Diamonds"},
+            {"amount": 310, "price": 15.00, "currency": "Diamonds"},
+            {"amount": 520, "price": 25.00, "currency": "Diamonds"},
+            {"amount": 1080, "price": 50.00, "currency": "Diamonds"},
+        ]
+    },
+    {
+        "name": "Mobile Legends",
+        "game_id": "mobilelegends",
+        "description": "Mobile Legends: Bang Bang MOBA game",
+        "image_url": "https://images.unsplash.com/photo-1511512578047-dfb367046420?w=400",
+        "regions": ["Global"],
+        "currencies": ["Diamonds"],
+        "is_active": True,
+        "api_supported": True,
+        "player_id_format": "User ID",
+        "denominations": [
+            {"amount": 100, "price": 5.00, "currency": "Diamonds"},
+            {"amount": 250, "price": 12.00, "currency": "Diamonds"},
+            {"amount": 500, "price": 23.00, "currency": "Diamonds"},
+            {"amount": 1000, "price": 45.00, "currency": "Diamonds"},
+        ]
+    },
+    {
+        "name": "PUBG Mobile",
+        "game_id": "pubgm",
+        "description": "PUBG Mobile battle royale game",
+        "image_url": "https://images.unsplash.com/photo-1560419015-7c427e8ae5ba?w=400",
+        "regions": ["Global"],
+        "currencies": ["UC"],
+        "is_active": True,
+        "api_supported": True,
+        "player_id_format": "Character ID",
+        "denominations": [
+            {"amount": 60, "price": 5.00, "currency": "UC"},
+            {"amount": 325, "price": 25.00, "currency": "UC"},
+            {"amount": 660, "price": 50.00, "currency": "UC"},
+            {"amount": 1800, "price": 125.00, "currency": "UC"},
+        ]
+    }
+]
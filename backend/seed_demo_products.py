@@ -139,7 +139,7 @@ async def seed_demo():
                 "metadata": {
                     "product_type": product_group["category"]
                 },
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             }
             
             await db.products.insert_one(product)
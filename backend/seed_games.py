@@ -202,7 +202,7 @@ async def seed_games():
                     "game_name": game_name,
                     "amount": variant["amount"]
                 },
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             }
             
             await db.products.insert_one(product)
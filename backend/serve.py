@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Production entry point.
+
+    python serve.py
+
+Runs uvicorn with one worker process per available CPU (WEB_CONCURRENCY
+overrides), uvloop/httptools when installed, and a graceful drain on SIGTERM:
+the listener stops accepting, in-flight requests (checkouts, Plisio webhooks)
+get GRACEFUL_TIMEOUT seconds to finish, then each worker runs its lifespan
+shutdown (background queue drained, scheduler lease released).
+"""
+
+import importlib.util
+import os
+import secrets
+
+import uvicorn
+
+
+def _available_cpus() -> int:
+    # Respect CPU affinity / container cpusets where the platform exposes them
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def worker_count() -> int:
+    configured = os.environ.get("WEB_CONCURRENCY")
+    if configured:
+        return max(1, int(configured))
+    return max(1, min(_available_cpus(), 8))
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def main():
+    workers = worker_count()
+    loop = "uvloop" if _installed("uvloop") else "asyncio"
+    http = "httptools" if _installed("httptools") else "h11"
+    if not os.environ.get("SESSION_SECRET"):
+        # Workers inherit the environment, so tokens from one are valid on the others
+        os.environ["SESSION_SECRET"] = secrets.token_urlsafe(32)
+        print("⚠️  SESSION_SECRET not set: generated one for this run, sessions end on restart")
+    print(f"✅ Starting KayiCom API: {workers} worker(s), loop={loop}, http={http}")
+    uvicorn.run(
+        "server:app",
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8000")),
+        workers=workers,
+        loop=loop,
+        http=http,
+        proxy_headers=True,
+        forwarded_allow_ips="*",
+        timeout_keep_alive=int(os.environ.get("KEEP_ALIVE_TIMEOUT", "5")),
+        timeout_graceful_shutdown=int(os.environ.get("GRACEFUL_TIMEOUT", "30")),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import logging
+import os
+import secrets
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+import jwt
+from fastapi import Header, HTTPException
+
+import metrics
+from cache import ReadThroughCache
+from core import db
+
+# Signed session tokens (HS256) issued by /auth/login. Claims carry the user id,
+# email, role and blocked flag, so authenticated handlers don't read the user
+# document just to learn who is calling and whether the account is blocked.
+
+SECRET = os.environ.get("SESSION_SECRET", "")
+if not SECRET:
+    # serve.py shares one generated secret across its workers; a bare process gets its own
+    SECRET = secrets.token_urlsafe(32)
+    logging.warning("SESSION_SECRET not set: session tokens will not survive a restart")
+
+TOKEN_TTL = int(os.environ.get("SESSION_TTL_SECONDS", str(12 * 3600)))
+# How long another worker may keep honouring a token after its account is blocked
+REVOCATION_SYNC_SECONDS = float(os.environ.get("SESSION_REVOCATION_SYNC_SECONDS", "5"))
+# Reject customer calls that identify themselves with ?user_id= instead of a token
+REQUIRE_TOKENS = os.environ.get("SESSION_TOKENS_REQUIRED", "").strip().lower() in ("1", "true", "yes", "on")
+
+_ALGORITHM = "HS256"
+
+# Calls still identified by ?user_id= alone: SESSION_TOKENS_REQUIRED is safe to
+# turn on once "accepted" stays at zero for a TOKEN_TTL
+LEGACY_AUTH = metrics.REGISTRY.register(metrics.Counter(
+    "session_legacy_auth_total", "Customer calls identified by user_id instead of a session token", ("outcome",)))
+
+
+class Session:
+    """The caller, as stated by a verified token (doc is None) or read from users (legacy)."""
+
+    __slots__ = ("user_id", "email", "role", "blocked", "doc")
+
+    def __init__(self, user_id: str, email: Optional[str], role: str, blocked: bool, doc: Optional[Dict[str, Any]] = None):
+        self.user_id = user_id
+        self.email = email
+        self.role = role
+        self.blocked = blocked
+        self.doc = doc
+
+
+def issue(user: Dict[str, Any]) -> str:
+    now = int(time.time())
+    claims = {
+        "sub": user["id"],
+        "email": user.get("email"),
+        "role": user.get("role", "customer"),
+        "blk": bool(user.get("is_blocked", False)),
+        "iat": now,
+        "exp": now + TOKEN_TTL,
+        "jti": uuid.uuid4().hex,
+    }
+    return jwt.encode(claims, SECRET, algorithm=_ALGORITHM)
+
+
+# ==================== REVOCATIONS ====================
+
+# session_revocations holds one {user_id, blocked, changed_at} per account whose
+# blocked status changed within the last TOKEN_TTL (TTL index, see ensure_indexes).
+# Tokens issued before changed_at take the recorded status instead of their claim.
+
+async def _load_revocations(_key) -> Dict[str, Dict[str, Any]]:
+    since = datetime.now(timezone.utc) - timedelta(seconds=TOKEN_TTL)
+    docs = await db.session_revocations.find(
+        {"changed_at": {"$gte": since}}, {"_id": 0, "user_id": 1, "blocked": 1, "changed_at": 1}
+    ).to_list(None)
+    return {d["user_id"]: d for d in docs}
+
+# One small read per worker every few seconds instead of a users read per request
+_revocations = ReadThroughCache(_load_revocations, ttl=REVOCATION_SYNC_SECONDS)
+
+
+async def set_blocked(user_id: str, blocked: bool) -> None:
+    """Record a block/unblock so existing tokens follow it; this worker sees it immediately."""
+    await db.session_revocations.update_one(
+        {"user_id": user_id},
+        {"$set": {"blocked": bool(blocked), "changed_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+    _revocations.invalidate()
+
+
+async def verify(token: str) -> Session:
+    try:
+        claims = jwt.decode(token, SECRET, algorithms=[_ALGORITHM], options={"require": ["sub", "exp", "iat"]})
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Session expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid session token")
+
+    blocked = bool(claims.get("blk"))
+    change = (await _revocations.get()).get(claims["sub"])
+    if change and claims["iat"] <= change["changed_at"].timestamp():
+        blocked = bool(change["blocked"])
+    return Session(claims["sub"], claims.get("email"), claims.get("role", "customer"), blocked)
+
+
+def subject(authorization: Optional[str]) -> Optional[str]:
+    """User id of a validly signed, unexpired token, or None. No revocation check."""
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    try:
+        return jwt.decode(token.strip(), SECRET, algorithms=[_ALGORITHM]).get("sub")
+    except jwt.InvalidTokenError:
+        return None
+
+
+# ==================== DEPENDENCIES ====================
+
+def _bearer(authorization: Optional[str]) -> Optional[str]:
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        raise HTTPException(status_code=401, detail="Invalid authorization header")
+    return token.strip()
+
+
+async def customer(
+    user_id: Optional[str] = None,
+    user_email: Optional[str] = None,
+    authorization: Optional[str] = Header(None),
+) -> Session:
+    """
+    Customer endpoints: the caller from a Bearer token, without touching users.
+    user_id/user_email query params are still accepted from older clients (one
+    users read, as before) unless SESSION_TOKENS_REQUIRED is set; alongside a
+    token they must name the token's own user.
+    """
+    token = _bearer(authorization)
+    if token:
+        session = await verify(token)
+        if user_id and user_id != session.user_id and session.role != "admin":
+            raise HTTPException(status_code=403, detail="Token does not belong to this user")
+        if session.blocked:
+            raise HTTPException(status_code=403, detail="Account is blocked")
+        if user_id and session.role == "admin":
+            # Admin acting for a customer: their identity comes from the users collection
+            return await _legacy(user_id, user_email)
+        return session
+
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if REQUIRE_TOKENS:
+        LEGACY_AUTH.inc("rejected")
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    LEGACY_AUTH.inc("accepted")
+    return await _legacy(user_id, user_email)
+
+
+async def _legacy(user_id: str, user_email: Optional[str]) -> Session:
+    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if user.get("is_blocked"):
+        raise HTTPException(status_code=403, detail="Account is blocked")
+    return Session(user["id"], user_email or user.get("email"), user.get("role", "customer"), False, doc=user)
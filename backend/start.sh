@@ -1,4 +1,5 @@
 #!/bin/bash
 # Railway startup script for backend
-uvicorn server:app --host 0.0.0.0 --port ${PORT:-8000}
+# Multi-worker launcher (WEB_CONCURRENCY, GRACEFUL_TIMEOUT); see serve.py
+exec python serve.py
 
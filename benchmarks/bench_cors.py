@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark: requests/sec through the CORS layer, before and after.
+
+  before: CORSMiddleware + BaseHTTPMiddleware safety net (the old server.py stack)
+  after:  CORSHeadersMiddleware (pure ASGI)
+
+Both wrap the same FastAPI router in-process (no sockets; the database is
+the in-memory backend from memory_mongo), so the difference is the
+middleware cost alone.
+
+    python benchmarks/bench_cors.py [--requests 3000] [--concurrency 20]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")  # client connects lazily; never used here
+
+import httpx  # noqa: E402
+from starlette.middleware.base import BaseHTTPMiddleware  # noqa: E402
+from starlette.middleware.cors import CORSMiddleware  # noqa: E402
+
+import server  # noqa: E402
+from cors import CORSHeadersMiddleware  # noqa: E402
+from memory_mongo import MemoryClient  # noqa: E402
+
+ORIGINS = ["https://kayicom.com", "https://www.kayicom.com"]
+
+
+def _database():
+    now = datetime.now(timezone.utc)
+    db = MemoryClient()["bench"]
+    db.products.preload(
+        {"id": str(uuid.uuid4()), "name": f"Product {i}", "description": "Instant delivery", "category": "giftcard",
+         "price": 10.0 + i, "created_at": now}
+        for i in range(20)
+    )
+    return db
+
+
+async def _legacy_safety_net(request, call_next):
+    # Same shape as the removed add_cors_headers_middleware
+    response = await call_next(request)
+    if "Access-Control-Allow-Origin" not in response.headers:
+        response.headers["Access-Control-Allow-Origin"] = ORIGINS[0]
+    return response
+
+
+def _before(inner):
+    return CORSMiddleware(
+        BaseHTTPMiddleware(inner, dispatch=_legacy_safety_net),
+        allow_credentials=True,
+        allow_origins=ORIGINS,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["*"],
+    )
+
+
+def _after(inner):
+    return CORSHeadersMiddleware(inner, allow_origins=ORIGINS)
+
+
+async def _drive(asgi_app, path: str, total: int, concurrency: int) -> float:
+    transport = httpx.ASGITransport(app=asgi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        headers = {"Origin": ORIGINS[1]}
+        await client.get(path, headers=headers)  # warm-up
+        remaining = total
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                r = await client.get(path, headers=headers)
+                assert r.headers.get("access-control-allow-origin") == ORIGINS[1], r.headers
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return total / (time.perf_counter() - start)
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    server.db.use(_database())
+    server.app.state.ready = True  # no lifespan here; /health would answer 503 "starting"
+    inner = server.app.router
+
+    print(f"{'path':<16} {'before req/s':>13} {'after req/s':>12} {'change':>8}")
+    for path in ["/health", "/api/products"]:
+        before = asyncio.run(_drive(_before(inner), path, args.requests, args.concurrency))
+        after = asyncio.run(_drive(_after(inner), path, args.requests, args.concurrency))
+        print(f"{path:<16} {before:>13.0f} {after:>12.0f} {(after / before - 1) * 100:>+7.0f}%")
+
+
+if __name__ == "__main__":
+    main()
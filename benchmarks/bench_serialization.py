@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark: validated response_model path vs trusted orjson path for list endpoints.
+
+Runs both code paths on the same realistic payloads, without a database:
+  - validated: FastAPI's serialize_response (Pydantic validation of List[Model]) + JSONResponse
+  - trusted:   TrustedModelView rows + FastJSONResponse (orjson)
+
+    python benchmarks/bench_serialization.py [--rows 1000] [--repeat 20]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")  # client connects lazily; never used here
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+import server  # noqa: E402
+
+
+def _order(rng: random.Random, now: datetime) -> dict:
+    items = [
+        {
+            "product_id": str(uuid.uuid4()),
+            "product_name": rng.choice(["Free Fire 310 Diamonds", "Netflix 1 Month", "Amazon Gift Card $50"]),
+            "quantity": rng.randint(1, 3),
+            "price": round(rng.uniform(1, 100), 2),
+            "player_id": str(rng.randint(10**8, 10**9)) if rng.random() < 0.5 else None,
+            "credentials": None,
+        }
+        for _ in range(rng.randint(1, 4))
+    ]
+    created = now - timedelta(minutes=rng.randint(0, 500_000))
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": str(uuid.uuid4()),
+        "user_email": f"user{rng.randint(1, 100_000)}@example.com",
+        "items": items,
+        "total_amount": round(sum(i["price"] * i["quantity"] for i in items), 2),
+        "subtotal_amount": None,
+        "currency": "USD",
+        "payment_method": rng.choice(["wallet", "crypto_plisio", "paypal", "moncash"]),
+        "payment_status": rng.choice(["pending", "paid", "pending_verification"]),
+        "order_status": rng.choice(["pending", "processing", "completed"]),
+        "payment_proof_url": None,
+        "transaction_id": None,
+        "plisio_invoice_id": None,
+        "delivery_info": {"details": "CODE-XXXX-YYYY", "delivered_at": created} if rng.random() < 0.3 else None,
+        "created_at": created,
+        "updated_at": created,
+    }
+
+
+def _product(rng: random.Random, now: datetime) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "name": rng.choice(["Free Fire Diamonds", "PUBG UC", "Steam Gift Card", "Spotify Premium"]),
+        "description": "Instant delivery. " * rng.randint(1, 10),
+        "category": rng.choice(["giftcard", "topup", "subscription", "service"]),
+        "price": round(rng.uniform(1, 200), 2),
+        "image_url": "https://images.unsplash.com/photo-1556438064-2d7646166914?w=400",
+        "delivery_type": "automatic",
+        "variant_name": "310 Diamonds",
+        "parent_product_id": str(uuid.uuid4()),
+        "requires_player_id": True,
+        "player_id_label": "Player ID",
+        "region": "US",
+        "metadata": {},
+        "created_at": now,
+    }
+
+
+async def _validated(field, docs) -> bytes:
+    content = await serialize_response(field=field, response_content=docs)
+    return JSONResponse(content).body
+
+
+def _trusted(view, docs) -> bytes:
+    return view.response(docs).body
+
+
+def _timeit(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(42)
+    now = datetime.now(timezone.utc)
+    cases = [
+        ("orders", server.Order, server._ORDER_VIEW, [_order(rng, now) for _ in range(args.rows)]),
+        ("products", server.Product, server._PRODUCT_VIEW, [_product(rng, now) for _ in range(args.rows)]),
+    ]
+
+    loop = asyncio.new_event_loop()
+    print(f"{'payload':<10} {'rows':>6} {'validated ms':>13} {'trusted ms':>11} {'speedup':>8} {'bytes':>9}")
+    for name, model, view, docs in cases:
+        field = create_response_field(name=f"Response_{name}", type_=List[model])
+        slow_body = loop.run_until_complete(_validated(field, docs))
+        fast_body = _trusted(view, docs)
+        slow = _timeit(lambda: loop.run_until_complete(_validated(field, docs)), args.repeat)
+        fast = _timeit(lambda: _trusted(view, docs), args.repeat)
+        print(f"{name:<10} {len(docs):>6} {slow * 1000:>13.2f} {fast * 1000:>11.2f} {slow / fast:>7.1f}x {len(fast_body):>9}")
+        assert len(slow_body) > 0
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Load test for the checkout, catalog, webhook and admin hot paths.
+
+1. Seed a synthetic dataset into a dedicated database (refuses names without
+   "bench" unless --force). Products start from the app's own demo/game
+   seeders, then are padded to size; users and orders are bulk-inserted.
+
+    MONGO_URL=mongodb://localhost:27017 DB_NAME=kayicom_bench \\
+        python benchmarks/load_test.py seed [--users 100000] [--orders 1000000] [--products 5000]
+
+2. Start the API against that database (e.g. `cd backend && python serve.py`)
+   and drive each scenario at a fixed concurrency:
+
+    python benchmarks/load_test.py run --base-url http://localhost:8000 \\
+        [--concurrency 32] [--requests 2000] [--scenarios catalog,checkout] \\
+        [--baseline benchmarks/out/baseline.json] [--max-regression 0.15] [--save-baseline]
+
+   Or, without MongoDB or a server, against the in-memory backend (smaller
+   default dataset; numbers are only comparable with other --in-process runs):
+
+    python benchmarks/load_test.py run --in-process [--users 5000] [--orders 50000]
+
+Results (p50/p90/p99 ms, req/s, error rate per scenario) are written to
+--output. With --baseline, the run exits 1 when a scenario's p99 grows or its
+req/s drops by more than --max-regression.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+ROOT = Path(__file__).resolve().parents[1]
+OUT_DIR = ROOT / "benchmarks" / "out"
+DEFAULT_MANIFEST = OUT_DIR / "manifest.json"
+DEFAULT_OUTPUT = OUT_DIR / "results.json"
+
+sys.path.insert(0, str(ROOT / "backend"))
+
+
+# ==================== SEEDING ====================
+
+_FIRST_NAMES = ["Jean", "Marie", "Pierre", "Rose", "Paul", "Anne", "Louis", "Sophie", "Marc", "Julie"]
+_LAST_NAMES = ["Joseph", "Pierre", "Louis", "Charles", "Jean-Baptiste", "Etienne", "Michel", "Francois"]
+_PAYMENT_METHODS = ["wallet", "crypto_plisio", "paypal", "moncash", "binance_pay"]
+
+
+async def _insert_batch(collection, batch: List[Dict[str, Any]]) -> int:
+    try:
+        await collection.insert_many(batch, ordered=False)
+        return len(batch)
+    except BulkWriteError as e:
+        # Random customer ids can collide on the unique index; skip those users
+        return e.details.get("nInserted", 0)
+
+
+async def _insert_batches(collection, docs_iter, total: int, batch_size: int, label: str) -> None:
+    batch: List[Dict[str, Any]] = []
+    done = 0
+    start = time.perf_counter()
+    for doc in docs_iter:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            done += await _insert_batch(collection, batch)
+            batch = []
+            print(f"\r  {label}: {done:,}/{total:,} ({done / (time.perf_counter() - start):,.0f}/s)", end="", flush=True)
+    if batch:
+        done += await _insert_batch(collection, batch)
+    print(f"\r  {label}: {done:,}/{total:,} in {time.perf_counter() - start:.1f}s{' ' * 20}")
+
+
+def _users(rng: random.Random, n: int, password_hash: str, new_customer_id: Callable[[], str]):
+    now = datetime.now(timezone.utc)
+    for i in range(n):
+        first, last = rng.choice(_FIRST_NAMES), rng.choice(_LAST_NAMES)
+        yield {
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "email": f"{first.lower()}.{last.lower()}{i}@bench.kayicom.test",
+            "full_name": f"{first} {last}",
+            "password": password_hash,
+            "customer_id": new_customer_id(),
+            "role": "customer",
+            "referral_code": uuid.UUID(int=rng.getrandbits(128)).hex[:8].upper(),
+            "referred_by": None,
+            "referral_balance": 0.0,
+            "wallet_balance": round(rng.uniform(0, 200), 2),
+            "credits_balance": rng.randint(0, 5000),
+            "is_blocked": False,
+            "created_at": now - timedelta(minutes=rng.randint(0, 1_000_000)),
+        }
+
+
+def _orders(rng: random.Random, n: int, users: List[Tuple[str, str]], products: List[Dict[str, Any]]):
+    now = datetime.now(timezone.utc)
+    for _ in range(n):
+        user_id, email = rng.choice(users)
+        items = []
+        for product in rng.sample(products, rng.randint(1, 3)):
+            items.append({
+                "product_id": product["id"],
+                "product_name": product["name"],
+                "quantity": rng.randint(1, 2),
+                "price": float(product.get("price", 0) or 0),
+                "player_id": str(rng.randint(10**8, 10**9)) if product.get("requires_player_id") else None,
+                "credentials": None,
+            })
+        total = round(sum(i["price"] * i["quantity"] for i in items), 2)
+        created = now - timedelta(minutes=rng.randint(0, 1_000_000))
+        paid = rng.random() < 0.7
+        yield {
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "user_id": user_id,
+            "user_email": email,
+            "items": items,
+            "total_amount": total,
+            "currency": "USD",
+            "payment_method": rng.choice(_PAYMENT_METHODS),
+            "payment_status": "paid" if paid else rng.choice(["pending", "pending_verification"]),
+            "order_status": rng.choice(["completed", "processing"]) if paid else "pending",
+            "payment_proof_url": None,
+            "transaction_id": None,
+            "plisio_invoice_id": None,
+            "delivery_info": None,
+            "created_at": created,
+            "updated_at": created,
+        }
+
+
+async def _seed_database(server, args) -> Dict[str, Any]:
+    """Fill server.db with the synthetic dataset; returns the manifest the scenarios draw from."""
+    db = server.db
+    rng = random.Random(args.seed)
+    print(f"Seeding {db.name} (users={args.users:,}, orders={args.orders:,}, products={args.products:,})")
+
+    # Catalog: the app's demo + game seeders, padded with synthetic variants of them
+    print(f"  demo products: {(await server.seed_demo_products_internal())['status']}")
+    print(f"  game configs:  {(await server.seed_games_internal())['status']}")
+    base = await db.products.find({}, {"_id": 0}).to_list(None)
+    missing = args.products - len(base)
+    if missing > 0 and base:
+        def padded():
+            for i in range(missing):
+                template = rng.choice(base)
+                yield {**template, "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                       "name": f"{template['name']} #{i}", "price": round(rng.uniform(1, 200), 2),
+                       "created_at": datetime.now(timezone.utc)}
+        await _insert_batches(db.products, padded(), missing, args.batch_size, "products")
+    # Checkout benchmark uses products that need no player id / credentials
+    products = await db.products.find(
+        {"requires_player_id": {"$ne": True}, "requires_credentials": {"$ne": True}}, {"_id": 0}
+    ).to_list(None)
+
+    password_hash = server.pwd_context.hash("bench-password")
+    await server.ensure_indexes()
+    await _insert_batches(db.users, _users(rng, args.users, password_hash, server._new_customer_id),
+                          args.users, args.batch_size, "users")
+
+    sample_users = [(u["id"], u["email"]) for u in await db.users.find(
+        {"role": "customer"}, {"_id": 0, "id": 1, "email": 1}).limit(min(args.users, 20_000)).to_list(None)]
+    await _insert_batches(db.orders, _orders(rng, args.orders, sample_users, products),
+                          args.orders, args.batch_size, "orders")
+
+    pending = await db.orders.find({"payment_status": "pending"}, {"_id": 0, "id": 1}).limit(5000).to_list(None)
+    return {
+        "db_name": db.name,
+        "seeded_at": datetime.now(timezone.utc).isoformat(),
+        "users": [{"id": uid, "email": email} for uid, email in sample_users[:2000]],
+        "products": [{"id": p["id"], "name": p["name"], "price": p.get("price", 0)} for p in products[:500]],
+        "pending_order_ids": [o["id"] for o in pending],
+        "search_terms": [n.lower()[:3] for n in _FIRST_NAMES],
+    }
+
+
+async def seed(args) -> None:
+    db_name = os.environ.get("DB_NAME", "kayicom_bench")
+    if "bench" not in db_name and not args.force:
+        sys.exit(f"❌ Refusing to seed DB_NAME={db_name!r}: use a name containing 'bench' or pass --force")
+    os.environ["DB_NAME"] = db_name
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+
+    import server  # noqa: E402  (reads MONGO_URL / DB_NAME at import)
+
+    if args.drop:
+        await server.client.drop_database(db_name)
+    manifest = await _seed_database(server, args)
+    Path(args.manifest).parent.mkdir(parents=True, exist_ok=True)
+    Path(args.manifest).write_text(json.dumps(manifest))
+    print(f"✅ Seeded. Manifest: {args.manifest}")
+
+
+# ==================== SCENARIOS ====================
+
+Request = Tuple[str, str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]  # method, path, params, json
+
+
+def _scenarios(manifest: Dict[str, Any], rng: random.Random) -> Dict[str, Callable[[], Request]]:
+    users, products = manifest["users"], manifest["products"]
+    pending, terms = manifest["pending_order_ids"], manifest["search_terms"]
+
+    def catalog() -> Request:
+        return "GET", "/api/products", None, None
+
+    def checkout() -> Request:
+        user = rng.choice(users)
+        items = [{"product_id": p["id"], "product_name": p["name"], "quantity": 1, "price": p["price"]}
+                 for p in rng.sample(products, rng.randint(1, 2))]
+        return ("POST", "/api/orders", {"user_id": user["id"], "user_email": user["email"]},
+                {"items": items, "payment_method": "paypal"})
+
+    def webhook() -> Request:
+        # Replayed "completed" callbacks: the handler must stay idempotent
+        return "POST", "/api/payments/plisio-callback", None, {"order_number": rng.choice(pending), "status": "completed"}
+
+    def admin_customers() -> Request:
+        return "GET", "/api/admin/customers", {"q": rng.choice(terms), "limit": 50}, None
+
+    def dashboard() -> Request:
+        return "GET", "/api/stats/dashboard", None, None
+
+    return {"catalog": catalog, "checkout": checkout, "webhook": webhook,
+            "admin_customers": admin_customers, "dashboard": dashboard}
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], errors: int, wall: float) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        "requests": total,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "req_per_s": round(total / wall, 1) if wall else 0.0,
+        "p50_ms": round(_percentile(ordered, 0.50) * 1000, 2),
+        "p90_ms": round(_percentile(ordered, 0.90) * 1000, 2),
+        "p99_ms": round(_percentile(ordered, 0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+    }
+
+
+async def _drive(client, make_request: Callable[[], Request], total: int, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            method, path, params, body = make_request()
+            start = time.perf_counter()
+            try:
+                r = await client.request(method, path, params=params, json=body)
+                ok = r.status_code < 400
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """Scenarios whose p99 grew or throughput fell by more than max_regression (fraction)."""
+    failures = []
+    for name, current in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        if before["p99_ms"] and current["p99_ms"] > before["p99_ms"] * (1 + max_regression):
+            failures.append(f"{name}: p99 {before['p99_ms']}ms -> {current['p99_ms']}ms")
+        if before["req_per_s"] and current["req_per_s"] < before["req_per_s"] * (1 - max_regression):
+            failures.append(f"{name}: req/s {before['req_per_s']} -> {current['req_per_s']}")
+        if current["error_rate"] > before["error_rate"] + 0.01:
+            failures.append(f"{name}: error rate {before['error_rate']} -> {current['error_rate']}")
+    return failures
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+async def run(args) -> int:
+    import httpx
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    if args.in_process:
+        # No Mongo, no sockets: seed the in-memory backend and call the ASGI app directly
+        os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+        import server  # noqa: E402
+        from memory_mongo import MemoryClient  # noqa: E402
+
+        server.db.use(MemoryClient()["kayicom_bench"])
+        server.app.state.ready = True
+        manifest = await _seed_database(server, args)
+        client_options: Dict[str, Any] = {"transport": httpx.ASGITransport(app=server.app), "base_url": "http://bench"}
+    else:
+        manifest = json.loads(Path(args.manifest).read_text())
+        client_options = {"base_url": args.base_url}
+    rng = random.Random(args.seed)
+    scenarios = _scenarios(manifest, rng)
+    selected = [s.strip() for s in args.scenarios.split(",")] if args.scenarios else list(scenarios)
+    unknown = [s for s in selected if s not in scenarios]
+    if unknown:
+        sys.exit(f"❌ Unknown scenario(s): {', '.join(unknown)} (choose from {', '.join(scenarios)})")
+
+    results: Dict[str, Any] = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "base_url": "in-process (memory_mongo)" if args.in_process else args.base_url,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "db_name": manifest.get("db_name"),
+        },
+        "scenarios": {},
+    }
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30, **client_options) as client:
+        print(f"{'scenario':<16} {'req/s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for name in selected:
+            await _drive(client, scenarios[name], args.warmup, min(args.concurrency, max(args.warmup, 1)))
+            stats = await _drive(client, scenarios[name], args.requests, args.concurrency)
+            results["scenarios"][name] = stats
+            print(f"{name:<16} {stats['req_per_s']:>9.1f} {stats['p50_ms']:>9.2f} {stats['p90_ms']:>9.2f} "
+                  f"{stats['p99_ms']:>9.2f} {stats['errors']:>7}")
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    print(f"Results: {args.output}")
+
+    status = 0
+    if args.baseline and Path(args.baseline).exists() and not args.save_baseline:
+        failures = compare(results, json.loads(Path(args.baseline).read_text()), args.max_regression)
+        if failures:
+            print(f"❌ Regressions beyond {args.max_regression:.0%}:")
+            for failure in failures:
+                print(f"   {failure}")
+            status = 1
+        else:
+            print(f"✅ Within {args.max_regression:.0%} of baseline {args.baseline}")
+    if args.save_baseline:
+        path = args.baseline or str(OUT_DIR / "baseline.json")
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(results, indent=2))
+        print(f"Baseline saved: {path}")
+    return status
+
+
+def _dataset_args(parser: argparse.ArgumentParser, users: int, orders: int, products: int) -> None:
+    parser.add_argument("--users", type=int, default=users)
+    parser.add_argument("--orders", type=int, default=orders)
+    parser.add_argument("--products", type=int, default=products)
+    parser.add_argument("--batch-size", type=int, default=5_000)
+    parser.add_argument("--seed", type=int, default=42)
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_seed = sub.add_parser("seed", help="seed a synthetic dataset")
+    _dataset_args(p_seed, users=100_000, orders=1_000_000, products=5_000)
+    p_seed.add_argument("--drop", action="store_true", help="drop the database first")
+    p_seed.add_argument("--force", action="store_true", help="allow a DB_NAME without 'bench'")
+    p_seed.add_argument("--manifest", default=str(DEFAULT_MANIFEST))
+
+    p_run = sub.add_parser("run", help="drive the scenarios against a running API")
+    p_run.add_argument("--base-url", default="http://localhost:8000")
+    p_run.add_argument("--concurrency", type=int, default=32)
+    p_run.add_argument("--requests", type=int, default=2000, help="per scenario")
+    p_run.add_argument("--warmup", type=int, default=100, help="unmeasured requests per scenario")
+    p_run.add_argument("--scenarios", default="", help="comma-separated; default all")
+    p_run.add_argument("--in-process", action="store_true",
+                       help="seed the in-memory backend (dataset flags below) and drive the app without a server")
+    _dataset_args(p_run, users=5_000, orders=50_000, products=500)
+    p_run.add_argument("--manifest", default=str(DEFAULT_MANIFEST))
+    p_run.add_argument("--output", default=str(DEFAULT_OUTPUT))
+    p_run.add_argument("--baseline", default="")
+    p_run.add_argument("--max-regression", type=float, default=0.15, help="allowed fraction, e.g. 0.15 = 15%%")
+    p_run.add_argument("--save-baseline", action="store_true", help="write this run as the baseline")
+
+    args = parser.parse_args(argv)
+    if args.command == "seed":
+        asyncio.run(seed(args))
+    else:
+        sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -43,6 +43,57 @@ export const axiosInstance = axios.create({
   baseURL: API,
 });
 
+// Drop the saved login and send the user to log in again
+const endSession = () => {
+  localStorage.removeItem('user');
+  if (!window.location.pathname.startsWith('/login')) {
+    window.location.assign('/login');
+  }
+};
+
+const savedSessionExpired = (saved) => Boolean(
+  saved && saved.access_token && saved.token_expires_at && Date.now() >= saved.token_expires_at
+);
+
+// Session token from /auth/login, kept with the saved user (users saved before
+// tokens existed have none and still go by ?user_id=). An expired token ends the
+// session: falling back to ?user_id= would fail once SESSION_TOKENS_REQUIRED is on.
+export const sessionToken = () => {
+  let saved;
+  try {
+    saved = JSON.parse(localStorage.getItem('user') || 'null');
+  } catch (e) {
+    return null;
+  }
+  if (!saved || !saved.access_token) return null;
+  if (savedSessionExpired(saved)) {
+    endSession();
+    return null;
+  }
+  return saved.access_token;
+};
+
+axiosInstance.interceptors.request.use((config) => {
+  const token = sessionToken();
+  if (token && !(config.headers && config.headers.Authorization)) {
+    config.headers = config.headers || {};
+    config.headers.Authorization = `Bearer ${token}`;
+  }
+  return config;
+});
+
+// A rejected token (expired early, or signed with a rotated secret), or a saved
+// login without one once tokens are required, means logging in again
+const SESSION_ENDED = ['Session expired', 'Invalid session token', 'Not authenticated'];
+
+axiosInstance.interceptors.response.use(undefined, (error) => {
+  const detail = error.response && error.response.data && error.response.data.detail;
+  if (error.response && error.response.status === 401 && SESSION_ENDED.includes(detail) && localStorage.getItem('user')) {
+    endSession();
+  }
+  return Promise.reject(error);
+});
+
 // Create language context
 export const LanguageContext = createContext();
 
@@ -69,7 +120,13 @@ function App() {
     const savedUser = localStorage.getItem('user');
     if (savedUser) {
       try {
-        setUser(JSON.parse(savedUser));
+        const parsed = JSON.parse(savedUser);
+        if (savedSessionExpired(parsed)) {
+          // Browse logged out rather than with a token nobody accepts
+          localStorage.removeItem('user');
+        } else {
+          setUser(parsed);
+        }
       } catch (e) {
         console.error('Error parsing saved user:', e);
         localStorage.removeItem('user');
@@ -112,6 +169,10 @@ function App() {
     if (!normalized.full_name && normalized.username) {
       normalized.full_name = normalized.username;
     }
+    // Remember when the session token runs out, so expired tokens aren't sent
+    if (normalized.access_token && normalized.expires_in && !normalized.token_expires_at) {
+      normalized.token_expires_at = Date.now() + normalized.expires_in * 1000;
+    }
     setUser(normalized);
     localStorage.setItem('user', JSON.stringify(normalized));
     return normalized; // Return for redirect logic
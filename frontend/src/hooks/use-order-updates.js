@@ -0,0 +1,81 @@
+import { useEffect, useRef } from 'react';
+import { API, axiosInstance, sessionToken } from '../App';
+
+const TOPICS = ['orders', 'wallet_topups', 'minutes_transfers'];
+
+// Pushed state changes of the user's own orders and topups: Server-Sent Events,
+// or long-polling where EventSource is unavailable. onChange(topic, doc) gets a
+// document's current fields; onReset() means updates were missed and the page
+// should reload its data once.
+export function useOrderUpdates(userId, onChange, onReset) {
+  const handlers = useRef({ onChange, onReset });
+  handlers.current = { onChange, onReset };
+
+  useEffect(() => {
+    if (!userId) return undefined;
+    let stopped = false;
+    // The session token identifies the caller (axios sends it as a Bearer header,
+    // EventSource can't set headers so it goes as ?token=); ?user_id= only for
+    // users saved before tokens existed
+    const query = () => {
+      const token = sessionToken();
+      return token ? `token=${encodeURIComponent(token)}` : `user_id=${encodeURIComponent(userId)}`;
+    };
+
+    if (typeof EventSource !== 'undefined') {
+      let source;
+      let retry;
+      const connect = () => {
+        source = new EventSource(`${API}/events?${query()}`);
+        TOPICS.forEach((topic) => {
+          source.addEventListener(topic, (e) => handlers.current.onChange(topic, JSON.parse(e.data).doc));
+        });
+        // Reconnect without the stale Last-Event-ID
+        source.addEventListener('reset', () => {
+          source.close();
+          if (handlers.current.onReset) handlers.current.onReset();
+          if (!stopped) connect();
+        });
+        // EventSource gives up on an error status (e.g. 401 after the token in the
+        // URL expired): reconnect with a fresh query
+        source.onerror = () => {
+          if (source.readyState !== EventSource.CLOSED || stopped) return;
+          retry = setTimeout(() => {
+            if (!stopped) connect();
+          }, 5000);
+        };
+      };
+      connect();
+      return () => {
+        stopped = true;
+        clearTimeout(retry);
+        source.close();
+      };
+    }
+
+    const poll = async () => {
+      let after = null;
+      while (!stopped) {
+        try {
+          const params = sessionToken() ? {} : { user_id: userId };
+          if (after !== null) params.after = after;
+          const { data } = await axiosInstance.get('/events/poll', { params });
+          if (stopped) return;
+          if (data.reset) {
+            after = null;
+            if (handlers.current.onReset) handlers.current.onReset();
+            continue;
+          }
+          data.events.forEach((e) => handlers.current.onChange(e.topic, e.doc));
+          after = data.next;
+        } catch (error) {
+          await new Promise((resolve) => setTimeout(resolve, 5000));
+        }
+      }
+    };
+    poll();
+    return () => {
+      stopped = true;
+    };
+  }, [userId]);
+}
@@ -1,6 +1,6 @@
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import { Link } from 'react-router-dom';
-import { axiosInstance } from '../App';
+import { API, axiosInstance } from '../App';
 import Navbar from '../components/Navbar';
 import Footer from '../components/Footer';
 import { Card, CardContent } from '@/components/ui/card';
@@ -29,7 +29,8 @@ import { toast } from 'sonner';
 const AdminOrders = ({ user, logout, settings }) => {
   const [orders, setOrders] = useState([]);
   const [loading, setLoading] = useState(true);
-  const [filter, setFilter] = useState('all');
+  const [filter, setFilter] = useState('pending_payment');
+  const [queueCounts, setQueueCounts] = useState({});
   const [deliveryDialog, setDeliveryDialog] = useState(false);
   const [selectedOrder, setSelectedOrder] = useState(null);
   const [deliveryInfo, setDeliveryInfo] = useState('');
@@ -39,14 +40,60 @@ const AdminOrders = ({ user, logout, settings }) => {
   const [proofViewerOpen, setProofViewerOpen] = useState(false);
   const [selectedProofUrl, setSelectedProofUrl] = useState(null);
 
+  // Work-queue filters load just that queue from the server; the others still need the full list
+  const QUEUES = { pending_payment: 'pending_verification', processing: 'processing' };
+
+  // Live when the admin change feed is connected: actions then wait for its event instead of reloading the list
+  const [live, setLive] = useState(false);
+  const loadOrdersRef = useRef(null);
+
   useEffect(() => {
     loadOrders();
+  }, [filter]);
+
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') return undefined;
+    let source;
+    const connect = () => {
+      source = new EventSource(`${API}/admin/events?topics=orders`);
+      source.onopen = () => setLive(true);
+      source.onerror = () => setLive(false);
+      source.addEventListener('orders', (e) => {
+        const { doc } = JSON.parse(e.data);
+        setOrders((current) => {
+          const index = current.findIndex((o) => o.id === doc.id);
+          if (index === -1) return [doc, ...current];
+          const next = current.slice();
+          next[index] = { ...current[index], ...doc };
+          return next;
+        });
+        axiosInstance.get('/admin/queues').then((r) => setQueueCounts(r.data.orders || {})).catch(() => {});
+      });
+      // Missed too much to replay: reload, then start a fresh stream (without the stale Last-Event-ID)
+      source.addEventListener('reset', () => {
+        source.close();
+        loadOrdersRef.current();
+        connect();
+      });
+    };
+    connect();
+    return () => source.close();
   }, []);
 
   const loadOrders = async () => {
     try {
-      const response = await axiosInstance.get('/orders');
-      setOrders(response.data);
+      const queue = QUEUES[filter];
+      if (queue) {
+        const [page, counts] = await Promise.all([
+          axiosInstance.get(`/admin/queues/orders/${queue}?limit=200`),
+          axiosInstance.get('/admin/queues'),
+        ]);
+        setOrders(page.data.items);
+        setQueueCounts(counts.data.orders || {});
+      } else {
+        const response = await axiosInstance.get('/orders');
+        setOrders(response.data);
+      }
     } catch (error) {
       console.error('Error loading orders:', error);
       toast.error('Error loading orders');
@@ -54,12 +101,13 @@ const AdminOrders = ({ user, logout, settings }) => {
       setLoading(false);
     }
   };
+  loadOrdersRef.current = loadOrders;
 
   const handleApprovePayment = async (orderId) => {
     try {
       await axiosInstance.put(`/orders/${orderId}/status?payment_status=paid&order_status=processing`);
       toast.success('Payment approved!');
-      loadOrders();
+      if (!live) loadOrders();
     } catch (error) {
       console.error('Error approving payment:', error);
       toast.error('Error approving payment');
@@ -72,7 +120,7 @@ const AdminOrders = ({ user, logout, settings }) => {
     try {
       await axiosInstance.put(`/orders/${orderId}/status?payment_status=failed`);
       toast.success('Payment rejected');
-      loadOrders();
+      if (!live) loadOrders();
     } catch (error) {
       console.error('Error rejecting payment:', error);
       toast.error('Error rejecting payment');
@@ -83,7 +131,7 @@ const AdminOrders = ({ user, logout, settings }) => {
     try {
       await axiosInstance.put(`/orders/${orderId}/status?order_status=completed`);
       toast.success('Order completed!');
-      loadOrders();
+      if (!live) loadOrders();
     } catch (error) {
       console.error('Error completing order:', error);
       toast.error('Error completing order');
@@ -117,7 +165,7 @@ const AdminOrders = ({ user, logout, settings }) => {
       });
       toast.success('Refunded to wallet successfully');
       setRefundDialog(false);
-      loadOrders();
+      if (!live) loadOrders();
     } catch (error) {
       console.error('Error refunding order:', error);
       toast.error(error.response?.data?.detail || 'Error refunding order');
@@ -138,7 +186,7 @@ const AdminOrders = ({ user, logout, settings }) => {
       
       toast.success('Order delivered successfully! Customer will receive the information.');
       setDeliveryDialog(false);
-      loadOrders();
+      if (!live) loadOrders();
     } catch (error) {
       console.error('Error delivering order:', error);
       toast.error('Error delivering order');
@@ -197,8 +245,8 @@ const AdminOrders = ({ user, logout, settings }) => {
               </SelectTrigger>
               <SelectContent>
                 <SelectItem value="all">All Orders</SelectItem>
-                <SelectItem value="pending_payment">Pending Payment</SelectItem>
-                <SelectItem value="processing">Processing</SelectItem>
+                <SelectItem value="pending_payment">Pending Payment{queueCounts.pending_verification != null ? ` (${queueCounts.pending_verification})` : ''}</SelectItem>
+                <SelectItem value="processing">Processing{queueCounts.processing != null ? ` (${queueCounts.processing})` : ''}</SelectItem>
                 <SelectItem value="completed">Completed</SelectItem>
               </SelectContent>
             </Select>
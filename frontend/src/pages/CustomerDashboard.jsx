@@ -1,6 +1,7 @@
 import { useEffect, useMemo, useState } from 'react';
 import { Link } from 'react-router-dom';
 import { axiosInstance } from '../App';
+import { useOrderUpdates } from '../hooks/use-order-updates';
 import Navbar from '../components/Navbar';
 import Footer from '../components/Footer';
 import { Card, CardContent } from '@/components/ui/card';
@@ -25,6 +26,18 @@ const CustomerDashboard = ({ user, logout, settings }) => {
     return () => clearInterval(id);
   }, []);
 
+  // Status changes of the user's orders are pushed and patched in place
+  useOrderUpdates(user?.user_id, (topic, doc) => {
+    if (topic !== 'orders') return;
+    setOrders((current) => {
+      const index = current.findIndex((o) => o.id === doc.id);
+      if (index === -1) return [doc, ...current];
+      const next = current.slice();
+      next[index] = { ...current[index], ...doc };
+      return next;
+    });
+  }, () => loadOrders());
+
   const loadOrders = async () => {
     try {
       const response = await axiosInstance.get(`/orders?user_id=${user.user_id}`);
@@ -1,6 +1,7 @@
 import { useEffect, useState } from 'react';
 import { useParams } from 'react-router-dom';
 import { axiosInstance } from '../App';
+import { useOrderUpdates } from '../hooks/use-order-updates';
 import Navbar from '../components/Navbar';
 import Footer from '../components/Footer';
 import { Card, CardContent } from '@/components/ui/card';
@@ -32,6 +33,13 @@ const OrderTrackingPage = ({ user, logout, settings }) => {
     return () => clearInterval(id);
   }, []);
 
+  // Status changes are pushed; no need to refetch the order to see it paid or delivered
+  useOrderUpdates(user?.user_id, (topic, doc) => {
+    if (topic === 'orders' && doc.id === orderId) {
+      setOrder((current) => (current ? { ...current, ...doc } : current));
+    }
+  }, () => loadOrder());
+
   const loadOrder = async () => {
     try {
       const response = await axiosInstance.get(`/orders/${orderId}`);
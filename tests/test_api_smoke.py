@@ -1,3 +1,4 @@
+import json
 import os
 import re
 import sys
@@ -5,138 +6,16 @@ import sys
 import pytest
 from fastapi.testclient import TestClient
 
-
-class _FakeCursor:
-    def __init__(self, items):
-        self._items = items
-        self._skip = 0
-
-    def sort(self, *_args, **_kwargs):
-        # no-op for tests
-        return self
-
-    def skip(self, n):
-        try:
-            self._skip = max(0, int(n))
-        except Exception:
-            self._skip = 0
-        return self
-
-    async def to_list(self, length):
-        items = list(self._items)[self._skip:]
-        return items[:length]
-
-
-def _match_value(doc_value, query_value):
-    # equality
-    if not isinstance(query_value, dict):
-        return doc_value == query_value
-
-    # regex
-    if "$regex" in query_value:
-        pattern = query_value.get("$regex") or ""
-        flags = 0
-        if (query_value.get("$options") or "").lower().find("i") >= 0:
-            flags |= re.IGNORECASE
-        try:
-            return re.search(pattern, str(doc_value or ""), flags) is not None
-        except re.error:
-            return False
-
-    return False
-
-
-def _doc_matches(doc, query):
-    if not query:
-        return True
-
-    # Mongo semantics: other keys AND ($or matches)
-    for k, v in query.items():
-        if k == "$or":
-            continue
-        if not _match_value(doc.get(k), v):
-            return False
-
-    if "$or" in query:
-        return any(_doc_matches(doc, subq) for subq in (query.get("$or") or []))
-
-    return True
-
-
-class _FakeCollection:
-    def __init__(self, initial=None):
-        self._docs = list(initial or [])
-
-    def _project(self, doc, projection):
-        if not projection:
-            return dict(doc)
-        # handle {"_id": 0} or {"email": 1, "_id": 0}
-        include = {k for k, v in projection.items() if v and k != "_id"}
-        exclude_id = projection.get("_id") == 0
-
-        if include:
-            out = {k: doc.get(k) for k in include if k in doc}
-            if not exclude_id and "_id" in doc:
-                out["_id"] = doc["_id"]
-            return out
-
-        out = dict(doc)
-        if exclude_id:
-            out.pop("_id", None)
-        return out
-
-    async def find_one(self, query, projection=None):
-        for d in self._docs:
-            if _doc_matches(d, query):
-                return self._project(d, projection)
-        return None
-
-    def find(self, query, projection=None):
-        items = [self._project(d, projection) for d in self._docs if _doc_matches(d, query)]
-        return _FakeCursor(items)
-
-    async def insert_one(self, doc):
-        self._docs.append(dict(doc))
-        return {"inserted_id": doc.get("id")}
-
-    async def update_one(self, query, update):
-        for d in self._docs:
-            if _doc_matches(d, query):
-                if "$set" in update:
-                    for k, v in update["$set"].items():
-                        d[k] = v
-                if "$inc" in update:
-                    for k, v in update["$inc"].items():
-                        d[k] = float(d.get(k, 0.0)) + float(v)
-                return {"matched_count": 1, "modified_count": 1}
-        return {"matched_count": 0, "modified_count": 0}
-
-    async def count_documents(self, query):
-        return sum(1 for d in self._docs if _doc_matches(d, query))
-
-
-class _FakeDB:
-    def __init__(self):
-        self.users = _FakeCollection()
-        self.products = _FakeCollection()
-        self.wallet_transactions = _FakeCollection()
-        self.referral_payouts = _FakeCollection()
-        self.settings = _FakeCollection([{
-            "id": "site_settings",
-            "minutes_transfer_enabled": True,
-            "minutes_transfer_fee_type": "percent",
-            "minutes_transfer_fee_value": 10.0,
-            "minutes_transfer_min_amount": 1.0,
-            "minutes_transfer_max_amount": 500.0,
-            "payment_gateways": {"paypal": {"enabled": True, "email": "x", "instructions": "pay"}},
-            "plisio_api_key": "dummy"
-        }])
-        self.minutes_transfers = _FakeCollection()
-        self.orders = _FakeCollection()
-        self.credits_transactions = _FakeCollection()
-        self.withdrawals = _FakeCollection()
-        self.wallet_topups = _FakeCollection()
-        self.minutes_transfers = _FakeCollection()
+SITE_SETTINGS = {
+    "id": "site_settings",
+    "minutes_transfer_enabled": True,
+    "minutes_transfer_fee_type": "percent",
+    "minutes_transfer_fee_value": 10.0,
+    "minutes_transfer_min_amount": 1.0,
+    "minutes_transfer_max_amount": 500.0,
+    "payment_gateways": {"paypal": {"enabled": True, "email": "x", "instructions": "pay"}},
+    "plisio_api_key": "dummy"
+}
 
 
 @pytest.fixture()
@@ -151,8 +30,21 @@ def app_module(monkeypatch):
     import importlib
 
     server = importlib.import_module("server")
-    fake_db = _FakeDB()
-    monkeypatch.setattr(server, "db", fake_db, raising=True)
+    memory_mongo = importlib.import_module("memory_mongo")
+    fake_db = memory_mongo.MemoryClient()["test"]
+    fake_db.settings.preload([SITE_SETTINGS])
+    monkeypatch.setattr(server.db, "target", fake_db)
+    # Module state survives between tests: start every test with cold caches
+    server._settings_cache.invalidate()
+    server._catalog_cache.invalidate()
+    server._mongo_ping_cache.invalidate()
+    server.sessions._revocations.invalidate()
+    importlib.import_module("rate_limit").LIMITER.reset()
+    importlib.import_module("crypto_pricing").invalidate()
+    importlib.import_module("routers.referrals")._leaderboard_cache.invalidate()
+    importlib.import_module("routers.referrals")._payout_indexes.invalidate()
+    importlib.import_module("events").BUS.reset()
+    server.app.state.ready = False
     return server
 
 
@@ -168,34 +60,36 @@ def test_register_assigns_customer_id(app_module):
     assert data.get("customer_id", "").startswith("KC-")
 
 
-def test_login_backfills_customer_id_for_legacy_user(app_module):
-    # Insert a legacy user with no customer_id
+def test_backfill_assigns_customer_id_to_legacy_users(app_module):
+    # Legacy users with no / empty customer_id
     hashed = app_module.pwd_context.hash("pass12345")
-    app_module.db.users._docs.append(
-        {
-            "id": "u-1",
-            "email": "legacy@example.com",
-            "full_name": "Legacy",
-            "role": "customer",
-            "password": hashed,
-            "wallet_balance": 0.0,
-            "customer_id": "",
-        }
+    app_module.db.users.preload(
+        [
+            {"id": "u-1", "email": "legacy@example.com", "full_name": "Legacy", "role": "customer", "password": hashed, "customer_id": ""},
+            {"id": "u-1b", "email": "legacy2@example.com", "full_name": "Legacy2", "role": "customer", "password": hashed},
+            {"id": "u-1c", "email": "has@example.com", "full_name": "Has", "role": "customer", "password": hashed, "customer_id": "KC-12121212"},
+        ]
     )
 
+    import asyncio
+
+    result = asyncio.run(app_module.backfill_customer_ids(batch_size=1))
+    assert result["assigned"] == 2
+
+    stored = {d["id"]: d.get("customer_id") for d in app_module.db.users.documents}
+    assert stored["u-1"].startswith("KC-")
+    assert stored["u-1b"].startswith("KC-")
+    assert stored["u-1c"] == "KC-12121212"
+
+    # Login returns the persisted id without writing anything
     client = TestClient(app_module.app)
     r = client.post("/api/auth/login", json={"email": "legacy@example.com", "password": "pass12345"})
     assert r.status_code == 200, r.text
-    data = r.json()
-    assert data.get("customer_id", "").startswith("KC-")
-
-    # Ensure persisted
-    stored = next(d for d in app_module.db.users._docs if d["id"] == "u-1")
-    assert stored.get("customer_id", "").startswith("KC-")
+    assert r.json()["customer_id"] == stored["u-1"]
 
 
 def test_products_search_q_filters(app_module):
-    app_module.db.products._docs.extend(
+    app_module.db.products.preload(
         [
             {"id": "p1", "name": "Steam Gift Card", "description": "Gaming", "category": "giftcard", "price": 10.0},
             {"id": "p2", "name": "Amazon Gift Card", "description": "Shopping", "category": "giftcard", "price": 25.0},
@@ -211,7 +105,7 @@ def test_products_search_q_filters(app_module):
 
 
 def test_admin_adjust_wallet_by_customer_id(app_module):
-    app_module.db.users._docs.append(
+    app_module.db.users.preload([
         {
             "id": "u-2",
             "customer_id": "KC-99999999",
@@ -221,7 +115,7 @@ def test_admin_adjust_wallet_by_customer_id(app_module):
             "password": app_module.pwd_context.hash("x"),
             "wallet_balance": 1.0,
         }
-    )
+    ])
     client = TestClient(app_module.app)
     r = client.post(
         "/api/wallet/admin-adjust",
@@ -233,11 +127,11 @@ def test_admin_adjust_wallet_by_customer_id(app_module):
     assert data["wallet_balance"] == pytest.approx(5.5)
 
     # transaction logged
-    assert len(app_module.db.wallet_transactions._docs) == 1
+    assert len(app_module.db.wallet_transactions.documents) == 1
 
 
 def test_admin_adjust_wallet_by_email_and_debit_validation(app_module):
-    app_module.db.users._docs.append(
+    app_module.db.users.preload([
         {
             "id": "u-3",
             "customer_id": "KC-11112222",
@@ -247,7 +141,7 @@ def test_admin_adjust_wallet_by_email_and_debit_validation(app_module):
             "password": app_module.pwd_context.hash("x"),
             "wallet_balance": 2.0,
         }
-    )
+    ])
     client = TestClient(app_module.app)
 
     # credit by email
@@ -261,7 +155,7 @@ def test_admin_adjust_wallet_by_email_and_debit_validation(app_module):
 
 
 def test_products_search_and_category_combined(app_module):
-    app_module.db.products._docs.extend(
+    app_module.db.products.preload(
         [
             {"id": "s1", "name": "Netflix", "description": "Entertainment", "category": "giftcard", "price": 10.0},
             {"id": "s2", "name": "Netflix", "description": "Service", "category": "service", "price": 12.0},
@@ -279,7 +173,7 @@ def test_products_search_and_category_combined(app_module):
 
 def test_minutes_quote_and_wallet_create(app_module):
     # Seed a user with wallet funds
-    app_module.db.users._docs.append(
+    app_module.db.users.preload([
         {
             "id": "u-m1",
             "email": "m1@example.com",
@@ -289,7 +183,7 @@ def test_minutes_quote_and_wallet_create(app_module):
             "wallet_balance": 100.0,
             "customer_id": "KC-22223333",
         }
-    )
+    ])
     client = TestClient(app_module.app)
 
     r = client.get("/api/minutes/quote?amount=10&country=Haiti")
@@ -317,9 +211,33 @@ def test_minutes_quote_and_wallet_create(app_module):
     assert r4.status_code == 200, r4.text
 
 
+def test_minutes_fee_schedule_tiers_countries_and_batch(app_module):
+    client = TestClient(app_module.app)
+    r = client.put("/api/settings", json={
+        "minutes_transfer_fee_tiers": [{"up_to": 20, "fee_type": "fixed", "fee_value": 1.5}, {"up_to": None, "fee_value": 5}],
+        "minutes_transfer_country_fees": {"Haiti": {"fee_type": "fixed", "fee_value": 0.5, "fee_tiers": [], "max_amount": 100}},
+    })
+    assert r.status_code == 200, r.text
+
+    app_module.db.counter.reset()
+    r = client.post("/api/minutes/quotes", json={"amounts": [10, 20, 40, 0.5]})
+    assert [q.get("fee_amount") for q in r.json()["quotes"]] == [1.5, 1.5, 2.0, None]
+    assert r.json()["quotes"][3]["error"].startswith("Amount must be between")
+    assert len(app_module.db.counter) == 0  # settings cached, fees compiled
+
+    from routers import minutes
+
+    schedule = minutes._schedule
+    r = client.post("/api/mobile-topup/quotes", json={"amounts": [40, 150], "country": "haiti "})
+    assert [q.get("total_amount") for q in r.json()["quotes"]] == [40.5, None]
+    assert client.get("/api/minutes/quote?amount=40&country=Haiti").json()["fee_amount"] == 0.5
+    assert minutes._schedule is schedule  # compiled once while settings are unchanged
+    assert client.post("/api/minutes/quotes", json={"amounts": [1] * 101}).status_code == 400
+
+
 def test_order_success_awards_credits_and_convert(app_module):
     # seed user
-    app_module.db.users._docs.append(
+    app_module.db.users.preload([
         {
             "id": "u-c1",
             "email": "c1@example.com",
@@ -330,9 +248,9 @@ def test_order_success_awards_credits_and_convert(app_module):
             "credits_balance": 95,
             "customer_id": "KC-33334444",
         }
-    )
+    ])
     # seed paid+completed order without credits_recorded
-    app_module.db.orders._docs.append(
+    app_module.db.orders.preload([
         {
             "id": "o-1",
             "user_id": "u-c1",
@@ -344,26 +262,26 @@ def test_order_success_awards_credits_and_convert(app_module):
             "order_status": "completed",
             "credits_recorded": False,
         }
-    )
+    ])
     client = TestClient(app_module.app)
 
     # completing should award credits idempotently
     r = client.put("/api/orders/o-1/complete")
     assert r.status_code == 200, r.text
     # user should now have 100 credits
-    user = next(u for u in app_module.db.users._docs if u["id"] == "u-c1")
+    user = next(u for u in app_module.db.users.documents if u["id"] == "u-c1")
     assert int(user.get("credits_balance", 0)) == 100
 
     # convert 100 credits to $1
     r2 = client.post("/api/credits/convert?user_id=u-c1&user_email=c1@example.com", json={"credits": 100})
     assert r2.status_code == 200, r2.text
-    user2 = next(u for u in app_module.db.users._docs if u["id"] == "u-c1")
+    user2 = next(u for u in app_module.db.users.documents if u["id"] == "u-c1")
     assert int(user2.get("credits_balance", 0)) == 0
     assert float(user2.get("wallet_balance", 0.0)) == pytest.approx(1.0)
 
 
 def test_admin_customers_list_and_search(app_module):
-    app_module.db.users._docs.extend(
+    app_module.db.users.preload(
         [
             {"id": "cu-1", "role": "customer", "email": "john@example.com", "full_name": "John", "customer_id": "KC-10101010", "wallet_balance": 0.0, "credits_balance": 0},
             {"id": "cu-2", "role": "customer", "email": "mary@example.com", "full_name": "Mary", "customer_id": "KC-20202020", "wallet_balance": 1.0, "credits_balance": 5},
@@ -385,18 +303,18 @@ def test_admin_customers_list_and_search(app_module):
 
 
 def test_admin_adjust_credits(app_module):
-    app_module.db.users._docs.append(
+    app_module.db.users.preload([
         {"id": "cu-3", "role": "customer", "email": "c3@example.com", "full_name": "C3", "customer_id": "KC-30303030", "credits_balance": 10}
-    )
+    ])
     client = TestClient(app_module.app)
     r = client.post("/api/credits/admin-adjust", json={"identifier": "KC-30303030", "credits": 90, "action": "credit"})
     assert r.status_code == 200, r.text
-    u = next(x for x in app_module.db.users._docs if x["id"] == "cu-3")
+    u = next(x for x in app_module.db.users.documents if x["id"] == "cu-3")
     assert int(u.get("credits_balance", 0)) == 100
 
 
 def test_block_customer_prevents_login(app_module):
-    app_module.db.users._docs.append(
+    app_module.db.users.preload([
         {
             "id": "blk-1",
             "role": "customer",
@@ -406,7 +324,1026 @@ def test_block_customer_prevents_login(app_module):
             "customer_id": "KC-90909090",
             "is_blocked": True,
         }
-    )
+    ])
     client = TestClient(app_module.app)
     r = client.post("/api/auth/login", json={"email": "blk@example.com", "password": "pass12345"})
     assert r.status_code == 403
+
+
+def test_admin_customer_overview_aggregates_sections(app_module):
+    app_module.db.users.preload([
+        {"id": "ov-1", "role": "customer", "email": "ov@example.com", "full_name": "Ov", "customer_id": "KC-40404040", "password": "x"}
+    ])
+    app_module.db.orders.preload(
+        [
+            {"id": "ov-o1", "user_id": "ov-1", "total_amount": 20.0, "payment_status": "paid", "order_status": "completed", "items": []},
+            {"id": "ov-o2", "user_id": "ov-1", "total_amount": 5.0, "payment_status": "cancelled", "order_status": "cancelled", "refunded_amount": 5.0, "items": []},
+            {"id": "other", "user_id": "someone-else", "total_amount": 99.0, "payment_status": "paid", "items": []},
+        ]
+    )
+    app_module.db.wallet_topups.preload([
+        {"id": "ov-t1", "user_id": "ov-1", "amount": 15.0, "payment_status": "paid", "credited": True}
+    ])
+    client = TestClient(app_module.app)
+
+    r = client.get("/api/admin/customers/ov-1/overview")
+    assert r.status_code == 200, r.text
+    data = r.json()
+    assert "password" not in data["customer"]
+    assert data["totals"]["lifetime_spend"] == {"total": 20.0, "count": 1}
+    assert data["totals"]["refunds"] == {"total": 5.0, "count": 1}
+    assert data["totals"]["topups"] == {"total": 15.0, "count": 1}
+    assert {o["id"] for o in data["orders"]} == {"ov-o1", "ov-o2"}
+    assert "items" not in data["orders"][0]
+    assert data["withdrawals"] == []
+
+    assert client.get("/api/admin/customers/missing/overview").status_code == 404
+
+
+def test_dates_are_stored_as_datetimes_and_legacy_strings_migrated(app_module):
+    import asyncio
+    from datetime import datetime
+
+    import migrate_datetimes
+
+    app_module.db.users.preload([
+        {"id": "dt-1", "email": "dt@example.com", "full_name": "Dt", "role": "customer", "wallet_balance": 50.0, "customer_id": "KC-50505050"}
+    ])
+    app_module.db.products.preload([
+        {"id": "dt-p", "name": "Card", "description": "d", "category": "giftcard", "price": 10.0}
+    ])
+    # Legacy order written as ISO strings
+    app_module.db.orders.preload([
+        {
+            "_id": "oid-legacy",
+            "id": "dt-legacy",
+            "user_id": "dt-1",
+            "user_email": "dt@example.com",
+            "items": [],
+            "total_amount": 5.0,
+            "payment_method": "paypal",
+            "created_at": "2024-01-02T03:04:05+00:00",
+            "updated_at": "2024-01-02T03:04:05+00:00",
+        }
+    ])
+    client = TestClient(app_module.app)
+
+    r = client.post(
+        "/api/orders?user_id=dt-1&user_email=dt@example.com",
+        json={"items": [{"product_id": "dt-p", "product_name": "Card", "quantity": 1, "price": 10.0}], "payment_method": "wallet"},
+    )
+    assert r.status_code == 200, r.text
+    new_order = next(o for o in app_module.db.orders.documents if o["id"] == r.json()["id"])
+    assert isinstance(new_order["created_at"], datetime)
+    assert isinstance(app_module.db.wallet_transactions.documents[0]["created_at"], datetime)
+
+    result = asyncio.run(migrate_datetimes.migrate_collection(app_module.db.orders, migrate_datetimes.DATETIME_FIELDS["orders"]))
+    assert result == {"converted": 1, "unparseable": 0}
+    legacy = next(o for o in app_module.db.orders.documents if o["id"] == "dt-legacy")
+    assert legacy["created_at"] == datetime.fromisoformat("2024-01-02T03:04:05+00:00")
+
+    r2 = client.get("/api/orders/dt-legacy")
+    assert r2.status_code == 200, r2.text
+    assert r2.json()["created_at"].startswith("2024-01-02T03:04:05")
+
+
+def test_fast_json_list_path_matches_validated_shape(app_module, monkeypatch):
+    from datetime import datetime, timezone
+
+    created = datetime(2025, 5, 6, 7, 8, 9, tzinfo=timezone.utc)
+    app_module.db.orders.preload([
+        {
+            "id": "fj-1",
+            "user_id": "fj-u",
+            "user_email": "fj@example.com",
+            "items": [{"product_id": "p", "product_name": "P", "quantity": 1, "price": 2.5}],
+            "total_amount": 2.5,
+            "payment_method": "wallet",
+            "internal_note": "not part of the model",
+            "created_at": created,
+            "updated_at": created,
+        }
+    ])
+    client = TestClient(app_module.app)
+
+    slow = client.get("/api/orders?user_id=fj-u").json()
+    monkeypatch.setattr(app_module.fast_json, "ENABLED", True)
+    fast = client.get("/api/orders?user_id=fj-u").json()
+
+    assert fast[0].keys() == slow[0].keys()
+    assert fast[0]["payment_status"] == "pending"
+    assert fast[0]["created_at"] == slow[0]["created_at"] == "2025-05-06T07:08:09Z"
+    assert "internal_note" not in fast[0]
+
+    # default_factory fields missing from a stored row are filled in, as the validated path does
+    legacy = app_module._ORDER_VIEW.rows([{"id": "fj-2", "user_id": "fj-u", "user_email": "fj@example.com", "items": [],
+                                          "total_amount": 0.0, "payment_method": "wallet", "created_at": created}])[0]
+    assert legacy.keys() == slow[0].keys() and legacy["created_at"] == created
+
+
+def test_cors_layer_covers_preflight_success_and_errors():
+    from fastapi import FastAPI, HTTPException
+
+    sys.path.insert(0, "/workspace/backend")
+    from cors import CORSHeadersMiddleware
+
+    app = FastAPI()
+
+    @app.get("/ok")
+    async def ok():
+        return {"ok": True}
+
+    @app.get("/missing")
+    async def missing():
+        raise HTTPException(status_code=404, detail="nope")
+
+    @app.get("/boom")
+    async def boom():
+        raise RuntimeError("boom")
+
+    app.add_middleware(CORSHeadersMiddleware, allow_origins=["https://kayicom.com", "https://www.kayicom.com"])
+    client = TestClient(app, raise_server_exceptions=False)
+
+    r = client.get("/ok", headers={"Origin": "https://www.kayicom.com"})
+    assert r.headers["access-control-allow-origin"] == "https://www.kayicom.com"
+    assert r.headers["access-control-allow-credentials"] == "true"
+    assert "Origin" in r.headers["vary"]
+
+    r = client.get("/missing", headers={"Origin": "https://kayicom.com"})
+    assert r.status_code == 404
+    assert r.headers["access-control-allow-origin"] == "https://kayicom.com"
+
+    r = client.get("/boom", headers={"Origin": "https://kayicom.com"})
+    assert r.status_code == 500
+    assert r.headers["access-control-allow-origin"] == "https://kayicom.com"
+
+    r = client.options(
+        "/ok",
+        headers={"Origin": "https://kayicom.com", "Access-Control-Request-Method": "POST", "Access-Control-Request-Headers": "content-type"},
+    )
+    assert r.status_code == 200
+    assert r.headers["access-control-allow-headers"] == "content-type"
+
+    r = client.options("/ok", headers={"Origin": "https://evil.example", "Access-Control-Request-Method": "POST"})
+    assert r.status_code == 400
+
+
+def test_metrics_endpoint_reports_routes_mongo_and_outbound(app_module):
+    import metrics
+
+    client = TestClient(app_module.app)
+    client.get("/api/products")
+    r = client.get("/api/products/does-not-exist")
+    assert r.status_code == 404
+
+    # Listener callbacks arrive on driver threads with only these attributes read
+    class _Event:
+        command_name = "find"
+        duration_micros = 1500
+
+    metrics.MONGO_LISTENER.succeeded(_Event())
+    with pytest.raises(RuntimeError):
+        with metrics.outbound("plisio", "create_invoice"):
+            raise RuntimeError("boom")
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain")
+    body = r.text
+    # Labelled by route template, not the raw path
+    assert re.search(r'http_requests_total\{method="GET",route="/api/products",status="200"\} \d+', body)
+    assert re.search(r'http_requests_total\{method="GET",route="/api/products/\{product_id\}",status="404"\} \d+', body)
+    assert "does-not-exist" not in body
+    assert 'http_request_duration_seconds_quantiles{method="GET",route="/api/products",quantile="0.99"}' in body
+    assert re.search(r'mongodb_commands_total\{command="find",outcome="success"\} \d+', body)
+    assert re.search(r'outbound_requests_total\{service="plisio",operation="create_invoice",outcome="error"\} \d+', body)
+
+    h = metrics.Histogram("t_seconds", "test", buckets=(0.1, 0.2, 0.4))
+    for v in (0.05, 0.15, 0.15, 0.3):
+        h.observe(v)
+    assert h.count() == 4
+    assert h.quantile(0.5) == pytest.approx(0.15)  # rank 2 of 4, halfway into (0.1, 0.2]
+    assert 0.2 < h.quantile(0.99) <= 0.4
+
+
+def test_db_profiler_headers_and_n_plus_one_log(app_module, caplog):
+    import logging
+
+    from fastapi import FastAPI
+
+    import db_profiler
+    import metrics
+
+    # The profiler has no listener of its own: it reads the shared per-request command log
+    listener = metrics.MONGO_LISTENER
+
+    class _Event:
+        def __init__(self, request_id, command_name, command):
+            self.connection_id = ("localhost", 27017)
+            self.request_id = request_id
+            self.command_name = command_name
+            self.command = command
+            self.duration_micros = 2000
+
+    app = FastAPI()
+
+    @app.get("/orders")
+    async def orders():
+        # What the driver reports for a per-item lookup loop
+        for i, command in enumerate([
+            {"find": "orders", "filter": {"user_id": "u1"}},
+            *({"find": "products", "filter": {"id": f"p{n}"}} for n in range(3)),
+        ]):
+            event = _Event(i, "find", command)
+            listener.started(event)
+            listener.succeeded(event)
+        return {"profiled": db_profiler.current_profile() is not None}
+
+    app.add_middleware(db_profiler.DBProfilerMiddleware, slow_ms=10_000)
+    client = TestClient(app)
+
+    with caplog.at_level(logging.WARNING, logger="db_profiler"):
+        r = client.get("/orders")
+    assert r.status_code == 200
+    assert r.json() == {"profiled": True}
+    assert r.headers["x-db-calls"] == "4"
+    assert r.headers["x-db-time"] == "8.0"
+
+    records = [json.loads(rec.getMessage()) for rec in caplog.records if rec.name == "db_profiler"]
+    assert len(records) == 1
+    assert records[0]["event"] == "n_plus_one"
+    assert records[0]["repeated"] == {'find products {"id": "?"}': 3}
+    assert len(records[0]["queries"]) == 4
+
+    # Outside a request nothing is recorded
+    listener.started(_Event(99, "find", {"find": "users", "filter": {}}))
+    assert db_profiler.current_profile() is None
+
+
+def test_loop_watchdog_logs_blocking_stack(app_module, caplog):
+    import asyncio
+    import logging
+    import time
+
+    import loop_watchdog
+    import metrics
+
+    stalls_before = metrics.LOOP_STALLS.value()
+
+    def _blocking_handler():
+        time.sleep(0.3)  # e.g. requests.post / bcrypt inside an async handler
+
+    async def run():
+        watchdog = loop_watchdog.LoopWatchdog(threshold_ms=100)
+        watchdog.start()
+        await asyncio.sleep(0.05)
+        _blocking_handler()
+        await asyncio.sleep(0.1)
+        await watchdog.stop()
+
+    with caplog.at_level(logging.WARNING, logger="loop_watchdog"):
+        asyncio.run(run())
+
+    records = [json.loads(rec.getMessage()) for rec in caplog.records if rec.name == "loop_watchdog"]
+    assert len(records) == 1
+    assert records[0]["event"] == "loop_stall"
+    assert records[0]["blocked_ms"] >= 100
+    assert any("_blocking_handler" in frame for frame in records[0]["stack"])
+    assert metrics.LOOP_STALLS.value() == stalls_before + 1
+
+
+def test_pool_health_and_read_write_routing(app_module):
+    from types import SimpleNamespace
+
+    from pymongo import ReadPreference
+
+    import database
+
+    assert database.available_compressors(["zstd", "bogus", "zlib", "zlib"])[-1] == "zlib"
+    assert "bogus" not in database.available_compressors(["bogus"])
+    options = database.client_options()
+    assert options["maxPoolSize"] > 0 and "zlib" in options["compressors"]
+
+    real = app_module.client["kayicom_test"].orders
+    assert database.analytics_reads(real).read_preference == ReadPreference.SECONDARY_PREFERRED
+    assert database.ledger_writes(real).write_concern.document == {"w": "majority"}
+
+    listener = database.PoolListener()
+    listener.max_pool_size = 4
+    event = SimpleNamespace(address=("db1", 27017))
+    for _ in range(4):
+        listener.connection_created(event)
+        listener.connection_check_out_started(event)
+        listener.connection_checked_out(event)
+    listener.connection_checked_in(event)
+    stats = listener.stats()["db1:27017"]
+    assert stats == {"connections": 4, "in_use": 3, "waiting": 0, "checkout_failures": 0,
+                     "max_pool_size": 4, "saturation": 0.75}
+    failures_before = database.POOL_CHECKOUT_FAILURES.value("db1:27017")
+    listener.connection_check_out_started(event)
+    listener.connection_check_out_failed(event)
+    assert listener.stats()["db1:27017"]["checkout_failures"] == 1
+    assert database.POOL_CHECKOUT_FAILURES.value("db1:27017") == failures_before + 1
+
+    client = TestClient(app_module.app)
+    r = client.get("/health/db")
+    assert r.status_code == 200
+    assert r.json()["status"] in ("ok", "saturated")
+    assert "mongodb_pool_in_use" in client.get("/metrics").text
+
+
+def test_lifespan_warms_caches_and_gates_health(app_module, monkeypatch):
+    server = app_module
+    assert TestClient(server.app).get("/health").status_code == 503
+
+    settings_reads = []
+    original_find_one = server.db.settings.find_one
+
+    async def counting_find_one(query, projection=None):
+        settings_reads.append(query)
+        return await original_find_one(query, projection)
+
+    monkeypatch.setattr(server.db.settings, "find_one", counting_find_one)
+    server.db.products.preload([{"id": "p1", "name": "Gift", "description": "d", "category": "giftcard", "price": 5.0}])
+
+    with TestClient(server.app) as client:
+        r = client.get("/health")
+        assert r.status_code == 200 and r.json() == {"status": "healthy"}
+        assert len(settings_reads) == 1  # warmed during startup
+
+        # Served from the warm caches
+        assert client.get("/api/settings").status_code == 200
+        assert client.get("/api/minutes/quote", params={"amount": 10, "country": "HT"}).status_code == 200
+        assert len(settings_reads) == 1
+        assert [p["id"] for p in client.get("/api/products").json()] == ["p1"]
+
+        # Writes invalidate
+        r = client.put("/api/settings", json={"site_name": "Renamed"})
+        assert r.status_code == 200 and r.json()["site_name"] == "Renamed"
+        assert len(settings_reads) == 2
+        r = client.post("/api/products", json={"name": "New", "description": "d", "category": "topup", "price": 1.0})
+        assert r.status_code == 200, r.text
+        assert len(client.get("/api/products").json()) == 2
+        assert len(client.get("/api/products", params={"category": "topup"}).json()) == 1
+
+    assert server.app.state.ready is True
+
+
+def test_ready_probe_reports_dependencies_and_breakers(app_module, monkeypatch):
+    import circuit_breaker
+    import http_clients
+
+    server = app_module
+    monkeypatch.setitem(http_clients.BREAKERS, "resend", circuit_breaker.CircuitBreaker("resend", failure_threshold=2, reset_timeout=60))
+
+    client = TestClient(server.app)
+    assert client.get("/health/live").json() == {"status": "alive"}
+    r = client.get("/health/ready")
+    assert r.status_code == 503 and r.json()["checks"]["warm"] is False  # no warm-up without lifespan
+
+    import metrics
+
+    monkeypatch.setattr(server.app.state, "ready", True)
+    metrics.LOOP_LAG.set(0.0)  # last sample of an earlier test's loop
+    r = client.get("/health/ready")
+    assert r.status_code == 200, r.json()
+    body = r.json()
+    assert body["status"] == "ready" and body["mongo"]["ok"] is True
+    assert body["circuit_breakers"]["resend"] == {"state": "closed", "consecutive_failures": 0}
+
+    # Two failures open the circuit; the next call fails fast without calling out
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            with http_clients.outbound("resend", "send_email"):
+                raise ConnectionError("resend down")
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        with http_clients.outbound("resend", "send_email"):
+            pytest.fail("must not be called while open")
+
+    # Reported, but an open circuit alone doesn't take the worker out of rotation
+    server._mongo_ping_cache.invalidate()
+    r = client.get("/health/ready")
+    assert r.status_code == 200
+    assert r.json()["circuit_breakers"]["resend"]["state"] == "open"
+
+    async def failing_ping(*_args, **_kwargs):
+        raise RuntimeError("no primary")
+
+    monkeypatch.setattr(server.db.target, "command", failing_ping)
+    server._mongo_ping_cache.invalidate()
+    r = client.get("/health/ready")
+    assert r.status_code == 503
+    assert r.json()["checks"]["mongo"] is False and "no primary" in r.json()["mongo"]["error"]
+
+
+def test_circuit_breaker_half_open_trial(app_module):
+    import circuit_breaker
+
+    breaker = circuit_breaker.CircuitBreaker("svc", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == circuit_breaker.HALF_OPEN  # reset_timeout elapsed
+    breaker.before_call()  # the single trial
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == circuit_breaker.CLOSED
+
+
+def test_scheduler_lease_elects_one_worker_and_reconciles_topups(app_module):
+    import asyncio
+    from datetime import datetime, timedelta, timezone
+
+    import scheduler
+
+    server = app_module
+    db = server.db
+    stale = datetime.now(timezone.utc) - timedelta(hours=1)
+    # t4's credit reached the wallet before the process died; t4 was never marked credited
+    db.users.preload([{"id": "u1", "email": "u1@example.com", "wallet_balance": 3.0, "applied_credits": ["topup:t4"]}])
+    db.wallet_topups.preload([
+        {"id": "t1", "user_id": "u1", "amount": 20.0, "payment_status": "paid", "credited": False, "updated_at": stale},
+        {"id": "t4", "user_id": "u1", "amount": 3.0, "payment_status": "paid", "credited": False, "updated_at": stale,
+         "crediting_at": stale},
+        {"id": "t2", "user_id": "u1", "amount": 5.0, "payment_status": "paid", "credited": True, "updated_at": stale},
+        # Just marked paid: the webhook path is still crediting it
+        {"id": "t3", "user_id": "u1", "amount": 7.0, "payment_status": "paid", "credited": False,
+         "updated_at": datetime.now(timezone.utc)},
+    ])
+
+    async def run():
+        runs = []
+
+        async def job():
+            runs.append(1)
+            return await server._reconcile_paid_topups()
+
+        workers = []
+        for _ in range(2):
+            s = scheduler.Scheduler(scheduler.MongoLease(lambda: db.leases, "scheduler", ttl=30), tick=0.01)
+            s.every(3600, "topup_reconciler", job)
+            workers.append(s)
+
+        for s in workers:
+            await s.run_once()
+        assert [s.is_leader for s in workers] == [True, False]
+        await asyncio.gather(*(j.task for s in workers for j in s.jobs if j.task))
+        assert len(runs) == 1
+
+        # Leader shuts down and hands over the lease
+        await workers[0].stop()
+        await workers[1].run_once()
+        assert workers[1].is_leader
+        await workers[1].stop()
+        assert db.leases.documents == []
+
+    asyncio.run(run())
+
+    assert db.users.documents[0]["wallet_balance"] == 23.0 and db.users.documents[0]["applied_credits"] == []
+    assert {t["id"] for t in db.wallet_topups.documents if t["credited"]} == {"t1", "t2", "t4"}
+    assert [t["reason"] for t in db.wallet_transactions.documents] == ["Wallet topup t1 (reconciled)", "Wallet topup t4 (reconciled)"]
+
+    # The admin status path and the reconciler racing on one topup credit it once
+    from routers.wallet import _credit_topup
+
+    async def race():
+        topup = {"id": "t3", "user_id": "u1", "amount": 7.0}
+        return await asyncio.gather(_credit_topup(topup, "Wallet topup t3"), server._reconcile_paid_topups())
+
+    next(t for t in db.wallet_topups.documents if t["id"] == "t3")["updated_at"] = stale
+    asyncio.run(race())
+    client = TestClient(server.app)
+    assert client.put("/api/wallet/topups/t3/status?payment_status=paid").status_code == 200
+    assert db.users.documents[0]["wallet_balance"] == 30.0
+    assert [t["topup_id"] for t in db.wallet_transactions.documents] == ["t1", "t4", "t3"]
+
+
+def test_checkout_query_budget(app_module):
+    db = app_module.db
+    db.users.preload([{"id": "qb-1", "email": "qb@example.com", "full_name": "Qb", "role": "customer", "wallet_balance": 100.0, "customer_id": "KC-31313131"}])
+    db.products.preload([
+        {"id": f"qb-p{i}", "name": f"Card {i}", "description": "d", "category": "giftcard", "price": 5.0}
+        for i in range(3)
+    ])
+    items = [{"product_id": f"qb-p{i}", "product_name": f"Card {i}", "quantity": 1, "price": 5.0} for i in range(3)]
+    client = TestClient(app_module.app)
+
+    db.counter.reset()
+    r = client.post("/api/orders?user_id=qb-1&user_email=qb@example.com", json={"items": items, "payment_method": "paypal"})
+    assert r.status_code == 200, r.text
+    # user + one batched product lookup + the order insert, however many items
+    assert len(db.counter) <= 3, db.counter.commands
+    assert db.counter.count("find", "products") == 1
+
+    db.counter.reset()
+    r = client.post("/api/orders?user_id=qb-1&user_email=qb@example.com", json={"items": items, "payment_method": "wallet"})
+    assert r.status_code == 200, r.text
+    assert db.counter.reads <= 2 and db.counter.writes <= 3, db.counter.commands
+
+
+def test_session_token_skips_user_read_and_follows_block(app_module):
+    db = app_module.db
+    db.users.preload([
+        {"id": "st-1", "email": "st@example.com", "full_name": "St", "role": "customer", "wallet_balance": 12.0,
+         "password_hash": app_module.pwd_context.hash("pw")},
+        {"id": "st-2", "email": "other@example.com", "full_name": "Other", "role": "customer", "wallet_balance": 3.0},
+    ])
+    db.products.preload([{"id": "st-p", "name": "Card", "description": "d", "category": "giftcard", "price": 5.0}])
+    client = TestClient(app_module.app)
+
+    r = client.post("/api/auth/login", json={"email": "st@example.com", "password": "pw"})
+    assert r.status_code == 200, r.text
+    auth = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    db.counter.reset()
+    r = client.post("/api/orders", headers=auth, json={
+        "items": [{"product_id": "st-p", "product_name": "Card", "quantity": 2, "price": 5.0}], "payment_method": "wallet",
+    })
+    assert r.status_code == 200, r.text
+    assert db.counter.count("find", "users") == 0, db.counter.commands
+    assert client.get("/api/wallet/balance", headers=auth).json()["wallet_balance"] == 2.0
+
+    # Wallet debits are conditional: an order the balance doesn't cover changes nothing
+    r = client.post("/api/orders", headers=auth, json={
+        "items": [{"product_id": "st-p", "product_name": "Card", "quantity": 1, "price": 5.0}], "payment_method": "wallet",
+    })
+    assert r.status_code == 400 and r.json()["detail"] == "Insufficient wallet balance"
+    assert db.users.documents[0]["wallet_balance"] == 2.0
+
+    assert client.get("/api/wallet/balance?user_id=st-2", headers=auth).status_code == 403
+    assert client.get("/api/wallet/balance", headers={"Authorization": "Bearer nope"}).status_code == 401
+    assert client.get("/api/wallet/balance").status_code == 401
+
+    # The frontend sends the token alongside the user_id older pages still add, and
+    # as ?token= from EventSource; only bare user_id calls take the legacy path
+    import sessions
+
+    accepted = sessions.LEGACY_AUTH.value("accepted")
+    assert client.get("/api/wallet/balance?user_id=st-1", headers=auth).status_code == 200
+    token = auth["Authorization"].split()[1]
+    assert client.get(f"/api/events/poll?token={token}&timeout=0").status_code == 200
+    assert sessions.LEGACY_AUTH.value("accepted") == accepted
+    assert client.get("/api/wallet/balance?user_id=st-1").status_code == 200
+    assert sessions.LEGACY_AUTH.value("accepted") == accepted + 1
+
+    sessions.REQUIRE_TOKENS = True
+    try:
+        assert client.get("/api/wallet/balance?user_id=st-1").status_code == 401
+        assert sessions.LEGACY_AUTH.value("rejected") >= 1
+        assert client.get("/api/wallet/balance?user_id=st-1", headers=auth).status_code == 200
+    finally:
+        sessions.REQUIRE_TOKENS = False
+
+    assert client.post("/api/admin/customers/st-1/block", json={"reason": "fraud"}).status_code == 200
+    r = client.get("/api/wallet/balance", headers=auth)
+    assert r.status_code == 403 and r.json()["detail"] == "Account is blocked"
+
+
+def test_rate_limits_expensive_endpoints(app_module, monkeypatch):
+    import rate_limit
+
+    monkeypatch.setitem(rate_limit.LIMITER.rules, "coupon_validate", rate_limit.Rule("coupon_validate", 2, 60))
+    monkeypatch.setitem(rate_limit.LIMITER.rules, "login_account", rate_limit.Rule("login_account", 1, 300))
+    client = TestClient(app_module.app)
+
+    codes = [client.get("/api/coupons/validate?code=NOPE&amount=10").status_code for _ in range(3)]
+    assert codes == [400, 400, 429]
+    r = client.get("/api/coupons/validate?code=NOPE&amount=10")
+    assert r.headers["Retry-After"] == "30"
+    assert rate_limit.metrics.RATE_LIMIT_DECISIONS.value("coupon_validate", "throttled") >= 2
+
+    # Per account as well as per IP
+    assert client.post("/api/auth/login", json={"email": "a@x.com", "password": "x"}).status_code == 401
+    assert client.post("/api/auth/login", json={"email": "A@x.com ", "password": "x"}).status_code == 429
+    assert client.post("/api/auth/login", json={"email": "b@x.com", "password": "x"}).status_code == 401
+
+    # Shared store: same decisions from the GCRA form over a collection
+    import asyncio
+    import memory_mongo
+
+    now = [1000.0]
+    store = rate_limit.MongoStore(lambda: coll, clock=lambda: now[0])
+    coll = memory_mongo.MemoryClient()["t"].rate_limits
+    rule = rate_limit.Rule("r", 3, 30)
+
+    async def takes(n):
+        return [await store.take(rule, "k") for _ in range(n)]
+
+    assert asyncio.run(takes(4)) == [0.0, 0.0, 0.0, 10.0]
+    now[0] += 10
+    assert asyncio.run(takes(2)) == [0.0, 10.0]
+
+
+def test_idempotency_key_replays_money_moving_posts(app_module):
+    import asyncio
+
+    import httpx
+
+    db = app_module.db
+    db.users.preload([{"id": "ik-1", "email": "ik@example.com", "full_name": "Ik", "role": "customer", "wallet_balance": 50.0}])
+    db.products.preload([{"id": "ik-p", "name": "Card", "description": "d", "category": "giftcard", "price": 10.0}])
+    order = {"items": [{"product_id": "ik-p", "product_name": "Card", "quantity": 1, "price": 10.0}], "payment_method": "wallet"}
+    url = "/api/orders?user_id=ik-1&user_email=ik@example.com"
+
+    async def concurrent_duplicates():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*[
+                client.post(url, json=order, headers={"Idempotency-Key": "k-1"}) for _ in range(3)
+            ])
+
+    responses = asyncio.run(concurrent_duplicates())
+    assert [r.status_code for r in responses] == [200, 200, 200]
+    assert len({r.json()["id"] for r in responses}) == 1
+    assert sum(r.headers.get("idempotent-replayed") == "true" for r in responses) == 2
+    assert len(db.orders.documents) == 1 and db.users.documents[0]["wallet_balance"] == 40.0
+
+    client = TestClient(app_module.app)
+    r = client.post(url, json=order, headers={"Idempotency-Key": "k-1"})
+    assert r.json()["id"] == responses[0].json()["id"] and len(db.orders.documents) == 1
+
+    r = client.post(url, json={**order, "payment_method": "paypal"}, headers={"Idempotency-Key": "k-1"})
+    assert r.status_code == 422
+    assert [d["state"] for d in db.idempotency_keys.documents] == ["done"]
+    assert client.post(url, json=order).status_code == 200 and len(db.orders.documents) == 2
+
+
+def test_crypto_quote_is_signed_and_honoured(app_module):
+    db = app_module.db
+    db.settings.preload([{"id": "site_settings", "crypto_settings": {}}])
+    db.crypto_config.preload([{"id": "crypto_config", "buy_rate_trc20": 1.25, "sell_rate_trc20": 0.9, "buy_fee_percent": 4.0,
+                               "sell_fee_percent": 1.0, "min_buy_usd": 10.0, "max_buy_usd": 500.0}])
+    client = TestClient(app_module.app)
+
+    q = client.get("/api/crypto/quote?side=buy&chain=TRC20&amount=100").json()
+    assert (q["exchange_rate"], q["amount_crypto"], q["fee"], q["total_usd"]) == (1.25, 80.0, 4.0, 104.0)
+    assert client.get("/api/crypto/quote?side=buy&chain=TRC20&amount=5000").status_code == 400
+
+    # Price changes after the quote; the quoted order keeps its price and reads no config
+    client.put("/api/crypto/config", json={"buy_rate_trc20": 2.0})
+    buy = {"chain": "TRC20", "amount_usd": 100, "payment_method": "paypal", "wallet_address": "T-addr"}
+    db.counter.reset()
+    r = client.post("/api/crypto/buy?user_id=c1&user_email=c1@example.com", json={**buy, "quote_token": q["quote_token"]})
+    assert r.status_code == 200, r.text
+    assert r.json()["total_usd"] == 104.0 and db.counter.count("find", "crypto_config") == 0
+    assert client.post("/api/crypto/buy", json=buy).json()["amount_crypto"] == 50.0
+
+    r = client.post("/api/crypto/buy", json={**buy, "amount_usd": 200, "quote_token": q["quote_token"]})
+    assert r.status_code == 400 and r.json()["detail"] == "Quote does not match this order"
+    assert client.post("/api/crypto/buy", json={**buy, "quote_token": q["quote_token"] + "x"}).status_code == 400
+
+    s = client.get("/api/crypto/quote?side=sell&chain=TRC20&amount=50").json()
+    assert (s["amount_usd"], s["total_usd"]) == (45.0, 44.55)
+
+    # The table is compiled once per config/settings change, not per request
+    import crypto_pricing
+
+    table = crypto_pricing._table
+    for side in ("buy", "sell", "buy"):
+        assert client.get(f"/api/crypto/quote?side={side}&chain=TRC20&amount=50").status_code == 200
+    assert crypto_pricing._table is table
+    client.put("/api/crypto/config", json={"buy_rate_trc20": 2.5})
+    client.get("/api/crypto/quote?side=buy&chain=TRC20&amount=50")
+    assert crypto_pricing._table is not table
+
+
+def test_withdrawals_hold_balance_and_settle_in_batches(app_module):
+    db = app_module.db
+    db.users.preload([
+        {"id": "wd-1", "email": "wd1@example.com", "role": "customer", "referral_balance": 30.0},
+        {"id": "wd-2", "email": "wd2@example.com", "role": "customer", "referral_balance": 10.0},
+    ])
+    client = TestClient(app_module.app)
+
+    def request(user, body):
+        return client.post(f"/api/withdrawals/request?user_id={user}&user_email={user}@example.com", json=body)
+
+    paypal = {"amount": 20, "method": "paypal", "paypal_email": "p@example.com"}
+    usdt = {"amount": 10, "method": "usdt_bep20", "wallet_address": "0xabc"}
+    ids = [request("wd-1", paypal).json()["withdrawal_id"], request("wd-1", usdt).json()["withdrawal_id"]]
+    assert request("wd-1", usdt).status_code == 400  # balance already held
+    ids.append(request("wd-2", usdt).json()["withdrawal_id"])
+    balances = {u["id"]: (u["referral_balance"], u["held_balance"]) for u in db.users.documents}
+    assert balances == {"wd-1": (0.0, 30.0), "wd-2": (0.0, 10.0)}
+
+    r = client.post("/api/withdrawals/batch-status", json={"ids": ids[:2] + ["missing"], "status": "approved"})
+    assert r.json()["updated"] == sorted(ids[:2]) and r.json()["skipped"] == ["missing"]
+
+    csv_text = client.get("/api/withdrawals/export?method=paypal").text
+    assert csv_text.splitlines() == ["paypal_email,amount,currency,withdrawal_id,note", f"p@example.com,20.0,USD,{ids[0]},Withdrawal {ids[0]}"]
+    assert client.get("/api/withdrawals/export?method=usdt").text.splitlines()[1].startswith("0xabc,BEP20,10.0,")
+
+    db.counter.reset()
+    client.post("/api/withdrawals/batch-status", json={"ids": [ids[0]], "status": "completed"})
+    client.post("/api/withdrawals/batch-status", json={"ids": ids[1:], "status": "rejected"})
+    assert db.counter.count("update", "users") == 2  # one bulk write per batch
+    balances = {u["id"]: (u["referral_balance"], u["held_balance"]) for u in db.users.documents}
+    assert balances == {"wd-1": (10.0, 0.0), "wd-2": (10.0, 0.0)}
+
+    # A settled withdrawal can't be settled again
+    assert client.put(f"/api/withdrawals/{ids[1]}/status?status=rejected").status_code == 200
+    assert client.put(f"/api/withdrawals/{ids[1]}/status?status=completed").status_code == 409
+    assert db.users.documents[0]["referral_balance"] == 10.0
+
+
+def test_referral_stats_are_materialized(app_module):
+    import asyncio
+
+    db = app_module.db
+    asyncio.run(app_module.ensure_indexes())
+    db.users.preload([
+        {"id": "rf-1", "email": "rf1@example.com", "full_name": "Rosa Fleur", "role": "customer", "referral_code": "ROSA"},
+        {"id": "rf-0", "email": "rf0@example.com", "full_name": "Legacy", "role": "customer", "referral_code": "OLD", "referral_count": 7},
+        {"id": "rf-old", "email": "old@example.com", "role": "customer", "referred_by": "ROSA"},
+    ])
+    db.products.preload([{"id": "rf-sub", "name": "Sub", "description": "d", "category": "subscription", "price": 5.0, "is_subscription": True}])
+    client = TestClient(app_module.app)
+
+    for i in range(2):
+        r = client.post("/api/auth/register-with-referral?referral_code=ROSA",
+                        json={"email": f"new{i}@example.com", "password": "pw", "full_name": f"New {i}"})
+        assert r.status_code == 200, r.text
+    assert client.post("/api/auth/register-with-referral?referral_code=NOPE",
+                       json={"email": "x@example.com", "password": "pw", "full_name": "X"}).json().get("referred_by") is None
+
+    assert asyncio.run(app_module.backfill_referral_stats()) == {"referrers": 1, "updated": 1}
+    referred = [u["id"] for u in db.users.documents if u.get("referred_by") == "ROSA" and u["id"] != "rf-old"]
+
+    # The payout check is the unique insert: paying the same referred user twice is a no-op
+    for order_id in ("o-1", "o-2"):
+        order = {"id": order_id, "user_id": referred[0], "payment_status": "paid", "order_status": "completed", "items": [{"product_id": "rf-sub"}]}
+        asyncio.run(app_module.orders.check_and_credit_referral(order))
+    assert len(db.referral_payouts.documents) == 1
+
+    db.counter.reset()
+    info = client.get("/api/referral/info?user_id=rf-1").json()
+    assert (info["total_referrals"], info["total_earnings"], info["referral_balance"]) == (3, 1.0, 1.0)
+    assert db.counter.count("aggregate") == 0 and db.counter.count("count") == 0
+
+    board = client.get("/api/referral/leaderboard").json()
+    assert [(row["name"], row["referrals"]) for row in board] == [("Legacy", 7), ("Rosa F.", 3)]
+
+
+def test_referral_payout_duplicates_and_reconcile(app_module):
+    import asyncio
+    from datetime import datetime, timedelta, timezone
+
+    db = app_module.db
+    old = datetime.now(timezone.utc) - timedelta(hours=1)
+    # p4's credit reached the balance before the process died; p4 was never marked credited
+    db.users.preload([{"id": "rp-1", "email": "rp@example.com", "role": "customer", "referral_code": "RP",
+                       "referral_balance": 3.0, "referral_earnings": 3.0, "applied_credits": ["referral_payout:p4"]}])
+    db.referral_payouts.preload([
+        {"id": "p1", "referrer_code": "RP", "referred_user_id": "u1", "order_id": "o1", "amount": 1.0, "created_at": old},
+        {"id": "p2", "referrer_code": "RP", "referred_user_id": "u1", "order_id": "o2", "amount": 1.0,
+         "created_at": old + timedelta(minutes=1)},
+        # Recorded, then the process died before the referrer was credited
+        {"id": "p3", "referrer_code": "RP", "referred_user_id": "u3", "order_id": "o3", "amount": 1.0,
+         "credited": False, "created_at": old},
+        {"id": "p4", "referrer_code": "RP", "referred_user_id": "u4", "order_id": "o4", "amount": 1.0,
+         "credited": False, "crediting_at": old, "created_at": old},
+    ])
+
+    # Duplicates keep their index from building, but no other index is skipped
+    assert asyncio.run(app_module.ensure_indexes()) == ["referral_payout_user"]
+    assert "referral_payout_order" in asyncio.run(db.referral_payouts.index_information())
+    assert "session_revocation_ttl" in asyncio.run(db.session_revocations.index_information())
+
+    # Without the unique indexes the payout is probed first: u1 was already paid for
+    db.users.preload([{"id": "u1", "email": "u1@example.com", "role": "customer", "referred_by": "RP"}])
+    db.products.preload([{"id": "rp-sub", "name": "Sub", "description": "d", "category": "subscription", "price": 5.0,
+                          "is_subscription": True}])
+    order = {"id": "o9", "user_id": "u1", "payment_status": "paid", "order_status": "completed", "items": [{"product_id": "rp-sub"}]}
+    asyncio.run(app_module.orders.check_and_credit_referral(order))
+    assert len(db.referral_payouts.documents) == 4
+
+    assert asyncio.run(app_module.dedupe_referral_payouts()) == {"moved": 1}
+    assert [d["id"] for d in db.referral_payouts_duplicates.documents] == ["p2"]
+    assert asyncio.run(app_module.ensure_indexes()) == []
+
+    async def race():
+        return await asyncio.gather(app_module._reconcile_referral_payouts(), app_module._reconcile_referral_payouts())
+
+    # p3 is paid once; p4 is finished without paying it again
+    assert sum(r["credited"] for r in asyncio.run(race())) == 2
+    referrer = db.users.documents[0]
+    assert (referrer["referral_balance"], referrer["referral_earnings"], referrer["applied_credits"]) == (4.0, 4.0, [])
+    assert [p["id"] for p in db.referral_payouts.documents if p.get("credited") is False or "crediting_at" in p] == []
+
+    # Indexes built: the insert alone is the check, with no probe
+    db.counter.reset()
+    asyncio.run(app_module.orders.check_and_credit_referral({**order, "id": "o10"}))
+    assert len(db.referral_payouts.documents) == 3 and db.counter.count("find", "referral_payouts") == 0
+
+
+def test_admin_work_queues(app_module):
+    import asyncio
+    from datetime import datetime, timedelta, timezone
+
+    db = app_module.db
+    asyncio.run(app_module.ensure_indexes())
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    statuses = [("pending_verification", "pending"), ("paid", "processing"), ("paid", "completed"), ("pending", "pending")]
+    db.orders.preload([
+        {"id": f"q-{i:02d}", "user_id": "u", "user_email": "q@example.com", "items": [{"product_name": "Card", "quantity": 1, "price": 5.0, "product_id": "p"}],
+         "total_amount": 5.0, "payment_method": "paypal", "payment_status": statuses[i % 4][0], "order_status": statuses[i % 4][1],
+         "created_at": start + timedelta(minutes=i), "notes": "x" * 500}
+        for i in range(12)
+    ])
+    client = TestClient(app_module.app)
+
+    counts = client.get("/api/admin/queues").json()
+    assert counts["orders"] == {"pending_verification": 3, "processing": 3, "awaiting_delivery": 3}
+    assert counts["withdrawals"] == {"pending": 0, "approved": 0}
+
+    page = client.get("/api/admin/queues/orders/pending_verification?limit=2").json()
+    assert [o["id"] for o in page["items"]] == ["q-00", "q-04"] and page["count"] == 3
+    assert "notes" not in page["items"][0] and "product_id" not in page["items"][0]["items"][0]
+    rest = client.get("/api/admin/queues/orders/pending_verification", params={"limit": 2, "after": page["next"]}).json()
+    assert [o["id"] for o in rest["items"]] == ["q-08"] and rest["next"] is None
+
+    plan = asyncio.run(db.orders.find({"payment_status": "pending_verification"}).sort([("created_at", 1), ("id", 1)]).explain())
+    assert plan["queryPlanner"]["winningPlan"]["indexName"] == "queue_orders_pending_verification"
+    assert client.get("/api/admin/queues/orders/nope").status_code == 404
+
+
+def test_admin_event_feed_streams_changes_and_resumes(app_module, monkeypatch):
+    import asyncio
+    import importlib
+
+    import httpx
+
+    events = importlib.import_module("events")
+    monkeypatch.setattr(importlib.import_module("routers.feed"), "STREAM_SECONDS", 0.3)
+    db = app_module.db
+    db.orders.preload([{"id": "ev-o", "user_id": "ev-u", "user_email": "ev@example.com", "total_amount": 10.0,
+                        "payment_status": "pending", "order_status": "pending", "items": [], "created_at": "2024-01-01T00:00:00+00:00"}])
+    db.crypto_transactions.preload([{"id": "ev-c", "user_id": "ev-u", "status": "pending", "amount_usd": 25.0}])
+
+    def parse(text):
+        return [
+            (int(re.search(r"^id: (\d+)$", block, re.M).group(1)), re.search(r"^event: (\w+)$", block, re.M).group(1),
+             json.loads(re.search(r"^data: (.*)$", block, re.M).group(1))["doc"])
+            for block in text.split("\n\n") if block.startswith("id: ")
+        ]
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            stream = asyncio.create_task(client.get("/api/admin/events"))
+            await asyncio.sleep(0.05)
+            # Two changes to one order before the flush publish its latest state once
+            await client.put("/api/orders/ev-o/status?payment_status=paid")
+            await client.put("/api/orders/ev-o/status?order_status=processing")
+            assert await events.BUS.flush() == 1
+            live = parse((await stream).text)
+            assert [(seq, topic) for seq, topic, _ in live] == [(1, "orders")]
+            assert live[0][2]["payment_status"] == "paid" and live[0][2]["order_status"] == "processing"
+            assert "user_id" not in live[0][2]
+
+            # Changes made while disconnected are replayed from the resume token, in order
+            await client.put("/api/crypto/transactions/ev-c/status", json={"status": "completed", "tx_hash": "0xh"})
+            await client.post("/api/payments/manual-proof", json={"order_id": "ev-o", "payment_proof_url": "u", "transaction_id": "t"})
+            await events.BUS.flush()
+            resumed = parse((await client.get("/api/admin/events", headers={"Last-Event-ID": "1"})).text)
+            assert [(seq, topic) for seq, topic, _ in resumed] == [(2, "crypto_transactions"), (3, "orders")]
+            assert resumed[0][2]["tx_hash"] == "0xh"
+            only_orders = parse((await client.get("/api/admin/events?after=1&topics=orders")).text)
+            assert [seq for seq, _, _ in only_orders] == [3]
+
+            # A failed write keeps the changes for the next flush
+            insert_many = db.events.insert_many
+
+            async def failing(*args, **kwargs):
+                raise RuntimeError("write failed")
+
+            monkeypatch.setattr(db.events, "insert_many", failing)
+            events.changed("orders", "ev-o")
+            with pytest.raises(RuntimeError):
+                await events.BUS.flush()
+            monkeypatch.setattr(db.events, "insert_many", insert_many)
+            assert await events.BUS.flush() == 1
+            assert [e["topic"] for e in db.events.documents if e["seq"] > 3] == ["orders"]
+
+            # A token older than the retained events: the console must reload
+            await db.events.delete_many({"seq": {"$lte": 2}})
+            reset = await client.get("/api/admin/events?after=1")
+            assert "event: reset" in reset.text and parse(reset.text) == []
+            assert (await client.get("/api/admin/events?topics=nope")).status_code == 400
+        await events.BUS.stop()
+
+    asyncio.run(scenario())
+
+
+def test_customer_update_channel_is_per_user_and_capped(app_module, monkeypatch):
+    import asyncio
+    import importlib
+
+    import httpx
+
+    events = importlib.import_module("events")
+    feed = importlib.import_module("routers.feed")
+    monkeypatch.setattr(feed, "STREAM_SECONDS", 0.3)
+    monkeypatch.setattr(feed, "MAX_STREAMS_PER_USER", 1)
+    db = app_module.db
+    db.users.preload([{"id": f"cu-{n}", "email": f"cu{n}@example.com", "role": "customer"} for n in (1, 2)])
+    db.orders.preload([
+        {"id": f"cu-o{n}", "user_id": f"cu-{n}", "user_email": f"cu{n}@example.com", "total_amount": 5.0, "items": [],
+         "payment_status": "pending", "order_status": "pending", "created_at": "2024-01-01T00:00:00+00:00"}
+        for n in (1, 2)
+    ])
+    db.wallet_topups.preload([{"id": "cu-t1", "user_id": "cu-1", "amount": 5.0, "payment_status": "pending", "credited": True}])
+    token = app_module.sessions.issue({"id": "cu-1", "email": "cu1@example.com"})
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            poll = asyncio.create_task(client.get("/api/events/poll?user_id=cu-1&timeout=5"))
+            await asyncio.sleep(0.05)
+            assert (await client.get("/api/events/poll?user_id=cu-1&timeout=0")).status_code == 429
+            await client.put("/api/orders/cu-o2/status?payment_status=paid")
+            await client.put("/api/orders/cu-o1/delivery", json={"delivery_details": "CODE-1"})
+            await events.BUS.flush()
+            body = (await poll).json()
+            assert [(e["topic"], e["id"]) for e in body["events"]] == [("orders", "cu-o1")]
+            assert body["events"][0]["doc"]["order_status"] == "completed" and body["reset"] is False
+
+            # Stream authenticated with ?token=, resumed from the start: only the caller's documents
+            sse = (await client.get(f"/api/events?token={token}&after=0")).text
+            assert re.findall(r"^event: (\w+)$", sse, re.M) == ["orders"] and '"id":"cu-o1"' in sse
+
+            await client.post("/api/payments/plisio-callback", json={"order_number": "cu-t1", "status": "completed"})
+            await events.BUS.flush()
+            body = (await client.get(f"/api/events/poll?user_id=cu-1&after={body['next']}&timeout=0")).json()
+            assert [(e["topic"], e["doc"]["payment_status"]) for e in body["events"]] == [("wallet_topups", "paid")]
+            assert (await client.get(f"/api/events/poll?user_id=cu-2&after={body['next']}&timeout=0")).json()["events"] == []
+            assert (await client.get("/api/events/poll?timeout=0")).status_code == 401
+            assert (await client.get("/api/events/poll?user_id=cu-1&topics=withdrawals")).status_code == 400
+
+            # The cap holds for concurrent opens, streams included
+            opens = [client.get("/api/events/poll?user_id=cu-2&timeout=0.2") for _ in range(4)]
+            opens += [client.get("/api/events?user_id=cu-2") for _ in range(4)]
+            codes = [r.status_code for r in await asyncio.gather(*opens)]
+            assert sorted(codes) == [200] + [429] * 7, codes
+            assert events.BUS.streams("cu-2") == 0
+        await events.BUS.stop()
+
+    asyncio.run(scenario())
+
+
+def test_memory_backend_indexes_and_operators():
+    import asyncio
+
+    import memory_mongo
+    from pymongo.errors import DuplicateKeyError
+
+    async def scenario():
+        db = memory_mongo.MemoryClient()["t"]
+        await db.users.create_index("customer_id", unique=True, partialFilterExpression={"customer_id": {"$gt": ""}})
+        await db.users.insert_many([
+            {"id": f"u{i}", "customer_id": f"KC-{i}" if i % 2 else "", "credits": i, "tags": ["a", f"t{i}"]}
+            for i in range(10)
+        ])
+        with pytest.raises(DuplicateKeyError) as err:
+            await db.users.insert_one({"id": "dup", "customer_id": "KC-1"})
+        assert err.value.details["keyPattern"] == {"customer_id": 1}
+        await db.users.insert_one({"id": "blank", "customer_id": ""})  # outside the partial index
+
+        await db.users.update_one({"id": "u3"}, {"$inc": {"credits": 2}, "$addToSet": {"tags": "a"}})
+        u3 = await db.users.find_one({"id": "u3"}, {"_id": 0, "credits": 1, "tags": 1})
+        assert u3 == {"credits": 5, "tags": ["a", "t3"]} and isinstance(u3["credits"], int)
+
+        assert await db.users.count_documents({"credits": {"$gte": 5, "$lt": 8}, "tags": "a"}) == 4
+        docs = await db.users.find({"customer_id": {"$in": ["KC-1", "KC-9"]}}, {"_id": 0, "id": 1}).sort("credits", -1).to_list(None)
+        assert docs == [{"id": "u9"}, {"id": "u1"}]
+
+        plan = await db.users.find({"customer_id": "KC-7"}).explain()
+        assert plan["queryPlanner"]["winningPlan"] == {"stage": "IXSCAN", "indexName": "customer_id_1"}
+        assert plan["executionStats"]["totalDocsExamined"] == 1
+        plan = await db.users.find({"customer_id": ""}).explain()
+        assert plan["queryPlanner"]["winningPlan"] == {"stage": "COLLSCAN"}
+
+        totals = await db.users.aggregate([
+            {"$match": {"credits": {"$gt": 0}}},
+            {"$group": {"_id": {"$cond": [{"$gt": ["$customer_id", ""]}, "with_id", "without"]}, "n": {"$sum": 1}}},
+            {"$sort": {"_id": 1}},
+        ]).to_list(None)
+        assert totals == [{"_id": "with_id", "n": 5}, {"_id": "without", "n": 4}]
+
+    asyncio.run(scenario())
+
+
+def test_server_import_defers_heavy_clients_and_seed_data():
+    # Fresh interpreter: the fixture's process has already imported everything
+    import subprocess
+
+    code = (
+        "import sys, server; "
+        "print(sorted(m for m in ('aiohttp', 'requests', 'plisio_helper', 'seed_data') if m in sys.modules)); "
+        "print(len([r for r in server.app.routes if r.path.startswith('/api/')]))"
+    )
+    env = dict(os.environ, MONGO_URL=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    out = subprocess.run([sys.executable, "-c", code], cwd="/workspace/backend", env=env,
+                         capture_output=True, text=True, check=True).stdout.split("\n")
+    assert out[0] == "[]"
+    # Every feature router is mounted under /api
+    assert int(out[1]) > 60